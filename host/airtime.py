@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tempo no ar e orçamento de ciclo de trabalho do ulora.
+
+Mostra, para cada ModemConfig, o tempo no ar da leitura de sensores
+(LoRa.time_on_air_ms) e quantas leituras cabem por hora no limite de ciclo de
+trabalho. Depois simula um transmissor enviando a cada --interval segundos,
+com set_duty_cycle, no SX1276 falso e relógio virtual: conta os quadros
+enviados e adiados e confere que nenhuma janela de uma hora passa do limite.
+
+    python host/airtime.py
+    python host/airtime.py --duty-cycle 0.001 --interval 10 --hours 3
+"""
+import argparse
+import sys
+
+import fakes
+
+RX_PIN = 20
+PAYLOAD = b"T:25.0,H:50.0,D:71.0"
+HOUR_MS = 3600 * 1000
+
+
+def make_lora(ulora, modem_config):
+    fakes.reset_world()
+    fakes.install()
+    fakes.SPI.devices[0] = fakes.SX127xRegisters(dio0=RX_PIN)
+    lora = ulora.LoRa(ulora.SPIConfig.rp2_0, RX_PIN, 1, 17, reset_pin=28, modem_config=modem_config)
+    lora.set_mode_rx()
+    return lora
+
+
+def simulate(ulora, modem_config, duty_cycle, interval_s, hours):
+    # Envia em broadcast (sem ACK) a cada interval_s; devolve os instantes e
+    # tempos no ar dos quadros enviados e o número de adiados
+    lora = make_lora(ulora, modem_config)
+    lora.set_duty_cycle(duty_cycle)
+    sent = []
+    deferred = 0
+    start = fakes.CLOCK.now_us
+    for i in range(int(hours * 3600 / interval_s)):
+        fakes.CLOCK.advance(start + i * interval_s * 1000000 - fakes.CLOCK.now_us)
+        if lora.airtime_wait_ms(len(PAYLOAD)) != 0:
+            deferred += 1
+            continue
+        assert lora.send_to_wait(PAYLOAD, ulora.BROADCAST_ADDRESS), "send recusado com orçamento livre"
+        sent.append((fakes.CLOCK.now_us // 1000, lora.time_on_air_ms(len(PAYLOAD))))
+    assert lora.airtime.deferred == 0, "send() recusou um quadro que cabia no orçamento"
+    return sent, deferred
+
+
+def worst_hour_ms(sent):
+    # Maior tempo no ar somado em qualquer janela de uma hora
+    worst = 0
+    j = 0
+    total = 0
+    for t, ms in sent:
+        total += ms
+        while sent[j][0] <= t - HOUR_MS:
+            total -= sent[j][1]
+            j += 1
+        worst = max(worst, total)
+    return worst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duty-cycle", type=float, default=0.01)
+    parser.add_argument("--interval", type=float, default=2, help="segundos entre leituras")
+    parser.add_argument("--hours", type=float, default=2)
+    args = parser.parse_args(argv)
+
+    fakes.install()
+    ulora = fakes.load("receiver/ulora.py", "ulora")
+    configs = ("Bw500Cr45Sf128", "Bw125Cr45Sf128", "Bw125Cr45Sf2048", "Bw125Cr48Sf4096")
+    budget_ms = HOUR_MS * args.duty_cycle
+
+    print(f"Ciclo de trabalho {args.duty_cycle:.2%}: {budget_ms / 1000:.0f} s no ar por hora; "
+          f"leitura a cada {args.interval:g} s por {args.hours:g} h")
+    print(f"{'ModemConfig':>17} {'no ar':>9} {'cabem/h':>8} {'enviados':>9} {'adiados':>8} {'pior hora':>10}")
+    for name in configs:
+        config = getattr(ulora.ModemConfig, name)
+        toa = make_lora(ulora, config).time_on_air_ms(len(PAYLOAD))
+        sent, deferred = simulate(ulora, config, args.duty_cycle, args.interval, args.hours)
+        worst = worst_hour_ms(sent)
+        assert worst <= budget_ms, f"{name}: {worst:.0f} ms numa hora"
+        print(f"{name:>17} {toa:>7.1f}ms {int(budget_ms // toa):>8} {len(sent):>9} {deferred:>8} "
+              f"{worst / budget_ms:>10.0%}")
+    print("pior hora: maior tempo no ar em uma janela de 1 h, em relação ao orçamento")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
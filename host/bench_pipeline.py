@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark das etapas do laço do transmissor (sensor -> display/BLE/LoRa) no host.
+
+Roda o laço real de transmitter/main.py com os substitutos de fakes.py para
+machine, bluetooth, neopixel e framebuf, e um receptor que responde com ACK.
+Cada etapa (read_sensors, get_decibels, show_*, update_display,
+BitDogBLE.update_data, send_lora_message) é envolvida por um medidor, e o
+joystick percorre os três modos de exibição. Para cada etapa o script mede:
+
+* tempo de CPU do host por chamada (p50/p90/p99/máx), que compara versões do
+  código entre si mas não é o tempo no RP2040;
+* tempo no relógio virtual por chamada: esperas do firmware (sleep, tempo no
+  ar, ACK), iguais às do dispositivo;
+* bytes alocados por chamada (pico do tracemalloc, numa segunda passada) e
+  bytes que continuam alocados depois dela (histórico, retorno).
+
+O laço completo entra como "loop", com a taxa de laços por segundo no host e
+no relógio virtual. Com --json os resultados vão para um arquivo; com
+--compare, um resultado anterior é comparado e o script sai com 1 se alguma
+etapa piorou mais que --tolerance (tempo de CPU p50 e bytes alocados) ou se o
+tempo virtual mudou.
+
+    python host/bench_pipeline.py
+    python host/bench_pipeline.py --loops 300 --json bench.json
+    python host/bench_pipeline.py --compare bench.json --tolerance 0.3
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import fakes
+
+STAGES = ("read_sensors", "get_decibels", "show_connection_status", "show_noise", "show_temperature",
+          "show_humidity", "update_display", "send_lora_message")
+# Joystick (ADC 26) a cada leitura: baixo, baixo, cima, cima percorre os modos
+# 0 -> 1 -> 2 -> 1 -> 0; no meio, repouso
+JOYSTICK = (60000,) + (32768,) * 4 + (60000,) + (32768,) * 4 + (8000,) + (32768,) * 4 + (8000,) + (32768,) * 4
+
+
+class Stop(BaseException):
+    """Encerra main() (que captura Exception) depois do último laço medido."""
+
+
+class Meter:
+    """Envolve funções do firmware e registra as medidas de cada chamada."""
+
+    def __init__(self, allocations):
+        self.allocations = allocations
+        self.samples = {}    # nome -> [(host_ns, clock_us, bytes, bytes retidos)]
+        self.enabled = False
+        self._peaks = []     # pico do tracemalloc das etapas em andamento (aninhadas)
+
+    def wrap(self, name, func):
+        samples = self.samples.setdefault(name, [])
+
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            if self.allocations:
+                return self._call_traced(samples, func, args, kwargs)
+            start_us = fakes.CLOCK.now_us
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append((time.perf_counter_ns() - start, fakes.CLOCK.now_us - start_us, 0, 0))
+
+        return timed
+
+    def _call_traced(self, samples, func, args, kwargs):
+        # reset_peak() zera o pico da etapa de fora: ele é guardado em _peaks
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        self._peaks.append(current)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            after, peak = tracemalloc.get_traced_memory()
+            peak = max(self._peaks.pop(), peak)
+            samples.append((0, 0, peak - current, after - current))
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+
+
+def run(loops, warmup, allocations, seed):
+    fakes.reset_world()
+    fakes.install(seed)
+    tx = fakes.load("transmitter/main.py")
+    radio = fakes.SPI.devices[tx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=tx.RFM95_INT)
+
+    def gateway(frame):
+        # Receptor: ACK 20 ms depois do fim do quadro
+        if not frame[3] & 0x80:
+            ack = bytes([frame[1], frame[0], frame[2], 0x80]) + b"!"
+            fakes.CLOCK.after(radio.TX_TIME_US + 20000, radio.receive, ack)
+
+    radio.on_tx = gateway
+    readings = iter(range(1 << 30))
+    fakes.ADC.sources[26] = lambda: JOYSTICK[next(readings) % len(JOYSTICK)]
+
+    meter = Meter(allocations)
+    for name in STAGES:
+        setattr(tx, name, meter.wrap(name, getattr(tx, name)))
+    ble_update = tx.BitDogBLE.update_data
+    tx.BitDogBLE.update_data = meter.wrap("BitDogBLE.update_data", ble_update)
+
+    # Um laço vai de uma chamada de read_sensors() à seguinte
+    loop_marks = []
+    read_sensors = tx.read_sensors
+
+    def next_loop():
+        loop_marks.append((time.perf_counter_ns(), fakes.CLOCK.now_us))
+        if len(loop_marks) == warmup + 1:
+            meter.enabled = True
+            if allocations:
+                tracemalloc.start()
+        if len(loop_marks) > warmup + loops:
+            raise Stop()
+        return read_sensors()
+
+    tx.read_sensors = next_loop
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # prints do firmware
+            tx.main()
+    except Stop:
+        pass
+    finally:
+        tx.BitDogBLE.update_data = ble_update
+        if allocations:
+            tracemalloc.stop()
+    marks = loop_marks[warmup:]
+    meter.samples["loop"] = [(b[0] - a[0], b[1] - a[1], 0, 0) for a, b in zip(marks, marks[1:])]
+    return meter.samples
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+
+    def at(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": ordered[-1],
+            "mean": round(sum(ordered) / len(ordered), 1)}
+
+
+def summarize(timing, allocs, loops):
+    stages = {}
+    for name, samples in timing.items():
+        if not samples:
+            continue
+        alloc = allocs.get(name, [])
+        stages[name] = {
+            "calls": len(samples),
+            "host_us": percentiles([s[0] / 1000 for s in samples]),
+            "clock_us": percentiles([s[1] for s in samples]),
+            "alloc_bytes": percentiles([s[2] for s in alloc]),
+            "retained_bytes": percentiles([s[3] for s in alloc]),
+        }
+    loop = stages["loop"]
+    return {
+        "python": platform.python_version(),
+        "loops": loops,
+        "stages": stages,
+        "loop_rate": {
+            "host_hz": round(1e6 / loop["host_us"]["mean"], 1),
+            "clock_hz": round(1e6 / loop["clock_us"]["mean"], 2),
+        },
+    }
+
+
+def compare(result, baseline, tolerance):
+    # Regressões: CPU do host e bytes alocados acima da tolerância; o tempo
+    # virtual é determinístico e só muda com o firmware
+    problems = []
+    for name, new in result["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+        if new["host_us"]["p50"] > old["host_us"]["p50"] * (1 + tolerance):
+            problems.append(f"{name}: CPU p50 {old['host_us']['p50']:.0f} -> {new['host_us']['p50']:.0f} us")
+        if new["alloc_bytes"] and old["alloc_bytes"] and \
+                new["alloc_bytes"]["p50"] > old["alloc_bytes"]["p50"] * (1 + tolerance) + 64:
+            problems.append(f"{name}: alocação p50 {old['alloc_bytes']['p50']} -> {new['alloc_bytes']['p50']} bytes")
+        if new["clock_us"]["p50"] != old["clock_us"]["p50"]:
+            problems.append(f"{name}: tempo virtual p50 {old['clock_us']['p50']} -> {new['clock_us']['p50']} us")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--loops", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5, help="laços descartados no início")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="grava os resultados neste arquivo")
+    parser.add_argument("--compare", default=None, help="resultado anterior (JSON) para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="piora relativa aceita na comparação")
+    args = parser.parse_args(argv)
+
+    timing = run(args.loops, args.warmup, False, args.seed)
+    allocs = run(args.loops, args.warmup, True, args.seed)
+    result = summarize(timing, allocs, args.loops)
+
+    print(f"{args.loops} laços do transmissor (Python {result['python']}); CPU do host em us, relógio virtual em ms")
+    print(f"{'etapa':>22} {'chamadas':>8} {'CPU p50':>8} {'p99':>8} {'virtual p50':>12} {'máx':>8} "
+          f"{'bytes p50':>10} {'máx':>7} {'retidos':>8}")
+    for name, s in result["stages"].items():
+        alloc = s["alloc_bytes"] or {"p50": 0, "max": 0}
+        retained = s["retained_bytes"] or {"p50": 0}
+        print(f"{name:>22} {s['calls']:>8} {s['host_us']['p50']:>8.0f} {s['host_us']['p99']:>8.0f} "
+              f"{s['clock_us']['p50'] / 1000:>12.1f} {s['clock_us']['max'] / 1000:>8.1f} "
+              f"{alloc['p50']:>10} {alloc['max']:>7} {retained['p50']:>8}")
+    rate = result["loop_rate"]
+    print(f"Laços por segundo: {rate['host_hz']} no host (só CPU), {rate['clock_hz']} no relógio virtual")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Resultados em {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSÃO {problem}")
+        if problems:
+            return 1
+        print(f"Sem regressões em relação a {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Simula ciclos do modo de baixo consumo do transmissor (Config.LOW_POWER).
+
+Cada ciclo recarrega transmitter/main.py como num boot após deepsleep, roda
+low_power_main() até machine.deepsleep() e mostra o tempo acordado, o ciclo
+de trabalho e o estado persistido entre os ciclos.
+
+    python host/duty_cycle.py --cycles 5
+"""
+import argparse
+import sys
+
+import fakes
+
+
+def run(cycles, interval_s):
+    fakes.reset_world()
+    fakes.install()
+    results = []
+    for _ in range(cycles):
+        # Novo boot: relógio e periféricos zerados, mas a memória RTC e a flash persistem
+        rtc, files = fakes.RTC._memory, fakes.Flash.files
+        fakes.reset_world()
+        fakes.RTC._memory, fakes.Flash.files = rtc, files
+        tx = fakes.load("transmitter/main.py")
+        tx.Config.LOW_POWER = True
+        tx.Config.LOW_POWER_INTERVAL = interval_s
+        radio = fakes.SPI.devices[tx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=tx.RFM95_INT)
+        slept = {}
+
+        def deepsleep(ms=0):
+            slept["awake_ms"] = fakes.CLOCK.now_us / 1000
+            raise fakes.DeepSleep("deepsleep")
+
+        tx.machine.deepsleep = deepsleep
+        try:
+            tx.low_power_main()
+        except fakes.DeepSleep:
+            pass
+        results.append({
+            "awake_ms": slept["awake_ms"],
+            "frames": len(radio.tx_frames),
+            "radio_sleeping": radio.regs[0x01] & 0x07 == 0x00,
+            "state": tx.load_state(),
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--interval", type=int, default=60, help="segundos entre medições")
+    args = parser.parse_args(argv)
+
+    for i, r in enumerate(run(args.cycles, args.interval)):
+        duty = r["awake_ms"] / (args.interval * 1000) * 100
+        print(f"Ciclo {i + 1}: acordado {r['awake_ms']:.0f} ms ({duty:.2f}% do tempo), "
+              f"quadros {r['frames']}, rádio em sleep: {r['radio_sleeping']}, estado {r['state']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1411 @@
+# -*- coding: utf-8 -*-
+"""
+Substitutos de host (CPython) para os módulos do MicroPython usados pelos nós.
+
+Permite importar e executar transmitter/main.py e receiver/main.py num PC,
+com periféricos falsos e um relógio virtual: sleep() apenas avança o relógio,
+então os tempos reportados refletem as esperas do firmware e não a velocidade
+do PC.
+
+Uso:
+    import fakes
+    fakes.install()
+    tx = fakes.load("transmitter/main.py")
+"""
+import sys
+import os
+import types
+import heapq
+import random
+import json
+import struct
+import math
+import collections
+import importlib.util
+import io
+import builtins
+import time as _time
+import gc as _gc
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+
+# ========================
+# Relógio virtual
+# ========================
+class Clock:
+    """Relógio virtual em microssegundos.
+
+    Cada leitura avança POLL_US para que laços de espera ativa terminem.
+    Eventos agendados com at() disparam quando o relógio passa do prazo,
+    inclusive enquanto outro evento espera: um handler de interrupção que
+    aguarda o TxDone vê o rádio terminar o quadro, como no hardware.
+    """
+    POLL_US = 10
+
+    def __init__(self):
+        self.now_us = 0
+        self._events = []
+        self._seq = 0
+        self._scheduled = collections.deque()
+        self._in_event = False
+
+    def reset(self):
+        self.__init__()
+
+    def at(self, due_us, callback, *args):
+        self._seq += 1
+        heapq.heappush(self._events, (due_us, self._seq, callback, args))
+
+    def after(self, delay_us, callback, *args):
+        self.at(self.now_us + delay_us, callback, *args)
+
+    def schedule(self, func, arg):
+        self._scheduled.append((func, arg))
+
+    def advance(self, us):
+        target = self.now_us + us
+        while self._events and self._events[0][0] <= target:
+            due, _, callback, args = heapq.heappop(self._events)
+            self.now_us = max(self.now_us, due)
+            self._in_event = True
+            try:
+                callback(*args)
+            finally:
+                self._in_event = False
+        self.now_us = max(self.now_us, target)
+        self.run_scheduled()
+
+    def run_scheduled(self):
+        if self._in_event:
+            return
+        while self._scheduled:
+            func, arg = self._scheduled.popleft()
+            self._in_event = True
+            try:
+                func(arg)
+            finally:
+                self._in_event = False
+
+    def poll(self):
+        self.advance(self.POLL_US)
+        return self.now_us
+
+
+CLOCK = Clock()
+
+
+def _make_utime():
+    m = types.ModuleType("utime")
+
+    def sleep(s):
+        CLOCK.advance(int(s * 1000000))
+
+    def sleep_ms(ms):
+        CLOCK.advance(int(ms) * 1000)
+
+    def sleep_us(us):
+        CLOCK.advance(int(us))
+
+    def ticks_us():
+        return CLOCK.poll() & _TICKS_MAX
+
+    def ticks_ms():
+        return (CLOCK.poll() // 1000) & _TICKS_MAX
+
+    def ticks_diff(a, b):
+        return ((a - b + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+    def ticks_add(a, delta):
+        return (a + delta) & _TICKS_MAX
+
+    def time_():
+        # Segundos inteiros, como o utime.time() do rp2
+        return CLOCK.poll() // 1000000
+
+    def monotonic():
+        return CLOCK.poll() / 1000000
+
+    def time_ns():
+        return CLOCK.poll() * 1000
+
+    m.sleep = sleep
+    m.sleep_ms = sleep_ms
+    m.sleep_us = sleep_us
+    m.ticks_us = ticks_us
+    m.ticks_ms = ticks_ms
+    m.ticks_cpu = ticks_us
+    m.ticks_diff = ticks_diff
+    m.ticks_add = ticks_add
+    m.time = time_
+    m.time_ns = time_ns
+    m.monotonic = monotonic
+    # Demais atributos (localtime, strftime...) vêm do módulo time real
+    m.__getattr__ = lambda name: getattr(_time, name)
+    return m
+
+
+# ========================
+# machine
+# ========================
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    registry = {}
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = 1 if pull == Pin.PULL_UP else 0
+        if value is not None:
+            self._value = value
+        self.handler = None
+        Pin.registry[id] = self
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self._value = value
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self, handler=None, trigger=IRQ_RISING, hard=False):
+        self.handler = handler
+
+    def fire(self):
+        if self.handler:
+            self.handler(self)
+
+
+class ADC:
+    # Fonte de amostras por pino: função sem argumentos que retorna read_u16()
+    sources = {}
+
+    def __init__(self, pin):
+        self.id = pin.id if isinstance(pin, Pin) else pin
+
+    def read_u16(self):
+        src = ADC.sources.get(self.id)
+        if src:
+            return src()
+        return 32768 + int(random.gauss(0, 1500))
+
+
+class AHT20Model:
+    """Responde como um AHT20 a 25 °C e 50 %UR."""
+
+    def __init__(self, temp=25.0, hum=50.0):
+        self.temp = temp
+        self.hum = hum
+
+    def writeto(self, buf):
+        pass
+
+    def readfrom(self, n):
+        raw_h = int(self.hum / 100.0 * 1048576) & 0xFFFFF
+        raw_t = int((self.temp + 50.0) / 200.0 * 1048576) & 0xFFFFF
+        data = bytes([0x1C, raw_h >> 12, (raw_h >> 4) & 0xFF,
+                      ((raw_h & 0x0F) << 4) | (raw_t >> 16), (raw_t >> 8) & 0xFF, raw_t & 0xFF])
+        return data[:n]
+
+
+class I2CSink:
+    """Dispositivo I2C que só conta bytes escritos (ex.: SSD1306)."""
+
+    def __init__(self):
+        self.bytes_written = 0
+        self.writes = 0
+
+    def writeto(self, buf):
+        self.writes += 1
+        self.bytes_written += len(buf)
+
+    def readfrom(self, n):
+        return bytes(n)
+
+
+class I2C:
+    # Dispositivos por endereço, compartilhados por todos os barramentos
+    devices = {}
+
+    def __init__(self, id=-1, scl=None, sda=None, freq=400000):
+        self.id = id
+
+    def scan(self):
+        return sorted(I2C.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        dev = I2C.devices.get(addr)
+        if dev is None:
+            raise OSError(19)  # ENODEV, como no MicroPython
+        dev.writeto(bytes(buf))
+        return 1
+
+    def writevto(self, addr, vector, stop=True):
+        return self.writeto(addr, b"".join(bytes(v) for v in vector), stop)
+
+    def readfrom(self, addr, n, stop=True):
+        dev = I2C.devices.get(addr)
+        if dev is None:
+            raise OSError(19)
+        return dev.readfrom(n)
+
+
+SoftI2C = I2C
+
+
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+# Valores de reset dos registradores do modo LoRa que entram no tempo no ar e
+# na escolha do canal (frequência, modem, preâmbulo)
+_SX127X_RESET = {
+    0x01: 0x09, 0x06: 0x6C, 0x07: 0x80, 0x08: 0x00, 0x09: 0x4F, 0x0B: 0x2B, 0x0C: 0x20,
+    0x0E: 0x80, 0x1D: 0x72, 0x1E: 0x70, 0x1F: 0x64, 0x21: 0x08, 0x23: 0xFF, 0x31: 0xC3,
+    0x37: 0x0A, 0x39: 0x12, 0x42: 0x12, 0x4D: 0x84,
+}
+
+
+class SX127xRegisters:
+    """Modelo do banco de registradores de um SX1276.
+
+    Acesso em rajada com auto-incremento (exceto na FIFO), FIFO de 256 bytes,
+    modos SLEEP/STDBY/TX/RXCONTINUOUS/RXSINGLE/CAD e DIO0 (RxDone, TxDone ou
+    CadDone, conforme RegDioMapping1). Sozinho, cada TX dura TX_TIME_US; num
+    Medium (ou com time_on_air=True) dura o tempo no ar calculado dos
+    registradores de modem, e os quadros chegam aos outros rádios do meio.
+    Mudar o modo durante o TX aborta o quadro, como no SX1276: sem TxDone, e
+    o quadro cortado (em tx_aborted) não chega a ninguém do meio. on_tx é
+    chamado no início do TX, antes de se saber se o quadro vai até o fim.
+    """
+    TX_TIME_US = 50000
+
+    def __init__(self, dio0=None, medium=None, time_on_air=None):
+        self.regs = bytearray(128)
+        for reg, val in _SX127X_RESET.items():
+            self.regs[reg] = val
+        self.fifo = bytearray(256)
+        self.dio0 = dio0
+        self.medium = None
+        self.time_on_air = medium is not None if time_on_air is None else time_on_air
+        self._arrivals = []         # quadros no ar chegando a este rádio (Medium)
+        self.transactions = 0
+        self.trace = None           # lista de (registrador, escrita) por transação, se ativada
+        self.tx_frames = []
+        self.tx_aborted = []        # (instante, quadro) dos TX cortados por uma mudança de modo
+        self.on_tx = None
+        self._addr = 0
+        self._write = False
+        self._tx_busy = False
+        self._tx_arrivals = []      # chegadas do quadro em TX nos outros rádios do meio
+        if medium is not None:
+            medium.attach(self)
+
+    # Interface de fluxo usada pelos SPIs falsos
+    def begin(self, addr_byte):
+        self.transactions += 1
+        self._write = bool(addr_byte & 0x80)
+        self._addr = addr_byte & 0x7F
+        if self.trace is not None:
+            self.trace.append((self._addr, self._write))
+
+    def stream_write(self, data):
+        for b in data:
+            self.write_reg(self._addr, b)
+            if self._addr:
+                self._addr = (self._addr + 1) & 0x7F
+
+    def stream_read(self, n):
+        out = bytearray(n)
+        for i in range(n):
+            out[i] = self.read_reg(self._addr)
+            if self._addr:
+                self._addr = (self._addr + 1) & 0x7F
+        return out
+
+    def read_reg(self, reg):
+        if reg == 0x00:
+            ptr = self.regs[0x0D]
+            self.regs[0x0D] = (ptr + 1) & 0xFF
+            return self.fifo[ptr]
+        if reg == 0x1B and self.medium is not None:
+            # RegRssiValue: o sinal mais forte chegando agora, ou o ruído
+            return max(0, min(255, int(self.medium.channel_rssi(self) + 157)))
+        return self.regs[reg]
+
+    def write_reg(self, reg, val):
+        if reg == 0x00:
+            ptr = self.regs[0x0D]
+            self.fifo[ptr] = val
+            self.regs[0x0D] = (ptr + 1) & 0xFF
+        elif reg == 0x12:
+            self.regs[0x12] &= ~val & 0xFF   # escrever 1 limpa a flag
+            self._update_dio0()
+        elif reg == 0x01:
+            if self._tx_busy and val & 0x07 != 0x03:
+                self._abort_tx()
+            self.regs[0x01] = val
+            if not self.listening():
+                for arrival in self._arrivals:   # quadro interrompido por TX/STDBY
+                    arrival["listening"] = False
+            if val & 0x07 == 0x03:
+                self._start_tx()
+            elif val & 0x07 == 0x07:
+                self._start_cad()
+        else:
+            self.regs[reg] = val
+            if reg == 0x40:
+                self._update_dio0()
+
+    def _update_dio0(self):
+        # Nível do pino DIO0: RxDone (mapeamento 00) ou TxDone (01), para quem
+        # lê o pino em vez de usar a interrupção
+        pin = Pin.registry.get(self.dio0) if self.dio0 is not None else None
+        if pin is not None:
+            mapping = self.regs[0x40] >> 6
+            flags = self.regs[0x12]
+            pin._value = int(bool((mapping == 0x00 and flags & 0x40) or (mapping == 0x01 and flags & 0x08)
+                                  or (mapping == 0x02 and flags & 0x04)))
+
+    def _fire_dio0(self, mapping):
+        if self.dio0 in Pin.registry and (self.regs[0x40] >> 6) == mapping:
+            Pin.registry[self.dio0].fire()
+
+    def listening(self):
+        return self.regs[0x01] & 0x07 in (0x05, 0x06)
+
+    def channel(self):
+        # Rádios só se ouvem com a mesma frequência, largura de banda e SF
+        return bytes(self.regs[0x06:0x09]), self.regs[0x1D] >> 4, self.regs[0x1E] >> 4
+
+    def symbol_us(self):
+        return (1 << (self.regs[0x1E] >> 4)) * 1000000 / BANDWIDTHS[min(self.regs[0x1D] >> 4, 9)]
+
+    def time_on_air_us(self, length):
+        """Tempo no ar de um quadro de `length` bytes (fórmula do datasheet)."""
+        config1, config2, config3 = self.regs[0x1D], self.regs[0x1E], self.regs[0x26]
+        sf = config2 >> 4
+        cr = max(1, (config1 >> 1) & 0x07)
+        bits = 8 * length - 4 * sf + 28 + 16 * ((config2 >> 2) & 1) - 20 * (config1 & 1)
+        n_payload = 8 + max(-(-bits // (4 * (sf - 2 * ((config3 >> 3) & 1)))) * (cr + 4), 0)
+        preamble = (self.regs[0x20] << 8) | self.regs[0x21]
+        return int((preamble + 4.25 + n_payload) * self.symbol_us())
+
+    def _start_tx(self):
+        n = self.regs[0x22]
+        base = self.regs[0x0E]
+        frame = bytes(self.fifo[(base + i) & 0xFF] for i in range(n))
+        self.tx_frames.append((CLOCK.now_us, frame))
+        if self.on_tx:
+            self.on_tx(frame)
+        self._tx_busy = True
+        airtime = self.time_on_air_us(n) if self.time_on_air else self.TX_TIME_US
+        self._tx_arrivals = self.medium.transmit(self, frame, airtime) if self.medium is not None else []
+        CLOCK.after(airtime, self._tx_done, len(self.tx_frames))
+
+    def _abort_tx(self):
+        # Modo trocado no meio do quadro: o rádio para de transmitir na hora,
+        # sem TxDone, e quem estava recebendo fica com um quadro incompleto
+        self._tx_busy = False
+        self.tx_aborted.append(self.tx_frames[-1])
+        for arrival in self._tx_arrivals:
+            arrival["aborted"] = True
+
+    def _start_cad(self):
+        # CAD dura cerca de dois símbolos; CadDetected se algum quadro do
+        # mesmo canal estiver chegando
+        CLOCK.after(int(2 * self.symbol_us()), self._cad_done)
+
+    def _cad_done(self):
+        if self.regs[0x01] & 0x07 != 0x07:
+            return
+        self.regs[0x01] = (self.regs[0x01] & 0xF8) | 0x01
+        self.regs[0x12] |= 0x04 | (0x01 if self._arrivals else 0)
+        self._update_dio0()
+        self._fire_dio0(0x02)
+
+    def receive(self, frame, snr=8.0, rssi=-60, crc_error=False):
+        """Entrega um quadro recebido: FIFO, RxDone (e PayloadCrcError) e DIO0
+        (se mapeado em RxDone). Em RXSINGLE o rádio volta para STDBY."""
+        if not self.listening():
+            return False
+        base = self.regs[0x0F]
+        for i, b in enumerate(frame):
+            self.fifo[(base + i) & 0xFF] = b
+        self.regs[0x10] = base
+        self.regs[0x13] = len(frame)
+        self.regs[0x19] = int(snr * 4) & 0xFF
+        self.regs[0x1A] = max(0, min(255, int(rssi + 157)))
+        self.regs[0x12] |= 0x40 | (0x20 if crc_error else 0)
+        if self.regs[0x01] & 0x07 == 0x06:
+            self.regs[0x01] = (self.regs[0x01] & 0xF8) | 0x01
+        self._update_dio0()
+        self._fire_dio0(0x00)
+        return True
+
+    def _tx_done(self, count):
+        if not self._tx_busy or count != len(self.tx_frames):
+            return   # quadro abortado (ou já substituído por outro TX)
+        self._tx_busy = False
+        self.regs[0x01] = (self.regs[0x01] & 0xF8) | 0x01
+        self.regs[0x12] |= 0x08
+        self._update_dio0()
+        self._fire_dio0(0x01)
+
+
+class Medium:
+    """Meio de rádio compartilhado por vários SX127xRegisters.
+
+    Um quadro transmitido chega, após o tempo no ar, a cada rádio no mesmo
+    canal que estava em RX do início ao fim, com o RSSI do enlace (set_rssi,
+    padrão `rssi`) e SNR em relação ao ruído da largura de banda. Perde-se
+    por colisão (outro quadro sobreposto a menos de capture_db), por SNR
+    abaixo da sensibilidade do SF, por aborto no transmissor ("aborted") ou
+    ao acaso com probabilidade `loss`; com `crc_error`, chega com
+    PayloadCrcError. Os resultados por destino
+    ficam em stats.
+
+    Vários drivers no mesmo processo: cada um se liga ao rádio que estiver
+    em SPI.devices[barramento] quando é construído, e cada rádio precisa do
+    seu pino de DIO0.
+    """
+    NOISE_FIGURE_DB = 6
+
+    def __init__(self, loss=0.0, rssi=-80.0, capture_db=6.0, crc_error=0.0, seed=1):
+        self.loss = loss
+        self.rssi = rssi
+        self.capture_db = capture_db
+        self.crc_error = crc_error
+        self.rng = random.Random(seed)
+        self.radios = []
+        self.links = {}
+        self.stats = collections.Counter()
+
+    def radio(self, dio0=None):
+        return SX127xRegisters(dio0=dio0, medium=self)
+
+    def attach(self, radio):
+        radio.medium = self
+        self.radios.append(radio)
+
+    def set_rssi(self, a, b, rssi):
+        """RSSI (dBm) do enlace entre os rádios a e b, nos dois sentidos."""
+        self.links[(a, b)] = self.links[(b, a)] = rssi
+
+    def noise_dbm(self, radio):
+        bw = BANDWIDTHS[min(radio.regs[0x1D] >> 4, 9)]
+        return -174 + 10 * math.log10(bw) + self.NOISE_FIGURE_DB
+
+    def channel_rssi(self, radio):
+        return max([a["rssi"] for a in radio._arrivals] + [self.noise_dbm(radio)])
+
+    def transmit(self, sender, frame, airtime_us):
+        self.stats["sent"] += 1
+        channel = sender.channel()
+        arrivals = []
+        for radio in self.radios:
+            if radio is sender or radio.channel() != channel:
+                continue
+            rssi = self.links.get((sender, radio), self.rssi)
+            arrival = {"frame": frame, "rssi": rssi, "listening": radio.listening(), "collided": False,
+                       "aborted": False}
+            for other in radio._arrivals:
+                if rssi < other["rssi"] + self.capture_db:
+                    arrival["collided"] = True
+                if other["rssi"] < rssi + self.capture_db:
+                    other["collided"] = True
+            radio._arrivals.append(arrival)
+            arrivals.append(arrival)
+            CLOCK.after(airtime_us, self._arrive, radio, arrival)
+        return arrivals
+
+    def _arrive(self, radio, arrival):
+        radio._arrivals.remove(arrival)
+        sf = radio.regs[0x1E] >> 4
+        snr = arrival["rssi"] - self.noise_dbm(radio)
+        if arrival["aborted"]:
+            outcome = "aborted"
+        elif arrival["collided"]:
+            outcome = "collided"
+        elif not (arrival["listening"] and radio.listening()):
+            outcome = "not_listening"
+        elif snr < -7.5 - 2.5 * (sf - 7):
+            outcome = "weak"
+        elif self.rng.random() < self.loss:
+            outcome = "lost"
+        else:
+            outcome = "delivered"
+            # o SX1276 reporta SNR até uns +12 dB
+            radio.receive(arrival["frame"], min(snr, 12.0), arrival["rssi"],
+                          crc_error=self.rng.random() < self.crc_error)
+        self.stats[outcome] += 1
+
+
+class SPI:
+    # Dispositivo por número de barramento
+    devices = {}
+
+    def __init__(self, id=0, baudrate=1000000, **kwargs):
+        self.id = id
+        if id not in SPI.devices:
+            SPI.devices[id] = SX127xRegisters()
+        self.device = SPI.devices[id]
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+    def write(self, buf):
+        self.device.begin(buf[0])
+        self.device.stream_write(buf[1:])
+
+    def read(self, nbytes, write=0x00):
+        self.device.begin(write)
+        return bytes([0]) + bytes(self.device.stream_read(nbytes - 1))
+
+    def readinto(self, buf, write=0x00):
+        data = self.read(len(buf), write)
+        buf[:] = data
+
+
+class SPIDevice:
+    """adafruit_bus_device.spi_device.SPIDevice sobre o SPI falso.
+
+    Cada bloco with é uma transação (CS baixo): o primeiro byte escrito é o
+    endereço e as demais escritas e leituras continuam o fluxo.
+    """
+
+    def __init__(self, spi, chip_select=None, *, baudrate=100000, polarity=0, phase=0, extra_clocks=0):
+        self.device = spi.device
+        self._started = False
+
+    def __enter__(self):
+        self._started = False
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, buf, *, start=0, end=None):
+        data = bytes(buf[start:len(buf) if end is None else end])
+        if not self._started:
+            self._started = True
+            self.device.begin(data[0])
+            data = data[1:]
+        self.device.stream_write(data)
+
+    def readinto(self, buf, *, start=0, end=None, write_value=0):
+        end = len(buf) if end is None else end
+        if not self._started:
+            self._started = True
+            self.device.begin(write_value)
+            buf[start] = 0
+            start += 1
+        buf[start:end] = self.device.stream_read(end - start)
+
+
+class DigitalInOut:
+    """digitalio.DigitalInOut sobre o Pin falso (CS, reset ou DIO0 lido por nível)."""
+
+    def __init__(self, pin):
+        self._pin = Pin.registry.get(pin) or Pin(pin)
+
+    def switch_to_output(self, value=False, drive_mode=None):
+        self._pin.value(value)
+
+    def switch_to_input(self, pull=None):
+        pass
+
+    def deinit(self):
+        pass
+
+    @property
+    def value(self):
+        return bool(self._pin.value())
+
+    @value.setter
+    def value(self, v):
+        self._pin.value(v)
+
+
+def _make_circuitpython():
+    # Módulos do CircuitPython usados por receiver/adafruit_rfm9x.py
+    bus_device = types.ModuleType("adafruit_bus_device")
+    spi_device = types.ModuleType("adafruit_bus_device.spi_device")
+    spi_device.SPIDevice = SPIDevice
+    bus_device.spi_device = spi_device
+    digitalio = types.ModuleType("digitalio")
+    digitalio.DigitalInOut = DigitalInOut
+    busio = types.ModuleType("busio")
+    busio.SPI = SPI
+    typing_mod = types.ModuleType("circuitpython_typing")
+    typing_mod.ReadableBuffer = typing_mod.WriteableBuffer = bytearray
+    return {
+        "adafruit_bus_device": bus_device,
+        "adafruit_bus_device.spi_device": spi_device,
+        "digitalio": digitalio,
+        "busio": busio,
+        "circuitpython_typing": typing_mod,
+    }
+
+
+class PWM:
+    def __init__(self, pin, freq=1000, duty_u16=0):
+        self._freq = freq
+        self._duty = duty_u16
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        pass
+
+
+class RTC:
+    _memory = b""
+
+    def memory(self, data=None):
+        if data is None:
+            return RTC._memory
+        RTC._memory = bytes(data)
+
+
+class DeepSleep(BaseException):
+    """Levantada por machine.deepsleep()/reset(): encerra a execução simulada."""
+
+
+def _make_machine():
+    m = types.ModuleType("machine")
+    m.Pin = Pin
+    m.ADC = ADC
+    m.I2C = I2C
+    m.SoftI2C = SoftI2C
+    m.SPI = SPI
+    m.PWM = PWM
+    m.RTC = RTC
+    m.DeepSleep = DeepSleep
+
+    def reset():
+        raise DeepSleep("reset")
+
+    def deepsleep(ms=0):
+        CLOCK.advance(ms * 1000)
+        raise DeepSleep("deepsleep")
+
+    def lightsleep(ms=0):
+        CLOCK.advance(ms * 1000)
+
+    m.reset = reset
+    m.soft_reset = reset
+    m.deepsleep = deepsleep
+    m.lightsleep = lightsleep
+    m.freq = lambda *a: 125000000
+    m.unique_id = lambda: b"\x00\x01\x02\x03\x04\x05\x06\x07"
+    m.reset_cause = lambda: 0
+    m.PWRON_RESET = 1
+    m.DEEPSLEEP_RESET = 4
+    return m
+
+
+# ========================
+# bluetooth
+# ========================
+class UUID:
+    def __init__(self, value):
+        self.value = value
+
+    def __bytes__(self):
+        if isinstance(self.value, int):
+            return struct.pack("<H", self.value)
+        return bytes.fromhex(self.value.replace("-", ""))[::-1]
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and bytes(self) == bytes(other)
+
+    def __hash__(self):
+        return hash(bytes(self))
+
+
+class BLE:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._init()
+        return cls._instance
+
+    def _init(self):
+        self._active = False
+        self._irq = None
+        self.values = {}
+        self.notifies = 0
+        self.advertising = False
+        self._next_handle = 1
+
+    def active(self, v=None):
+        if v is None:
+            return self._active
+        self._active = bool(v)
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def irq(self, handler):
+        self._irq = handler
+
+    def gatts_register_services(self, services):
+        handles = []
+        for _uuid, chars in services:
+            hs = []
+            for _ in chars:
+                hs.append(self._next_handle)
+                self._next_handle += 1
+            handles.append(tuple(hs))
+        return tuple(handles)
+
+    def gatts_write(self, handle, data, send_update=False):
+        self.values[handle] = bytes(data)
+
+    def gatts_read(self, handle):
+        return self.values.get(handle, b"")
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        self.notifies += 1
+
+    def gap_advertise(self, interval_us, adv_data=None, **kwargs):
+        self.advertising = interval_us is not None
+
+    # Ganchos de simulação
+    def connect_central(self, conn_handle=0):
+        self._irq(1, (conn_handle, 0, b"\x00" * 6))
+
+    def disconnect_central(self, conn_handle=0):
+        self._irq(2, (conn_handle, 0, b"\x00" * 6))
+
+
+def _make_bluetooth():
+    m = types.ModuleType("bluetooth")
+    m.BLE = BLE
+    m.UUID = UUID
+    m.FLAG_READ = 0x0002
+    m.FLAG_WRITE_NO_RESPONSE = 0x0004
+    m.FLAG_WRITE = 0x0008
+    m.FLAG_NOTIFY = 0x0010
+    return m
+
+
+# ========================
+# neopixel / framebuf
+# ========================
+class NeoPixel:
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.n = n
+        self.buf = bytearray(n * bpp)
+        self.bpp = bpp
+        self.writes = 0
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, i, color):
+        o = i * self.bpp
+        self.buf[o:o + self.bpp] = bytes(color)
+
+    def __getitem__(self, i):
+        o = i * self.bpp
+        return tuple(self.buf[o:o + self.bpp])
+
+    def fill(self, color):
+        for i in range(self.n):
+            self[i] = color
+
+    def write(self):
+        self.writes += 1
+
+
+class FrameBuffer:
+    """FrameBuffer MONO_VLSB em Python puro (custo próximo do real por pixel)."""
+
+    def __init__(self, buf, width, height, fmt=0, stride=None):
+        self.buf = buf
+        self.width = width
+        self.height = height
+
+    def fill(self, c):
+        v = 0xFF if c else 0x00
+        for i in range(len(self.buf)):
+            self.buf[i] = v
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None if c is None else None
+        idx = (y >> 3) * self.width + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buf[idx] & bit else 0
+        if c:
+            self.buf[idx] |= bit
+        else:
+            self.buf[idx] &= ~bit & 0xFF
+
+    def hline(self, x, y, w, c):
+        for i in range(x, x + w):
+            self.pixel(i, y, c)
+
+    def vline(self, x, y, h, c):
+        for j in range(y, y + h):
+            self.pixel(x, j, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            return self.fill_rect(x, y, w, h, c)
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def fill_rect(self, x, y, w, h, c):
+        for j in range(y, y + h):
+            self.hline(x, j, w, c)
+
+    def text(self, s, x, y, c=1):
+        # Glifo sintético 8x8 derivado do código do caractere
+        for k, ch in enumerate(str(s)):
+            code = ord(ch)
+            for col in range(8):
+                bits = (code * (col + 3)) & 0x7E
+                for row in range(8):
+                    if bits & (1 << row):
+                        self.pixel(x + k * 8 + col, y + row, c)
+
+    def scroll(self, dx, dy):
+        pass
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        pass
+
+
+def _make_framebuf():
+    m = types.ModuleType("framebuf")
+    m.FrameBuffer = FrameBuffer
+    m.MONO_VLSB = 0
+    m.MONO_HLSB = 3
+    m.MONO_HMSB = 4
+    m.RGB565 = 1
+    return m
+
+
+# ========================
+# micropython / módulos "u"
+# ========================
+def _make_micropython():
+    m = types.ModuleType("micropython")
+    m.const = lambda x: x
+    m.schedule = CLOCK.schedule
+    m.alloc_emergency_exception_buf = lambda n: None
+    m.mem_info = lambda *a: None
+    m.native = lambda f: f
+    m.viper = lambda f: f
+    return m
+
+
+def _make_urandom():
+    m = types.ModuleType("urandom")
+    m.getrandbits = random.getrandbits
+    m.randint = random.randint
+    m.random = random.random
+    m.choice = random.choice
+    m.seed = random.seed
+    m.uniform = random.uniform
+    return m
+
+
+# ========================
+# Serial USB (sys.stdout) e select
+# ========================
+class USBSerial:
+    """CDC USB do RP2040 no lugar de sys.stdout (e de sys.stdout.buffer).
+
+    A FIFO de transmissão de FIFO bytes é esvaziada pelo PC a `rate` bytes
+    por segundo do relógio virtual (0: PC parado); o que o PC leu fica em
+    `received`. write() aceita str (print) e bytes e, como
+    mp_hal_stdout_tx_strn, espera (avançando o relógio) por espaço na FIFO
+    até TX_TIMEOUT_US e devolve quantos bytes couberam. Sem PC conectado os
+    bytes são descartados. ioctl() responde ao poll do select.
+    """
+    FIFO = 256
+    TX_TIMEOUT_US = 500000  # MICROPY_HW_USB_CDC_TX_TIMEOUT
+
+    def __init__(self, rate=1000000, connected=True):
+        self.rate = rate
+        self.connected = connected
+        self.received = bytearray()
+        self.blocked_us = 0  # tempo de relógio parado dentro de write()
+        self.timeouts = 0
+        self._fifo = bytearray()
+        self._last_us = CLOCK.now_us
+
+    @property
+    def buffer(self):
+        return self
+
+    def _drain(self):
+        n = (CLOCK.now_us - self._last_us) * self.rate // 1000000
+        if n or not self._fifo or not self.rate:
+            self._last_us = CLOCK.now_us
+        self.received += self._fifo[:n]
+        del self._fifo[:n]
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        data = bytes(data)
+        if not self.connected:
+            return len(data)
+        start = CLOCK.now_us
+        written = 0
+        while True:
+            self._drain()
+            free = self.FIFO - len(self._fifo)
+            self._fifo += data[written:written + free]
+            written = min(len(data), written + free)
+            if written == len(data):
+                break
+            if CLOCK.now_us - start >= self.TX_TIMEOUT_US:
+                self.timeouts += 1
+                break
+            CLOCK.advance(1000)
+        self.blocked_us += CLOCK.now_us - start
+        return written
+
+    def flush(self):
+        pass
+
+    def ioctl(self, request, arg):
+        if request != _MP_STREAM_POLL:
+            return 0
+        self._drain()
+        flags = 0
+        if arg & _POLLOUT and (not self.connected or len(self._fifo) < self.FIFO):
+            flags |= _POLLOUT
+        return flags
+
+
+_MP_STREAM_POLL = 3
+_POLLIN = 0x0001
+_POLLOUT = 0x0004
+
+
+def _make_select():
+    # Só o poll() sem espera do MicroPython, sobre objetos com ioctl()
+    m = types.ModuleType("select")
+
+    class poll:
+        def __init__(self):
+            self._objects = {}
+
+        def register(self, obj, eventmask=_POLLIN | _POLLOUT):
+            self._objects[id(obj)] = (obj, eventmask)
+
+        def modify(self, obj, eventmask):
+            self._objects[id(obj)] = (obj, eventmask)
+
+        def unregister(self, obj):
+            self._objects.pop(id(obj), None)
+
+        def poll(self, timeout=-1):
+            if timeout != 0:
+                raise NotImplementedError("só poll(0) no relógio virtual")
+            ready = []
+            for obj, mask in self._objects.values():
+                flags = obj.ioctl(_MP_STREAM_POLL, mask)
+                if flags:
+                    ready.append((obj, flags))
+            return ready
+
+    m.poll = poll
+    m.POLLIN = _POLLIN
+    m.POLLOUT = _POLLOUT
+    return m
+
+
+# ========================
+# Sistema de arquivos da flash (os e open do firmware)
+# ========================
+class Flash:
+    """
+    Arquivos da flash do firmware, em memória (só modo binário): load() troca
+    o os e o open dos módulos carregados por estes, então nada vai para o
+    disco do PC.
+    writes conta as escritas (cada write() de um arquivo) e bytes_written os
+    bytes gravados. reset_world() apaga tudo; para simular um reset com a
+    flash preservada, guarde Flash.files antes e restaure depois.
+    """
+    files = {}
+    writes = 0
+    bytes_written = 0
+
+    @staticmethod
+    def open(name, mode="r"):
+        return _FlashFile(name, mode)
+
+
+class _FlashFile(io.BytesIO):
+    def __init__(self, name, mode):
+        data = Flash.files.get(name)
+        if data is None and "r" in mode and "+" not in mode:
+            raise OSError(2, "ENOENT", name)
+        super().__init__(b"" if data is None or "w" in mode else data)
+        self._name = name
+        self._mode = mode
+        if "a" in mode:
+            self.seek(0, 2)
+
+    def write(self, data):
+        n = super().write(data)
+        Flash.writes += 1
+        Flash.bytes_written += n
+        return n
+
+    def close(self):
+        if not self.closed and (self._mode[0] in "wa" or "+" in self._mode):
+            Flash.files[self._name] = self.getvalue()
+        super().close()
+
+
+def _make_os():
+    m = types.ModuleType("os")
+
+    def listdir(path=""):
+        return sorted(Flash.files)
+
+    def remove(name):
+        if Flash.files.pop(name, None) is None:
+            raise OSError(2, "ENOENT", name)
+
+    def stat(name):
+        if name not in Flash.files:
+            raise OSError(2, "ENOENT", name)
+        return (0x8000, 0, 0, 0, 0, 0, len(Flash.files[name]), 0, 0, 0)
+
+    def rename(old, new):
+        if old not in Flash.files:
+            raise OSError(2, "ENOENT", old)
+        Flash.files[new] = Flash.files.pop(old)
+
+    m.listdir = listdir
+    m.remove = remove
+    m.stat = stat
+    m.rename = rename
+    m.sep = "/"
+    return m
+
+
+_OS = _make_os()
+
+
+# ========================
+# asyncio (subconjunto do MicroPython)
+# ========================
+class _Loop:
+    """Escalonador cooperativo no relógio virtual.
+
+    Sem tarefas prontas, avança CLOCK até o próximo sleep ou evento agendado
+    (quadros do rádio, DIO0), que pode acordar tarefas por Event/ThreadSafeFlag.
+    """
+
+    def __init__(self):
+        self.ready = collections.deque()
+        self.sleepers = []
+        self._seq = 0
+
+    def step(self, task, value=None):
+        try:
+            request = task.coro.send(value)
+        except StopIteration as e:
+            task.done = True
+            task.result = e.value
+            for waiter in task.waiters:
+                self.ready.append(waiter)
+            return
+        kind, arg = request
+        if kind == "sleep":
+            self._seq += 1
+            heapq.heappush(self.sleepers, (arg, self._seq, task))
+        elif kind == "wait":
+            arg.waiting.append(task)
+        elif kind == "join":
+            if arg.done:
+                self.ready.append(task)
+            else:
+                arg.waiters.append(task)
+
+    def run_until(self, main):
+        while not main.done:
+            if self.ready:
+                self.step(self.ready.popleft())
+                continue
+            if self.sleepers:
+                due = self.sleepers[0][0]
+                if CLOCK._events:
+                    due = min(due, CLOCK._events[0][0])
+                CLOCK.advance(max(0, due - CLOCK.now_us))
+            elif CLOCK._events:
+                CLOCK.advance(max(0, CLOCK._events[0][0] - CLOCK.now_us))
+            else:
+                raise RuntimeError("todas as tarefas estão bloqueadas")
+            while self.sleepers and self.sleepers[0][0] <= CLOCK.now_us:
+                self.ready.append(heapq.heappop(self.sleepers)[2])
+        return main.result
+
+
+class _Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+        self.result = None
+        self.waiters = []
+
+    def __await__(self):
+        if not self.done:
+            yield ("join", self)
+        return self.result
+
+
+LOOP = _Loop()
+
+
+def _make_asyncio():
+    m = types.ModuleType("asyncio")
+
+    @types.coroutine
+    def sleep_ms(ms):
+        yield ("sleep", CLOCK.now_us + max(0, int(ms)) * 1000)
+
+    @types.coroutine
+    def sleep(s):
+        yield ("sleep", CLOCK.now_us + max(0, int(s * 1000000)))
+
+    class Event:
+        def __init__(self):
+            self.state = False
+            self.waiting = []
+
+        def is_set(self):
+            return self.state
+
+        def set(self):
+            self.state = True
+            while self.waiting:
+                LOOP.ready.append(self.waiting.pop(0))
+
+        def clear(self):
+            self.state = False
+
+        @types.coroutine
+        def wait(self):
+            if not self.state:
+                yield ("wait", self)
+            return True
+
+    class ThreadSafeFlag(Event):
+        # Como no MicroPython: wait() consome o sinal
+        @types.coroutine
+        def wait(self):
+            if not self.state:
+                yield ("wait", self)
+            self.state = False
+
+    def create_task(coro):
+        task = _Task(coro)
+        LOOP.ready.append(task)
+        return task
+
+    def run(coro):
+        LOOP.__init__()
+        return LOOP.run_until(create_task(coro))
+
+    m.sleep_ms = sleep_ms
+    m.sleep = sleep
+    m.Event = Event
+    m.ThreadSafeFlag = ThreadSafeFlag
+    m.create_task = create_task
+    m.run = run
+    return m
+
+
+# Só entram em sys.modules durante load(), para não trocar o asyncio e o
+# select do host
+_ASYNCIO = _make_asyncio()
+_SELECT = _make_select()
+
+
+_INSTALLED = False
+
+
+def install(seed=1):
+    """Registra os substitutos em sys.modules (idempotente)."""
+    global _INSTALLED
+    random.seed(seed)
+    if _INSTALLED:
+        return
+    utime = _make_utime()
+    ucollections = types.ModuleType("ucollections")
+    ucollections.namedtuple = collections.namedtuple
+    ucollections.OrderedDict = collections.OrderedDict
+    ucollections.deque = collections.deque
+    bt = _make_bluetooth()
+    np_mod = types.ModuleType("neopixel")
+    np_mod.NeoPixel = NeoPixel
+    sys.modules.update({
+        "utime": utime,
+        "machine": _make_machine(),
+        "micropython": _make_micropython(),
+        "ucollections": ucollections,
+        "urandom": _make_urandom(),
+        "ujson": json,
+        "ustruct": struct,
+        "bluetooth": bt,
+        "ubluetooth": bt,
+        "neopixel": np_mod,
+        "framebuf": _make_framebuf(),
+    })
+    sys.modules.update(_make_circuitpython())
+    # gc.mem_alloc()/mem_free() do MicroPython: bytes rastreados pelo
+    # tracemalloc (0 se ele não estiver ligado) num heap de 192 KB
+    _gc.mem_alloc = lambda: tracemalloc.get_traced_memory()[0]
+    _gc.mem_free = lambda: max(0, 196608 - tracemalloc.get_traced_memory()[0])
+    # No MicroPython const() também existe como builtin
+    builtins.const = sys.modules["micropython"].const
+    I2C.devices.setdefault(0x38, AHT20Model())
+    I2C.devices.setdefault(0x3C, I2CSink())
+    _INSTALLED = True
+
+
+def reset_world():
+    """Reinicia relógio e periféricos entre execuções."""
+    CLOCK.reset()
+    LOOP.__init__()
+    Pin.registry.clear()
+    SPI.devices.clear()
+    ADC.sources.clear()
+    I2C.devices.clear()
+    I2C.devices[0x38] = AHT20Model()
+    I2C.devices[0x3C] = I2CSink()
+    BLE._instance = None
+    RTC._memory = b""
+    Flash.files = {}
+    Flash.writes = 0
+    Flash.bytes_written = 0
+
+
+# Nomes de módulos de firmware que existem em mais de um diretório
+_FIRMWARE_MODULES = ("main", "ulora", "ssd1306", "ahtx0", "ble_advertising", "bme280", "bmp280", "tdma", "adr",
+                     "lorafrag", "prof", "flashlog")
+
+
+def _patch_ble_advertising(mod):
+    # No MicroPython str suporta o protocolo de buffer; no CPython não.
+    orig = mod.advertising_payload
+
+    def advertising_payload(*args, name=None, **kwargs):
+        if isinstance(name, str):
+            name = name.encode()
+        return orig(*args, name=name, **kwargs)
+
+    mod.advertising_payload = advertising_payload
+
+
+def load(relpath, name=None):
+    """Importa um arquivo de firmware com o relógio virtual no lugar de `time`.
+
+    Os módulos irmãos (ulora, ssd1306, ...) são recarregados a partir do
+    diretório do arquivo, para que transmissor e receptor não se misturem.
+    """
+    install()
+    path = os.path.join(ROOT, relpath)
+    directory = os.path.dirname(path)
+    for mod_name in list(sys.modules):
+        mod = sys.modules[mod_name]
+        mod_file = getattr(mod, "__file__", None) or ""
+        if mod_name in _FIRMWARE_MODULES or mod_file.startswith(os.path.join(ROOT, "transmitter")) \
+                or mod_file.startswith(os.path.join(ROOT, "receiver")):
+            del sys.modules[mod_name]
+    real_time = sys.modules["time"]
+    real_asyncio = sys.modules.get("asyncio")
+    real_select = sys.modules.get("select")
+    sys.modules["time"] = sys.modules["utime"]
+    sys.modules["asyncio"] = _ASYNCIO
+    sys.modules["select"] = _SELECT
+    sys.path.insert(0, directory)
+    try:
+        adv = os.path.join(directory, "ble_advertising.py")
+        if os.path.exists(adv):
+            _patch_ble_advertising(__import__("ble_advertising"))
+        spec = importlib.util.spec_from_file_location(name or "fw_" + os.path.basename(directory), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        # Arquivos do firmware na flash falsa
+        for mod in [module] + list(sys.modules.values()):
+            if (getattr(mod, "__file__", None) or "").startswith(directory + os.sep) or mod is module:
+                if getattr(mod, "os", None) is os:
+                    mod.os = _OS
+                mod.open = Flash.open
+    finally:
+        sys.path.remove(directory)
+        sys.modules["time"] = real_time
+        for mod_name, real in (("asyncio", real_asyncio), ("select", real_select)):
+            if real is None:
+                del sys.modules[mod_name]
+            else:
+                sys.modules[mod_name] = real
+    return module
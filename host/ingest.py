@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Serviço de ingestão no PC: saída binária do receptor -> armazenamento colunar.
+
+Lê o fluxo do receptor em SERIAL_BINARY (serialbridge.py) de uma porta
+serial ou de um arquivo, decodifica os quadros em lote (cada leitura de até
+64 KB de uma vez) e grava cada pacote em host/tsstore.py como um ponto do
+nó "<gateway>.<origem>": RSSI, SNR e, quando a mensagem é uma leitura
+"T:..,H:..,D:.." (ou o quadro compacto com --compact), temperatura, umidade
+e dB. O instante de cada ponto vem do ticks_ms da interrupção no receptor,
+relativo ao último pacote do lote, que é datado com o relógio do PC; assim
+reinícios do receptor e a volta do ticks_ms não atrapalham. Os lotes de
+leituras antigas do backlog do transmissor (FLAGS_BATCH) vão para o nó
+"<gateway>.<origem>.backlog", cada leitura datada pela sua idade (ou pela
+recepção, se a idade é desconhecida): o nó ao vivo já está à frente delas, e
+o armazenamento só acrescenta no fim.
+
+Os pontos ficam em memória e são gravados a cada --flush-s segundos (ou
+--flush-points pontos). Com --record, o fluxo bruto também é gravado numa
+captura (blocos com o instante do PC e o gateway), que host/ingest_replay.py
+reproduz. Ctrl-C grava o que falta e sai.
+
+    python host/ingest.py --port /dev/ttyACM0 --store dados --record cap.lcap
+    python host/ingest.py --port COM5 --gateway 2 --store dados
+    python host/ingest.py --file captura.bin --store dados
+"""
+import argparse
+import struct
+import sys
+import time
+
+import serial_reader
+import tsstore
+
+CAPTURE_MAGIC = b"LCAP1\n"
+CAPTURE_CHUNK = struct.Struct("<qHI")  # ms do PC, gateway, bytes do bloco
+TICKS_MASK = (1 << 30) - 1  # ticks_ms do MicroPython volta a zero em 2**30 ms
+FLAGS_FRAG = 0x01  # ulora: fragmento de uma mensagem maior
+FLAGS_BATCH = 0x08  # ulora: lote de leituras do backlog do transmissor
+BATCH_RECORD = struct.Struct("<Ihhh")  # idade (s), temperatura, umidade e dB, x10
+AGE_UNKNOWN = 0xffffffff  # leitura de um boot anterior do transmissor
+BACKLOG_SUFFIX = ".backlog"
+NO_SENSORS = (tsstore.NAN,) * 3
+
+
+def parse_sensors(payload, compact=False):
+    """(temperatura, umidade, dB) da mensagem, NaN se não for uma leitura."""
+    if compact:
+        if len(payload) < 6:
+            return NO_SENSORS
+        return tuple(v / 10 for v in struct.unpack_from("<hhh", payload))
+    if payload[:2] != b"T:":
+        return NO_SENSORS
+    try:
+        temp, hum, db = payload.split(b",")
+        return float(temp[2:]), float(hum[2:]), float(db[2:])
+    except ValueError:
+        return NO_SENSORS
+
+
+def parse_batch(payload):
+    """[(idade em ms, ou None se desconhecida, (temperatura, umidade, dB))] de um lote."""
+    size = len(payload) - len(payload) % BATCH_RECORD.size
+    return [(None if age == AGE_UNKNOWN else age * 1000, (temp / 10, hum / 10, db / 10))
+            for age, temp, hum, db in BATCH_RECORD.iter_unpack(payload[:size])]
+
+
+def write_chunk(f, wall_ms, gateway, data):
+    f.write(CAPTURE_CHUNK.pack(wall_ms, gateway, len(data)))
+    f.write(data)
+
+
+def read_capture(path):
+    """Gera (ms do PC, gateway, bytes) de uma captura gravada com --record."""
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} não é uma captura ({CAPTURE_MAGIC!r})")
+        while True:
+            header = f.read(CAPTURE_CHUNK.size)
+            if len(header) < CAPTURE_CHUNK.size:
+                return
+            wall_ms, gateway, size = CAPTURE_CHUNK.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                return  # captura cortada no meio de um bloco
+            yield wall_ms, gateway, data
+
+
+class Ingest:
+    """Decodifica blocos do fluxo de cada gateway e grava os pontos."""
+
+    def __init__(self, store, compact=False, flush_s=5.0, flush_points=200000):
+        self.store = store
+        self.compact = compact
+        self.flush_s = flush_s
+        self.flush_points = flush_points
+        self.records = 0
+        self.fragments = 0
+        self._readers = {}  # gateway -> serial_reader.Reader
+        self._last_flush = time.monotonic()
+
+    def reader(self, gateway):
+        reader = self._readers.get(gateway)
+        if reader is None:
+            reader = self._readers[gateway] = serial_reader.Reader()
+        return reader
+
+    def feed(self, gateway, data, wall_ms):
+        """Um bloco lido da serial às wall_ms; devolve as linhas de texto."""
+        records = []
+        texts = []
+        for kind, item in self.reader(gateway).feed(data):
+            (records if kind == "record" else texts).append(item)
+        self.add(gateway, records, wall_ms)
+        return texts
+
+    def add(self, gateway, records, wall_ms):
+        if not records:
+            return
+        append = self.store.append
+        ref = records[-1].ticks_ms
+        prefix = "%d." % gateway
+        for r in records:
+            t = wall_ms - ((ref - r.ticks_ms) & TICKS_MASK)
+            if r.flags & FLAGS_BATCH:
+                node = prefix + str(r.src) + BACKLOG_SUFFIX
+                for age, sensors in parse_batch(r.payload):
+                    append(node, t - (age or 0), (r.rssi, r.snr) + sensors)
+                continue
+            if r.flags & FLAGS_FRAG:
+                self.fragments += 1
+                sensors = NO_SENSORS
+            else:
+                sensors = parse_sensors(r.payload, self.compact)
+            append(prefix + str(r.src), t, (r.rssi, r.snr) + sensors)
+        self.records += len(records)
+        if self.store.buffered >= self.flush_points:
+            self.flush()
+
+    def poll(self):
+        if time.monotonic() - self._last_flush >= self.flush_s:
+            self.flush()
+
+    def flush(self):
+        self.store.flush()
+        self._last_flush = time.monotonic()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--port", help="porta serial do receptor")
+    source.add_argument("--file", help="fluxo bruto capturado (- para a entrada padrão)")
+    parser.add_argument("--baud", type=int, default=115200, help="ignorado pela CDC USB")
+    parser.add_argument("--store", required=True, help="diretório do armazenamento")
+    parser.add_argument("--gateway", type=int, default=0, help="número deste receptor nos nomes dos nós")
+    parser.add_argument("--compact", action="store_true", help="leituras no quadro binário do perfil compacto")
+    parser.add_argument("--record", default=None, help="grava o fluxo bruto nesta captura")
+    parser.add_argument("--flush-s", type=float, default=5.0)
+    parser.add_argument("--flush-points", type=int, default=200000)
+    parser.add_argument("--stats-s", type=float, default=60.0, help="resumo no stderr a cada N s (0: nunca)")
+    args = parser.parse_args(argv)
+
+    read, close = serial_reader.open_input(args)
+    store = tsstore.Store(args.store)
+    ingest = Ingest(store, args.compact, args.flush_s, args.flush_points)
+    capture = None
+    if args.record:
+        capture = open(args.record, "ab")
+        if not capture.tell():
+            capture.write(CAPTURE_MAGIC)
+    start = last_stats = time.monotonic()
+    try:
+        while True:
+            data = read(65536)
+            if not data and not args.port:
+                break
+            if data:
+                wall_ms = time.time_ns() // 1000000
+                if capture:
+                    write_chunk(capture, wall_ms, args.gateway, data)
+                for line in ingest.feed(args.gateway, data, wall_ms):
+                    print(line, file=sys.stderr)
+            ingest.poll()
+            if args.stats_s and time.monotonic() - last_stats >= args.stats_s:
+                last_stats = time.monotonic()
+                reader = ingest.reader(args.gateway)
+                print(f"{ingest.records} registros ({ingest.records / (last_stats - start):.0f}/s), "
+                      f"{reader.missing} faltando pelo seq, {reader.bad} inválidos", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingest.flush()
+        close()
+        if capture:
+            capture.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Reprodução de capturas no serviço de ingestão (host/ingest.py) e benchmark.
+
+Com capturas gravadas por ingest.py --record, reproduz os blocos num
+armazenamento (host/tsstore.py) exatamente como o ingest.py os gravou; várias
+capturas, de vários gateways, são intercaladas pelo instante do PC. Com
+--speed 1 os intervalos originais são respeitados (10: dez vezes mais rápido);
+sem ele, os blocos vão o mais rápido possível.
+
+Sem capturas, roda o benchmark: gera capturas sintéticas (--nodes nós em
+gateways de até 250 nós, uma leitura a cada --interval-s por --hours horas,
+atravessando uma virada de mês e a volta do ticks_ms; mais --long-nodes nós
+com --days dias de dados), e mede:
+
+* registros/s só decodificando os quadros e registros/s com a ingestão
+  completa (decodificação, armazenamento, agregados e flushes);
+* arquivos e bytes no disco;
+* o tempo das consultas: um dia de pontos brutos e --days dias em baldes de
+  1 dia, com e sem os agregados.
+
+A ingestão dos nós longos é interrompida no meio, com o estado do último
+flush perdido e lixo no fim de colunas, como numa queda; depois de reiniciar,
+os valores lidos (pontos e agregados: contagem, mínimo e máximo exatos,
+média com tolerância) têm que ser os das capturas.
+
+    python host/ingest_replay.py cap1.lcap cap2.lcap --store dados
+    python host/ingest_replay.py cap.lcap --store dados --speed 10
+    python host/ingest_replay.py --bench
+    python host/ingest_replay.py --bench --nodes 5000 --json ingest.json
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import ingest
+import serial_reader
+import tsstore
+
+NODES_PER_GATEWAY = 250
+START = tsstore.parse_time("2026-01-01")
+SHORT_START = tsstore.parse_time("2026-03-31T23:00")  # atravessa a virada de mês
+DELAY_MS = 5  # do último pacote do bloco até a leitura no PC
+LONG_GATEWAY = 100
+
+
+def replay(sink, paths, speed=0.0):
+    """Entrega os blocos das capturas a sink.feed() na ordem do instante do PC; devolve os blocos."""
+    chunks = 0
+    first = None
+    start = time.monotonic()
+    for wall_ms, gateway, data in heapq.merge(*map(ingest.read_capture, paths), key=lambda c: c[0]):
+        if speed:
+            first = wall_ms if first is None else first
+            wait = (wall_ms - first) / 1000 / speed - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+        sink.feed(gateway, data, wall_ms)
+        if speed and isinstance(sink, ingest.Ingest):
+            sink.poll()
+        chunks += 1
+    return chunks
+
+
+class Decoder:
+    """Só decodifica (mesma interface de Ingest.feed), para medir o custo dos quadros."""
+
+    def __init__(self):
+        self.readers = {}
+        self.records = 0
+
+    def feed(self, gateway, data, wall_ms):
+        reader = self.readers.setdefault(gateway, serial_reader.Reader())
+        self.records += sum(kind == "record" for kind, _ in reader.feed(data))
+
+
+def f32(v):
+    return struct.unpack("<f", struct.pack("<f", v))[0]
+
+
+def synth_node(rng, t0, t1, interval_ms):
+    """Leituras de um nó: (t, rssi, snr, mensagem); uma em 50 não é leitura."""
+    points = []
+    t = t0 + rng.randrange(interval_ms)
+    while t < t1:
+        if rng.randrange(50):
+            text = "T:%.1f,H:%.1f,D:%.1f" % (rng.uniform(15, 35), rng.uniform(20, 90), rng.uniform(40, 90))
+        else:
+            text = "ping"
+        points.append((t, rng.randrange(-125, -50), rng.randrange(-80, 48) / 4, text.encode()))
+        t += interval_ms + rng.randrange(-500, 500)
+    return points
+
+
+def write_capture(path, gateway, nodes, boot_ms):
+    """Captura de um gateway com os pontos de {origem: pontos}, um bloco por segundo com pacotes."""
+    packets = sorted((p[0], src, p) for src, points in nodes.items() for p in points)
+    seq = 0
+    minute = None
+    with open(path, "wb") as f:
+        f.write(ingest.CAPTURE_MAGIC)
+        data = bytearray()
+        for k, (t, src, (_, rssi, snr, payload)) in enumerate(packets):
+            ticks = (t - boot_ms) & ingest.TICKS_MASK
+            data += serial_reader.encode_record(serial_reader.Record(seq, 1, src, k & 0xff, 0, rssi, snr,
+                                                                     ticks, payload))
+            seq = (seq + 1) & 0xffff
+            if k + 1 == len(packets) or packets[k + 1][0] // 1000 != t // 1000:
+                if t // 60000 != minute:
+                    minute = t // 60000
+                    data += b'LINK {"nodes":%d}\n' % len(nodes)
+                ingest.write_chunk(f, t + DELAY_MS, gateway, data)
+                data = bytearray()
+    return len(packets)
+
+
+def split_capture(path, parts):
+    """Divide uma captura nos arquivos de parts {caminho: instante de corte (o último: None)}."""
+    outs = [open(p, "wb") for p in parts]
+    for out in outs:
+        out.write(ingest.CAPTURE_MAGIC)
+    cuts = list(parts.values())
+    for wall_ms, gateway, data in ingest.read_capture(path):
+        i = next(i for i, cut in enumerate(cuts) if cut is None or wall_ms < cut)
+        ingest.write_chunk(outs[i], wall_ms, gateway, data)
+    for out in outs:
+        out.close()
+
+
+def expected(points):
+    """(t, [valor por métrica]) como o armazenamento deve devolver."""
+    out = []
+    for t, rssi, snr, payload in points:
+        out.append((t + DELAY_MS, [f32(v) for v in (rssi, snr) + ingest.parse_sensors(payload)]))
+    return out
+
+
+def expected_aggregate(points, metric, step):
+    i = tsstore.METRICS.index(metric)
+    acc = {}
+    for t, values in points:
+        v = values[i]
+        if v == v:
+            b = acc.setdefault(t - t % (step * 1000), [0, v, v, 0.0])
+            b[0] += 1
+            b[1] = min(b[1], v)
+            b[2] = max(b[2], v)
+            b[3] += v
+    return [(start, n, lo, hi, total / n) for start, (n, lo, hi, total) in sorted(acc.items())]
+
+
+def check_aggregate(got, want, what):
+    assert [r[:4] for r in got] == [r[:4] for r in want], f"{what}: contagem/mínimo/máximo diferentes"
+    for g, w in zip(got, want):
+        assert abs(g[4] - w[4]) <= 1e-9 * max(1.0, abs(w[4])), f"{what}: média diferente em {g[0]}"
+
+
+def disk_usage(root):
+    files = size = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+    return files, size
+
+
+def timed(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def bench(args, root):
+    rng = random.Random(args.seed)
+    caps = os.path.join(root, "captures")
+    store_dir = os.path.join(root, "store")
+    os.makedirs(caps)
+    result = {"nodes": args.nodes, "hours": args.hours, "long_nodes": args.long_nodes, "days": args.days}
+
+    # Capturas: nós "curtos" em vários gateways e poucos nós com meses de dados
+    short_end = SHORT_START + args.hours * 3600000
+    short = {}
+    short_paths = []
+    records = 0
+    gateways = -(-args.nodes // NODES_PER_GATEWAY)
+    for gw in range(gateways):
+        nodes = {src: synth_node(rng, SHORT_START, short_end, args.interval_s * 1000)
+                 for src in range(1, min(NODES_PER_GATEWAY, args.nodes - gw * NODES_PER_GATEWAY) + 1)}
+        path = os.path.join(caps, "gw%d.lcap" % gw)
+        # ticks_ms volta a zero 1 h depois do início
+        records += write_capture(path, gw, nodes, SHORT_START + 3600000 - (1 << 30))
+        short_paths.append(path)
+        short.update(("%d.%d" % (gw, src), points) for src, points in nodes.items())
+    long_end = START + args.days * 86400000
+    long = {src: synth_node(rng, START, long_end, 120000) for src in range(1, args.long_nodes + 1)}
+    long_path = os.path.join(caps, "long.lcap")
+    records += write_capture(long_path, LONG_GATEWAY, long, START - 1000)
+    half = START + args.days * 86400000 // 2
+    parts = {os.path.join(caps, "long-%d.lcap" % i): cut
+             for i, cut in enumerate((half, half + 6 * 3600000, None))}
+    split_capture(long_path, parts)
+    capture_bytes = sum(os.path.getsize(p) for p in short_paths + [long_path])
+    print(f"{len(short)} nós em {gateways} gateways por {args.hours} h e {len(long)} nós por {args.days} dias: "
+          f"{records} registros, {capture_bytes} bytes de capturas")
+
+    # Só decodificando
+    decoder = Decoder()
+    _, ms = timed(replay, decoder, short_paths + [long_path], repeat=1)
+    assert decoder.records == records, "registros perdidos na decodificação"
+    result["decode_records_s"] = round(records / ms * 1000)
+    print(f"Decodificação: {result['decode_records_s']} registros/s")
+
+    # Ingestão completa, com uma queda no meio dos nós longos
+    long_parts = list(parts)
+    store = tsstore.Store(store_dir)
+    sink = ingest.Ingest(store, flush_points=args.flush_points)
+    start = time.perf_counter()
+    replay(sink, short_paths + long_parts[:1])
+    sink.flush()
+    state = {}
+    for src in long:
+        path = os.path.join(store_dir, "state", "%d.%d.bin" % (LONG_GATEWAY, src))
+        with open(path, "rb") as f:
+            state[path] = f.read()
+    replay(sink, long_parts[1:2])
+    sink.flush()
+    elapsed = time.perf_counter() - start
+    ingested = sink.records
+    # Queda: o estado do último flush se perde e colunas ficam com lixo no fim
+    for path, data in state.items():
+        with open(path, "wb") as f:
+            f.write(data)
+    node = "%d.1" % LONG_GATEWAY
+    month = store.months(node)[-1]
+    for name, garbage in (("temp.f32", b"\x01\x02"), ("rssi.f32", b"\0\0\xc0\x7f"), ("t.i64", b"\x05")):
+        with open(os.path.join(store_dir, "raw", node, month, name), "ab") as f:
+            f.write(garbage)
+    rows = os.path.join(store_dir, "r%d" % tsstore.LEVELS[0], node, month, "rows.bin")
+    with open(rows, "ab") as f:
+        f.write(b"\xff" * (tsstore.ROW.size // 2))
+    store = tsstore.Store(store_dir)
+    sink = ingest.Ingest(store, flush_points=args.flush_points)
+    start = time.perf_counter()
+    replay(sink, long_parts[2:])
+    sink.flush()
+    elapsed += time.perf_counter() - start
+    ingested += sink.records
+    assert ingested == records, "registros perdidos na ingestão"
+    result["ingest_records_s"] = round(records / elapsed)
+    result["files"], result["bytes"] = disk_usage(store_dir)
+    print(f"Ingestão: {result['ingest_records_s']} registros/s; {result['files']} arquivos, "
+          f"{result['bytes']} bytes ({result['bytes'] / records:.1f} por registro)")
+
+    # Conferência: pontos e agregados iguais aos das capturas
+    store = tsstore.Store(store_dir)
+    assert len(store.nodes()) == len(short) + len(long), "nós faltando"
+    for name in rng.sample(sorted(short), min(20, len(short))):
+        want = expected(short[name])
+        for i, metric in enumerate(tsstore.METRICS):
+            got = store.points(name, metric, SHORT_START, short_end + 1000)
+            assert got == [(t, v[i]) for t, v in want if v[i] == v[i]], f"{name} {metric}: pontos diferentes"
+        check_aggregate(store.aggregate(name, "temp", SHORT_START, short_end + 1000, 300),
+                        expected_aggregate(want, "temp", 300), f"{name} temp 300 s")
+    queries = {}
+    for src, points in long.items():
+        name = "%d.%d" % (LONG_GATEWAY, src)
+        want = expected(points)
+        for i, metric in enumerate(tsstore.METRICS):
+            got = store.points(name, metric, START, long_end + 1000)
+            assert got == [(t, v[i]) for t, v in want if v[i] == v[i]], f"{name} {metric}: pontos diferentes"
+        for metric in ("rssi", "temp"):
+            for step in (3600, 86400, 7 * 86400):
+                check_aggregate(store.aggregate(name, metric, START, long_end + 1000, step),
+                                expected_aggregate(want, metric, step), f"{name} {metric} {step} s")
+        day = START + args.days // 2 * 86400000
+        q = {"raw_1_day": timed(store.points, name, "temp", day, day + 86400000)[1],
+             "daily_rollups": timed(store.aggregate, name, "temp", START, long_end, 86400)[1],
+             "daily_raw": timed(lambda: store.aggregate(name, "temp", START, long_end, 86400, rollups=False))[1],
+             "hourly_rollups": timed(store.aggregate, name, "temp", START, long_end, 3600)[1]}
+        for key, ms in q.items():
+            queries[key] = min(ms, queries.get(key, ms))
+    result["query_ms"] = {key: round(ms, 2) for key, ms in queries.items()}
+    print(f"Consultas de um nó longo (ms): 1 dia de pontos {queries['raw_1_day']:.2f}; {args.days} dias por dia "
+          f"{queries['daily_rollups']:.2f} com agregados, {queries['daily_raw']:.2f} sem; "
+          f"por hora {queries['hourly_rollups']:.2f}")
+    print("Pontos e agregados conferem com as capturas, inclusive depois da queda")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("captures", nargs="*", help="capturas gravadas com ingest.py --record")
+    parser.add_argument("--store", default=None, help="diretório do armazenamento (no benchmark: temporário)")
+    parser.add_argument("--compact", action="store_true", help="leituras no quadro binário do perfil compacto")
+    parser.add_argument("--speed", type=float, default=0.0, help="fator de tempo real (0: sem esperar)")
+    parser.add_argument("--flush-points", type=int, default=200000)
+    parser.add_argument("--bench", action="store_true", help="benchmark com capturas sintéticas")
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--hours", type=int, default=2)
+    parser.add_argument("--interval-s", type=int, default=60)
+    parser.add_argument("--long-nodes", type=int, default=3)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="grava os resultados do benchmark neste arquivo")
+    args = parser.parse_args(argv)
+
+    if args.captures and not args.bench:
+        if not args.store:
+            parser.error("--store é obrigatório para reproduzir capturas")
+        sink = ingest.Ingest(tsstore.Store(args.store), args.compact, flush_points=args.flush_points)
+        start = time.monotonic()
+        try:
+            chunks = replay(sink, args.captures, args.speed)
+        finally:
+            sink.flush()
+        elapsed = max(time.monotonic() - start, 1e-9)
+        print(f"{chunks} blocos, {sink.records} registros ({sink.records / elapsed:.0f}/s), "
+              f"{sink.fragments} fragmentos")
+        return 0
+
+    root = args.store or tempfile.mkdtemp(prefix="ingest-bench-")
+    try:
+        result = bench(args, root)
+    finally:
+        if not args.store:
+            shutil.rmtree(root)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Resultados em {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
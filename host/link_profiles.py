@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Tempo no ar da leitura de sensores e do ACK em cada perfil de enlace do ulora.
+
+Para cada ModemConfig, mostra o quadro de sensores (texto "T:..,H:..,D:.." nos
+perfis de cabeçalho explícito, binário de 6 bytes no Compact) e o ACK com
+SNR/RSSI, usando ulora.link_time_on_air_ms.
+
+    python host/link_profiles.py
+"""
+import argparse
+import sys
+
+import fakes
+
+TEXT_LEN = len("T:25.0,H:50.0,D:71.0")
+BINARY_LEN = 6 # struct "<hhh"
+ACK_LEN = 3 # b'!' + SNR + RSSI
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args(argv)
+
+    fakes.install()
+    ulora = fakes.load("receiver/ulora.py", "ulora")
+    profiles = ("Standard", "ShortPreamble", "Compact")
+    configs = ("Bw500Cr45Sf128", "Bw125Cr45Sf128", "Bw125Cr45Sf2048", "Bw125Cr48Sf4096")
+
+    print(f"{'ModemConfig':>17} {'perfil':>14} {'bytes no ar':>12} {'leitura':>10} {'ACK':>9} {'economia':>9}")
+    for name in configs:
+        config = getattr(ulora.ModemConfig, name)
+        base = None
+        for profile_name in profiles:
+            profile = getattr(ulora.LinkProfile, profile_name)
+            payload = BINARY_LEN if profile[0] else TEXT_LEN
+            data_ms = ulora.link_time_on_air_ms(payload, config, profile)
+            ack_ms = ulora.link_time_on_air_ms(ACK_LEN, config, profile)
+            total = data_ms + ack_ms
+            if base is None:
+                base = total
+            print(f"{name:>17} {profile_name:>14} {ulora.link_frame_len(payload, profile):>12} "
+                  f"{data_ms:>8.1f}ms {ack_ms:>7.1f}ms {1 - total / base:>9.0%}")
+    print("economia: tempo no ar de leitura + ACK em relação ao Standard")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Estatísticas de qualidade do enlace do receptor (linkstats) no host.
+
+Primeiro compara os percentis do estimador P² com os exatos em amostras
+sintéticas (normal, exponencial, bimodal). Depois roda receiver/main.py com o
+SX1276 falso e relógio virtual: --nodes transmissores com RSSI/SNR próprios,
+intervalo com jitter e uma fração --loss de quadros que nunca chegam (lacunas
+no header_id, que não dão a volta em 255 com os valores padrão). Confere as linhas "LINK {json}" exportadas pela serial contra
+os pacotes processados (média, mínimo, máximo, percentis da janela), a perda
+contra as lacunas entre os quadros entregues e mostra a página de estatísticas do OLED (botão B).
+
+    python host/link_stats.py
+    python host/link_stats.py --nodes 3 --loss 0.2 --seconds 300
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+
+import fakes
+
+BUTTON_B = 6
+
+
+def check_p2(linkstats, samples, rng):
+    print(f"{'distribuição':>13} {'q':>5} {'exato':>9} {'P²':>9} {'erro (IQR)':>11}")
+    worst = 0.0
+    for name, draw in (("normal", lambda: rng.gauss(-90, 6)), ("exponencial", lambda: rng.expovariate(1 / 40)),
+                       ("bimodal", lambda: rng.gauss(-110, 3) if rng.random() < 0.3 else rng.gauss(-75, 3))):
+        values = [draw() for _ in range(samples)]
+        ordered = sorted(values)
+        iqr = ordered[samples * 3 // 4] - ordered[samples // 4]
+        for q in linkstats.QUANTILES:
+            estimator = linkstats.P2Quantile(q)
+            for v in values:
+                estimator.add(v)
+            exact = ordered[int(q * samples)]
+            error = abs(estimator.value() - exact) / iqr
+            worst = max(worst, error)
+            print(f"{name:>13} {q:>5} {exact:>9.2f} {estimator.value():>9.2f} {error:>10.1%}")
+    return worst
+
+
+class Stop(BaseException):
+    """Encerra o asyncio.run() do receptor no fim da simulação."""
+
+
+def run(nodes, interval_ms, seconds, loss, seed):
+    fakes.reset_world()
+    fakes.install(seed)
+    rx = fakes.load("receiver/main.py")
+    radio = fakes.SPI.devices[rx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=rx.RFM95_INT)
+    rx.ADR = False
+    rx.LINK_EXPORT_MS = 10000
+    rng = random.Random(seed)
+
+    sent = {}  # nó -> [enviados, perdidos de propósito]
+    for node in range(1, nodes + 1):
+        sent[node] = [0, 0]
+        mean_rssi = -70 - 15 * (node - 1)
+        t = 500000 + rng.randrange(interval_ms) * 1000
+        header_id = 0
+        while t < seconds * 1000000:
+            header_id = (header_id + 1) & 0xff
+            sent[node][0] += 1
+            if rng.random() < loss:
+                sent[node][1] += 1
+            else:
+                frame = bytes([rx.SERVER_ADDRESS, node, header_id, 0]) + b"T:25.0,H:50.0,D:60.0"
+                fakes.CLOCK.at(t, radio.receive, frame, rng.uniform(2, 9), rng.gauss(mean_rssi, 4))
+            t += interval_ms * 1000 + int(rng.gauss(0, 30)) * 1000
+
+    processed = {}  # nó -> [(rssi, snr, header_id)]
+    on_recv = rx.on_recv
+
+    def recorded(payload):
+        processed.setdefault(payload.header_from, []).append((payload.rssi, payload.snr / 4, payload.header_id))
+        on_recv(payload)
+
+    def stop():
+        raise Stop()
+
+    # Botão B pressionado por 300 ms perto do fim: página de estatísticas
+    fakes.CLOCK.at((seconds - 5) * 1000000, lambda: fakes.Pin.registry[BUTTON_B].value(0))
+    fakes.CLOCK.at((seconds - 5) * 1000000 + 300000, lambda: fakes.Pin.registry[BUTTON_B].value(1))
+    pages = []
+    show_stats_page = rx.show_stats_page
+    rx.show_stats_page = lambda: pages.append(show_stats_page())
+    rx.on_recv = recorded
+    fakes.CLOCK.at(seconds * 1000000 + 1000000, stop)
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            rx.main()
+    except Stop:
+        pass
+    exports = [json.loads(line[5:]) for line in out.getvalue().splitlines() if line.startswith("LINK ")]
+    return rx, sent, processed, exports, pages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--interval-ms", type=int, default=2000)
+    parser.add_argument("--seconds", type=int, default=120)
+    parser.add_argument("--loss", type=float, default=0.1, help="fração de quadros que não chegam")
+    parser.add_argument("--samples", type=int, default=5000, help="amostras por distribuição no teste do P²")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    fakes.install(args.seed)
+    linkstats = fakes.load("receiver/linkstats.py", "linkstats")
+    worst = check_p2(linkstats, args.samples, random.Random(args.seed))
+
+    rx, sent, processed, exports, pages = run(args.nodes, args.interval_ms, args.seconds, args.loss, args.seed)
+    window = rx.LINK_WINDOW
+    print(f"{args.nodes} nós, um quadro a cada {args.interval_ms} ms por {args.seconds} s, perda {args.loss:.0%}; "
+          f"{len(exports)} linhas LINK exportadas, janela de {window} pacotes")
+    print(f"{'nó':>3} {'enviados':>9} {'perdidos':>9} {'perda LINK':>11} {'RSSI média':>11} {'p10/p90':>13} "
+          f"{'SNR média':>10} {'intervalo':>10} {'jitter':>7}")
+    last = {}
+    for record in exports:
+        last[record["addr"]] = record
+    for node, (total, lost) in sent.items():
+        record = last[node]
+        recent = processed[node][-window:]
+        rssi = sorted(p[0] for p in recent)
+        snr = [p[1] for p in recent]
+        print(f"{node:>3} {total:>9} {lost:>9} {record['loss']:>10.1%} {record['rssi']['mean']:>11.1f} "
+              f"{record['rssi']['p10']:>6.0f}/{record['rssi']['p90']:<6.0f} {record['snr']['mean']:>10.2f} "
+              f"{record['interval']['mean']:>8.0f}ms {record['jitter_ms']:>6.0f}")
+        # A última exportação pode ser anterior aos últimos pacotes: compara
+        # com os pacotes processados até ela
+        upto = processed[node][:record["n"]][-window:]
+        rssi = sorted(p[0] for p in upto)
+        assert abs(record["rssi"]["mean"] - sum(rssi) / len(rssi)) < 0.01, f"nó {node}: média de RSSI"
+        assert record["rssi"]["min"] == rssi[0] and record["rssi"]["max"] == rssi[-1], f"nó {node}: mín/máx"
+        assert record["rssi"]["p90"] == rssi[min(len(rssi) - 1, int(0.9 * len(rssi)))], f"nó {node}: p90"
+        assert abs(record["snr"]["mean"] - sum(p[1] for p in upto) / len(upto)) < 0.01, f"nó {node}: SNR"
+        assert abs(record["interval"]["mean"] - args.interval_ms) < args.interval_ms * args.loss * 3 + 100
+        # Perdas antes do primeiro e depois do último quadro recebido não
+        # aparecem como lacunas no header_id
+        ids = [p[2] for p in processed[node][:record["n"]]]
+        assert record["lost"] == ids[-1] - ids[0] + 1 - len(ids), \
+            f"nó {node}: {record['lost']} perdidos, lacunas {ids[-1] - ids[0] + 1 - len(ids)}"
+        assert len(snr) == len(recent)
+
+    print("Página de estatísticas do OLED:")
+    for line in rx.link_stats.get(1).lines():
+        print(f"  |{line:<16}|")
+    assert worst < 0.05, f"P² errou {worst:.1%} do intervalo interquartil"
+    assert pages and all(len(line) <= 16 for line in rx.link_stats.get(1).lines()), "página de estatísticas"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Perfilamento do transmissor (prof.py) ligado, no host.
+
+Copia transmitter/ para um diretório temporário com _PROF = const(1) em
+main.py e ulora.py e roda o laço principal com os periféricos falsos, um
+receptor que responde com ACK e o botão A pressionado por alguns segundos
+(página de depuração no OLED). Mostra prof.report() como sairia no REPL,
+as linhas da página do OLED e a característica BLE de depuração, confere
+que todas as etapas foram medidas e compara o tempo de CPU do host por laço
+com o perfilamento desligado. Com _PROF = 0 o módulo prof nem é importado.
+
+    python host/prof_report.py
+    python host/prof_report.py --loops 200 --press-ms 3000
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fakes
+
+BUTTON_A = 5
+
+
+class Stop(BaseException):
+    """Encerra main() (que captura Exception) depois do último laço."""
+
+
+def firmware(enabled):
+    if not enabled:
+        return "transmitter/main.py"
+    directory = tempfile.mkdtemp(prefix="prof_")
+    for name in os.listdir(os.path.join(fakes.ROOT, "transmitter")):
+        shutil.copy(os.path.join(fakes.ROOT, "transmitter", name), directory)
+    for name in ("main.py", "ulora.py"):
+        path = os.path.join(directory, name)
+        with open(path, "rb") as f:
+            source = f.read()
+        assert b"_PROF = const(0)" in source, f"{name} sem _PROF"
+        with open(path, "wb") as f:
+            f.write(source.replace(b"_PROF = const(0)", b"_PROF = const(1)"))
+    return os.path.join(directory, "main.py")
+
+
+def run(path, loops, press_ms, count_pages=False):
+    fakes.reset_world()
+    fakes.install()
+    tx = fakes.load(path)
+    radio = fakes.SPI.devices[tx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=tx.RFM95_INT)
+
+    def gateway(frame):
+        if not frame[3] & 0x80:
+            ack = bytes([frame[1], frame[0], frame[2], 0x80]) + b"!"
+            fakes.CLOCK.after(radio.TX_TIME_US + 20000, radio.receive, ack)
+
+    radio.on_tx = gateway
+    # Botão A pressionado a partir de 5 s por press_ms
+    fakes.CLOCK.at(5000000, lambda: fakes.Pin.registry[BUTTON_A].value(0))
+    fakes.CLOCK.at(5000000 + press_ms * 1000, lambda: fakes.Pin.registry[BUTTON_A].value(1))
+    ble = fakes.BLE()
+    fakes.CLOCK.at(1000000, ble.connect_central)
+
+    done = []
+    read_sensors = tx.read_sensors
+
+    def counted():
+        done.append(time.perf_counter_ns())
+        if len(done) > loops:
+            raise Stop()
+        return read_sensors()
+
+    tx.read_sensors = counted
+    pages = []
+    if count_pages:
+        show_profile = tx.show_profile
+        tx.show_profile = lambda: pages.append(show_profile())
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            tx.main()
+    except Stop:
+        pass
+    if count_pages:
+        return tx, ble, len(pages)
+    return ble, (done[-1] - done[0]) / (len(done) - 1) / 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--loops", type=int, default=100)
+    parser.add_argument("--press-ms", type=int, default=2000, help="tempo com o botão A pressionado")
+    args = parser.parse_args(argv)
+
+    _, off_us = run(firmware(False), args.loops, args.press_ms)
+    assert "prof" not in sys.modules, "prof importado com _PROF = 0"
+
+    path = firmware(True)
+    _, on_us = run(path, args.loops, args.press_ms)
+    tracemalloc.start()  # gc.mem_alloc() dos substitutos; só na passada do relatório
+    try:
+        _, ble, pages = run(path, args.loops, args.press_ms, count_pages=True)
+    finally:
+        tracemalloc.stop()
+    prof = sys.modules["prof"]
+
+    print(f"prof.report() após {args.loops} laços (tempos do relógio virtual, bytes do tracemalloc):")
+    prof.report()
+    print(f"Página de depuração do OLED (mostrada em {pages} laços com o botão A):")
+    for line in prof.lines(0, 7) + prof.lines(7, 7):
+        print(f"  |{line:<16}|")
+    data = ble.gatts_read(max(ble.values))  # serviço de depuração: registrado por último
+    size = struct.calcsize(prof.SNAPSHOT_FORMAT)
+    calls = [struct.unpack_from(prof.SNAPSHOT_FORMAT, data, s * size)[0] for s in range(prof.STAGES)]
+    print(f"Característica BLE de depuração: {len(data)} bytes, chamadas por etapa {calls}")
+    print(f"CPU do host por laço: {off_us:.0f} us sem perfilamento, {on_us:.0f} us com")
+
+    missing = [prof.NAMES[s] for s in range(prof.STAGES) if not prof._count[s]]
+    assert not missing, f"etapas sem medida: {missing}"
+    assert pages, "página de depuração não mostrada"
+    assert len(data) == prof.STAGES * size + 4 * prof.COUNTERS, "snapshot com tamanho inesperado"
+    assert all(0 < c <= n for c, n in zip(calls, prof._count)), "snapshot BLE não corresponde ao prof"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
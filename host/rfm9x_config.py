@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Conta as transações SPI de configuração do adafruit_rfm9x no SX1276 falso.
+
+Mede a inicialização do RFM9x, a troca de modem (SF7/BW125 <-> SF12/BW125 e
+BW500) pelas propriedades e por configure(), e o ciclo listen()/idle(). Com
+--baseline, compara o adafruit_rfm9x atual com outro arquivo, por exemplo o
+de uma revisão anterior extraído do git, e confere que os registradores do
+rádio terminam iguais nas duas versões.
+
+    python host/rfm9x_config.py
+    git show HEAD~1:receiver/adafruit_rfm9x.py > /tmp/rfm9x_antigo.py
+    python host/rfm9x_config.py --baseline /tmp/rfm9x_antigo.py --verbose
+"""
+import argparse
+import os
+import sys
+
+import fakes
+from spi_trace import describe, isolated
+
+CS_PIN = 17
+RESET_PIN = 28
+# (signal_bandwidth, coding_rate, spreading_factor)
+PROFILES = ((125000, 5, 12), (125000, 5, 7), (500000, 8, 9), (125000, 5, 7))
+
+
+def make_radio(rfm9x):
+    fakes.reset_world()
+    fakes.install()
+    radio = fakes.SPI.devices[0] = fakes.SX127xRegisters()
+    radio.trace = []
+    rfm = rfm9x.RFM9x(fakes.SPI(0), fakes.DigitalInOut(CS_PIN), fakes.DigitalInOut(RESET_PIN), 915.0)
+    return rfm, radio
+
+
+def measure(path):
+    # Transações por etapa e os registradores ao fim de cada uma
+    rfm9x = fakes.load(path, "adafruit_rfm9x_trace")
+    rfm, radio = make_radio(rfm9x)
+    steps = [("inicialização", radio.trace, bytes(radio.regs))]
+
+    radio.trace = []
+    for bw, cr, sf in PROFILES:
+        rfm.signal_bandwidth = bw
+        rfm.coding_rate = cr
+        rfm.spreading_factor = sf
+    steps.append(("propriedades", radio.trace, bytes(radio.regs)))
+
+    if hasattr(rfm, "configure"):
+        radio.trace = []
+        for bw, cr, sf in PROFILES:
+            rfm.configure(signal_bandwidth=bw, coding_rate=cr, spreading_factor=sf)
+        steps.append(("configure()", radio.trace, bytes(radio.regs)))
+
+    radio.trace = []
+    for _ in range(len(PROFILES)):
+        rfm.listen()
+        rfm.idle()
+    steps.append(("listen/idle", radio.trace, bytes(radio.regs)))
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", metavar="ARQUIVO", help="outro adafruit_rfm9x.py para comparar com o atual")
+    parser.add_argument("--verbose", action="store_true", help="mostra os registradores acessados")
+    args = parser.parse_args(argv)
+
+    new = measure("receiver/adafruit_rfm9x.py")
+    label = os.path.basename(args.baseline)[:11] if args.baseline else "-"
+    old = isolated(args.baseline, "adafruit_rfm9x", measure) if args.baseline else []
+    print(f"{len(PROFILES)} trocas de modem; transações SPI por etapa")
+    print(f"{'etapa':>15} {label:>11} {'atual':>7}")
+    old_by_name = {name: (trace, regs) for name, trace, regs in old}
+    for name, trace, regs in new:
+        print(f"{name:>15} {len(old_by_name[name][0]) if name in old_by_name else '-':>11} {len(trace):>7}")
+        if args.verbose:
+            print(f"    {describe(trace)}")
+        if old:
+            base = old_by_name.get(name, old_by_name["propriedades"])
+            diff = [hex(r) for r in range(len(regs)) if regs[r] != base[1][r]]
+            assert not diff, f"{name}: registradores diferentes de {args.baseline}: {diff}"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
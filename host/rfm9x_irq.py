@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Envio e recepção do adafruit_rfm9x por polling, nível do DIO0 e interrupção.
+
+Roda receiver/adafruit_rfm9x.py no SX1276 falso de fakes.py, com relógio
+virtual, nos três modos de espera: IRQ flags lidas por SPI (dio0=None), nível
+do pino DIO0 (digitalio.DigitalInOut) e interrupção do DIO0 (machine.Pin) com
+a fila de recepção. Mede as transações SPI por send() e por pacote recebido e
+quantos quadros de rajadas se perdem enquanto a aplicação está ocupada
+processando o pacote anterior.
+
+    python host/rfm9x_irq.py
+    python host/rfm9x_irq.py --burst 6 --gap-ms 40 --process-ms 300 --queue 8
+"""
+import argparse
+import sys
+
+import fakes
+
+CS_PIN = 17
+RESET_PIN = 28
+DIO0_PIN = 20
+MODES = ("polling", "nível", "interrupção")
+
+
+def make_radio(rfm9x, mode, queue):
+    fakes.reset_world()
+    fakes.install()
+    radio = fakes.SPI.devices[0] = fakes.SX127xRegisters(dio0=DIO0_PIN)
+    if mode == "polling":
+        dio0 = None
+    elif mode == "nível":
+        dio0 = fakes.DigitalInOut(DIO0_PIN)
+    else:
+        dio0 = fakes.Pin(DIO0_PIN, fakes.Pin.IN)
+    rfm = rfm9x.RFM9x(fakes.SPI(0), fakes.DigitalInOut(CS_PIN), fakes.DigitalInOut(RESET_PIN), 915.0,
+                      dio0=dio0, rx_queue_size=queue)
+    return rfm, radio
+
+
+def measure_send(rfm9x, mode, sends):
+    # Transações SPI e tempo por send() (sem ACK, volta para idle)
+    rfm, radio = make_radio(rfm9x, mode, 4)
+    start_tr, start_us = radio.transactions, fakes.CLOCK.now_us
+    for i in range(sends):
+        assert rfm.send(b"T:25.0,H:50.0,D:%d" % i), "send() expirou"
+    assert len(radio.tx_frames) == sends
+    return (radio.transactions - start_tr) / sends, (fakes.CLOCK.now_us - start_us) / sends / 1000
+
+
+def measure_receive(rfm9x, mode, queue, bursts, burst, gap_ms, process_ms):
+    # Rajadas de `burst` quadros a cada `gap_ms`; a aplicação chama receive()
+    # e gasta `process_ms` com cada pacote (display, log...)
+    rfm, radio = make_radio(rfm9x, mode, queue)
+    sent = []
+    period_us = (burst * gap_ms + 1000) * 1000
+    for b in range(bursts):
+        for i in range(burst):
+            seq = b * burst + i
+            frame = bytes([0xFF, 1, seq & 0xFF, 0]) + b"leitura %03d" % seq
+            fakes.CLOCK.at(100000 + b * period_us + i * gap_ms * 1000, radio.receive, frame, 7.5, -80)
+            sent.append(frame[4:])
+    end_us = 100000 + bursts * period_us
+    rfm.listen()
+    start_tr = radio.transactions
+    got = []
+    while fakes.CLOCK.now_us < end_us:
+        packet = rfm.receive(timeout=0.1)
+        if packet is not None:
+            got.append(bytes(packet))
+            assert rfm.last_snr == 7.5, "SNR não corresponde ao pacote"
+            fakes.CLOCK.advance(process_ms * 1000)
+    spi_per_packet = (radio.transactions - start_tr) / max(1, len(got))
+    return sent, got, spi_per_packet, rfm.rx_overflow_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sends", type=int, default=20)
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--burst", type=int, default=4, help="quadros por rajada")
+    parser.add_argument("--gap-ms", type=int, default=80, help="intervalo entre quadros da rajada")
+    parser.add_argument("--process-ms", type=int, default=200, help="tempo da aplicação por pacote")
+    parser.add_argument("--queue", type=int, default=4, help="rx_queue_size")
+    args = parser.parse_args(argv)
+
+    fakes.install()
+    rfm9x = fakes.load("receiver/adafruit_rfm9x.py", "adafruit_rfm9x")
+
+    print(f"send(): {args.sends} quadros de {fakes.SX127xRegisters.TX_TIME_US // 1000} ms no ar")
+    print(f"{'modo':>12} {'SPI/send':>9} {'ms/send':>8}")
+    send_spi = {}
+    for mode in MODES:
+        send_spi[mode], ms = measure_send(rfm9x, mode, args.sends)
+        print(f"{mode:>12} {send_spi[mode]:>9.0f} {ms:>8.1f}")
+
+    print(f"receive(): {args.bursts} rajadas de {args.burst} quadros a cada {args.gap_ms} ms, "
+          f"{args.process_ms} ms por pacote, fila de {args.queue}")
+    print(f"{'modo':>12} {'entregues':>10} {'perdidos':>9} {'fila cheia':>11} {'SPI/pacote':>11}")
+    lost = {}
+    for mode in MODES:
+        sent, got, spi, overflow = measure_receive(rfm9x, mode, args.queue, args.bursts, args.burst,
+                                                   args.gap_ms, args.process_ms)
+        # Entregues intactos e em ordem: subsequência dos enviados
+        it = iter(sent)
+        assert all(any(p == s for s in it) for p in got), f"{mode}: pacote corrompido ou fora de ordem"
+        lost[mode] = len(sent) - len(got)
+        print(f"{mode:>12} {len(got):>10} {lost[mode]:>9} {overflow:>11} {spi:>11.1f}")
+
+    assert send_spi["interrupção"] < send_spi["polling"], "a interrupção não reduziu o SPI no send()"
+    assert lost["interrupção"] <= lost["polling"], "a fila perdeu mais que o polling"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
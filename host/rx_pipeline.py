@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Recepção contínua do receptor (poll_recv + fila de RxPacket) no host.
+
+Roda receiver/main.py com o SX1276 falso de fakes.py, relógio virtual e o
+asyncio de fakes. Vários transmissores simulados enviam leituras, com
+retransmissões repetidas de propósito, e cada pacote processado custa
+--process-ms de relógio (o OLED por I2C leva dezenas de ms). O script confere
+que cada leitura é processada uma vez, que o ticks_ms do pacote é o instante
+da interrupção e que só os pacotes pré-alocados da fila são usados. Um quadro
+que chega antes de o anterior ser lido o sobrescreve no rádio, como no SX1276;
+esses são contados à parte. Antes, confere que só os quadros com FLAGS_ADR
+trocam o ModemConfig do receptor, e não lotes do backlog ou fragmentos que
+começam com os bytes do comando ADR.
+
+    python host/rx_pipeline.py
+    python host/rx_pipeline.py --nodes 6 --interval-ms 500 --profile Compact
+"""
+import argparse
+import contextlib
+import io
+import random
+import struct
+import sys
+
+import fakes
+
+
+class Stop(BaseException):
+    """Encerra o asyncio.run() do receptor no fim da simulação."""
+
+
+def make_frame(ulora, profile, to, node, header_id, values):
+    if profile[2]:
+        header = bytes([(to << 4) | node, header_id & 0x7f])
+    else:
+        header = bytes([to, node, header_id, 0])
+    if profile[0]:
+        body = struct.pack("<hhh", *(round(v * 10) for v in values))
+        return header + body + bytes(profile[3] - len(body))
+    return header + "T:{:.1f},H:{:.1f},D:{:.1f}".format(*values).encode()
+
+
+def run(nodes, interval_ms, seconds, process_ms, repeat, profile_name, seed):
+    fakes.reset_world()
+    fakes.install(seed)
+    rx = fakes.load("receiver/main.py")
+    radio = fakes.SPI.devices[rx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=rx.RFM95_INT)
+    profile = getattr(rx.LinkProfile, profile_name)
+    rx.LINK_PROFILE = profile
+    rng = random.Random(seed)
+
+    arrivals = {}   # (nó, header_id) -> [ms em que cada cópia chegou ao rádio]
+    overwritten = set()  # (nó, header_id, ms) sobrescritos antes de poll_recv()
+    stats = {"air": 0, "accepted": 0, "last": None}
+    processed = []  # (nó, header_id, ticks_ms do pacote, ms do processamento, pacote)
+
+    def transmit(node, header_id):
+        frame = make_frame(rx, profile, rx.SERVER_ADDRESS, node, header_id, (25.0 + node, 50.0, 60.0))
+        stats["air"] += 1
+        unread = radio.regs[0x12] & 0x40  # RxDone do quadro anterior ainda não limpo
+        if radio.receive(frame, snr=rng.uniform(-5, 10), rssi=rng.uniform(-110, -60)):
+            if unread and stats["last"]:
+                overwritten.add(stats["last"])
+            key = (node, header_id & 0x7f if profile[2] else header_id)
+            now = fakes.CLOCK.now_us // 1000
+            stats["accepted"] += 1
+            stats["last"] = key + (now,)
+            arrivals.setdefault(key, []).append(now)
+
+    for node in range(1, nodes + 1):
+        t = rng.randrange(interval_ms) * 1000
+        header_id = 0
+        while t < seconds * 1000000:
+            header_id = (header_id + 1) & 0xff
+            fakes.CLOCK.at(t, transmit, node, header_id)
+            if rng.random() < repeat:
+                # Retransmissão do mesmo header_id (ACK perdido no transmissor)
+                fakes.CLOCK.at(t + 300000, transmit, node, header_id)
+            t += interval_ms * 1000 + rng.randrange(-50, 50) * 1000
+
+    on_recv = rx.on_recv
+
+    def timed_on_recv(payload):
+        processed.append((payload.header_from, payload.header_id, payload.ticks_ms,
+                          fakes.CLOCK.now_us // 1000, payload))
+        on_recv(payload)
+        fakes.CLOCK.advance(process_ms * 1000)  # OLED, prints
+
+    def stop():
+        raise Stop()
+
+    rx.on_recv = timed_on_recv
+    fakes.CLOCK.at(seconds * 1000000 + 1000000, stop)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # prints do firmware
+            rx.main()
+    except Stop:
+        pass
+    return rx, radio, arrivals, overwritten, stats, processed
+
+
+def check_adr(seed):
+    # Só um quadro com FLAGS_ADR troca o ModemConfig: um lote do backlog com
+    # idade 16640 s (<Ihhh começa com b"\x00A\x00") e um fragmento de msg_id 0
+    # e índice 65 começam com os bytes do comando e não podem trocar
+    fakes.reset_world()
+    fakes.install(seed)
+    rx = fakes.load("receiver/main.py")
+    radio = fakes.SPI.devices[rx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=rx.RFM95_INT)
+    ulora, adr = sys.modules["ulora"], sys.modules["adr"]
+    frames = [
+        (ulora.FLAGS_BATCH, struct.pack("<Ihhh", 16640, 250, 500, 600)),
+        (ulora.FLAGS_FRAG, bytes([0, 65, 70]) + bytes(20)),
+        (0, adr.COMMAND + bytes([0])),  # comando sem o flag
+        (ulora.FLAGS_ADR, adr.COMMAND + bytes([0])),
+    ]
+    configs = []  # (preset do receptor, RegModemConfig1-2) depois de cada quadro
+
+    def transmit(header_id, flags, body):
+        radio.receive(bytes([rx.SERVER_ADDRESS, 1, header_id, flags]) + body)
+
+    def sample():
+        configs.append((rx.adr_follower.preset, bytes(radio.regs[0x1D:0x1F])))
+
+    def stop():
+        raise Stop()
+
+    for i, (flags, body) in enumerate(frames):
+        fakes.CLOCK.at((i + 1) * 1000000, transmit, i + 1, flags, body)
+        fakes.CLOCK.at((i + 1) * 1000000 + 500000, sample)
+    fakes.CLOCK.at((len(frames) + 1) * 1000000, stop)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rx.main()
+    except Stop:
+        pass
+    default = (adr.DEFAULT, bytes(adr.PRESETS[adr.DEFAULT][:2]))
+    assert configs[:3] == [default] * 3, f"ModemConfig trocado por um quadro de dados: {configs[:3]}"
+    assert configs[3] == (0, bytes(adr.PRESETS[0][:2])), "comando ADR com FLAGS_ADR ignorado"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--interval-ms", type=int, default=2000)
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--process-ms", type=int, default=30)
+    parser.add_argument("--repeat", type=float, default=0.1, help="fração de quadros retransmitidos")
+    parser.add_argument("--profile", default="Standard", choices=("Standard", "ShortPreamble", "Compact"))
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    check_adr(args.seed)
+    rx, radio, arrivals, overwritten, stats, processed = run(args.nodes, args.interval_ms, args.seconds,
+                                                            args.process_ms, args.repeat, args.profile, args.seed)
+    keys = [(p[0], p[1]) for p in processed]
+    readable = {k for k, times in arrivals.items() if any(k + (t,) not in overwritten for t in times)}
+    ts_error = [min(abs(p[2] - t) for t in arrivals[(p[0], p[1])]) for p in processed]
+    latency = [p[3] - p[2] for p in processed]
+    acks = [f for _, f in radio.tx_frames if (f[1] if rx.LINK_PROFILE[2] else f[3]) & 0x80]
+    packets = {id(p[4]): p[4] for p in processed}
+
+    print(f"{args.nodes} nós, um quadro a cada {args.interval_ms} ms por {args.seconds} s, "
+          f"perfil {args.profile}, {args.process_ms} ms por pacote processado")
+    print(f"Quadros no ar: {stats['air']}  recebidos pelo rádio: {stats['accepted']}  "
+          f"ACKs: {len(acks)}  duplicados descartados: {rx.lora.duplicates}")
+    print(f"Leituras processadas: {len(processed)} de {len(arrivals)} distintas  "
+          f"sobrescritas no rádio antes da leitura: {len(overwritten)}  fila cheia: {rx.rx_overruns}")
+    print(f"Erro do ticks_ms do pacote: máx {max(ts_error)} ms")
+    print(f"Interrupção -> processamento: média {sum(latency) / len(latency):.1f} ms, máx {max(latency)} ms")
+    print(f"RxPacket usados: {len(packets)} (fila de {rx.RX_QUEUE}); "
+          f"memoryviews criadas: {sum(len(p._views) for p in packets.values())}")
+
+    assert len(set(keys)) == len(keys), "leitura processada duas vezes"
+    assert readable <= set(keys) <= set(arrivals), "leitura recebida e não processada"
+    assert max(ts_error) <= 1, "ticks_ms não corresponde à interrupção"
+    assert all(p is rx.rx_spare or any(p is q for q in rx.rx_pool) for p in packets.values())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Saída binária do receptor pela serial USB (serialbridge.py) no host.
+
+Primeiro codifica registros com o serialbridge do firmware (mensagens de 0 a
+255 bytes, com zeros e sequências longas sem zero) e confere que
+serial_reader.py os decodifica iguais. Depois roda receiver/main.py com o
+SX1276 falso, relógio virtual e a CDC USB falsa de fakes.py no lugar de
+sys.stdout, em quatro casos: texto (prints) e binário (SERIAL_BINARY), com
+o PC lendo o tempo todo e com o PC parando de ler por --stall-ms. Para cada
+caso mostra os bytes por pacote na serial, quanto o receptor ficou
+bloqueado escrevendo, os pacotes processados e a latência interrupção ->
+processamento. No modo binário, confere que os registros
+lidos pelo PC são exatamente os pacotes processados (menos os descartados
+com o buffer cheio, que aparecem como lacunas no seq) e que as linhas LINK
+chegam como texto.
+
+    python host/serial_bridge.py
+    python host/serial_bridge.py --nodes 8 --interval-ms 250 --stall-ms 3000
+"""
+import argparse
+import contextlib
+import random
+import sys
+import types
+
+import fakes
+import serial_reader
+
+
+class Stop(BaseException):
+    """Encerra o asyncio.run() do receptor no fim da simulação."""
+
+
+def check_roundtrip(serialbridge, rng):
+    bridge = serialbridge.SerialBridge(64 * 1024)
+    packets = []
+    for length in list(range(0, 256)) + [254, 255] * 4:
+        kind = rng.randrange(3)
+        if kind == 0:
+            data = bytes(rng.randrange(256) for _ in range(length))
+        elif kind == 1:
+            data = bytes(rng.choice((0, 0, 1, 0xff)) for _ in range(length))
+        else:
+            data = bytes(rng.randrange(1, 256) for _ in range(length))
+        packet = types.SimpleNamespace(length=length, data=memoryview(data), header_to=rng.randrange(256),
+                                       header_from=rng.randrange(256), header_id=rng.randrange(256),
+                                       header_flags=rng.randrange(256), rssi=rng.randrange(-140, 0),
+                                       snr=rng.randrange(-80, 60), ticks_ms=rng.randrange(1 << 30))
+        if not bridge.put(packet):
+            break
+        packets.append(packet)
+    reader = serial_reader.Reader()
+    records = [item for kind, item in reader.feed(bytes(bridge._view[:bridge.used])) if kind == "record"]
+    assert len(records) == len(packets) and not reader.bad and not reader.missing
+    for p, r in zip(packets, records):
+        assert (r.to, r.src, r.id, r.flags, r.rssi, r.snr, r.ticks_ms, r.payload) == \
+            (p.header_to, p.header_from, p.header_id, p.header_flags, p.rssi, p.snr / 4, p.ticks_ms,
+             bytes(p.data)), f"registro {r.seq} diferente"
+    return len(records), bridge.used
+
+
+def run(binary, nodes, interval_ms, seconds, stall_ms, rate, seed):
+    fakes.reset_world()
+    fakes.install(seed)
+    rx = fakes.load("receiver/main.py")
+    radio = fakes.SPI.devices[rx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=rx.RFM95_INT)
+    rx.ADR = False
+    rx.SERIAL_BINARY = binary
+    rx.LINK_EXPORT_MS = 5000
+    usb = fakes.USBSerial(rate)
+    rng = random.Random(seed)
+
+    for node in range(1, nodes + 1):
+        t = 500000 + rng.randrange(interval_ms) * 1000
+        header_id = 0
+        while t < seconds * 1000000:
+            header_id = (header_id + 1) & 0xff
+            text = "T:{:.1f},H:{:.1f},D:{:.1f}".format(rng.uniform(15, 35), rng.uniform(20, 90), rng.uniform(40, 90))
+            frame = bytes([rx.SERVER_ADDRESS, node, header_id, 0]) + text.encode()
+            fakes.CLOCK.at(t, radio.receive, frame, rng.uniform(-5, 10), rng.uniform(-120, -60))
+            t += interval_ms * 1000 + rng.randrange(-50, 50) * 1000
+    if stall_ms:
+        # O PC para de ler no meio da simulação
+        stall_at = seconds * 1000000 // 2
+        fakes.CLOCK.at(stall_at, setattr, usb, "rate", 0)
+        fakes.CLOCK.at(stall_at + stall_ms * 1000, setattr, usb, "rate", rate)
+
+    processed = []  # (nó, header_id, rssi, snr, ticks_ms, mensagem, ms do processamento)
+    on_recv = rx.on_recv
+
+    def recorded(payload):
+        processed.append((payload.header_from, payload.header_id, payload.rssi, payload.snr / 4,
+                          payload.ticks_ms, bytes(payload.data), fakes.CLOCK.now_us // 1000))
+        on_recv(payload)
+
+    def stop():
+        raise Stop()
+
+    rx.on_recv = recorded
+    fakes.CLOCK.at(seconds * 1000000 + 2000000, stop)
+    try:
+        with contextlib.redirect_stdout(usb):
+            rx.main()
+    except Stop:
+        pass
+    return rx, usb, processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--interval-ms", type=int, default=500)
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--stall-ms", type=int, default=10000, help="tempo em que o PC para de ler")
+    parser.add_argument("--rate", type=int, default=1000000, help="bytes/s lidos pelo PC")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    fakes.install(args.seed)
+    serialbridge = fakes.load("receiver/serialbridge.py", "serialbridge")
+    count, size = check_roundtrip(serialbridge, random.Random(args.seed))
+    print(f"Ida e volta: {count} registros de 0 a 255 bytes, {size} bytes codificados, todos iguais")
+
+    print(f"{args.nodes} nós, um quadro a cada {args.interval_ms} ms por {args.seconds} s; "
+          f"PC lendo {args.rate} bytes/s, parado por {args.stall_ms} ms nos casos com parada")
+    print(f"{'caso':>17} {'pacotes':>8} {'bytes/pac':>10} {'bloqueado':>10} {'latência':>9} "
+          f"{'máx':>6} {'registros':>10} {'faltando':>9} {'inválidos':>10} {'texto':>6}")
+    for binary in (False, True):
+        for stall in (0, args.stall_ms):
+            rx, usb, processed = run(binary, args.nodes, args.interval_ms, args.seconds, stall, args.rate,
+                                     args.seed)
+            reader = serial_reader.Reader()
+            items = reader.feed(bytes(usb.received)) + reader.flush()
+            records = [item for kind, item in items if kind == "record"]
+            texts = [item for kind, item in items if kind == "text"]
+            latency = [p[6] - p[4] for p in processed]
+            name = ("binário" if binary else "texto") + (" PC parado" if stall else "")
+            print(f"{name:>17} {len(processed):>8} {len(usb.received) / len(processed):>10.1f} "
+                  f"{usb.blocked_us / 1000:>8.0f}ms "
+                  f"{sum(latency) / len(latency):>7.1f}ms {max(latency):>4}ms {len(records):>10} "
+                  f"{reader.missing:>9} {reader.bad:>10} {len(texts):>6}")
+            if not binary:
+                assert not records, "registro binário no modo texto"
+                continue
+            bridge = rx.bridge
+            # Cada registro lido é o pacote processado de mesmo seq
+            for r in records:
+                p = processed[r.seq]
+                assert (r.src, r.id, r.rssi, r.snr, r.ticks_ms, r.payload) == p[:6], f"registro {r.seq} diferente"
+            assert not reader.bad, "quadros inválidos"
+            assert reader.missing == bridge.dropped, "lacunas no seq diferentes dos descartes"
+            assert not bridge.used and len(records) + bridge.dropped == len(processed), "registros perdidos"
+            assert any(t.startswith("LINK {") for t in texts), "export LINK não chegou como texto"
+            if not stall:
+                assert not bridge.dropped, "descartes sem parada do PC"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
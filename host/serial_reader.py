@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Leitor no PC da saída binária do receptor (SERIAL_BINARY, serialbridge.py).
+
+Separa o fluxo da serial nos quadros COBS terminados em 0x00, confere o
+CRC32 e decodifica cada registro (seq, destino, origem, header_id, flags,
+RSSI, SNR, ticks_ms e a mensagem). Linhas de texto entre os quadros (export
+LINK, erros) são reconhecidas e repassadas à parte. Lacunas no seq indicam
+registros descartados no receptor (buffer cheio) ou corrompidos na serial.
+
+Lê de uma porta serial (precisa do pyserial), de um arquivo capturado ou da
+entrada padrão, e escreve um registro por linha em JSON ou CSV:
+
+    python host/serial_reader.py --port /dev/ttyACM0
+    python host/serial_reader.py --port COM5 --format csv --out pacotes.csv
+    python host/serial_reader.py --file captura.bin --stats
+
+Também pode ser importado: Reader().feed(bytes) devolve ("record", Record)
+e ("text", str) na ordem em que chegaram.
+"""
+import argparse
+import collections
+import csv
+import json
+import struct
+import sys
+import time
+import zlib
+
+# Mesmo formato de receiver/serialbridge.py
+PACKET = 1
+RECORD_HEADER = "<BHBBBBhbI"
+HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+CRC_SIZE = 4
+MAX_FRAME = HEADER_SIZE + 255 + CRC_SIZE + 4
+
+Record = collections.namedtuple("Record", "seq to src id flags rssi snr ticks_ms payload")
+CSV_FIELDS = Record._fields
+
+
+def cobs_encode(data):
+    """Codificação COBS (sem o 0x00 final), para testes."""
+    out = bytearray([0])
+    code_at = 0
+    for b in data:
+        if b:
+            out.append(b)
+            if len(out) - code_at == 0xff:
+                out[code_at] = 0xff
+                code_at = len(out)
+                out.append(0)
+        else:
+            out[code_at] = len(out) - code_at
+            code_at = len(out)
+            out.append(0)
+    out[code_at] = len(out) - code_at
+    return bytes(out)
+
+
+def cobs_decode(data):
+    """Decodifica um quadro COBS (sem o 0x00); ValueError se inválido."""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code == 0 or i + code > len(data):
+            raise ValueError("COBS inválido")
+        out += data[i + 1:i + code]
+        i += code
+        if code < 0xff and i < len(data):
+            out.append(0)
+    return bytes(out)
+
+
+def encode_record(record):
+    """Quadro de um Record como o serialbridge do firmware gera (com o 0x00), para testes."""
+    data = struct.pack(RECORD_HEADER, PACKET, record.seq, record.to, record.src, record.id, record.flags,
+                       record.rssi, round(record.snr * 4), record.ticks_ms) + bytes(record.payload)
+    return cobs_encode(data + struct.pack("<I", zlib.crc32(data))) + b"\0"
+
+
+def decode_record(frame):
+    """Record de um quadro (sem o 0x00), ou None se não for um registro válido."""
+    if not 0 < len(frame) <= MAX_FRAME:
+        return None
+    try:
+        data = cobs_decode(frame)
+    except ValueError:
+        return None
+    if len(data) < HEADER_SIZE + CRC_SIZE or data[0] != PACKET:
+        return None
+    if zlib.crc32(data[:-CRC_SIZE]) != struct.unpack_from("<I", data, len(data) - CRC_SIZE)[0]:
+        return None
+    _, seq, to, src, id_, flags, rssi, snr, ticks_ms = struct.unpack_from(RECORD_HEADER, data)
+    return Record(seq, to, src, id_, flags, rssi, snr / 4, ticks_ms, data[HEADER_SIZE:-CRC_SIZE])
+
+
+class Reader:
+    """Decodificador incremental do fluxo da serial, com contadores."""
+
+    def __init__(self):
+        self.records = 0
+        self.text_lines = 0
+        self.bad = 0      # quadros que não são registro nem texto
+        self.missing = 0  # registros que faltam pelo seq
+        self.bytes = 0
+        self._buf = bytearray()
+        self._next_seq = None
+
+    def feed(self, data):
+        self.bytes += len(data)
+        self._buf += data
+        out = []
+        while True:
+            end = self._buf.find(0)
+            if end < 0:
+                break
+            chunk = bytes(self._buf[:end])
+            del self._buf[:end + 1]
+            self._chunk(chunk, out)
+        if len(self._buf) > 64 * 1024:
+            # Só texto, sem nenhum quadro: entrega as linhas completas
+            end = self._buf.rfind(b"\n") + 1
+            self._text(bytes(self._buf[:end]), out)
+            del self._buf[:end]
+        return out
+
+    def flush(self):
+        """Fim do fluxo: o que sobrou sem 0x00 só pode ser texto."""
+        out = []
+        self._text(bytes(self._buf), out)
+        self._buf.clear()
+        return out
+
+    def _chunk(self, chunk, out):
+        if not chunk:
+            return
+        record = decode_record(chunk)
+        if record is None:
+            # Texto impresso antes do quadro: tenta o quadro depois de cada
+            # quebra de linha
+            start = 0
+            while True:
+                start = chunk.find(b"\n", start) + 1
+                if not start:
+                    break
+                record = decode_record(chunk[start:])
+                if record is not None:
+                    self._text(chunk[:start], out)
+                    break
+        if record is None:
+            if self._is_text(chunk):
+                self._text(chunk, out)
+            else:
+                self.bad += 1
+            return
+        if self._next_seq is not None:
+            self.missing += (record.seq - self._next_seq) & 0xffff
+        self._next_seq = (record.seq + 1) & 0xffff
+        self.records += 1
+        out.append(("record", record))
+
+    @staticmethod
+    def _is_text(chunk):
+        try:
+            text = chunk.decode()
+        except UnicodeError:
+            return False
+        return text.endswith("\n") and all(c.isprintable() or c in "\r\n\t" for c in text)
+
+    def _text(self, data, out):
+        for line in data.decode(errors="replace").splitlines():
+            if line.strip():
+                self.text_lines += 1
+                out.append(("text", line))
+
+
+def record_dict(record):
+    d = record._asdict()
+    try:
+        d["payload"] = record.payload.decode()
+    except UnicodeError:
+        d["payload"] = record.payload.hex()
+    return d
+
+
+def open_input(args):
+    if args.port:
+        try:
+            import serial
+        except ImportError:
+            sys.exit("--port precisa do pyserial: pip install pyserial")
+        port = serial.Serial(args.port, args.baud, timeout=0.1)
+        return port.read, port.close
+    f = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    return (lambda n: f.read1(n) if hasattr(f, "read1") else f.read(n)), f.close
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--port", help="porta serial do receptor (ex.: /dev/ttyACM0, COM5)")
+    source.add_argument("--file", help="fluxo capturado (- para a entrada padrão)")
+    parser.add_argument("--baud", type=int, default=115200, help="ignorado pela CDC USB")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--out", default=None, help="arquivo de saída (padrão: saída padrão)")
+    parser.add_argument("--stats", action="store_true", help="resumo dos contadores no fim (stderr)")
+    args = parser.parse_args(argv)
+
+    read, close = open_input(args)
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    writer = csv.DictWriter(out, CSV_FIELDS) if args.format == "csv" else None
+    if writer:
+        writer.writeheader()
+    reader = Reader()
+    start = time.monotonic()
+    try:
+        while True:
+            data = read(4096)
+            if not data:
+                if args.port:
+                    continue
+                items = reader.flush()
+            else:
+                items = reader.feed(data)
+            for kind, item in items:
+                if kind == "text":
+                    print(item, file=sys.stderr)
+                elif writer:
+                    writer.writerow(record_dict(item))
+                else:
+                    out.write(json.dumps(record_dict(item)) + "\n")
+            if not data:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close()
+        if args.out:
+            out.close()
+    if args.stats:
+        elapsed = max(time.monotonic() - start, 1e-9)
+        print(f"{reader.records} registros ({reader.records / elapsed:.0f}/s), {reader.text_lines} linhas de "
+              f"texto, {reader.missing} faltando pelo seq, {reader.bad} quadros inválidos, {reader.bytes} bytes",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Goodput do ARQ com janela (lorafrag / LoRa.send_bulk) em função da perda.
+
+Transfere uma mensagem com Sender/Reassembler reais e contabiliza o tempo
+de cada rajada: tempo no ar dos fragmentos, inversão TX/RX do half-duplex,
+tempo no ar do SACK e, quando o pedido de SACK ou o SACK se perde, o timeout
+inteiro. A janela 1 equivale ao stop-and-wait de send_to_wait.
+
+    python host/sim_arq.py --windows 1 2 4 8 --loss 0 0.1 0.2
+"""
+import argparse
+import math
+import random
+import sys
+
+import fakes
+
+
+def time_on_air_ms(payload_len, sf=7, bw_hz=125000, cr=5, preamble=8, crc=True, implicit=False):
+    # Fórmula do datasheet SX1276 (seção 4.1.1.7), a mesma de receiver/lib/lora/modem.py
+    t_sym = (1 << sf) / bw_hz * 1000
+    ldr = t_sym >= 16
+    bits = 8 * payload_len - 4 * sf + 28 + (16 if crc else 0) - (20 if implicit else 0)
+    n_payload = 8 + max(math.ceil(bits / (4 * (sf - 2 * ldr))) * cr, 0)
+    return (preamble + 4.25 + n_payload) * t_sym
+
+
+def transfer(lorafrag, size, window, loss, rng, timing):
+    data = bytes(size)
+    sender = lorafrag.Sender(data, msg_id=1, window=window)
+    reasm = lorafrag.Reassembler(timeout_ms=10 ** 9)
+    t = 0.0
+    failures = 0
+    while not sender.done:
+        if failures > 20:
+            return None
+        pending = sender.pending()
+        got_last = False
+        for i in pending:
+            t += timing["frag"]
+            got_last = rng.random() >= loss
+            if got_last:
+                reasm.feed(1, sender.frames[i])
+        if not got_last or rng.random() < loss:
+            t += timing["timeout"]
+            failures += 1
+            continue
+        t += 2 * timing["turn"] + timing["sack"]
+        failures = 0 if sender.on_sack(reasm.sack(1, sender.msg_id, sender.count)) else failures + 1
+    return t
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=4000, help="bytes por mensagem")
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.05, 0.1, 0.2, 0.3])
+    parser.add_argument("--sf", type=int, default=7)
+    parser.add_argument("--turn-ms", type=float, default=15.0, help="inversão TX/RX de cada lado")
+    parser.add_argument("--timeout-ms", type=float, default=400.0, help="espera pelo SACK (2 x retry_timeout)")
+    parser.add_argument("--trials", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    fakes.install()
+    lorafrag = fakes.load("receiver/lorafrag.py", "lorafrag")
+    timing = {
+        "frag": time_on_air_ms(4 + lorafrag.MAX_FRAME_PAYLOAD, sf=args.sf),
+        "sack": time_on_air_ms(4 + 3 + lorafrag.SACK_BITMAP_BYTES, sf=args.sf),
+        "turn": args.turn_ms,
+        "timeout": args.timeout_ms,
+    }
+    print(f"SF{args.sf}: fragmento {timing['frag']:.0f} ms no ar, SACK {timing['sack']:.0f} ms; "
+          f"mensagem de {args.size} bytes")
+    print("goodput em bytes/s (taxa de entrega entre parênteses quando < 100%)")
+    print("perda " + "".join(f"{'W=' + str(w):>14}" for w in args.windows))
+    rng = random.Random(1)
+    for loss in args.loss:
+        row = f"{loss:4.2f} "
+        for w in args.windows:
+            times = [transfer(lorafrag, args.size, w, loss, rng, timing) for _ in range(args.trials)]
+            ok = [x for x in times if x is not None]
+            goodput = args.size * len(ok) / (sum(ok) / 1000) if ok else 0.0
+            cell = f"{goodput:.0f}" if len(ok) == len(times) else f"{goodput:.0f} ({len(ok) / len(times):.0%})"
+            row += f"{cell:>14}"
+        print(row)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Simula a fragmentação (lorafrag) sobre um canal com perdas.
+
+Mensagens de vários tamanhos passam por Sender -> canal -> Reassembler, com
+perdas independentes nos fragmentos e nos SACKs. Para cada taxa de perda o
+script mostra a taxa de entrega, os quadros transmitidos por mensagem (incluindo SACKs) e as
+rodadas (esperas por SACK) necessárias.
+
+    python host/sim_fragments.py --size 2000 --loss 0 0.1 0.3
+"""
+import argparse
+import random
+import sys
+
+import fakes
+
+
+def transfer(lorafrag, data, loss, rounds, rng):
+    sender = lorafrag.Sender(data, msg_id=rng.randrange(256), window=lorafrag.MAX_FRAGMENTS)
+    reasm = lorafrag.Reassembler(timeout_ms=60000)
+    frames = 0
+    delivered = None
+    for r in range(1, rounds + 1):
+        pending = sender.pending()
+        got_last = False
+        for i in pending:
+            frames += 1
+            got_last = rng.random() >= loss
+            if got_last:
+                msg = reasm.feed(1, sender.frames[i])
+                if msg is not None:
+                    delivered = msg
+        # O pedido de SACK vai no último fragmento da rodada; se ele se perde,
+        # o transmissor só percebe pelo timeout
+        if not got_last:
+            continue
+        frames += 1  # quadro de SACK
+        if rng.random() < loss:
+            continue
+        sender.on_sack(reasm.sack(1, sender.msg_id, sender.count))
+        if sender.done:
+            return delivered == data, frames, r
+    return False, frames, rounds
+
+
+def check_reused_id(lorafrag):
+    # msg_id tem 8 bits: uma mensagem nova com o id de outra já completa não pode
+    # ser descartada como retransmissão (nem confirmada sem ter chegado)
+    reasm = lorafrag.Reassembler(timeout_ms=60000)
+    first, second, third = b"A" * 600, b"B" * 600, b"C" * 300
+    for data in (first, second, third):
+        frames = lorafrag.fragment(data, 7)
+        # o primeiro fragmento se perde na primeira rajada
+        assert all(reasm.feed(1, f) is None for f in frames[1:]), "mensagem com msg_id reutilizado descartada"
+        assert lorafrag.decode_sack(reasm.sack(1, 7, len(frames)))[2] == (1 << len(frames)) - 2, \
+            "SACK confirma fragmento que não chegou"
+        assert reasm.feed(1, frames[0]) == data, "mensagem com msg_id reutilizado descartada"
+    assert reasm.feed(1, lorafrag.fragment(third, 7)[1]) is None, "retransmissão entregue de novo"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=2000, help="bytes por mensagem")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.0, 0.05, 0.1, 0.2, 0.3])
+    parser.add_argument("--trials", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    fakes.install()
+    lorafrag = fakes.load("receiver/lorafrag.py", "lorafrag")
+    check_reused_id(lorafrag)
+    rng = random.Random(1)
+    n_frag = len(lorafrag.fragment(bytes(args.size), 0))
+    print(f"Mensagem de {args.size} bytes = {n_frag} fragmentos")
+    print("perda  entrega  quadros/msg  rodadas/msg")
+    for loss in args.loss:
+        ok = frames = rounds = 0
+        for _ in range(args.trials):
+            data = bytes(rng.getrandbits(8) for _ in range(args.size))
+            good, f, r = transfer(lorafrag, data, loss, args.rounds, rng)
+            ok += good
+            frames += f
+            rounds += r
+        t = args.trials
+        print(f"{loss:5.2f}  {ok / t * 100:6.1f}%  {frames / t:11.1f}  {rounds / t:11.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Vários drivers LoRa num meio de rádio simulado (fakes.Medium), no host.
+
+Primeiro confere o tempo no ar: para cada ModemConfig, o que o SX1276 falso
+calcula dos registradores escritos pelo ulora, o LoRa.time_on_air_ms do
+ulora e o get_time_on_air_us de lora/modem.py. Depois roda uma rede no
+relógio virtual: --nodes transmissores ulora enviando leituras com ACK e
+retransmissões para um receptor ulora em poll_recv (como receiver/main.py),
+com um adafruit_rfm9x (DIO0 por interrupção) e um modem de lora/modem.py
+ouvindo o mesmo canal. O meio tem perda, colisões com efeito de captura e
+RSSI por enlace. O modem de lora/modem.py só é lido no laço principal, que
+fica parado enquanto o receptor envia o ACK: o ACK sobrescreve no rádio a
+leitura que ele ouviu logo antes, enquanto a fila do adafruit_rfm9x guarda
+os dois.
+
+    python host/sim_medium.py
+    python host/sim_medium.py --nodes 8 --interval-ms 1000 --loss 0.2 --seconds 120
+"""
+import argparse
+import collections
+import random
+import sys
+
+import fakes
+
+GATEWAY = 1
+PAYLOAD = b"T:25.0,H:50.0,D:71.0"
+CONFIGS = ("Bw125Cr45Sf128", "Bw500Cr45Sf128", "Bw31_25Cr48Sf512", "Bw125Cr45Sf2048", "Bw125Cr48Sf4096")
+
+
+def load_modem():
+    # lora/__init__.py exige um driver lora-sx127x, que não está no
+    # repositório; só a classe base (modem.py) é carregada
+    fakes.install()
+    modem = fakes.load("receiver/lib/lora/modem.py", "lora_modem")
+
+    class SimModem(modem.BaseModem):
+        """Ganchos de registrador mínimos para exercitar o BaseModem no SX1276 falso."""
+        _IRQ_RX_COMPLETE = 0x40
+        _IRQ_TX_COMPLETE = 0x08
+
+        def __init__(self, dio0, freq_mhz, config, preamble=8):
+            self._spi = fakes.SPI(0)
+            super().__init__(None)
+            config1, config2, config3 = config
+            self._bw_hz = fakes.BANDWIDTHS[config1 >> 4]
+            self._coding_rate = ((config1 >> 1) & 0x07) + 4
+            self._implicit_header = bool(config1 & 0x01)
+            self._sf = config2 >> 4
+            self._crc_en = bool(config2 & 0x04)
+            self._preamble_len = preamble
+            frf = int(freq_mhz * 1000000 / (32000000 / 524288))
+            self._write(0x01, 0x80)  # LoRa, sleep
+            self._write(0x06, bytes((frf >> 16, (frf >> 8) & 0xFF, frf & 0xFF)))
+            self._write(0x0E, b"\x00\x00")
+            self._write(0x1D, bytes((config1, config2)))
+            self._write(0x20, bytes((preamble >> 8, preamble & 0xFF)))
+            self._write(0x26, 0x04 | (0x08 if self._get_ldr_en() else 0))
+            self._standby()
+            fakes.Pin(dio0, fakes.Pin.IN).irq(handler=self._radio_isr)
+
+        def _after_init(self):
+            pass
+
+        def _write(self, reg, data):
+            self._spi.write(bytes([reg | 0x80]) + (bytes([data]) if isinstance(data, int) else data))
+
+        def _read(self, reg, n=1):
+            return self._spi.read(n + 1, reg)[1:]
+
+        def _standby(self):
+            self._write(0x01, 0x81)
+
+        def is_idle(self):
+            return self._read(0x01)[0] & 0x07 in (0x00, 0x01)
+
+        def _get_irq(self):
+            return self._read(0x12)[0]
+
+        def _clear_irq(self, flags=0xFF):
+            self._write(0x12, flags)
+
+        def _rx_flags_success(self, flags):
+            return not flags & 0x20
+
+        def start_recv(self, timeout_ms=None, continuous=False, rx_length=0xFF):
+            super().start_recv(timeout_ms, continuous, rx_length)
+            self._write(0x40, 0x00)
+            self._write(0x01, 0x85 if continuous else 0x86)
+
+        def send(self, packet):
+            self._standby()
+            self._write(0x0D, 0x00)
+            self._write(0x00, bytes(packet))
+            self._write(0x22, len(packet))
+            self._write(0x40, 0x40)
+            self._last_irq = None
+            self._tx = True
+            self._write(0x01, 0x83)
+
+        def _read_packet(self, rx_packet, flags):
+            addr, _, _, length = self._read(0x10, 4)
+            self._write(0x0D, addr)
+            snr, rssi = self._read(0x19, 2)
+            snr = snr - 256 if snr > 127 else snr
+            return modem.RxPacket(self._read(0x00, length), self._get_last_irq(), snr, rssi - 157,
+                                  self._rx_flags_success(flags))
+
+    return SimModem
+
+
+def check_time_on_air(SimModem):
+    # Tempo no ar: simulador x ulora x lora/modem.py, e duração real do TX
+    # (cada driver é conferido contra o simulador configurado por ele mesmo:
+    # lora/modem.py liga o LDRO quando o símbolo passa de 16 ms, o ulora usa
+    # o RegModemConfig3 da tabela)
+    print(f"{'ModemConfig':>17} {'simulador':>10} {'ulora':>9} {'LDRO':>5} {'modem.py':>9} {'LDRO':>5} "
+          f"{'TX medido':>10}")
+    for name in CONFIGS:
+        fakes.reset_world()
+        ulora = fakes.load("receiver/ulora.py", "ulora")
+        config = getattr(ulora.ModemConfig, name)
+        radio = fakes.SPI.devices[0] = fakes.SX127xRegisters(dio0=20, time_on_air=True)
+        lora = ulora.LoRa(ulora.SPIConfig.rp2_0, 20, GATEWAY, 17, modem_config=config)
+        lora.set_mode_rx()
+        start = fakes.CLOCK.now_us
+        assert lora.send(PAYLOAD, ulora.BROADCAST_ADDRESS)
+        lora.wait_packet_sent()
+        measured = (fakes.CLOCK.now_us - start) / 1000
+        frame_len = len(radio.tx_frames[-1][1])
+        sim = radio.time_on_air_us(frame_len) / 1000
+        mine = lora.time_on_air_ms(len(PAYLOAD))
+        ldro = "sim" if radio.regs[0x26] & 0x08 else "não"
+        other = fakes.SPI.devices[0] = fakes.SX127xRegisters(time_on_air=True)
+        theirs = SimModem(21, ulora.RF95_FREQ, config).get_time_on_air_us(frame_len) / 1000
+        other_ldro = "sim" if other.regs[0x26] & 0x08 else "não"
+        print(f"{name:>17} {sim:>8.1f}ms {mine:>7.1f}ms {ldro:>5} {theirs:>7.1f}ms {other_ldro:>5} "
+              f"{measured:>8.1f}ms")
+        assert abs(sim - mine) < 1, f"{name}: tempo no ar do ulora diverge do simulador"
+        assert abs(other.time_on_air_us(frame_len) / 1000 - theirs) < 1, f"{name}: modem.py diverge do simulador"
+        assert 0 <= measured - sim < 2, f"{name}: o TX durou {measured:.1f} ms"
+
+
+class Node:
+    """Transmissor ulora dirigido por eventos: send(), ACK no modo callback e
+    até 3 retransmissões, como send_to_wait."""
+
+    def __init__(self, ulora, medium, address, interval_ms, rng):
+        self.ulora = ulora
+        fakes.SPI.devices[0] = self.radio = medium.radio(dio0=100 + address)
+        self.lora = ulora.LoRa(ulora.SPIConfig.rp2_0, 100 + address, address, 17)
+        self.lora.set_mode_rx()
+        self.address = address
+        self.interval_ms = interval_ms
+        self.rng = rng
+        self.header_id = 0
+        self.readings = []   # header_ids enviados
+        self.acked = 0
+        self.failed = 0
+        self.attempts = 0
+        fakes.CLOCK.after(rng.randrange(interval_ms) * 1000, self.reading)
+
+    def reading(self):
+        self.header_id = (self.header_id + 1) & 0xFF
+        self.readings.append(self.header_id)
+        self.attempt(3)
+        fakes.CLOCK.after((self.interval_ms + self.rng.randrange(-50, 50)) * 1000, self.reading)
+
+    def attempt(self, retries):
+        self.attempts += 1
+        self.lora.send(PAYLOAD, GATEWAY, header_id=self.header_id)
+        self.lora.set_mode_rx()
+        timeout = self.lora.retry_timeout * (1 + self.rng.random())
+        fakes.CLOCK.after(int(timeout * 1000000) + self.radio.time_on_air_us(4 + len(PAYLOAD)), self.check, retries,
+                          self.header_id)
+
+    def check(self, retries, header_id):
+        p = self.lora._last_payload
+        if p is not None and p.header_flags & self.ulora.FLAGS_ACK and p.header_id == header_id \
+                and p.header_to == self.address:
+            self.acked += 1
+        elif retries:
+            self.attempt(retries - 1)
+        else:
+            self.failed += 1
+
+
+def run_network(SimModem, nodes, interval_ms, seconds, loss, crc_error, seed):
+    fakes.reset_world()
+    ulora = fakes.load("receiver/ulora.py", "ulora")
+    rfm9x = fakes.load("receiver/adafruit_rfm9x.py", "adafruit_rfm9x")
+    rng = random.Random(seed)
+    medium = fakes.Medium(loss=loss, crc_error=crc_error, seed=seed)
+
+    fakes.SPI.devices[0] = gw_radio = medium.radio(dio0=20)
+    gateway = ulora.LoRa(ulora.SPIConfig.rp2_0, 20, GATEWAY, 17, acks=True)
+    gateway.start_recv()
+    packet = ulora.RxPacket()
+
+    fakes.SPI.devices[0] = medium.radio(dio0=21)
+    sniffer = rfm9x.RFM9x(fakes.SPI(0), fakes.DigitalInOut(18), fakes.DigitalInOut(19), ulora.RF95_FREQ,
+                          dio0=fakes.Pin(21, fakes.Pin.IN), rx_queue_size=8)
+    sniffer.listen()
+
+    fakes.SPI.devices[0] = medium.radio(dio0=22)
+    listener = SimModem(22, ulora.RF95_FREQ, ulora.ModemConfig.Bw125Cr45Sf128)
+    listener.start_recv(continuous=True)
+
+    senders = [Node(ulora, medium, GATEWAY + 1 + i, interval_ms, rng) for i in range(nodes)]
+    for i, node in enumerate(senders):
+        # nós mais distantes chegam mais fracos ao receptor
+        medium.set_rssi(node.radio, gw_radio, -70 - 40 * i / max(1, nodes - 1))
+
+    got = set()
+    heard = collections.Counter()
+    end_us = seconds * 1000000
+    while fakes.CLOCK.now_us < end_us:
+        if gateway.irq_triggered():
+            p = gateway.poll_recv(packet)
+            if p is packet:
+                got.add((p.header_from, p.header_id))
+        while sniffer.rx_queued:
+            p = sniffer.receive(timeout=None, with_header=True)
+            if p is not None:
+                heard["rfm9x", "ACK" if p[3] & ulora.FLAGS_ACK else "dados"] += 1
+        if listener.irq_triggered():
+            p = listener.poll_recv()
+            if p and p is not True:
+                heard["modem.py", "ACK" if p[3] & ulora.FLAGS_ACK else "dados"] += 1
+        fakes.CLOCK.advance(1000)
+    return senders, got, heard, medium, gateway
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--interval-ms", type=int, default=2000)
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--loss", type=float, default=0.05, help="probabilidade de perder cada quadro")
+    parser.add_argument("--crc-error", type=float, default=0.01, help="probabilidade de chegar com erro de CRC")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    SimModem = load_modem()
+    check_time_on_air(SimModem)
+
+    senders, got, heard, medium, gateway = run_network(SimModem, args.nodes, args.interval_ms, args.seconds,
+                                                       args.loss, args.crc_error, args.seed)
+    readings = sum(len(n.readings) for n in senders)
+    attempts = sum(n.attempts for n in senders)
+    acked = sum(n.acked for n in senders)
+    stats = medium.stats
+    print(f"{args.nodes} nós, uma leitura a cada {args.interval_ms} ms por {args.seconds} s, "
+          f"perda {args.loss:.0%}, CRC {args.crc_error:.0%}")
+    print(f"Quadros no ar: {stats['sent']}  entregas (por rádio): {stats['delivered']}  colisões: {stats['collided']}  "
+          f"perdidos: {stats['lost']}  fracos: {stats['weak']}  fora de RX: {stats['not_listening']}")
+    print(f"Leituras: {readings}  tentativas: {attempts}  com ACK: {acked}  "
+          f"recebidas pelo receptor: {len(got)}  duplicadas descartadas: {gateway.duplicates}  "
+          f"erros de CRC: {gateway.crc_errors}")
+    for name in ("rfm9x", "modem.py"):
+        print(f"Ouvidos por {name:>8}: {heard[name, 'dados']} leituras, {heard[name, 'ACK']} ACKs")
+
+    assert acked <= len(got) <= readings, "ACK sem leitura recebida"
+    assert stats["delivered"] > 0 and heard["rfm9x", "dados"] and heard["modem.py", "dados"], "nada chegou pelo meio"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
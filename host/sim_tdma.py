@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Colisões e uso do canal com N transmissores: envio livre (ALOHA) x TDMA.
+
+Simula, com o relógio virtual de fakes.py, N nós enviando uma leitura a cada
+intervalo para um receptor. Dois quadros que se sobrepõem no ar se perdem
+(sem efeito de captura), incluindo ACKs e beacons.
+
+- aloha: o esquema atual, com cada nó no seu próprio ritmo, send_to_wait com
+  até 3 retransmissões após 200-400 ms sem ACK.
+- tdma: o receptor transmite beacons (tdma.Schedule) e cada nó envia no seu
+  slot (tdma.SlotClock), sem retransmissões; nós novos entram pelos slots de
+  entrada.
+
+    python host/sim_tdma.py --nodes 2 5 10 20 --seconds 600
+"""
+import argparse
+import random
+import sys
+
+import fakes
+
+DATA_LEN = 4 + 20 # "T:25.0,H:50.0,D:71.0"
+ACK_LEN = 4 + 1
+
+
+class Channel:
+    """Meio compartilhado: um quadro só chega se nada mais estiver no ar."""
+
+    def __init__(self, ulora, modem_config):
+        self.ulora = ulora
+        self.modem_config = modem_config
+        self.active = []
+        self.busy_us = 0 # tempo com pelo menos uma transmissão no ar
+        self._busy_since = 0
+        self.data_tx = 0
+        self.data_collided = 0
+
+    def transmit(self, length, on_end, kind="data"):
+        # on_end(ok) é chamado no fim do quadro
+        airtime_us = int(self.ulora.time_on_air_ms(length, self.modem_config) * 1000)
+        tx = {"ok": not self.active, "kind": kind}
+        for other in self.active:
+            other["ok"] = False
+        if not self.active:
+            self._busy_since = fakes.CLOCK.now_us
+        self.active.append(tx)
+        if kind == "data":
+            self.data_tx += 1
+
+        def end():
+            self.active.remove(tx)
+            if not self.active:
+                self.busy_us += fakes.CLOCK.now_us - self._busy_since
+            if kind == "data" and not tx["ok"]:
+                self.data_collided += 1
+            on_end(tx["ok"])
+
+        fakes.CLOCK.after(airtime_us, end)
+
+
+def run(scheme, n_nodes, seconds, interval_ms, turn_ms, rng):
+    fakes.reset_world()
+    fakes.install()
+    ulora = fakes.load("receiver/ulora.py", "ulora")
+    tdma = fakes.load("receiver/tdma.py", "tdma")
+    clock = fakes.CLOCK
+    modem = ulora.ModemConfig.Bw125Cr45Sf128
+    channel = Channel(ulora, modem)
+    end_us = seconds * 1000000
+    stats = {"offered": 0, "delivered": set()} # (nó, leitura) entregues, sem contar duplicatas
+    schedule = tdma.Schedule(modem, interval_ms, max_slots=32)
+
+    def receive(node, reading, ok, on_ack):
+        if not ok:
+            return
+        stats["delivered"].add((node, reading))
+        if scheme == "tdma":
+            schedule.assign(node)
+        # O receptor responde com ACK após a inversão TX/RX
+        clock.after(turn_ms * 1000, channel.transmit, ACK_LEN, on_ack, "ack")
+
+    def aloha_node(node):
+        state = {"acked": False, "reading": 0}
+
+        def attempt(retries_left):
+            state["acked"] = False
+            reading = state["reading"]
+            channel.transmit(DATA_LEN, lambda ok: receive(node, reading, ok, lambda a: state.update(acked=a)))
+            timeout_ms = 200 * (1 + rng.random())
+            clock.after(int(timeout_ms * 1000), check, retries_left)
+
+        def check(retries_left):
+            if not state["acked"] and retries_left:
+                attempt(retries_left - 1)
+
+        def reading():
+            if clock.now_us >= end_us:
+                return
+            stats["offered"] += 1
+            state["reading"] += 1
+            attempt(3)
+            # intervalo medido pelo laço principal, que roda a cada ~100-150 ms
+            clock.after(int((interval_ms + rng.uniform(0, 150)) * 1000), reading)
+
+        clock.at(int(rng.uniform(0, interval_ms) * 1000), reading)
+
+    def tdma_node(node):
+        slot_clock = tdma.SlotClock(node, rand=lambda: rng.getrandbits(16))
+
+        def send():
+            if clock.now_us >= end_us:
+                return
+            stats["offered"] += 1
+            reading = stats["offered"]
+            slot_clock.used()
+            channel.transmit(DATA_LEN, lambda ok: receive(node, reading, ok, lambda a: None))
+
+        def on_beacon(payload):
+            # latência da interrupção de recepção
+            slot_clock.on_beacon(payload, rx_ticks=clock.now_us // 1000 + rng.randint(0, 3))
+            delay = slot_clock.delay_ms(clock.now_us // 1000)
+            if delay is not None:
+                clock.after(int((max(delay, 0) + rng.uniform(0, 5)) * 1000), send)
+
+        return on_beacon
+
+    if scheme == "aloha":
+        for node in range(1, n_nodes + 1):
+            aloha_node(node)
+    else:
+        listeners = [tdma_node(node) for node in range(1, n_nodes + 1)]
+
+        def beacon():
+            if clock.now_us >= end_us:
+                return
+            payload = schedule.beacon()
+
+            def sent(ok):
+                if ok:
+                    for listener in listeners:
+                        listener(payload)
+
+            channel.transmit(4 + len(payload), sent, "beacon")
+            clock.after(schedule.period_ms * 1000, beacon)
+
+        clock.at(0, beacon)
+
+    clock.advance(end_us + 5000000)
+    delivered = len(stats["delivered"])
+    data_airtime_us = ulora.time_on_air_ms(DATA_LEN, modem) * 1000
+    return {
+        "offered": stats["offered"],
+        "delivered": delivered,
+        "delivery": delivered / stats["offered"] if stats["offered"] else 0.0,
+        "collision": channel.data_collided / channel.data_tx if channel.data_tx else 0.0,
+        "utilization": delivered * data_airtime_us / end_us,
+        "busy": channel.busy_us / end_us,
+        "period_ms": schedule.period_ms if scheme == "tdma" else interval_ms,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[2, 5, 10, 15, 20])
+    parser.add_argument("--seconds", type=int, default=300)
+    parser.add_argument("--interval-ms", type=int, default=2000, help="SENSOR_UPDATE_INTERVAL / BEACON_INTERVAL_MS")
+    parser.add_argument("--turn-ms", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    print(f"SF7/125 kHz, leitura a cada {args.interval_ms} ms, {args.seconds} s simulados")
+    print(f"{'nós':>4} {'esquema':>8} {'período':>8} {'entrega':>8} {'colisão':>8} {'útil':>7} {'ocupado':>8}")
+    for n in args.nodes:
+        for scheme in ("aloha", "tdma"):
+            r = run(scheme, n, args.seconds, args.interval_ms, args.turn_ms, rng)
+            print(f"{n:>4} {scheme:>8} {r['period_ms']:>6}ms {r['delivery']:>8.1%} {r['collision']:>8.1%} "
+                  f"{r['utilization']:>7.1%} {r['busy']:>8.1%}")
+    print("útil: fração do tempo com leituras entregues no ar; ocupado: qualquer transmissão (dados, ACK, beacon)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
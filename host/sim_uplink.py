@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Uplink MQTT (host/uplink.py) contra um broker local no estilo do mosquitto.
+
+Sobe um broker MQTT 3.1.1 mínimo em 127.0.0.1 (CONNECT com sessão
+persistente, PUBLISH QoS 1 com PUBACK, PINGREQ), gera o fluxo binário de um
+receptor (quadros COBS do serialbridge) e o passa por serial_reader e pelo
+Uplink, em quatro casos:
+
+* contínuo: leituras/s publicadas, comparadas com o máximo de pacotes/s que
+  um gateway recebe no ModemConfig mais rápido (só tempo no ar, sem pausas);
+* quedas: o broker fecha a conexão várias vezes com mensagens em voo;
+* broker fora: o broker para no meio do fluxo, a fila passa para o disco e
+  tudo é enviado quando ele volta;
+* reinício: o uplink fecha com o broker fora e uma nova execução envia o que
+  ficou no disco.
+
+Em todos, confere que cada leitura chegou ao broker (pelo menos uma vez, na
+ordem dentro de cada mensagem) e que a fila no disco termina vazia.
+
+    python host/sim_uplink.py
+    python host/sim_uplink.py --readings 200000 --batch-max 500
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import fakes
+import serial_reader
+import uplink
+
+PAYLOAD = b"T:25.0,H:50.0,D:71.0"
+
+
+class Broker:
+    """Broker MQTT mínimo em 127.0.0.1: guarda as mensagens recebidas."""
+
+    def __init__(self):
+        self.messages = []  # (tópico, mensagem, dup)
+        self.sessions = set()
+        self.connections = 0
+        self.drop_every = 0  # fecha a conexão a cada N PUBLISH, sem o PUBACK do último
+        self.port = 0
+        self._server = None
+        self._sockets = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                broker._serve(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            for sock in self._sockets:
+                sock.close()
+            self._sockets = []
+
+    def _serve(self, sock):
+        with self._lock:
+            self._sockets.append(sock)
+            self.connections += 1
+        reader = uplink.PacketReader()
+        published = 0
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                for kind, flags, body in reader.feed(data):
+                    if kind == uplink.CONNECT:
+                        n = struct.unpack_from("!H", body, 10)[0]
+                        client_id = body[12:12 + n].decode()
+                        present = client_id in self.sessions and not body[7] & 0x02
+                        self.sessions.add(client_id)
+                        sock.sendall(uplink.mqtt_packet(uplink.CONNACK, 0, bytes([present, 0])))
+                    elif kind == uplink.PUBLISH:
+                        n = struct.unpack_from("!H", body)[0]
+                        topic = body[2:2 + n].decode()
+                        packet_id = body[2 + n:4 + n]
+                        published += 1
+                        with self._lock:
+                            self.messages.append((topic, body[4 + n:], bool(flags & uplink.PUBLISH_DUP)))
+                        if self.drop_every and published % self.drop_every == 0:
+                            return
+                        sock.sendall(uplink.mqtt_packet(uplink.PUBACK, 0, packet_id))
+                    elif kind == uplink.PINGREQ:
+                        sock.sendall(uplink.mqtt_packet(uplink.PINGRESP, 0))
+                    elif kind == uplink.DISCONNECT:
+                        return
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+
+def make_stream(readings, nodes, per_chunk, seed):
+    """Blocos da serial de um receptor: [(wall_ms, bytes, [(nó, t)])]."""
+    rng = random.Random(seed)
+    chunks = []
+    t = 1780000000000
+    for start in range(0, readings, per_chunk):
+        data = bytearray()
+        sent = []
+        for k in range(start, min(readings, start + per_chunk)):
+            t += rng.randrange(1, 20)
+            node = rng.randrange(1, nodes + 1)
+            data += serial_reader.encode_record(serial_reader.Record(
+                k & 0xffff, 1, node, k & 0xff, 0, rng.randrange(-125, -50), rng.randrange(-80, 48) / 4,
+                t & 0x3fffffff, PAYLOAD))
+            sent.append((node, t + 5))  # o PC lê o bloco 5 ms depois do último pacote
+        chunks.append((t + 5, bytes(data), sent))
+    return chunks
+
+
+def feed(up, reader, chunks, gateway=0, on_chunk=None):
+    for i, (wall_ms, data, _) in enumerate(chunks):
+        up.add(gateway, [item for kind, item in reader.feed(data) if kind == "record"], wall_ms)
+        up.poll()
+        if on_chunk:
+            on_chunk(i)
+
+
+def check(broker, chunks, what, gateway=0):
+    """Cada leitura enviada chegou ao broker; devolve as duplicadas."""
+    got = []
+    for topic, payload, _ in list(broker.messages):
+        message = json.loads(payload)
+        assert topic == "lora/%d/readings" % gateway and message["gateway"] == gateway, f"{what}: tópico {topic}"
+        times = [(r["node"], r["t"]) for r in message["readings"]]
+        assert times == sorted(times, key=lambda r: r[1]), f"{what}: leituras fora de ordem"
+        assert all(r["temp"] == 25.0 and r["hum"] == 50.0 and r["db"] == 71.0 for r in message["readings"])
+        got += times
+    sent = [s for _, _, chunk in chunks for s in chunk]
+    assert set(got) == set(sent), f"{what}: {len(set(sent) - set(got))} leituras não chegaram"
+    return len(got) - len(set(got))
+
+
+def run_case(name, chunks, args, spool, setup=None, on_chunk=None, restart=False):
+    broker = Broker()
+    broker.start()
+    client = uplink.MqttClient("127.0.0.1", broker.port, window=args.window)
+    queue = uplink.Spool(spool, args.memory, segment_bytes=64 * 1024)
+    up = uplink.Uplink(client, batch_ms=args.batch_ms, batch_max=args.batch_max, spool=queue,
+                       retry_s=0.02, max_retry_s=0.2)
+    if setup:
+        setup(broker)
+    reader = serial_reader.Reader()
+    start = time.perf_counter()
+    feed(up, reader, chunks, on_chunk=lambda i: on_chunk(i, broker) if on_chunk else None)
+    messages = up.messages
+    clients, queues = [client], [queue]
+    if restart:
+        # O broker está fora: fecha, e uma nova execução envia o que ficou no disco
+        up.close()
+        assert os.listdir(spool), "nada foi para o disco ao fechar"
+        broker.start()
+        client = uplink.MqttClient("127.0.0.1", broker.port, window=args.window)
+        queue = uplink.Spool(spool, args.memory, segment_bytes=64 * 1024)
+        assert len(queue) >= messages - up.acked, "mensagens perdidas no reinício"
+        clients.append(client)
+        queues.append(queue)
+        up = uplink.Uplink(client, batch_ms=args.batch_ms, batch_max=args.batch_max, spool=queue,
+                           retry_s=0.02, max_retry_s=0.2)
+    assert up.flush(30), f"{name}: fila não esvaziou"
+    elapsed = time.perf_counter() - start
+    up.close()
+    broker.stop()
+    duplicates = check(broker, chunks, name)
+    assert not spool or not os.listdir(spool), f"{name}: fila no disco não esvaziou"
+    readings = sum(len(c[2]) for c in chunks)
+    size = sum(len(m[1]) for m in broker.messages)
+    print(f"{name:>12} {readings:>9} {readings / elapsed:>10.0f} {messages:>9} {size / readings:>9.1f} "
+          f"{sum(c.connects for c in clients):>8} {sum(c.resent for c in clients):>10} "
+          f"{sum(q.spilled for q in queues):>9} "
+          f"{duplicates:>10}")
+    return readings / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument("--nodes", type=int, default=250)
+    parser.add_argument("--batch-ms", type=int, default=1000)
+    parser.add_argument("--batch-max", type=int, default=200)
+    parser.add_argument("--window", type=int, default=16)
+    parser.add_argument("--memory", type=int, default=20, help="mensagens na fila em memória")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    fakes.install(args.seed)
+    ulora = fakes.load("receiver/ulora.py", "ulora")
+    toa = ulora.time_on_air_ms(len(PAYLOAD) + 4, ulora.ModemConfig.Bw500Cr45Sf128)
+    gateway_rate = 1000 / toa
+    chunks = make_stream(args.readings, args.nodes, 50, args.seed)
+    print(f"Gateway cheio: {toa:.1f} ms no ar por leitura no Bw500Cr45Sf128, até {gateway_rate:.0f} leituras/s")
+    print(f"{'caso':>12} {'leituras':>9} {'leituras/s':>10} {'mensagens':>9} {'bytes/lei':>9} "
+          f"{'conexões':>8} {'reenviadas':>10} {'no disco':>9} {'duplicadas':>10}")
+    root = tempfile.mkdtemp(prefix="uplink-")
+    try:
+        rate = run_case("contínuo", chunks, args, None)
+        assert rate >= 10 * gateway_rate, "uplink abaixo de 10 gateways cheios"
+
+        def drops(broker):
+            broker.drop_every = 25
+
+        run_case("quedas", chunks, args, os.path.join(root, "quedas"), setup=drops)
+        third = len(chunks) // 3
+
+        def outage(i, broker):
+            if i == third:
+                broker.stop()
+            elif i == 2 * third:
+                broker.start()
+
+        run_case("broker fora", chunks, args, os.path.join(root, "fora"), on_chunk=outage)
+
+        def down(i, broker):
+            if i == third:
+                broker.stop()
+
+        run_case("reinício", chunks, args, os.path.join(root, "reinicio"), on_chunk=down, restart=True)
+    finally:
+        shutil.rmtree(root)
+    print(f"Tudo entregue; contínuo a {rate / gateway_rate:.0f}x a taxa de um gateway cheio")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
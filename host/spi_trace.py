@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Conta as transações SPI do ulora por pacote, no SX1276 falso de fakes.py.
+
+Mede a recepção de um quadro (interrupção, leitura, ACK e volta ao RX) e o
+envio com send_to_wait até o ACK, no segundo pacote (o primeiro só aquece
+caches). Com --baseline, compara o ulora atual com outro arquivo, por exemplo
+o de uma revisão anterior extraído do git.
+
+    python host/spi_trace.py
+    git show HEAD~1:receiver/ulora.py > /tmp/ulora_antigo.py
+    python host/spi_trace.py --baseline /tmp/ulora_antigo.py --verbose
+"""
+import argparse
+import collections
+import os
+import shutil
+import sys
+import tempfile
+
+import fakes
+
+RX_PIN = 20
+PAYLOAD = b"T:25.0,H:50.0,D:71.0"
+
+
+def make_radio(ulora, address, **kwargs):
+    fakes.reset_world()
+    fakes.install()
+    radio = fakes.SPI.devices[0] = fakes.SX127xRegisters(dio0=RX_PIN)
+    lora = ulora.LoRa(ulora.SPIConfig.rp2_0, RX_PIN, address, 17, reset_pin=28, **kwargs)
+    lora.set_mode_rx()
+    return lora, radio
+
+
+def measure_rx(path):
+    # Receptor (endereço 2, com ACK) recebe um quadro do nó 1
+    ulora = fakes.load(path, "ulora_trace")
+    lora, radio = make_radio(ulora, 2, acks=True)
+    got = []
+    lora.on_recv = got.append
+    for header_id in (7, 8):
+        radio.trace = []
+        radio.receive(bytes([2, 1, header_id, 0]) + PAYLOAD)
+    assert len(got) == 2 and got[1].message == PAYLOAD, "quadro não entregue"
+    return radio.trace
+
+
+def measure_tx(path):
+    # Transmissor (endereço 1) envia com send_to_wait e recebe o ACK
+    ulora = fakes.load(path, "ulora_trace")
+    lora, radio = make_radio(ulora, 1)
+
+    def on_tx(frame):
+        if frame[3] & 0x80:
+            return
+        ack = bytes([frame[1], frame[0], frame[2], 0x80]) + b"!"
+        fakes.CLOCK.after(radio.TX_TIME_US + 20000, radio.receive, ack)
+
+    radio.on_tx = on_tx
+    for _ in range(2):
+        fakes.CLOCK.advance(500000)
+        radio.trace = []
+        assert lora.send_to_wait(PAYLOAD, 2), "ACK não recebido"
+    return radio.trace
+
+
+def isolated(path, module, measure):
+    """Roda measure() sobre uma cópia de `path` sozinha num diretório temporário,
+    com o nome do módulo: nenhum arquivo vizinho do original é carregado junto."""
+    with tempfile.TemporaryDirectory(prefix=module + "_") as directory:
+        copy = os.path.join(directory, module + ".py")
+        shutil.copyfile(path, copy)
+        return measure(copy)
+
+
+def describe(trace):
+    counts = collections.Counter(f"{'W' if write else 'R'} 0x{reg:02x}" for reg, write in trace)
+    return ", ".join(f"{name} x{n}" if n > 1 else name for name, n in sorted(counts.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", metavar="ARQUIVO", help="outro ulora.py para comparar com o atual")
+    parser.add_argument("--verbose", action="store_true", help="mostra os registradores acessados")
+    args = parser.parse_args(argv)
+
+    versions = [("atual", measure_rx("receiver/ulora.py"), measure_tx("receiver/ulora.py"))]
+    if args.baseline:
+        rx, tx = isolated(args.baseline, "ulora", lambda path: (measure_rx(path), measure_tx(path)))
+        versions.insert(0, (os.path.basename(args.baseline)[:12], rx, tx))
+    print(f"{'ulora':>12} {'recepção':>10} {'envio':>8}")
+    for name, rx, tx in versions:
+        print(f"{name:>12} {len(rx):>10} {len(tx):>8}")
+        if args.verbose:
+            print(f"    recepção: {describe(rx)}")
+            print(f"    envio:    {describe(tx)}")
+    print("transações SPI por pacote (cada uma é um ciclo de CS, com ou sem rajada)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Store-and-forward do transmissor: leituras de uma queda do enlace LoRa vão
+para a flash (transmitter/flashlog.py) e são reenviadas quando ele volta.
+
+Roda transmitter/main.py com um gateway que confirma cada quadro (tempo no
+ar do datasheet), some por --outage-s segundos e volta. No meio da queda o
+firmware reinicia (erro fatal -> machine.reset(), com os arquivos da flash
+preservados), então parte do backlog vem do boot anterior. Confere que toda
+leitura chegou ao gateway, que a idade das reenviadas do mesmo boot bate com
+o instante da medição e que o backlog não atrasa as leituras ao vivo, e
+mostra as escritas na flash por leitura guardada, o tempo no ar por leitura
+nos lotes (FLAGS_BATCH) e quanto tempo o backlog levou para esvaziar depois
+da volta do enlace. Antes, repete a queda com LinkProfile.Compact, que não
+leva flags nem a idade, e confere que as leituras da queda ficam na flash e
+nenhuma chega ao gateway como se fosse ao vivo.
+
+    python host/store_forward.py
+    python host/store_forward.py --outage-s 3600 --tail-s 300
+"""
+import argparse
+import contextlib
+import io
+import sys
+
+import fakes
+import ingest
+
+
+class Stop(BaseException):
+    """Interrompe main() (que captura Exception) no fim da simulação."""
+
+
+def run(up_s, outage_s, tail_s, seed):
+    fakes.reset_world()
+    fakes.install(seed)
+    # Instantes no relógio de cada boot; o segundo começa quando o primeiro reinicia
+    reset_at = up_s + outage_s // 2
+    measured = {}   # temperatura x10 (única por leitura) -> (boot, s do boot)
+    received = []   # (temperatura x10, boot, s do boot, idade ou None, veio num lote)
+    frames = []     # (boot, s do boot, bytes, leituras) dos quadros de dados que chegaram
+    boots = []
+    stats = {}
+    flash = {}
+    for boot in (1, 2):
+        fakes.reset_world()
+        fakes.Flash.files = flash
+        tx = fakes.load("transmitter/main.py")
+        radio = fakes.SPI.devices[tx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=tx.RFM95_INT, time_on_air=True)
+        if boot == 1:
+            down = (up_s, None)
+        else:
+            down = (0, up_s + outage_s - reset_at)
+        boots.append(down)
+
+        def gateway(frame, boot=boot, down=down, radio=radio):
+            if frame[3] & 0x80:
+                return
+            now = fakes.CLOCK.now_us / 1e6
+            if now >= down[0] and (down[1] is None or now < down[1]):
+                return  # enlace fora: nenhum quadro chega ao gateway
+            payload = bytes(frame[4:])
+            if frame[3] & ingest.FLAGS_BATCH:
+                readings = ingest.parse_batch(payload)
+                for age, sensors in readings:
+                    received.append((round(sensors[0] * 10), boot, now, None if age is None else age // 1000, True))
+            else:
+                readings = [ingest.parse_sensors(payload)]
+                received.append((round(readings[0][0] * 10), boot, now, None, False))
+            frames.append((boot, now, len(frame), len(readings)))
+            ack = bytes([frame[1], frame[0], frame[2], 0x80]) + b"!"
+            fakes.CLOCK.after(radio.time_on_air_us(len(frame)) + 20000, radio.receive, ack)
+
+        radio.on_tx = gateway
+
+        # Cada leitura enviada tem uma temperatura diferente, para conferir a entrega
+        send = tx.send_lora_message
+
+        def send_lora_message(temp, hum, db, retries=3, boot=boot):
+            temp = len(measured) / 10
+            measured[len(measured)] = (boot, fakes.CLOCK.now_us / 1e6)
+            return send(temp, hum, db, retries)
+
+        tx.send_lora_message = send_lora_message
+        read_sensors = tx.read_sensors
+
+        def reading(boot=boot):
+            if boot == 1 and fakes.CLOCK.now_us >= reset_at * 1000000:
+                raise RuntimeError("falha simulada")
+            return read_sensors()
+
+        tx.read_sensors = reading
+
+        def stop():
+            raise Stop()
+
+        if boot == 2:
+            fakes.CLOCK.at((up_s + outage_s - reset_at + tail_s) * 1000000, stop)
+        try:
+            tx.main()
+        except (fakes.DeepSleep, Stop):
+            pass
+        flash = fakes.Flash.files
+        stats[boot] = {"log": tx.backlog, "writes": fakes.Flash.writes, "bytes": fakes.Flash.bytes_written,
+                       "toa_us": radio.time_on_air_us}
+    return measured, received, frames, boots, stats, reset_at
+
+
+def check_compact(up_s, outage_s, tail_s, seed):
+    # LinkProfile.Compact não leva FLAGS_BATCH nem a idade: as leituras da
+    # queda ficam na flash e nenhum quadro depois da volta pode ser antigo
+    fakes.reset_world()
+    fakes.install(seed)
+    tx = fakes.load("transmitter/main.py")
+    tx.LINK_PROFILE = tx.LinkProfile.Compact
+    radio = fakes.SPI.devices[tx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters(dio0=tx.RFM95_INT, time_on_air=True)
+    measured = []   # instante de cada leitura (o índice vai na temperatura)
+    received = []   # (s, índice da leitura no quadro, índice da última leitura medida)
+
+    def gateway(frame):
+        if frame[1] & 0x80:
+            return
+        now = fakes.CLOCK.now_us / 1e6
+        if up_s <= now < up_s + outage_s:
+            return
+        received.append((now, round(ingest.parse_sensors(bytes(frame[2:]), compact=True)[0] * 10),
+                         len(measured) - 1))
+        ack = bytes([(frame[0] & 0x0f) << 4 | frame[0] >> 4, frame[1] | 0x80]) + b"!" + bytes(5)
+        fakes.CLOCK.after(radio.time_on_air_us(len(frame)) + 20000, radio.receive, ack)
+
+    radio.on_tx = gateway
+    send = tx.send_lora_message
+
+    def send_lora_message(temp, hum, db, retries=3):
+        measured.append(fakes.CLOCK.now_us / 1e6)
+        return send((len(measured) - 1) / 10, hum, db, retries)
+
+    tx.send_lora_message = send_lora_message
+
+    def stop():
+        raise Stop()
+
+    fakes.CLOCK.at((up_s + outage_s + tail_s) * 1000000, stop)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            tx.main()
+    except Stop:
+        pass
+    old = [(now, k) for now, k, last in received if k != last]
+    assert not old, f"{len(old)} leituras antigas reenviadas sem idade no perfil Compact: {old[:5]}"
+    assert len(tx.backlog) == tx.backlog.appended > 0, "leituras da queda fora da flash no perfil Compact"
+    assert any(now >= up_s + outage_s for now, _, _ in received), "enlace não voltou no perfil Compact"
+    return len(tx.backlog)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--up-s", type=int, default=20, help="segundos de enlace bom antes da queda")
+    parser.add_argument("--outage-s", type=int, default=600)
+    parser.add_argument("--tail-s", type=int, default=60, help="segundos de enlace bom depois da queda")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    kept = check_compact(args.up_s, args.outage_s, args.tail_s, args.seed)
+    measured, received, frames, boots, stats, reset_at = run(args.up_s, args.outage_s, args.tail_s, args.seed)
+    got = [r[0] for r in received]
+    missing = sorted(set(measured) - set(got))
+    assert not missing, f"{len(missing)} leituras não chegaram: {missing[:10]}"
+    duplicates = len(got) - len(set(got))
+
+    # Idade: instante da recepção menos a idade deve dar o instante da medição (mesmo boot)
+    aged = [(k, boot, now, age) for k, boot, now, age, _ in received if age is not None]
+    for k, boot, now, age in aged:
+        assert measured[k][0] == boot and abs(now - age - measured[k][1]) <= 1.5, f"idade errada na leitura {k}"
+    stored = sum(s["log"].appended for s in stats.values())
+    writes = sum(s["writes"] for s in stats.values())
+    flash_bytes = sum(s["bytes"] for s in stats.values())
+    recovered = boots[1][1]
+    backlog_rx = [now for _, boot, now, _, batched in received if boot == 2 and batched]
+    drained = max(backlog_rx) if backlog_rx else recovered
+    previous = sum(1 for k, boot, _, _, _ in received if boot == 2 and measured[k][0] == 1)
+
+    # Leituras ao vivo: intervalo entre as entregas antes da queda e enquanto o backlog esvazia
+    live = [(boot, now) for _, boot, now, _, batched in received if not batched]
+    before = [b - a for (_, a), (_, b) in zip(live, live[1:]) if b <= args.up_s]
+    during = [b - a for (boot_a, a), (boot, b) in zip(live, live[1:])
+              if boot_a == boot == 2 and recovered < a and b <= drained]
+    batches = [f for f in frames if f[3] > 1]
+    toa_us = stats[2]["toa_us"]
+
+    log = stats[2]["log"]
+    print(f"Leituras: {len(measured)}, guardadas na flash na queda: {stored}, "
+          f"entregues: {len(set(got))}, duplicadas: {duplicates}")
+    print(f"Reinício aos {reset_at} s (boot {log.boot}), {previous} reenviadas do boot anterior, "
+          f"{len(aged)} com idade conferida")
+    print(f"Flash: {writes} escritas, {flash_bytes} bytes ({flash_bytes / max(stored, 1):.1f} bytes e "
+          f"{writes / max(stored, 1):.2f} escritas por leitura guardada; {log.cursor_writes} do cursor no boot 2)")
+    if batches:
+        batched = sum(f[3] for f in batches)
+        print(f"Lotes: {len(batches)} quadros, {batched / len(batches):.1f} leituras por quadro, "
+              f"{sum(toa_us(f[2]) for f in batches) / 1000 / batched:.1f} ms no ar por leitura "
+              f"(ao vivo: {toa_us(frames[0][2]) / 1000:.1f} ms)")
+    print(f"Backlog vazio {drained - recovered:.1f} s depois da volta do enlace; pendentes no fim: {len(log)}")
+    if during:
+        print(f"Intervalo entre leituras ao vivo: máx {max(before):.2f} s antes da queda, "
+              f"{max(during):.2f} s enquanto o backlog esvaziava ({len(during)} intervalos)")
+        assert max(during) <= max(before) + 0.15, "o backlog atrasou as leituras ao vivo"
+    print(f"Perfil Compact: {kept} leituras da queda mantidas na flash, sem reenvio")
+    assert not len(log), "backlog não esvaziou"
+    assert not fakes.Flash.files.keys() - {"backlogc0", "backlogc1"}, "segmentos restaram na flash"
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Mede, no host, o tempo do boot do transmissor até o primeiro quadro LoRa.
+
+Roda transmitter/main.py com periféricos falsos (fakes.py) e relógio virtual,
+sem nenhum central BLE conectado, e para no primeiro quadro entregue ao rádio.
+Com --connect-after-ms, um central conecta depois desse tempo e o script
+confirma que o BLE passa a notificar sem interromper o envio LoRa.
+
+    python host/time_to_first_packet.py
+"""
+import argparse
+import sys
+
+import fakes
+
+
+class FirstPacket(BaseException):
+    """Interrompe main() (que captura Exception) no primeiro quadro transmitido."""
+
+
+def run(connect_after_ms=None, frames=1):
+    fakes.reset_world()
+    fakes.install()
+    tx = fakes.load("transmitter/main.py")
+    radio = fakes.SPI.devices[tx.RFM95_SPIBUS[0]] = fakes.SX127xRegisters()
+    ble = fakes.BLE()
+    sent = []
+
+    def on_tx(frame):
+        sent.append(fakes.CLOCK.now_us)
+        if len(sent) >= frames:
+            raise FirstPacket()
+
+    radio.on_tx = on_tx
+    if connect_after_ms is not None:
+        fakes.CLOCK.at(connect_after_ms * 1000, ble.connect_central)
+    try:
+        tx.main()
+    except FirstPacket:
+        pass
+    return sent, ble
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connect-after-ms", type=int, default=None)
+    parser.add_argument("--frames", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    sent, ble = run(args.connect_after_ms, args.frames)
+    if not sent:
+        print("Nenhum quadro LoRa transmitido")
+        return 1
+    print(f"Primeiro quadro LoRa em {sent[0] / 1000:.1f} ms (relógio virtual, sem central BLE)")
+    if args.frames > 1:
+        print(f"Quadro {len(sent)} em {sent[-1] / 1000:.1f} ms")
+    if args.connect_after_ms is not None:
+        print(f"Central BLE conectado em {args.connect_after_ms} ms; notificações: {ble.notifies}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+Armazenamento colunar em disco das séries dos nós (gravado por host/ingest.py).
+
+Cada nó tem, por mês (UTC), um arquivo por coluna, com valores de tamanho
+fixo que só são acrescentados no fim:
+
+    DIR/raw/<nó>/<AAAA-MM>/t.i64           instante em ms desde a época (int64, crescente)
+    DIR/raw/<nó>/<AAAA-MM>/<métrica>.f32   um float32 por instante (NaN: sem valor)
+    DIR/r<L>/<nó>/<AAAA-MM>/rows.bin       agregados de L segundos, uma ROW por balde
+    DIR/state/<nó>.bin                     baldes abertos no último flush
+
+A leitura mapeia os arquivos com mmap e devolve memoryviews (t como "q",
+métricas como "f") sem copiar; o intervalo pedido é achado por bisseção em t.
+Os agregados de 5 min, 1 h e 1 dia guardam, por métrica, contagem, mínimo,
+máximo e soma. aggregate() usa o maior nível que divide o passo pedido e
+completa com os dados brutos as bordas e o balde ainda aberto, então meses
+de dados se consultam lendo poucos milhares de linhas.
+
+O escritor junta os pontos em memória, e flush() acrescenta cada coluna com
+uma escrita. Nenhum arquivo fica aberto entre flushes, então milhares de nós
+não esgotam os descritores. Um balde só é gravado quando fecha. Os baldes
+abertos vão para state/ a cada flush e, ao reiniciar, são refeitos com os
+pontos brutos gravados depois disso. Se uma queda deixa colunas de tamanhos
+diferentes, vale o menor, e o escritor trunca as outras. Um ponto fora de
+ordem num nó entra com o instante do último, para t continuar crescente.
+
+Consultas pela linha de comando:
+
+    python host/tsstore.py DIR --list
+    python host/tsstore.py DIR --node 0.3 --metric rssi --from 2026-01-01 --to 2026-04-01 --step 86400
+"""
+import argparse
+import bisect
+import calendar
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+METRICS = ("rssi", "snr", "temp", "hum", "db")
+LEVELS = (300, 3600, 86400)  # segundos por balde de agregado
+# Balde: início (ms) e, por métrica, contagem, mínimo, máximo e soma
+ROW = struct.Struct("<q" + "Iffd" * len(METRICS))
+STATE_HEADER = struct.Struct("<7sI")  # mês e pontos brutos já nos baldes abertos
+NAN = float("nan")
+
+
+def month_of(t_ms):
+    """(chave "AAAA-MM", início em ms, fim em ms) do mês UTC de t_ms."""
+    tm = time.gmtime(t_ms // 1000)
+    start = calendar.timegm((tm.tm_year, tm.tm_mon, 1, 0, 0, 0)) * 1000
+    year, month = (tm.tm_year + 1, 1) if tm.tm_mon == 12 else (tm.tm_year, tm.tm_mon + 1)
+    return "%04d-%02d" % (tm.tm_year, tm.tm_mon), start, calendar.timegm((year, month, 1, 0, 0, 0)) * 1000
+
+
+def parse_time(text):
+    """Instante em ms de "AAAA-MM-DD[THH:MM[:SS]]" (UTC) ou de um número em ms."""
+    if text.isdigit():
+        return int(text)
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(text, fmt)) * 1000
+        except ValueError:
+            pass
+    raise ValueError(f"instante inválido: {text}")
+
+
+def _map(path, fmt):
+    # memoryview do arquivo inteiro no formato fmt, ou None se vazio; o mmap
+    # vive enquanto a memoryview existir
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        size = os.fstat(f.fileno()).st_size // struct.calcsize(fmt) * struct.calcsize(fmt)
+        if not size:
+            return None
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    return view[:size].cast(fmt)
+
+
+class _RowTimes:
+    """Início dos baldes de um rows.bin mapeado, para bisect."""
+
+    def __init__(self, view):
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // ROW.size
+
+    def __getitem__(self, i):
+        return struct.unpack_from("<q", self.view, i * ROW.size)[0]
+
+
+class _Bucket:
+    __slots__ = ("start", "n", "min", "max", "sum")
+
+    def __init__(self, start):
+        self.start = start
+        self.n = [0] * len(METRICS)
+        self.min = [NAN] * len(METRICS)
+        self.max = [NAN] * len(METRICS)
+        self.sum = [0.0] * len(METRICS)
+
+    def add(self, values):
+        for i, v in enumerate(values):
+            if v == v:
+                if self.n[i]:
+                    if v < self.min[i]:
+                        self.min[i] = v
+                    elif v > self.max[i]:
+                        self.max[i] = v
+                else:
+                    self.min[i] = self.max[i] = v
+                self.n[i] += 1
+                self.sum[i] += v
+
+    def pack(self):
+        fields = [self.start]
+        for i in range(len(METRICS)):
+            fields += (self.n[i], self.min[i], self.max[i], self.sum[i])
+        return ROW.pack(*fields)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        fields = ROW.unpack_from(data, offset)
+        bucket = cls(fields[0])
+        for i in range(len(METRICS)):
+            bucket.n[i], bucket.min[i], bucket.max[i], bucket.sum[i] = fields[1 + 4 * i:5 + 4 * i]
+        return bucket
+
+
+class _NodeWriter:
+    """Pontos e baldes de um nó ainda não gravados."""
+
+    def __init__(self, store, node):
+        self.store = store
+        self.node = node
+        self.last_t = None
+        self.month = None  # (chave, início, fim) do último ponto
+        self.columns = {}  # mês -> [array t, arrays das métricas]
+        self.rows = {}     # (nível, mês) -> bytearray de ROWs
+        self.buckets = [None] * len(LEVELS)
+        self.last_row = [-1] * len(LEVELS)  # início do último balde gravado por nível
+        self.raw_len = 0  # pontos do mês atual já no disco mais os em memória
+        self._recover()
+
+    def _recover(self):
+        store = self.store
+        months = store.months(self.node)
+        if not months:
+            return
+        for month in months[-2:]:  # uma queda no flush afeta os últimos meses
+            store._repair(self.node, month)
+        for li, level in enumerate(LEVELS):
+            rows = store._rows_months(self.node, level)
+            if rows:
+                view = _map(store._path("r%d" % level, self.node, rows[-1], "rows.bin"), "B")
+                if view is not None:
+                    self.last_row[li] = struct.unpack_from("<q", view, len(view) - ROW.size)[0]
+        # Baldes abertos do último flush e os pontos gravados depois dele
+        try:
+            with open(store._path("state", self.node + ".bin"), "rb") as f:
+                data = f.read()
+            key, start = STATE_HEADER.unpack_from(data)
+            month = key.decode()
+            for li in range(len(LEVELS)):
+                bucket = _Bucket.unpack(data, STATE_HEADER.size + li * ROW.size)
+                self.buckets[li] = bucket if bucket.start >= 0 else None
+        except (FileNotFoundError, struct.error):
+            month = None
+        if month not in months:
+            month, start = months[0], 0
+            self.buckets = [None] * len(LEVELS)
+        for m in months[months.index(month):]:
+            t, values = store._raw(self.node, m)
+            if t is None:
+                continue
+            first = start if m == month else 0
+            for i in range(first, len(t)):
+                self._roll(t[i], [v[i] for v in values])
+            self.last_t = t[-1]
+            self.month = month_of(t[-1])
+            self.raw_len = len(t)
+
+    def append(self, t, values):
+        if self.last_t is not None and t < self.last_t:
+            t = self.last_t
+        month = self.month
+        if month is None or not month[1] <= t < month[2]:
+            month = self.month = month_of(t)
+            self.raw_len = 0 if month[0] not in self.store.months(self.node) else \
+                len(self.store._raw(self.node, month[0])[0] or ())
+        columns = self.columns.get(month[0])
+        if columns is None:
+            columns = self.columns[month[0]] = [array("q")] + [array("f") for _ in METRICS]
+        columns[0].append(t)
+        for column, v in zip(columns[1:], values):
+            column.append(v)
+        self.raw_len += 1
+        # Os agregados usam os valores como gravados (float32), iguais aos
+        # relidos depois de reiniciar
+        self._roll(t, [column[-1] for column in columns[1:]])
+        self.last_t = t
+
+    def _roll(self, t, values):
+        for li, level in enumerate(LEVELS):
+            start = t - t % (level * 1000)
+            bucket = self.buckets[li]
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    self._close(li, bucket)
+                bucket = self.buckets[li] = _Bucket(start)
+            bucket.add(values)
+
+    def _close(self, li, bucket):
+        if bucket.start <= self.last_row[li]:
+            return  # já gravado antes de uma queda
+        key = (LEVELS[li], month_of(bucket.start)[0])
+        self.rows.setdefault(key, bytearray()).extend(bucket.pack())
+        self.last_row[li] = bucket.start
+
+    def flush(self):
+        store = self.store
+        for month, columns in self.columns.items():
+            directory = store._makedirs("raw", self.node, month)
+            for name, column in zip(store.COLUMNS, columns):
+                with open(os.path.join(directory, name), "ab") as f:
+                    column.tofile(f)
+        for (level, month), data in self.rows.items():
+            directory = store._makedirs("r%d" % level, self.node, month)
+            with open(os.path.join(directory, "rows.bin"), "ab") as f:
+                f.write(data)
+        if self.columns or self.rows:
+            state = bytearray(STATE_HEADER.pack(self.month[0].encode(), self.raw_len))
+            for bucket in self.buckets:
+                state += (bucket or _Bucket(-1)).pack()
+            path = store._path("state", self.node + ".bin")
+            with open(path + ".tmp", "wb") as f:
+                f.write(state)
+            os.replace(path + ".tmp", path)
+        self.columns = {}
+        self.rows = {}
+
+
+class Store:
+    """Séries por nó e métrica em DIR; append()/flush() gravam, o resto lê."""
+
+    COLUMNS = ("t.i64",) + tuple(m + ".f32" for m in METRICS)
+
+    def __init__(self, root):
+        self.root = root
+        self.buffered = 0  # pontos em memória
+        self._writers = {}
+        self._months = {}  # nó -> meses com dados brutos (cache do escritor)
+        self._dirs = set()  # diretórios que já existem
+        os.makedirs(os.path.join(root, "state"), exist_ok=True)
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _makedirs(self, *parts):
+        directory = self._path(*parts)
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+        return directory
+
+    # --- escrita ---
+    def append(self, node, t_ms, values):
+        """values: um float por métrica de METRICS (NaN: sem valor)."""
+        writer = self._writers.get(node)
+        if writer is None:
+            if not node or "/" in node or node.startswith("."):
+                raise ValueError(f"nome de nó inválido: {node!r}")
+            writer = self._writers[node] = _NodeWriter(self, node)
+        writer.append(t_ms, values)
+        self.buffered += 1
+
+    def flush(self):
+        for node, writer in self._writers.items():
+            if writer.columns:
+                months = self.months(node)
+                for month in writer.columns:
+                    if month not in months:
+                        bisect.insort(months, month)
+            writer.flush()
+        self.buffered = 0
+
+    def _repair(self, node, month):
+        # Colunas do mesmo tamanho (o menor) e rows.bin com ROWs inteiras
+        directory = self._path("raw", node, month)
+        sizes = []
+        for name in self.COLUMNS:
+            path = os.path.join(directory, name)
+            sizes.append(os.path.getsize(path) if os.path.exists(path) else 0)
+        widths = [8 if name == "t.i64" else 4 for name in self.COLUMNS]
+        n = min(size // width for size, width in zip(sizes, widths))
+        for name, size, width in zip(self.COLUMNS, sizes, widths):
+            if size > n * width:
+                with open(os.path.join(directory, name), "r+b") as f:
+                    f.truncate(n * width)
+        for level in LEVELS:
+            path = self._path("r%d" % level, node, month, "rows.bin")
+            if os.path.exists(path) and os.path.getsize(path) % ROW.size:
+                with open(path, "r+b") as f:
+                    f.truncate(os.path.getsize(path) // ROW.size * ROW.size)
+
+    # --- leitura ---
+    @staticmethod
+    def _list(directory):
+        try:
+            return sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return []
+
+    def nodes(self):
+        return self._list(self._path("raw"))
+
+    def months(self, node):
+        months = self._months.get(node)
+        if months is None:
+            months = self._months[node] = self._list(self._path("raw", node))
+        return months
+
+    def _rows_months(self, node, level):
+        return self._list(self._path("r%d" % level, node))
+
+    def _raw(self, node, month):
+        # (t, [métricas]) de um mês, cortados ao menor tamanho
+        directory = self._path("raw", node, month)
+        t = _map(os.path.join(directory, "t.i64"), "q")
+        if t is None:
+            return None, None
+        values = [_map(os.path.join(directory, m + ".f32"), "f") for m in METRICS]
+        n = min([len(t)] + [len(v) if v is not None else 0 for v in values])
+        if not n:
+            return None, None
+        return t[:n], [v[:n] for v in values]
+
+    def series(self, node, metric, t0, t1):
+        """Gera (t, valores) por mês em [t0, t1), memoryviews sobre os arquivos."""
+        i = METRICS.index(metric)
+        first, last = month_of(t0)[0], month_of(t1 - 1)[0]
+        for month in self._list(self._path("raw", node)):
+            if not first <= month <= last:
+                continue
+            t, values = self._raw(node, month)
+            if t is None:
+                continue
+            a, b = bisect.bisect_left(t, t0), bisect.bisect_left(t, t1)
+            if a < b:
+                yield t[a:b], values[i][a:b]
+
+    def points(self, node, metric, t0, t1):
+        """Lista de (t, valor) em [t0, t1), sem os NaN."""
+        out = []
+        for t, values in self.series(node, metric, t0, t1):
+            out += [(ti, v) for ti, v in zip(t, values) if v == v]
+        return out
+
+    def rows(self, node, level, t0, t1):
+        """Gera os _Bucket de um nível com início em [t0, t1)."""
+        first, last = month_of(t0)[0], month_of(t1 - 1)[0]
+        for month in self._rows_months(node, level):
+            if not first <= month <= last:
+                continue
+            view = _map(self._path("r%d" % level, node, month, "rows.bin"), "B")
+            if view is None:
+                continue
+            times = _RowTimes(view)
+            a, b = bisect.bisect_left(times, t0), bisect.bisect_left(times, t1)
+            for k in range(a, b):
+                yield _Bucket.unpack(view, k * ROW.size)
+
+    def _rolled_until(self, node, level):
+        # Fim do último balde gravado do nível: depois dele, só dados brutos
+        months = self._rows_months(node, level)
+        for month in reversed(months):
+            view = _map(self._path("r%d" % level, node, month, "rows.bin"), "B")
+            if view is not None:
+                return struct.unpack_from("<q", view, len(view) - ROW.size)[0] + level * 1000
+        return None
+
+    def aggregate(self, node, metric, t0, t1, step, rollups=True):
+        """
+        [(início, contagem, mínimo, máximo, média)] de baldes de `step`
+        segundos (alinhados à época) em [t0, t1), só os que têm valores.
+        rollups=False lê só os dados brutos (para comparar).
+        """
+        i = METRICS.index(metric)
+        step_ms = step * 1000
+        acc = {}
+
+        def add(start, n, lo, hi, total):
+            bucket = acc.get(start)
+            if bucket is None:
+                acc[start] = [n, lo, hi, total]
+            else:
+                bucket[0] += n
+                bucket[1] = min(bucket[1], lo)
+                bucket[2] = max(bucket[2], hi)
+                bucket[3] += total
+
+        def add_raw(a, b):
+            for t, values in self.series(node, metric, a, b):
+                for ti, v in zip(t, values):
+                    if v == v:
+                        add(ti - ti % step_ms, 1, v, v, v)
+
+        levels = [level for level in LEVELS if rollups and step % level == 0]
+        rolled = self._rolled_until(node, levels[-1]) if levels else None
+        if rolled is None:
+            add_raw(t0, t1)
+        else:
+            level_ms = levels[-1] * 1000
+            a = -(-t0 // level_ms) * level_ms
+            b = max(a, min(t1 - t1 % level_ms, rolled))
+            add_raw(t0, min(a, t1))
+            for bucket in self.rows(node, levels[-1], a, b):
+                if bucket.n[i]:
+                    add(bucket.start - bucket.start % step_ms, bucket.n[i], bucket.min[i], bucket.max[i],
+                        bucket.sum[i])
+            add_raw(b, t1)
+        return [(start, n, lo, hi, total / n) for start, (n, lo, hi, total) in sorted(acc.items())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("store", help="diretório do armazenamento")
+    parser.add_argument("--list", action="store_true", help="lista os nós e os meses")
+    parser.add_argument("--node")
+    parser.add_argument("--metric", choices=METRICS, default="rssi")
+    parser.add_argument("--from", dest="start", default="1970-01-01")
+    parser.add_argument("--to", dest="end", default=None, help="padrão: agora")
+    parser.add_argument("--step", type=int, default=0, help="segundos por balde (0: pontos brutos)")
+    args = parser.parse_args(argv)
+
+    store = Store(args.store)
+    if args.list or not args.node:
+        for node in store.nodes():
+            print(node, " ".join(store.months(node)))
+        return 0
+    t0 = parse_time(args.start)
+    t1 = parse_time(args.end) if args.end else int(time.time() * 1000) + 1
+    start = time.perf_counter()
+    if args.step:
+        rows = store.aggregate(args.node, args.metric, t0, t1, args.step)
+        for t, n, lo, hi, mean in rows:
+            print(f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t // 1000))} {n:>7} {lo:>9.2f} "
+                  f"{hi:>9.2f} {mean:>9.2f}")
+    else:
+        rows = store.points(args.node, args.metric, t0, t1)
+        for t, v in rows:
+            print(f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t // 1000))}.{t % 1000:03d} {v:.2f}")
+    print(f"{len(rows)} linhas em {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
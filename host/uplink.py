@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""
+Uplink MQTT no PC: saída binária do receptor -> broker MQTT.
+
+Lê o fluxo do receptor em SERIAL_BINARY (como host/ingest.py) e publica as
+leituras em "<tópico>/<gateway>/readings", em lotes: uma mensagem JSON a cada
+--batch-ms ou --batch-max leituras, com o nó, o seq da serial, o header_id, o
+instante em ms, RSSI, SNR e os sensores de cada pacote. Um lote do backlog
+do transmissor (FLAGS_BATCH) vira uma leitura por registro, com
+"backlog": true e o instante da medição. Uma só conexão MQTT
+3.1.1, persistente (clean session 0), com QoS 1: cada lote fica pendente até
+o PUBACK, com até --window lotes em voo, e os pendentes são reenviados (DUP)
+ao reconectar. Entrega pelo menos uma vez; o seq e o instante identificam
+duplicatas.
+
+Enquanto o broker está fora, os lotes esperam numa fila em memória de até
+--memory mensagens; o que passa disso vai para arquivos em --spool, na
+ordem, e volta quando a conexão retorna. Ao sair, os lotes ainda não
+confirmados também vão para o --spool e são enviados na próxima execução.
+Com --store, os pontos também são gravados em host/tsstore.py.
+
+    python host/uplink.py --port /dev/ttyACM0 --broker localhost --spool fila
+    python host/uplink.py --port COM5 --broker 192.168.0.10:1883 --topic fazenda --gateway 2
+    python host/uplink.py --file captura.bin --broker localhost --store dados
+"""
+import argparse
+import collections
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+import ingest
+import serial_reader
+
+# Tipos de pacote do MQTT 3.1.1 (OASIS)
+CONNECT, CONNACK, PUBLISH, PUBACK, PINGREQ, PINGRESP, DISCONNECT = 1, 2, 3, 4, 12, 13, 14
+PUBLISH_DUP = 0x08
+PUBLISH_QOS1 = 0x02
+SEGMENT = struct.Struct("<HI")  # tamanho do tópico e da mensagem, no --spool
+
+
+def mqtt_string(text):
+    data = text.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def mqtt_packet(kind, flags, body=b""):
+    """Pacote MQTT: cabeçalho fixo (tipo, flags, tamanho restante em base 128) e corpo."""
+    header = bytearray([kind << 4 | flags])
+    n = len(body)
+    while True:
+        header.append((n & 0x7f) | (0x80 if n > 0x7f else 0))
+        n >>= 7
+        if not n:
+            break
+    return bytes(header) + body
+
+
+def publish_packet(topic, payload, packet_id, dup=False):
+    return mqtt_packet(PUBLISH, PUBLISH_QOS1 | (PUBLISH_DUP if dup else 0),
+                       mqtt_string(topic) + struct.pack("!H", packet_id) + payload)
+
+
+class PacketReader:
+    """Separa os pacotes MQTT de um fluxo TCP: feed(bytes) -> [(tipo, flags, corpo)]."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data):
+        self._buf += data
+        out = []
+        while len(self._buf) >= 2:
+            n = shift = 0
+            i = 1
+            while True:
+                if i >= len(self._buf):
+                    return out
+                b = self._buf[i]
+                n |= (b & 0x7f) << shift
+                shift += 7
+                i += 1
+                if not b & 0x80:
+                    break
+                if shift > 21:
+                    raise ValueError("tamanho de pacote MQTT inválido")
+            if len(self._buf) < i + n:
+                break
+            out.append((self._buf[0] >> 4, self._buf[0] & 0x0f, bytes(self._buf[i:i + n])))
+            del self._buf[:i + n]
+        return out
+
+
+class MqttClient:
+    """Uma conexão MQTT 3.1.1 persistente com publicações QoS 1 e janela de pendentes."""
+
+    def __init__(self, host, port=1883, client_id="lora-gateway", keepalive=30, window=16, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.window = window
+        self.timeout = timeout
+        self.sock = None
+        self.session_present = False
+        self.inflight = collections.OrderedDict()  # packet id -> (tópico, mensagem, item da fila)
+        self.connects = 0
+        self.resent = 0
+        self._next_id = 1
+        self._out = bytearray()
+        self._reader = None
+        self._last_sent = self._last_recv = 0.0
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def connect(self):
+        """Conecta e reenvia os pendentes; OSError se o broker não responde."""
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            body = mqtt_string("MQTT") + bytes([4, 0x00]) + struct.pack("!H", self.keepalive) + \
+                mqtt_string(self.client_id)  # flags 0x00: clean session 0, sem usuário
+            sock.sendall(mqtt_packet(CONNECT, 0, body))
+            reader = PacketReader()
+            packets = []
+            while not packets:
+                data = sock.recv(4096)
+                if not data:
+                    raise ConnectionError("broker fechou a conexão no CONNECT")
+                packets = reader.feed(data)
+            kind, _, body = packets[0]
+            if kind != CONNACK or len(body) < 2 or body[1]:
+                raise ConnectionError(f"CONNECT recusado ({body[1:2].hex() or kind})")
+        except (OSError, ValueError):
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self.sock = sock
+        self._reader = reader
+        self.session_present = bool(body[0] & 1)
+        self.connects += 1
+        self._out = bytearray()
+        for packet_id, (topic, payload, _) in self.inflight.items():
+            self._out += publish_packet(topic, payload, packet_id, dup=True)
+            self.resent += 1
+        self._last_sent = self._last_recv = time.monotonic()
+        self._handle(packets[1:])
+
+    def close(self, disconnect=False):
+        if self.sock is None:
+            return
+        if disconnect:
+            try:
+                self.sock.setblocking(True)
+                self.sock.sendall(bytes(self._out) + mqtt_packet(DISCONNECT, 0))
+            except OSError:
+                pass
+        self.sock.close()
+        self.sock = None
+        self._out = bytearray()
+
+    def can_publish(self):
+        return self.sock is not None and len(self.inflight) < self.window
+
+    def publish(self, topic, payload, item=None):
+        packet_id = self._next_id
+        while packet_id in self.inflight:
+            packet_id = packet_id % 0xffff + 1
+        self._next_id = packet_id % 0xffff + 1
+        self.inflight[packet_id] = (topic, payload, item)
+        self._out += publish_packet(topic, payload, packet_id)
+
+    def poll(self, timeout=0.0):
+        """Envia o que couber e lê as respostas; devolve os itens confirmados (PUBACK)."""
+        if self.sock is None:
+            return []
+        acked = []
+        try:
+            writers = [self.sock] if self._out else []
+            readable, writable, _ = select.select([self.sock], writers, [], timeout)
+            now = time.monotonic()
+            if writable:
+                n = self.sock.send(self._out)
+                del self._out[:n]
+                self._last_sent = now
+            if readable:
+                data = self.sock.recv(65536)
+                if not data:
+                    raise ConnectionError("broker fechou a conexão")
+                self._last_recv = now
+                acked = self._handle(self._reader.feed(data))
+            if now - self._last_sent >= self.keepalive / 2 and not self._out:
+                self._out += mqtt_packet(PINGREQ, 0)
+            if now - self._last_recv > self.keepalive * 1.5:
+                raise ConnectionError("broker não responde")
+        except (OSError, ValueError):
+            self.close()
+        return acked
+
+    def _handle(self, packets):
+        acked = []
+        for kind, _, body in packets:
+            if kind == PUBACK and len(body) >= 2:
+                entry = self.inflight.pop(struct.unpack_from("!H", body)[0], None)
+                if entry is not None:
+                    acked.append(entry[2])
+        return acked
+
+
+class Spool:
+    """
+    Fila FIFO de mensagens (tópico, bytes): até `memory` em memória, o resto
+    em arquivos de até segment_bytes em `directory`, apagados quando todas as
+    suas mensagens são confirmadas.
+    """
+
+    def __init__(self, directory=None, memory=1000, segment_bytes=1 << 20):
+        self.directory = directory
+        self.memory = memory
+        self.segment_bytes = segment_bytes
+        self.spilled = 0
+        self._mem = collections.deque()  # (segmento ou None, tópico, mensagem)
+        self._disk = {}     # segmento ainda não carregado -> mensagens, em ordem
+        self._loaded = {}   # segmento carregado -> mensagens não confirmadas
+        self._writing = None  # arquivo do último segmento, aberto para acrescentar
+        self._next = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            # Segmentos de uma execução anterior vão antes de tudo
+            for segment in sorted(int(name[:-2]) for name in os.listdir(directory) if name.endswith(".q")):
+                self._disk[segment] = len(self._read(segment))
+                self._next = segment + 1
+
+    def __len__(self):
+        return len(self._mem) + sum(self._disk.values())
+
+    def _path(self, segment):
+        return os.path.join(self.directory, "%08d.q" % segment)
+
+    def _read(self, segment):
+        with open(self._path(segment), "rb") as f:
+            data = f.read()
+        out = []
+        i = 0
+        while i + SEGMENT.size <= len(data):
+            topic_len, size = SEGMENT.unpack_from(data, i)
+            end = i + SEGMENT.size + topic_len + size
+            if end > len(data):
+                break  # escrita cortada no fim do segmento
+            out.append((data[i + SEGMENT.size:end - size].decode(), data[end - size:end]))
+            i = end
+        return out
+
+    def push(self, topic, payload):
+        if not self.directory or (not self._disk and len(self._mem) < self.memory):
+            self._mem.append((None, topic, payload))
+            return
+        if self._writing is None or self._writing.tell() >= self.segment_bytes:
+            if self._writing is not None:
+                self._writing.close()
+            self._writing = open(self._path(self._next), "ab")
+            self._disk[self._next] = 0
+            self._next += 1
+        data = topic.encode()
+        self._writing.write(SEGMENT.pack(len(data), len(payload)) + data + payload)
+        self._writing.flush()
+        self._disk[self._next - 1] += 1
+        self.spilled += 1
+
+    def pop(self):
+        """Próxima mensagem (item para ack), ou None se a fila está vazia."""
+        if not self._mem and self._disk:
+            segment = next(iter(self._disk))
+            del self._disk[segment]
+            if segment == self._next - 1 and self._writing is not None:
+                self._writing.close()
+                self._writing = None
+            messages = self._read(segment)
+            if messages:
+                self._loaded[segment] = len(messages)
+                self._mem.extend((segment, topic, payload) for topic, payload in messages)
+            else:
+                os.remove(self._path(segment))
+        return self._mem.popleft() if self._mem else None
+
+    def ack(self, item):
+        segment = item[0]
+        if segment is not None:
+            self._loaded[segment] -= 1
+            if not self._loaded[segment]:
+                del self._loaded[segment]
+                os.remove(self._path(segment))
+
+    def close(self, unsent=()):
+        """Grava no disco as mensagens em memória e as `unsent` (não confirmadas) que não vieram dele."""
+        if self.directory:
+            pending = [item for item in unsent if item[0] is None] + [item for item in self._mem if item[0] is None]
+            self._mem.clear()
+            self.memory = 0
+            for _, topic, payload in pending:
+                self.push(topic, payload)
+        if self._writing is not None:
+            self._writing.close()
+            self._writing = None
+
+
+class Uplink:
+    """Junta as leituras em lotes por gateway e os publica pelo MqttClient."""
+
+    def __init__(self, client, topic="lora", compact=False, batch_ms=1000, batch_max=200, spool=None,
+                 retry_s=1.0, max_retry_s=30.0):
+        self.client = client
+        self.topic = topic
+        self.compact = compact
+        self.batch_ms = batch_ms
+        self.batch_max = batch_max
+        self.queue = spool if spool is not None else Spool()
+        self.retry_s = retry_s
+        self.max_retry_s = max_retry_s
+        self.readings = 0
+        self.messages = 0
+        self.acked = 0
+        self._batches = {}  # gateway -> (início, [leituras])
+        self._delay = retry_s
+        self._next_try = 0.0
+
+    def add(self, gateway, records, wall_ms):
+        """Mesma interface de Ingest.add: registros de um bloco lido às wall_ms."""
+        if not records:
+            return
+        now = time.monotonic()
+        batch = self._batches.get(gateway)
+        if batch is None:
+            batch = self._batches[gateway] = (now, [])
+        ref = records[-1].ticks_ms
+        for r in records:
+            t = wall_ms - ((ref - r.ticks_ms) & ingest.TICKS_MASK)
+            if r.flags & ingest.FLAGS_BATCH:
+                # Lote do backlog do transmissor: uma leitura por registro, datada pela idade
+                readings = []
+                for age, sensors in ingest.parse_batch(r.payload):
+                    reading = {"node": r.src, "seq": r.seq, "id": r.id, "t": t - (age or 0),
+                               "rssi": r.rssi, "snr": r.snr, "backlog": True}
+                    reading.update(zip(("temp", "hum", "db"), sensors))
+                    readings.append(reading)
+            else:
+                reading = {"node": r.src, "seq": r.seq, "id": r.id, "t": t, "rssi": r.rssi, "snr": r.snr}
+                if not r.flags & ingest.FLAGS_FRAG:
+                    for name, v in zip(("temp", "hum", "db"), ingest.parse_sensors(r.payload, self.compact)):
+                        if v == v:
+                            reading[name] = v
+                readings = [reading]
+            for reading in readings:
+                batch[1].append(reading)
+                if len(batch[1]) >= self.batch_max:
+                    self._seal(gateway)
+                    batch = self._batches[gateway] = (now, [])
+            self.readings += len(readings)
+
+    def _seal(self, gateway):
+        _, readings = self._batches.pop(gateway)
+        if readings:
+            payload = json.dumps({"gateway": gateway, "readings": readings}, separators=(",", ":")).encode()
+            self.queue.push("%s/%d/readings" % (self.topic, gateway), payload)
+            self.messages += 1
+
+    def poll(self, timeout=0.0):
+        now = time.monotonic()
+        for gateway, (start, _) in list(self._batches.items()):
+            if (now - start) * 1000 >= self.batch_ms:
+                self._seal(gateway)
+        client = self.client
+        if not client.connected and now >= self._next_try:
+            try:
+                client.connect()
+                self._delay = self.retry_s
+            except (OSError, ValueError):
+                self._next_try = now + self._delay
+                self._delay = min(self._delay * 2, self.max_retry_s)
+        while client.can_publish():
+            item = self.queue.pop()
+            if item is None:
+                break
+            client.publish(item[1], item[2], item)
+        for item in client.poll(timeout):
+            self.queue.ack(item)
+            self.acked += 1
+
+    def pending(self):
+        return len(self.queue) + len(self.client.inflight) + sum(bool(b[1]) for b in self._batches.values())
+
+    def flush(self, timeout=10.0):
+        """Fecha os lotes e espera a confirmação de tudo por até timeout s; True se confirmou."""
+        for gateway in list(self._batches):
+            self._seal(gateway)
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            self.poll(0.01)
+        return not self.pending()
+
+    def close(self):
+        """Desconecta; os lotes não confirmados vão para o --spool (se houver)."""
+        for gateway in list(self._batches):
+            self._seal(gateway)
+        unsent = [entry[2] for entry in self.client.inflight.values()]
+        self.client.inflight.clear()
+        self.client.close(disconnect=True)
+        self.queue.close(unsent)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--port", help="porta serial do receptor")
+    source.add_argument("--file", help="fluxo bruto capturado (- para a entrada padrão)")
+    parser.add_argument("--baud", type=int, default=115200, help="ignorado pela CDC USB")
+    parser.add_argument("--broker", required=True, help="HOST[:PORTA] do broker MQTT")
+    parser.add_argument("--client-id", default="lora-gateway")
+    parser.add_argument("--topic", default="lora", help="prefixo dos tópicos")
+    parser.add_argument("--gateway", type=int, default=0, help="número deste receptor nos tópicos")
+    parser.add_argument("--compact", action="store_true", help="leituras no quadro binário do perfil compacto")
+    parser.add_argument("--batch-ms", type=int, default=1000)
+    parser.add_argument("--batch-max", type=int, default=200, help="leituras por mensagem")
+    parser.add_argument("--window", type=int, default=16, help="mensagens sem PUBACK")
+    parser.add_argument("--memory", type=int, default=1000, help="mensagens na fila em memória")
+    parser.add_argument("--spool", default=None, help="diretório da fila em disco")
+    parser.add_argument("--store", default=None, help="também grava os pontos neste armazenamento")
+    parser.add_argument("--stats-s", type=float, default=60.0, help="resumo no stderr a cada N s (0: nunca)")
+    args = parser.parse_args(argv)
+
+    host, _, port = args.broker.partition(":")
+    client = MqttClient(host, int(port or 1883), args.client_id, window=args.window)
+    uplink = Uplink(client, args.topic, args.compact, args.batch_ms, args.batch_max,
+                    Spool(args.spool, args.memory))
+    store = None
+    if args.store:
+        import tsstore
+        store = ingest.Ingest(tsstore.Store(args.store), args.compact)
+    reader = serial_reader.Reader()
+    read, close = serial_reader.open_input(args)
+    last_stats = time.monotonic()
+    try:
+        while True:
+            data = read(65536)
+            if not data and not args.port:
+                for _, line in reader.flush():
+                    print(line, file=sys.stderr)
+                break
+            if data:
+                wall_ms = time.time_ns() // 1000000
+                records = []
+                for kind, item in reader.feed(data):
+                    if kind == "record":
+                        records.append(item)
+                    else:
+                        print(item, file=sys.stderr)
+                uplink.add(args.gateway, records, wall_ms)
+                if store:
+                    store.add(args.gateway, records, wall_ms)
+            uplink.poll()
+            if store:
+                store.poll()
+            if args.stats_s and time.monotonic() - last_stats >= args.stats_s:
+                last_stats = time.monotonic()
+                print(f"{uplink.readings} leituras, {uplink.acked}/{uplink.messages} mensagens confirmadas, "
+                      f"{uplink.pending()} na fila, {uplink.queue.spilled} para o disco, "
+                      f"{'conectado' if client.connected else 'desconectado'}", file=sys.stderr)
+        uplink.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        uplink.close()
+        close()
+        if store:
+            store.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
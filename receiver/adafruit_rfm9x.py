@@ -100,6 +100,20 @@ _RH_RF95_DETECTION_THRESHOLD = const(0x37)
 _RH_RF95_PA_DAC_DISABLE = const(0x04)
 _RH_RF95_PA_DAC_ENABLE = const(0x07)
 
+# Configuration registers, which only change when written.  RFM9x keeps a
+# write-through cache of them: reads after the first one and writes of the
+# value already there cost no SPI transaction.  OP_MODE is included; the one
+# change the chip makes by itself (TX -> standby after TxDone) is applied to
+# the cache by send().
+_CACHED = bytearray(0x80)
+for _reg in (
+    0x01, 0x06, 0x07, 0x08, 0x09, 0x0B, 0x0C, 0x0E, 0x0F,
+    0x1D, 0x1E, 0x1F, 0x20, 0x21, 0x22, 0x23, 0x24, 0x26,
+    0x2F, 0x30, 0x31, 0x36, 0x37, 0x3A, 0x40, 0x41, 0x4D,
+):
+    _CACHED[_reg] = 1
+del _reg
+
 # The crystal oscillator frequency of the module
 _RH_RF95_FXOSC = 32000000.0
 
@@ -163,6 +177,13 @@ class RFM9x:
     choose to lower to 1mhz if using long wires or a breadboard.
     - agc: Boolean to Enable/Disable Automatic Gain Control - Default=False (AGC off)
     - crc: Boolean to Enable/Disable Cyclic Redundancy Check - Default=True (CRC Enabled)
+    - dio0: The pin connected to the radio's DIO0 (G0) output.  With a MicroPython
+    machine.Pin the TxDone/RxDone interrupt completes send() and fills a queue of
+    received packets, so packets arriving while the application is busy are kept
+    instead of being overwritten in the FIFO.  With a DigitalInOut (CircuitPython has
+    no pin interrupts) the pin level is polled instead of the IRQ flags register.
+    Default None polls the IRQ flags over SPI.
+    - rx_queue_size: Packets held by the interrupt-driven receive queue (default 4).
     Remember this library makes a best effort at receiving packets with pure
     Python code.  Trying to receive packets too quickly will result in lost data
     so limit yourself to simple scenarios of sending and receiving single
@@ -267,8 +288,16 @@ class RFM9x:
         high_power: bool = True,
         baudrate: int = 5000000,
         agc: bool = False,
-        crc: bool = True
+        crc: bool = True,
+        dio0: Optional[DigitalInOut] = None,
+        rx_queue_size: int = 4
     ) -> None:
+        # SPI transactions in progress (see _release) and whether a DIO0
+        # interrupt arrived during one of them.
+        self._spi_lock = 0
+        self._irq_pending = False
+        # Cached configuration registers, address -> value (see _CACHED).
+        self._cache = {}
         self.high_power = high_power
         # Device support SPI mode 0 (polarity & phase = 0) up to a max of 10mhz.
         # Set Default Baudrate to 5MHz to avoid problems
@@ -292,11 +321,14 @@ class RFM9x:
         self.sleep()
         time.sleep(0.01)
         self.long_range_mode = True
+        # Read the mode back from the chip, not from the cache.
+        del self._cache[_RH_RF95_REG_01_OP_MODE]
         if self.operation_mode != SLEEP_MODE or not self.long_range_mode:
             raise RuntimeError("Failed to configure radio for LoRa mode, check wiring!")
         # clear default setting for access to LF registers if frequency > 525MHz
         if frequency > 525:
             self.low_frequency_mode = 0
+        self._rssi_offset = 157 if self.low_frequency_mode else 164
         # Setup entire 256 byte FIFO
         self._write_u8(_RH_RF95_REG_0E_FIFO_TX_BASE_ADDR, 0x00)
         self._write_u8(_RH_RF95_REG_0F_FIFO_RX_BASE_ADDR, 0x00)
@@ -304,18 +336,17 @@ class RFM9x:
         self.idle()
         # Set frequency
         self.frequency_mhz = frequency
-        # Set preamble length (default 8 bytes to match radiohead).
-        self.preamble_length = preamble_length
-        # Defaults set modem config to RadioHead compatible Bw125Cr45Sf128 mode.
-        self.signal_bandwidth = 125000
-        self.coding_rate = 5
-        self.spreading_factor = 7
-        # Default to enable CRC checking on incoming packets.
-        self.enable_crc = crc
-        """CRC Enable state"""
-        # set AGC - Default = False
-        self.auto_agc = agc
-        """Automatic Gain Control state"""
+        # Defaults set modem config to RadioHead compatible Bw125Cr45Sf128 mode
+        # with the preamble length (default 8 bytes to match radiohead), CRC
+        # checking on incoming packets and AGC (default off), in one burst.
+        self.configure(
+            signal_bandwidth=125000,
+            coding_rate=5,
+            spreading_factor=7,
+            enable_crc=crc,
+            auto_agc=agc,
+            preamble_length=preamble_length,
+        )
         # Set transmit power to 13 dBm, a safe value any module supports.
         self.tx_power = 13
         # initialize last RSSI reading
@@ -375,6 +406,22 @@ class RFM9x:
            Fourth byte of the RadioHead header.
         """
         self.crc_error_count = 0
+        # DIO0 completion: interrupt (machine.Pin) or pin level (DigitalInOut).
+        self._dio0 = dio0
+        self._irq = dio0 is not None and hasattr(dio0, "irq")
+        self._listening = False
+        self._tx_complete = False
+        # Receive queue filled by the interrupt: one FIFO-sized buffer per slot
+        # plus [length, raw RSSI, raw SNR].
+        size = rx_queue_size if self._irq else 0
+        self._rx_slots = [bytearray(256) for _ in range(size)]
+        self._rx_info = [[0, 0, 0] for _ in range(size)]
+        self._rx_first = 0
+        self._rx_count = 0
+        self.rx_overflow_count = 0
+        """Packets dropped because the interrupt-driven receive queue was full."""
+        if self._irq:
+            dio0.irq(handler=self._handle_dio0, trigger=dio0.IRQ_RISING)
 
     # pylint: disable=no-member
     # Reconsider pylint: disable when this can be tested
@@ -386,16 +433,32 @@ class RFM9x:
         # will be filled.
         if length is None:
             length = len(buf)
-        with self._device as device:
-            self._BUFFER[0] = address & 0x7F  # Strip out top bit to set 0
-            # value (read).
-            device.write(self._BUFFER, end=1)
-            device.readinto(buf, end=length)
+        self._spi_lock += 1
+        try:
+            with self._device as device:
+                self._BUFFER[0] = address & 0x7F  # Strip out top bit to set 0
+                # value (read).
+                device.write(self._BUFFER, end=1)
+                device.readinto(buf, end=length)
+        finally:
+            self._release()
 
     def _read_u8(self, address: int) -> int:
         # Read a single byte from the provided address and return it.
-        self._read_into(address, self._BUFFER, length=1)
-        return self._BUFFER[0]
+        # Configuration registers come from the cache after the first read.
+        value = self._cache.get(address)
+        if value is not None:
+            return value
+        # Hold the lock until the shared buffer has been read.
+        self._spi_lock += 1
+        try:
+            self._read_into(address, self._BUFFER, length=1)
+            value = self._BUFFER[0]
+        finally:
+            self._release()
+        if _CACHED[address]:
+            self._cache[address] = value
+        return value
 
     def _write_from(
         self, address: int, buf: ReadableBuffer, length: Optional[int] = None
@@ -405,24 +468,171 @@ class RFM9x:
         # buffer is written.
         if length is None:
             length = len(buf)
-        with self._device as device:
-            self._BUFFER[0] = (address | 0x80) & 0xFF  # Set top bit to 1 to
-            # indicate a write.
-            device.write(self._BUFFER, end=1)
-            device.write(buf, end=length)
+        self._spi_lock += 1
+        try:
+            with self._device as device:
+                self._BUFFER[0] = (address | 0x80) & 0xFF  # Set top bit to 1 to
+                # indicate a write.
+                device.write(self._BUFFER, end=1)
+                device.write(buf, end=length)
+        finally:
+            self._release()
+        if address != _RH_RF95_REG_00_FIFO:  # burst over consecutive registers
+            for i in range(length):
+                if _CACHED[address + i]:
+                    self._cache[address + i] = buf[i]
 
     def _write_u8(self, address: int, val: int) -> None:
         # Write a byte register to the chip.  Specify the 7-bit address and the
-        # 8-bit value to write to that address.
-        with self._device as device:
-            self._BUFFER[0] = (
-                address | 0x80
-            ) & 0xFF  # Set top bit to 1 to indicate a write.
-            self._BUFFER[1] = val & 0xFF
-            device.write(self._BUFFER, end=2)
+        # 8-bit value to write to that address.  Skipped when the cache says
+        # the register already holds it.
+        val &= 0xFF
+        cached = _CACHED[address]
+        if cached and self._cache.get(address) == val:
+            return
+        self._spi_lock += 1
+        try:
+            with self._device as device:
+                self._BUFFER[0] = (
+                    address | 0x80
+                ) & 0xFF  # Set top bit to 1 to indicate a write.
+                self._BUFFER[1] = val
+                device.write(self._BUFFER, end=2)
+        finally:
+            self._release()
+        if cached:
+            self._cache[address] = val
+
+    def _read_block(self, address: int, length: int) -> bytearray:
+        # Values of consecutive registers, from the cache when it holds all
+        # the cacheable ones, else with one burst read.  Registers that are
+        # not cached (read-only ones inside the range) are only valid after
+        # a burst read.
+        block = bytearray(length)
+        for i in range(length):
+            if _CACHED[address + i]:
+                value = self._cache.get(address + i)
+                if value is None:
+                    self._read_into(address, block)
+                    for j in range(length):
+                        if _CACHED[address + j]:
+                            self._cache[address + j] = block[j]
+                    return block
+                block[i] = value
+        return block
+
+    def _write_block(self, address: int, block: ReadableBuffer) -> None:
+        # Burst-write consecutive registers, unless the cache says they
+        # already hold these values.
+        for i, value in enumerate(block):
+            if _CACHED[address + i] and self._cache.get(address + i) != value:
+                self._write_from(address, block)
+                return
+
+    def _release(self) -> None:
+        # End of an SPI transaction (or of a sequence that must not be split,
+        # like filling the FIFO).  A DIO0 interrupt is a soft IRQ that can run
+        # between any two bytecodes, so one that arrived meanwhile was only
+        # flagged by _handle_dio0 and is serviced here, with the bus free.
+        self._spi_lock -= 1
+        if self._irq_pending and not self._spi_lock:
+            self._service_dio0()
+
+    def _handle_dio0(self, _pin) -> None:
+        # DIO0 rising edge: TxDone while transmitting, RxDone while listening.
+        if self._spi_lock:
+            self._irq_pending = True
+        else:
+            self._service_dio0()
+
+    def _service_dio0(self) -> None:
+        # Read the IRQ flags once, complete the transmission or queue the
+        # received packet, then clear the flags.
+        self._irq_pending = False
+        flags = self._read_u8(_RH_RF95_REG_12_IRQ_FLAGS)
+        if flags & 0x08:
+            self._tx_complete = True
+        if flags & 0x40:
+            if flags & 0x20:
+                self.crc_error_count += 1
+            else:
+                self._queue_packet()
+        self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
+
+    def _queue_packet(self) -> None:
+        # Copy the packet in the FIFO into the next free slot of the receive
+        # queue.  The slots are preallocated, so nothing is allocated here.
+        if self._rx_count == len(self._rx_slots):
+            self.rx_overflow_count += 1
+            return
+        length = self._read_u8(_RH_RF95_REG_13_RX_NB_BYTES)
+        if length == 0:
+            return
+        slot = (self._rx_first + self._rx_count) % len(self._rx_slots)
+        info = self._rx_info[slot]
+        current_addr = self._read_u8(_RH_RF95_REG_10_FIFO_RX_CURRENT_ADDR)
+        self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR, current_addr)
+        self._read_into(_RH_RF95_REG_00_FIFO, self._rx_slots[slot], length)
+        info[0] = length
+        info[1] = self._read_u8(_RH_RF95_REG_1A_PKT_RSSI_VALUE)
+        info[2] = self._read_u8(_RH_RF95_REG_19_PKT_SNR_VALUE)
+        self._rx_count += 1
+
+    def _pop_packet(self) -> bytearray:
+        # Oldest queued packet, as a new bytearray; sets last_rssi/last_snr
+        # from the values read with it.  The lock keeps the interrupt from
+        # queueing a packet while the indexes are updated.
+        self._spi_lock += 1
+        try:
+            info = self._rx_info[self._rx_first]
+            packet = self._rx_slots[self._rx_first][: info[0]]
+            self.last_rssi = info[1] - self._rssi_offset
+            snr_byte = info[2]
+            if snr_byte > 127:
+                snr_byte = (256 - snr_byte) * -1
+            self.last_snr = snr_byte / 4
+            self._rx_first = (self._rx_first + 1) % len(self._rx_slots)
+            self._rx_count -= 1
+        finally:
+            self._release()
+        return packet
+
+    @property
+    def rx_queued(self) -> int:
+        """Packets waiting in the interrupt-driven receive queue (0 without a
+        dio0 interrupt pin).
+        """
+        return self._rx_count
+
+    def _dio0_high(self) -> bool:
+        # DIO0 level: TxDone or RxDone, depending on the mapping set by
+        # transmit()/listen().
+        return self._dio0.value
+
+    def _tx_completed(self) -> bool:
+        return self._tx_complete
+
+    def _rx_waiting(self) -> bool:
+        return self._rx_count > 0
+
+    def _wait_for(self, done, timeout: float) -> bool:
+        # Spin until done() is true.  Returns False if timeout seconds
+        # elapsed first.
+        if HAS_SUPERVISOR:
+            start = supervisor.ticks_ms()
+            while not done():
+                if ticks_diff(supervisor.ticks_ms(), start) >= timeout * 1000:
+                    return False
+        else:
+            start = time.monotonic()
+            while not done():
+                if time.monotonic() - start >= timeout:
+                    return False
+        return True
 
     def reset(self) -> None:
         """Perform a reset of the chip."""
+        self._cache = {}  # registers go back to their reset values
         # See section 7.2.2 of the datasheet for reset description.
         self._reset.value = False  # Set Reset Low
         time.sleep(0.0001)  # 100 us
@@ -431,10 +641,12 @@ class RFM9x:
 
     def idle(self) -> None:
         """Enter idle standby mode."""
+        self._listening = False
         self.operation_mode = STANDBY_MODE
 
     def sleep(self) -> None:
         """Enter sleep mode."""
+        self._listening = False
         self.operation_mode = SLEEP_MODE
 
     def listen(self) -> None:
@@ -443,12 +655,15 @@ class RFM9x:
         """
         self.operation_mode = RX_MODE
         self.dio0_mapping = 0b00  # Interrupt on rx done.
+        self._listening = True
 
     def transmit(self) -> None:
         """Transmit a packet which is queued in the FIFO.  This is a low level
         function for entering transmit mode and more.  For generating and
         transmitting a packet of data use :py:func:`send` instead.
         """
+        self._listening = False
+        self._tx_complete = False
         self.operation_mode = TX_MODE
         self.dio0_mapping = 0b01  # Interrupt on tx done.
 
@@ -464,9 +679,7 @@ class RFM9x:
 
     @preamble_length.setter
     def preamble_length(self, val: int) -> None:
-        assert 0 <= val <= 65535
-        self._write_u8(_RH_RF95_REG_20_PREAMBLE_MSB, (val >> 8) & 0xFF)
-        self._write_u8(_RH_RF95_REG_21_PREAMBLE_LSB, val & 0xFF)
+        self.configure(preamble_length=val)
 
     @property
     def frequency_mhz(self) -> Literal[433.0, 915.0]:
@@ -490,9 +703,7 @@ class RFM9x:
         msb = frf >> 16
         mid = (frf >> 8) & 0xFF
         lsb = frf & 0xFF
-        self._write_u8(_RH_RF95_REG_06_FRF_MSB, msb)
-        self._write_u8(_RH_RF95_REG_07_FRF_MID, mid)
-        self._write_u8(_RH_RF95_REG_08_FRF_LSB, lsb)
+        self._write_block(_RH_RF95_REG_06_FRF_MSB, bytes((msb, mid, lsb)))
 
     @property
     def tx_power(self) -> int:
@@ -568,15 +779,11 @@ class RFM9x:
     @signal_bandwidth.setter
     def signal_bandwidth(self, val: int) -> None:
         # Set signal bandwidth (set to 125000 to match RadioHead Bw125).
-        for bw_id, cutoff in enumerate(self.bw_bins):
-            if val <= cutoff:
-                break
-        else:
-            bw_id = 9
-        self._write_u8(
-            _RH_RF95_REG_1D_MODEM_CONFIG1,
-            (self._read_u8(_RH_RF95_REG_1D_MODEM_CONFIG1) & 0x0F) | (bw_id << 4),
-        )
+        self.configure(signal_bandwidth=val)
+
+    def _bandwidth_errata(self, val: int) -> None:
+        # Registers that depend on the signal bandwidth.  Through the cache
+        # only the ones that change are written.
         if val >= 500000:
             # see Semtech SX1276 errata note 2.3
             self.auto_ifon = True
@@ -613,12 +820,7 @@ class RFM9x:
     @coding_rate.setter
     def coding_rate(self, val: Literal[5, 6, 7, 8]) -> None:
         # Set coding rate (set to 5 to match RadioHead Cr45).
-        denominator = min(max(val, 5), 8)
-        cr_id = denominator - 4
-        self._write_u8(
-            _RH_RF95_REG_1D_MODEM_CONFIG1,
-            (self._read_u8(_RH_RF95_REG_1D_MODEM_CONFIG1) & 0xF1) | (cr_id << 1),
-        )
+        self.configure(coding_rate=val)
 
     @property
     def spreading_factor(self) -> Literal[6, 7, 8, 9, 10, 11, 12]:
@@ -632,21 +834,7 @@ class RFM9x:
     @spreading_factor.setter
     def spreading_factor(self, val: Literal[6, 7, 8, 9, 10, 11, 12]) -> None:
         # Set spreading factor (set to 7 to match RadioHead Sf128).
-        val = min(max(val, 6), 12)
-
-        if val == 6:
-            self.detection_optimize = 0x5
-        else:
-            self.detection_optimize = 0x3
-
-        self._write_u8(_RH_RF95_DETECTION_THRESHOLD, 0x0C if val == 6 else 0x0A)
-        self._write_u8(
-            _RH_RF95_REG_1E_MODEM_CONFIG2,
-            (
-                (self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2) & 0x0F)
-                | ((val << 4) & 0xF0)
-            ),
-        )
+        self.configure(spreading_factor=val)
 
     @property
     def enable_crc(self) -> bool:
@@ -658,15 +846,65 @@ class RFM9x:
     @enable_crc.setter
     def enable_crc(self, val: bool) -> None:
         # Optionally enable CRC checking on incoming packets.
-        if val:
-            self._write_u8(
-                _RH_RF95_REG_1E_MODEM_CONFIG2,
-                self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2) | 0x04,
-            )
-        else:
+        self.configure(enable_crc=val)
+
+    # pylint: disable=too-many-arguments
+    def configure(
+        self,
+        *,
+        signal_bandwidth: Optional[int] = None,
+        coding_rate: Optional[Literal[5, 6, 7, 8]] = None,
+        spreading_factor: Optional[Literal[6, 7, 8, 9, 10, 11, 12]] = None,
+        enable_crc: Optional[bool] = None,
+        auto_agc: Optional[bool] = None,
+        low_datarate_optimize: Optional[bool] = None,
+        preamble_length: Optional[int] = None
+    ) -> None:
+        """Set several modem parameters at once.  Arguments left as None keep
+        their current value.
+        MODEM_CONFIG1/2/3 and the preamble length are computed in memory and
+        written with a single SPI burst over registers 0x1D-0x26, then the
+        bandwidth errata and spreading factor detection registers that
+        changed.  The individual properties (signal_bandwidth, coding_rate,
+        spreading_factor, enable_crc, preamble_length) go through here too.
+        """
+        # 0x1D MODEM_CONFIG1, 0x1E MODEM_CONFIG2, 0x1F SYMB_TIMEOUT_LSB,
+        # 0x20/0x21 PREAMBLE, 0x22 PAYLOAD_LENGTH, 0x23 MAX_PAYLOAD_LENGTH,
+        # 0x24 HOP_PERIOD, 0x25 FIFO_RX_BYTE_ADDR (read only), 0x26 MODEM_CONFIG3
+        regs = self._read_block(_RH_RF95_REG_1D_MODEM_CONFIG1, 10)
+        if signal_bandwidth is not None:
+            for bw_id, cutoff in enumerate(self.bw_bins):
+                if signal_bandwidth <= cutoff:
+                    break
+            else:
+                bw_id = 9
+            regs[0] = (regs[0] & 0x0F) | (bw_id << 4)
+        if coding_rate is not None:
+            cr_id = min(max(coding_rate, 5), 8) - 4
+            regs[0] = (regs[0] & 0xF1) | (cr_id << 1)
+        if spreading_factor is not None:
+            spreading_factor = min(max(spreading_factor, 6), 12)
+            regs[1] = (regs[1] & 0x0F) | ((spreading_factor << 4) & 0xF0)
+        if enable_crc is not None:
+            regs[1] = (regs[1] | 0x04) if enable_crc else (regs[1] & 0xFB)
+        if preamble_length is not None:
+            assert 0 <= preamble_length <= 65535
+            regs[3] = (preamble_length >> 8) & 0xFF
+            regs[4] = preamble_length & 0xFF
+        if auto_agc is not None:
+            regs[9] = (regs[9] | 0x04) if auto_agc else (regs[9] & 0xFB)
+        if low_datarate_optimize is not None:
+            regs[9] = (regs[9] | 0x08) if low_datarate_optimize else (regs[9] & 0xF7)
+        self._write_block(_RH_RF95_REG_1D_MODEM_CONFIG1, regs)
+        if signal_bandwidth is not None:
+            self._bandwidth_errata(signal_bandwidth)
+        if spreading_factor is not None:
+            if spreading_factor == 6:
+                self.detection_optimize = 0x5
+            else:
+                self.detection_optimize = 0x3
             self._write_u8(
-                _RH_RF95_REG_1E_MODEM_CONFIG2,
-                self._read_u8(_RH_RF95_REG_1E_MODEM_CONFIG2) & 0xFB,
+                _RH_RF95_DETECTION_THRESHOLD, 0x0C if spreading_factor == 6 else 0x0A
             )
 
     def tx_done(self) -> bool:
@@ -713,8 +951,6 @@ class RFM9x:
         assert 0 < len(data) <= 252
         # pylint: enable=len-as-condition
         self.idle()  # Stop receiving to clear FIFO and keep it clear.
-        # Fill the FIFO with a packet to send.
-        self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR, 0x00)  # FIFO starts at 0.
         # Combine header and data to form payload
         payload = bytearray(4)
         if destination is None:  # use attribute
@@ -734,25 +970,32 @@ class RFM9x:
         else:  # use kwarg
             payload[3] = flags
         payload = payload + data
-        # Write payload.
-        self._write_from(_RH_RF95_REG_00_FIFO, payload)
-        # Write payload and header length.
-        self._write_u8(_RH_RF95_REG_22_PAYLOAD_LENGTH, len(payload))
+        # Fill the FIFO with a packet to send.  A late RxDone interrupt must not
+        # move the FIFO pointer in the middle of it.
+        self._spi_lock += 1
+        try:
+            self._write_u8(_RH_RF95_REG_0D_FIFO_ADDR_PTR, 0x00)  # FIFO starts at 0.
+            # Write payload.
+            self._write_from(_RH_RF95_REG_00_FIFO, payload)
+            # Write payload and header length.
+            self._write_u8(_RH_RF95_REG_22_PAYLOAD_LENGTH, len(payload))
+        finally:
+            self._release()
         # Turn on transmit mode to send out the packet.
         self.transmit()
-        # Wait for tx done interrupt with explicit polling (not ideal but
-        # best that can be done right now without interrupts).
-        timed_out = False
-        if HAS_SUPERVISOR:
-            start = supervisor.ticks_ms()
-            while not timed_out and not self.tx_done():
-                if ticks_diff(supervisor.ticks_ms(), start) >= self.xmit_timeout * 1000:
-                    timed_out = True
+        # Wait for tx done: flag set by the DIO0 interrupt, DIO0 level, or
+        # polling the IRQ flags over SPI when there is no DIO0 pin.
+        if self._irq:
+            done = self._tx_completed
+        elif self._dio0 is not None:
+            done = self._dio0_high
         else:
-            start = time.monotonic()
-            while not timed_out and not self.tx_done():
-                if time.monotonic() - start >= self.xmit_timeout:
-                    timed_out = True
+            done = self.tx_done
+        timed_out = not self._wait_for(done, self.xmit_timeout)
+        # After TxDone the chip is back in standby by itself.
+        mode = self._cache.pop(_RH_RF95_REG_01_OP_MODE, None)
+        if mode is not None and not timed_out:
+            self._cache[_RH_RF95_REG_01_OP_MODE] = (mode & 0xF8) | STANDBY_MODE
         # Listen again if necessary and return the result packet.
         if keep_listening:
             self.listen()
@@ -825,24 +1068,17 @@ class RFM9x:
         timed_out = False
         if timeout is None:
             timeout = self.receive_timeout
+        if self._irq:
+            return self._receive_queued(keep_listening, with_header, with_ack, timeout)
         if timeout is not None:
             # Wait for the payload_ready signal.  This is not ideal and will
             # surely miss or overflow the FIFO when packets aren't read fast
             # enough, however it's the best that can be done from Python without
-            # interrupt supports.
+            # interrupt supports (pass a machine.Pin as dio0 for that).
             # Make sure we are listening for packets.
             self.listen()
-            timed_out = False
-            if HAS_SUPERVISOR:
-                start = supervisor.ticks_ms()
-                while not timed_out and not self.rx_done():
-                    if ticks_diff(supervisor.ticks_ms(), start) >= timeout * 1000:
-                        timed_out = True
-            else:
-                start = time.monotonic()
-                while not timed_out and not self.rx_done():
-                    if time.monotonic() - start >= timeout:
-                        timed_out = True
+            done = self.rx_done if self._dio0 is None else self._dio0_high
+            timed_out = not self._wait_for(done, timeout)
         # Payload ready is set, a packet is in the FIFO.
         packet = None
         # save last RSSI reading
@@ -873,40 +1109,7 @@ class RFM9x:
                 if fifo_length < 5:
                     packet = None
                 else:
-                    if (
-                        self.node != _RH_BROADCAST_ADDRESS
-                        and packet[0] != _RH_BROADCAST_ADDRESS
-                        and packet[0] != self.node
-                    ):
-                        packet = None
-                    # send ACK unless this was an ACK or a broadcast
-                    elif (
-                        with_ack
-                        and ((packet[3] & _RH_FLAGS_ACK) == 0)
-                        and (packet[0] != _RH_BROADCAST_ADDRESS)
-                    ):
-                        # delay before sending Ack to give receiver a chance to get ready
-                        if self.ack_delay is not None:
-                            time.sleep(self.ack_delay)
-                        # send ACK packet to sender (data is b'!')
-                        self.send(
-                            b"!",
-                            destination=packet[1],
-                            node=packet[0],
-                            identifier=packet[2],
-                            flags=(packet[3] | _RH_FLAGS_ACK),
-                        )
-                        # reject Retries if we have seen this idetifier from this source before
-                        if (self.seen_ids[packet[1]] == packet[2]) and (
-                            packet[3] & _RH_FLAGS_RETRY
-                        ):
-                            packet = None
-                        else:  # save the packet identifier for this source
-                            self.seen_ids[packet[1]] = packet[2]
-                    if (
-                        not with_header and packet is not None
-                    ):  # skip the header if not wanted
-                        packet = packet[4:]
+                    packet = self._filter_packet(packet, with_header, with_ack)
         # Listen again if necessary and return the result packet.
         if keep_listening:
             self.listen()
@@ -916,3 +1119,68 @@ class RFM9x:
         # Clear interrupt.
         self._write_u8(_RH_RF95_REG_12_IRQ_FLAGS, 0xFF)
         return packet
+
+    def _receive_queued(
+        self,
+        keep_listening: bool,
+        with_header: bool,
+        with_ack: bool,
+        timeout: Optional[float],
+    ) -> Optional[bytearray]:
+        # receive() with a DIO0 interrupt: the radio stays in RX and packets
+        # are read into the queue as they arrive, so waiting costs no SPI
+        # traffic and nothing is lost while the caller is busy elsewhere.
+        if not self._listening:
+            self.listen()
+        packet = None
+        if self._rx_count or (
+            timeout is not None and self._wait_for(self._rx_waiting, timeout)
+        ):
+            packet = self._pop_packet()
+            if len(packet) < 5:
+                packet = None
+            else:
+                packet = self._filter_packet(packet, with_header, with_ack)
+        if not keep_listening:
+            self.idle()
+        elif not self._listening:  # sending an ACK left RX mode
+            self.listen()
+        return packet
+
+    def _filter_packet(
+        self, packet: bytearray, with_header: bool, with_ack: bool
+    ) -> Optional[bytearray]:
+        # RadioHead header handling: address filter, ACK and retry filtering.
+        if (
+            self.node != _RH_BROADCAST_ADDRESS
+            and packet[0] != _RH_BROADCAST_ADDRESS
+            and packet[0] != self.node
+        ):
+            return None
+        # send ACK unless this was an ACK or a broadcast
+        if (
+            with_ack
+            and ((packet[3] & _RH_FLAGS_ACK) == 0)
+            and (packet[0] != _RH_BROADCAST_ADDRESS)
+        ):
+            # delay before sending Ack to give receiver a chance to get ready
+            if self.ack_delay is not None:
+                time.sleep(self.ack_delay)
+            # send ACK packet to sender (data is b'!')
+            self.send(
+                b"!",
+                destination=packet[1],
+                node=packet[0],
+                identifier=packet[2],
+                flags=(packet[3] | _RH_FLAGS_ACK),
+            )
+            # reject Retries if we have seen this idetifier from this source before
+            if (self.seen_ids[packet[1]] == packet[2]) and (
+                packet[3] & _RH_FLAGS_RETRY
+            ):
+                return None
+            # save the packet identifier for this source
+            self.seen_ids[packet[1]] = packet[2]
+        if not with_header:  # skip the header if not wanted
+            packet = packet[4:]
+        return packet
@@ -0,0 +1,209 @@
+import math
+import time
+from ulora import ModemConfig, BANDWIDTHS, FLAGS_ADR
+
+# Adaptive data rate: the fastest modem config and lowest TX power that keep a
+# target link margin.
+#
+# The receiver reports, in each ACK, the SNR and RSSI it measured on the acked
+# frame (see ulora.encode_ack_quality). The transmitter averages a few reports
+# and estimates the margin every preset would have at every power, from the
+# SX1276 demodulation SNR floor per spreading factor and the noise floor of
+# each bandwidth. It then moves one preset at a time towards the fastest one
+# that keeps the margin, at the lowest power that does.
+#
+# TX power changes only affect the transmitter. A modem config change must
+# happen on both ends, so the transmitter asks first with a command frame,
+# flagged FLAGS_ADR in the RadioHead header:
+#   COMMAND + [preset index]
+# and switches once it is acked; the receiver switches after acking it. The
+# flag, not the payload, tells commands from data: a backlog batch or a
+# fragment may start with the COMMAND bytes. The compact header carries no
+# flags, so there the transmitter only adapts its power. If
+# either end stops hearing the other on a non-default preset, it falls back
+# to DEFAULT on its own (after max_fails lost ACKs / timeout_ms of silence),
+# so both ends meet again there. A transmitter that sleeps for longer than
+# the receiver's timeout (FALLBACK_MS) falls back when it wakes up, before
+# sending on a preset nobody listens to any more (Controller.on_silence).
+
+COMMAND = b'\x00A' # payload of a FLAGS_ADR frame, followed by the preset index
+# From fastest to most robust
+PRESETS = (
+    ModemConfig.Bw500Cr45Sf128,
+    ModemConfig.Bw125Cr45Sf128,
+    ModemConfig.Bw125Cr45Sf2048,
+    ModemConfig.Bw125Cr48Sf4096,
+)
+DEFAULT = 1 # Bw125Cr45Sf128, where every node starts
+FALLBACK_MS = 10000 # silence after which the receiver returns to DEFAULT
+SNR_REQUIRED = {6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0} # dB, SX1276 datasheet
+NOISE_FIGURE_DB = 6
+SNR_SATURATION_DB = 5 # the reported SNR stops growing with signal strength around +10 dB
+MIN_POWER = 5
+MAX_POWER = 20
+
+
+def spreading_factor(modem_config):
+    return modem_config[1] >> 4
+
+
+def bandwidth(modem_config):
+    return BANDWIDTHS[modem_config[0] >> 4]
+
+
+def sensitivity_dbm(modem_config):
+    return -174 + 10 * math.log10(bandwidth(modem_config)) + NOISE_FIGURE_DB + \
+        SNR_REQUIRED[spreading_factor(modem_config)]
+
+
+def margin_db(snr, rssi, current, power, preset, new_power):
+    # Margin expected with `preset` at `new_power`, from snr/rssi measured
+    # with `current` at `power`. Strong signals are judged by RSSI alone,
+    # weak ones by the lower of the SNR and RSSI estimates.
+    gain = new_power - power
+    by_rssi = rssi + gain - sensitivity_dbm(preset)
+    if snr >= SNR_SATURATION_DB:
+        return by_rssi
+    by_snr = snr + gain - 10 * math.log10(bandwidth(preset) / bandwidth(current)) - \
+        SNR_REQUIRED[spreading_factor(preset)]
+    return min(by_snr, by_rssi)
+
+
+class Controller(object):
+    def __init__(self, preset=DEFAULT, tx_power=MAX_POWER, target_margin_db=10, window=4, max_fails=3,
+                 adapt_rate=True):
+        """
+        Controller(preset=DEFAULT, tx_power=MAX_POWER, target_margin_db=10, window=4, max_fails=3,
+                   adapt_rate=True)
+        Transmitter side.
+        window: ACK reports averaged per decision
+        max_fails: sends in a row without ACK before falling back to DEFAULT at MAX_POWER
+        adapt_rate: if False only the TX power adapts (e.g. with a gateway for many nodes)
+        """
+        self.preset = preset
+        self.tx_power = tx_power
+        self.target_margin_db = target_margin_db
+        self.window = window
+        self.max_fails = max_fails
+        self.adapt_rate = adapt_rate
+        self._snr = []
+        self._rssi = []
+        self.fails = 0
+        self.changes = 0
+
+    def on_ack(self, snr, rssi):
+        # Returns the (preset, tx_power) to move to, or None to stay
+        self.fails = 0
+        self._snr.append(snr)
+        self._rssi.append(rssi)
+        if len(self._snr) < self.window:
+            return None
+        snr = sum(self._snr) / len(self._snr)
+        rssi = sum(self._rssi) / len(self._rssi)
+        self._snr = []
+        self._rssi = []
+
+        best = self._best(snr, rssi)
+        # one preset step per decision, at the lowest power that keeps the margin there
+        preset = self.preset + (best > self.preset) - (best < self.preset)
+        power = self._lowest_power(snr, rssi, preset)
+        if preset == self.preset and abs(power - self.tx_power) < 2:
+            return None
+        return preset, power
+
+    def on_fail(self):
+        # Returns (DEFAULT, MAX_POWER) after max_fails sends in a row without ACK
+        self.fails += 1
+        self._snr = []
+        self._rssi = []
+        if self.fails >= self.max_fails and (self.preset, self.tx_power) != (DEFAULT, MAX_POWER):
+            return DEFAULT, MAX_POWER
+        return None
+
+    def on_silence(self, silent_ms, timeout_ms=FALLBACK_MS):
+        # Returns (DEFAULT, MAX_POWER) if silent_ms without sending (e.g. a sleep)
+        # outlasts the receiver's timeout_ms: by then it is back on DEFAULT
+        if silent_ms > timeout_ms and (self.preset, self.tx_power) != (DEFAULT, MAX_POWER):
+            return DEFAULT, MAX_POWER
+        return None
+
+    def _lowest_power(self, snr, rssi, preset):
+        current = PRESETS[self.preset]
+        for power in range(MIN_POWER, MAX_POWER + 1):
+            if margin_db(snr, rssi, current, self.tx_power, PRESETS[preset], power) >= self.target_margin_db:
+                return power
+        return MAX_POWER
+
+    def _best(self, snr, rssi):
+        if not self.adapt_rate:
+            return self.preset
+        current = PRESETS[self.preset]
+        for i, preset in enumerate(PRESETS):
+            if margin_db(snr, rssi, current, self.tx_power, preset, MAX_POWER) >= self.target_margin_db:
+                return i
+        return len(PRESETS) - 1
+
+    def apply(self, lora, header_to, change):
+        """
+        Move to change = (preset, tx_power). A preset change is requested from
+        header_to first, except when falling back to DEFAULT.
+        Returns True if the radio now uses the new settings.
+        """
+        preset, power = change
+        if preset != self.preset:
+            if self.fails < self.max_fails and \
+                    not lora.send_to_wait(COMMAND + bytes([preset]), header_to, header_flags=FLAGS_ADR):
+                return False
+            lora.set_modem_config(PRESETS[preset])
+            self.preset = preset
+        lora.set_tx_power(power)
+        self.tx_power = power
+        self.fails = 0
+        self.changes += 1
+        return True
+
+    def restore(self, lora, preset, tx_power, fails=0):
+        # Set the radio to settings both ends already agree on (e.g. kept across
+        # deepsleep, or DEFAULT after on_silence), without asking the receiver
+        lora.set_modem_config(PRESETS[preset]) # registers already set are not rewritten
+        lora.set_tx_power(tx_power)
+        self.preset = preset
+        self.tx_power = tx_power
+        self.fails = fails
+        self._snr = []
+        self._rssi = []
+
+
+class Follower(object):
+    def __init__(self, timeout_ms=FALLBACK_MS):
+        """
+        Follower(timeout_ms=FALLBACK_MS)
+        Receiver side: switches modem config when a transmitter asks and
+        falls back to DEFAULT after timeout_ms without hearing anything.
+        """
+        self.timeout_ms = timeout_ms
+        self.preset = DEFAULT
+        self._last_rx = time.ticks_ms()
+
+    def on_frame(self, lora, payload):
+        # Call from on_recv with the RxPacket from poll_recv. Returns True if
+        # the frame was an ADR command. Reads payload.data in place: no copy per frame
+        self._last_rx = time.ticks_ms()
+        if not payload.header_flags & FLAGS_ADR:
+            return False
+        data = payload.data
+        if payload.length <= len(COMMAND) or data[0] != COMMAND[0] or data[1] != COMMAND[1]:
+            return False
+        preset = data[len(COMMAND)]
+        if preset < len(PRESETS) and preset != self.preset:
+            # The ACK already went out with the old config
+            lora.set_modem_config(PRESETS[preset])
+            self.preset = preset
+        return True
+
+    def poll(self, lora):
+        # Call periodically from the main loop
+        if self.preset != DEFAULT and time.ticks_diff(time.ticks_ms(), self._last_rx) > self.timeout_ms:
+            lora.set_modem_config(PRESETS[DEFAULT])
+            self.preset = DEFAULT
+            self._last_rx = time.ticks_ms()
@@ -0,0 +1,263 @@
+import time
+from array import array
+
+# Streaming link-quality statistics per transmitter, for tuning the
+# spreading factor and node placement.
+#
+# For each sender a LinkStats keeps, with fixed memory:
+#   - the last `window` packets in ring buffers (RSSI, SNR, inter-arrival
+#     interval, IRQ -> processing latency), for rolling mean/min/max and
+#     exact percentiles of the recent link;
+#   - P² estimators (Jain & Chlamtac, 1985) for the median and the 10th/90th
+#     percentiles since boot, five markers each, no samples stored;
+#   - inter-arrival jitter as in RFC 3550: a 1/16 running average of how much
+#     each interval differs from the previous one;
+#   - losses from header_id gaps, since boot and within the window. The
+#     sequence is followed here rather than taken from LoRa.sender_stats(),
+#     which only keeps totals since boot; as there, a step back, or a jump
+#     ahead longer than the silence allows, is a sender restart instead of a
+#     loss.
+# Samples are added from the processing task, never from the radio ISR.
+
+RSSI = 0
+SNR = 1
+INTERVAL = 2 # ms between consecutive packets of the same sender
+LATENCY = 3 # ms from the radio interrupt to processing
+METRICS = 4
+NAMES = ("rssi", "snr", "interval", "latency")
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+class P2Quantile(object):
+    def __init__(self, p):
+        """
+        P2Quantile(p)
+        Running estimate of the p-quantile (0 < p < 1) with five markers.
+        """
+        self.p = p
+        self.n = 0
+        self._q = [0.0] * 5 # marker heights
+        self._pos = [1, 2, 3, 4, 5] # marker positions
+        self._want = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0] # desired positions
+        self._step = (0.0, p / 2, p, (1 + p) / 2, 1.0)
+
+    def add(self, x):
+        q = self._q
+        if self.n < 5:
+            q[self.n] = x
+            self.n += 1
+            if self.n == 5:
+                q.sort()
+            return
+        self.n += 1
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        pos = self._pos
+        for i in range(k + 1, 5):
+            pos[i] += 1
+        want = self._want
+        for i in range(5):
+            want[i] += self._step[i]
+        for i in (1, 2, 3):
+            d = want[i] - pos[i]
+            if (d >= 1 and pos[i + 1] - pos[i] > 1) or (d <= -1 and pos[i - 1] - pos[i] < -1):
+                d = 1 if d > 0 else -1
+                # piecewise-parabolic prediction, linear if it leaves the neighbours' range
+                h = q[i] + d / (pos[i + 1] - pos[i - 1]) * (
+                    (pos[i] - pos[i - 1] + d) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i]) +
+                    (pos[i + 1] - pos[i] - d) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1]))
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (pos[i + d] - pos[i])
+                q[i] = h
+                pos[i] += d
+
+    def value(self):
+        if self.n >= 5:
+            return self._q[2]
+        if not self.n:
+            return None
+        ordered = sorted(self._q[:self.n])
+        return ordered[min(self.n - 1, int(self.p * self.n))]
+
+
+class Window(object):
+    def __init__(self, size):
+        """
+        Window(size)
+        The last `size` samples in a ring buffer of floats.
+        """
+        self._buf = array('f', bytes(4 * size))
+        self._next = 0
+        self.n = 0
+
+    def add(self, x):
+        self._buf[self._next] = x
+        self._next = (self._next + 1) % len(self._buf)
+        if self.n < len(self._buf):
+            self.n += 1
+
+    def _values(self):
+        return self._buf if self.n == len(self._buf) else self._buf[:self.n]
+
+    def mean(self):
+        return sum(self._values()) / self.n if self.n else None
+
+    def min(self):
+        return min(self._values()) if self.n else None
+
+    def max(self):
+        return max(self._values()) if self.n else None
+
+    def percentile(self, q):
+        # Sorts a copy: for display and export, not per packet
+        if not self.n:
+            return None
+        ordered = sorted(self._values())
+        return ordered[min(self.n - 1, int(q * self.n))]
+
+
+class LinkStats(object):
+    def __init__(self, window=32, id_mask=0xff):
+        """
+        LinkStats(window=32, id_mask=0xff)
+        Link quality of one sender; window: packets in the rolling statistics,
+        id_mask: 0x7f when header ids wrap at 128 (compact header)
+        """
+        self.id_mask = id_mask
+        self.windows = [Window(window) for _ in range(METRICS)]
+        self.quantiles = [[P2Quantile(p) for p in QUANTILES] for _ in range(METRICS)]
+        self._gaps = array('B', bytes(window)) # frames lost right before each windowed packet
+        self.received = 0
+        self.lost = 0
+        self.jitter_ms = 0.0
+        self.last_ms = None # ticks_ms of the last packet
+        self.last_id = None # header_id of the last packet
+        self._last_interval = None
+
+    def add(self, payload, now=None):
+        """
+        payload: RxPacket (rssi in dBm, snr in 0.25 dB steps, ticks_ms of the
+        interrupt, header_id); duplicates are expected to be filtered already
+        now: ticks_ms at processing, for the latency
+        """
+        if now is None:
+            now = time.ticks_ms()
+        values = [payload.rssi, payload.snr / 4, None, time.ticks_diff(now, payload.ticks_ms)]
+        lost = 0
+        if self.last_ms is not None:
+            interval = time.ticks_diff(payload.ticks_ms, self.last_ms)
+            ahead = (payload.header_id - self.last_id) & self.id_mask
+            shortest = self.windows[INTERVAL].min()
+            if 1 < ahead <= self.id_mask >> 1 and (shortest is None or 2 * interval >= ahead * shortest):
+                lost = ahead - 1
+            values[INTERVAL] = interval
+            if self._last_interval is not None:
+                self.jitter_ms += (abs(interval - self._last_interval) - self.jitter_ms) / 16
+            self._last_interval = interval
+        self.last_ms = payload.ticks_ms
+        self.last_id = payload.header_id
+        for metric in range(METRICS):
+            if values[metric] is not None:
+                self.windows[metric].add(values[metric])
+                for estimator in self.quantiles[metric]:
+                    estimator.add(values[metric])
+        self._gaps[self.received % len(self._gaps)] = min(lost, 255)
+        self.received += 1
+        self.lost += lost
+
+    def loss(self):
+        total = self.received + self.lost
+        return self.lost / total if total else 0.0
+
+    def recent_loss(self):
+        n = min(self.received, len(self._gaps))
+        lost = sum(self._gaps[:n])
+        return lost / (n + lost) if n else 0.0
+
+    def summary(self):
+        """Dict of the current statistics (None where there are no samples yet), for export."""
+        out = {"n": self.received, "lost": self.lost, "loss": round(self.loss(), 4),
+               "recent_loss": round(self.recent_loss(), 4), "jitter_ms": round(self.jitter_ms, 1)}
+        for metric in range(METRICS):
+            w = self.windows[metric]
+            if not w.n:
+                continue
+            out[NAMES[metric]] = {
+                "mean": _round(w.mean()), "min": _round(w.min()), "max": _round(w.max()),
+                "p10": _round(w.percentile(0.1)), "p50": _round(w.percentile(0.5)),
+                "p90": _round(w.percentile(0.9)),
+                "all_p10": _round(self.quantiles[metric][0].value()),
+                "all_p50": _round(self.quantiles[metric][1].value()),
+                "all_p90": _round(self.quantiles[metric][2].value()),
+            }
+        return out
+
+    def lines(self):
+        # Up to 6 lines of 16 columns for the OLED
+        out = ["n:%d perda:%d%%" % (self.received, round(self.recent_loss() * 100))]
+        w = self.windows[RSSI]
+        if w.n:
+            out.append("RSSI%4d %d/%d" % (round(w.mean()), round(w.min()), round(w.max())))
+            out.append(" p10/90 %d/%d" % (round(w.percentile(0.1)), round(w.percentile(0.9))))
+            w = self.windows[SNR]
+            out.append("SNR%5.1f %d/%d" % (w.mean(), round(w.min()), round(w.max())))
+        w = self.windows[INTERVAL]
+        if w.n:
+            out.append("Int%5dms j%d" % (round(w.mean()), round(self.jitter_ms)))
+        w = self.windows[LATENCY]
+        if w.n:
+            out.append("Lat%4dms max%d" % (round(w.mean()), round(w.max())))
+        return [line[:16] for line in out]
+
+
+class StatsTable(object):
+    def __init__(self, max_nodes=8, window=32, id_mask=0xff):
+        """
+        StatsTable(max_nodes=8, window=32, id_mask=0xff)
+        LinkStats per sender address; the least recently heard is evicted when full
+        """
+        self.max_nodes = max_nodes
+        self.window = window
+        self.id_mask = id_mask
+        self._stats = {}
+
+    def __len__(self):
+        return len(self._stats)
+
+    def get(self, address):
+        return self._stats.get(address)
+
+    def addresses(self):
+        return sorted(self._stats)
+
+    def add(self, payload, now=None):
+        """Record a packet from payload.header_from."""
+        address = payload.header_from
+        stats = self._stats.get(address)
+        if stats is None:
+            if len(self._stats) >= self.max_nodes:
+                oldest = min(self._stats, key=lambda a: self._stats[a].last_ms)
+                del self._stats[oldest]
+            stats = self._stats[address] = LinkStats(self.window, self.id_mask)
+        stats.add(payload, now)
+        return stats
+
+    def export(self, out=print):
+        """One JSON line per sender, prefixed with "LINK", for a serial log."""
+        import json
+        for address in self.addresses():
+            record = self._stats[address].summary()
+            record["addr"] = address
+            out("LINK " + json.dumps(record))
+
+
+def _round(x):
+    return None if x is None else round(x, 2)
@@ -1,10 +1,18 @@
 # --- Importação das Bibliotecas ---
 from machine import Pin, SoftI2C, PWM
-from time import sleep
-from ulora import LoRa, ModemConfig, SPIConfig # Biblioteca para comunicação LoRa
+from ulora import LoRa, RxPacket, ModemConfig, SPIConfig, LinkProfile, FLAGS_FRAG, FLAGS_BEACON, FLAGS_BATCH # Biblioteca para comunicação LoRa
 from ssd1306 import SSD1306_I2C # Biblioteca para o display OLED
+import lorafrag # Mensagens maiores que um quadro LoRa
+import nodes # Tabela de nós para o modo gateway
+import tdma # Beacons e slots do modo TDMA
+import adr # Taxa de dados adaptativa
+import linkstats # Estatísticas de qualidade do enlace
+import serialbridge # Saída binária dos pacotes pela serial USB
 import os
+import sys
+import struct
 import time
+import asyncio
 
 # --- Configuração dos Periféricos ---
 
@@ -28,44 +36,106 @@ RF95_FREQ = 915.0   # Frequência de operação em MHz (ex: 915.0 para US, 868.0
 RF95_POW = 20       # Potência de transmissão em dBm (2 a 20)
 CLIENT_ADDRESS = 1  # Endereço do nó que envia (nó sensor)
 SERVER_ADDRESS = 2  # Endereço deste nó (nó receptor)
+LINK_PROFILE = LinkProfile.Standard  # Perfil do enlace, igual ao dos transmissores
+SENSOR_FRAME = "<hhh"  # Quadro binário do perfil compacto: temperatura, umidade e dB, x10
+BATCH_RECORD = "<Ihhh"  # Leitura num lote do backlog (FLAGS_BATCH): idade (s), temperatura, umidade e dB x10
+BATCH_SIZE = struct.calcsize(BATCH_RECORD)
+AGE_UNKNOWN = 0xffffffff  # Leitura de um boot anterior do transmissor
 
-# --- Função de Callback para Recebimento de Dados ---
+# --- Modo Gateway ---
+# Com GATEWAY = True o receptor acompanha vários transmissores (qualquer endereço
+# que envie para SERVER_ADDRESS) e o OLED mostra uma página por nó.
+GATEWAY = False
+MAX_NODES = 8                 # Nós guardados ao mesmo tempo (o mais antigo sai quando lota)
+NODE_STALE_MS = 10 * 60 * 1000  # Nó sem enviar por 10 min sai da tabela
+PAGE_MS = 4000                # Troca automática de página no OLED
 
-# Esta função é chamada automaticamente toda vez que uma mensagem LoRa é recebida.
-def on_recv(payload):
+node_table = nodes.NodeTable(max_nodes=MAX_NODES, stale_ms=NODE_STALE_MS)
+page = 0             # Índice do nó exibido
+display_dirty = False  # on_recv marca, a tarefa de manutenção redesenha
+
+# --- Modo TDMA ---
+# Com TDMA = True o receptor transmite um beacon a cada BEACON_INTERVAL_MS com
+# os slots de cada transmissor (que também precisam de Config.TDMA = True).
+# Transmissores ainda sem slot usam os slots de entrada no fim do quadro e
+# recebem um slot no beacon seguinte.
+TDMA = False
+BEACON_INTERVAL_MS = 2000  # Igual ao SENSOR_UPDATE_INTERVAL dos transmissores
+schedule = tdma.Schedule(ModemConfig.Bw125Cr45Sf128, BEACON_INTERVAL_MS, max_slots=MAX_NODES)
+
+# --- Taxa de dados adaptativa ---
+# Os ACKs sempre levam o SNR/RSSI medido. Com ADR = True o receptor também
+# aceita os pedidos de troca de ModemConfig do transmissor (Config.ADR) e
+# volta ao padrão após ADR_TIMEOUT_MS sem ouvir nada. Um transmissor que
+# dorme mais do que isso (baixo consumo) volta ao padrão junto ao acordar,
+# então o valor deve ser o adr.FALLBACK_MS dos transmissores. Só com um
+# transmissor: no modo gateway ou TDMA todos precisam ficar no mesmo ModemConfig.
+ADR = True
+ADR_TIMEOUT_MS = adr.FALLBACK_MS
+adr_follower = adr.Follower(timeout_ms=ADR_TIMEOUT_MS)
+
+# --- Qualidade do enlace ---
+# RSSI, SNR, intervalo entre pacotes, jitter, latência (interrupção ->
+# processamento) e perda de cada transmissor, nos últimos LINK_WINDOW pacotes
+# e desde o boot. O botão B alterna o OLED para a página de estatísticas (no
+# modo gateway, do nó da página atual). A cada LINK_EXPORT_MS as estatísticas
+# saem pela serial, uma linha "LINK {json}" por nó (None desliga).
+LINK_WINDOW = 32
+LINK_EXPORT_MS = 60000
+link_stats = linkstats.StatsTable(max_nodes=MAX_NODES, window=LINK_WINDOW,
+                                  id_mask=0x7f if LINK_PROFILE[2] else 0xff)
+stats_page = False  # Página de estatísticas no lugar das mensagens/nós
+
+# --- Saída binária pela serial ---
+# Com SERIAL_BINARY = True cada pacote recebido (mensagem, RSSI, SNR, origem e
+# ticks_ms) sai pela serial USB como um registro binário com COBS e CRC32
+# (serialbridge.py), lido no PC por host/serial_reader.py. Os registros passam
+# por um buffer circular de SERIAL_BUFFER bytes esvaziado por uma tarefa, sem
+# bloquear o receptor; se ele lota, o registro é descartado (lacuna no seq).
+# As mensagens deixam de ser impressas e o export LINK vai pelo mesmo buffer.
+SERIAL_BINARY = False
+SERIAL_BUFFER = 4096
+bridge = serialbridge.SerialBridge(SERIAL_BUFFER)
+
+# Remontagem de mensagens fragmentadas (várias mensagens podem chegar intercaladas)
+reassembler = lorafrag.Reassembler(timeout_ms=5000)
+
+# --- Recepção contínua ---
+# A interrupção do rádio só marca o instante (ticks_ms) e acorda a tarefa do
+# rádio, que lê cada quadro com poll_recv() para um dos RX_QUEUE pacotes
+# pré-alocados, sem alocar memória. A tarefa de processamento consome os
+# pacotes na ordem de chegada; enquanto ela trabalha (OLED, fragmentos), o
+# rádio continua recebendo e respondendo os ACKs.
+RX_QUEUE = 4
+rx_pool = [RxPacket() for _ in range(RX_QUEUE)]
+rx_spare = RxPacket()  # Recebe (e confirma) quadros com a fila cheia, que são descartados
+rx_first = 0  # Índice do pacote mais antigo ainda não processado
+rx_count = 0  # Pacotes na fila
+rx_overruns = 0  # Quadros descartados por fila cheia
+rx_ready = asyncio.Event()
+
+# --- Exibição de uma mensagem completa ---
+def show_message(message):
     """
-    Processa a mensagem recebida via LoRa.
-    
+    Exibe no OLED uma mensagem de sensores (formato "T:xx,H:xx,D:xx")
+    ou, se não estiver nesse formato, a mensagem bruta.
+
     Args:
-        payload: Objeto contendo os dados da mensagem (payload.message),
-                 RSSI (payload.rssi) e SNR (payload.snr).
+        message: Mensagem já decodificada (str).
     """
     oled.fill(0)  # Limpa completamente o conteúdo do display OLED
 
-    # Decodifica a mensagem de bytes para uma string no formato UTF-8
-    message = payload.message.decode('utf-8')
-    print("Mensagem Recebida:", message) # Imprime a mensagem no console serial
-
     # Tenta processar a mensagem como dados de sensores (formato "T:xx,H:xx,D:xx")
-    try:
-        parts = message.split(',') # Separa a string pela vírgula. Ex: ["T:25.3", "H:60.1", "D:75.5"]
-
-        # Extrai as strings de cada sensor
-        temp_str = parts[0] # "T:25.3"
-        hum_str = parts[1]  # "H:60.1"
-        db_str = parts[2]   # "D:75.5"
-
-        # Extrai os valores numéricos, separando pelo ":" e convertendo para float
-        temp_value = float(temp_str.split(':')[1])
-        hum_value = float(hum_str.split(':')[1])
-        db_value = float(db_str.split(':')[1])
+    values = nodes.parse_sensors(message)
+    if values is not None:
+        temp_value, hum_value, db_value = values
 
         # Exibe os valores formatados no display OLED
         oled.text(f"Temp: {temp_value:.1f} C", 0, 0, 1)
         oled.text(f"Umidade: {hum_value:.1f}%", 0, 10, 1)
         oled.text(f"Decibeis: {db_value:.1f}dB", 0, 20, 1)
 
-    except (IndexError, ValueError):
+    else:
         # Se a mensagem não estiver no formato esperado, exibe a mensagem bruta
         oled.text("Msg recebida:", 0, 0, 1)
         oled.text(message, 0, 10, 1)
@@ -74,20 +144,173 @@ def on_recv(payload):
     # Atualiza o display com o novo conteúdo
     oled.show()
 
+# --- Página de um nó (modo gateway) ---
+def show_node_page():
+    """
+    Exibe no OLED o nó da página atual: últimos valores, RSSI/SNR,
+    perda de quadros e há quanto tempo foi ouvido.
+    """
+    global page
+    oled.fill(0)
+    addresses = node_table.addresses()
+    if not addresses:
+        oled.text("Gateway LoRa", 0, 0, 1)
+        oled.text("Sem nos ativos", 0, 20, 1)
+        oled.show()
+        return
+
+    page %= len(addresses)
+    address = addresses[page]
+    node = node_table.get(address)
+    oled.text(f"No {address}  {page + 1}/{len(addresses)}", 0, 0, 1)
+    if node[nodes.TEMP] is not None:
+        oled.text(f"T:{node[nodes.TEMP]:.1f} H:{node[nodes.HUM]:.0f}%", 0, 12, 1)
+        oled.text(f"D:{node[nodes.DB]:.1f}dB", 0, 22, 1)
+    oled.text(f"RSSI:{node[nodes.RSSI]:.0f} SNR:{node[nodes.SNR]:.0f}", 0, 34, 1)
+    oled.text(f"Perda: {node_table.loss(address) * 100:.0f}%", 0, 44, 1)
+    oled.text(f"Visto ha {node_table.age_ms(address) // 1000}s", 0, 54, 1)
+    oled.show()
+
+# --- Página de estatísticas do enlace ---
+def show_stats_page():
+    """
+    Exibe no OLED as estatísticas do enlace do nó da página atual: pacotes,
+    perda, RSSI e SNR (média, mínimo/máximo, percentis), intervalo, jitter
+    e latência.
+    """
+    oled.fill(0)
+    addresses = link_stats.addresses()
+    if not addresses:
+        oled.text("Enlace", 0, 0, 1)
+        oled.text("Sem pacotes", 0, 20, 1)
+        oled.show()
+        return
+    address = addresses[page % len(addresses)]
+    oled.text(f"Enlace no {address}", 0, 0, 1)
+    for i, line in enumerate(link_stats.get(address).lines()):
+        oled.text(line, 0, 10 + 9 * i, 1)
+    oled.show()
+
+# --- Texto de uma mensagem recebida ---
+def message_text(payload):
+    """
+    Retorna a mensagem como texto. No perfil de tamanho fixo (cabeçalho
+    implícito) as leituras chegam num quadro binário, convertido para o
+    formato "T:xx,H:xx,D:xx".
+    """
+    if LINK_PROFILE[0]:
+        temp, hum, db = struct.unpack_from(SENSOR_FRAME, payload.data)
+        return f"T:{temp / 10:.1f},H:{hum / 10:.1f},D:{db / 10:.1f}"
+    return str(payload.data, 'utf-8')
+
+def batch_texts(payload):
+    """
+    Leituras de um lote do backlog do transmissor (FLAGS_BATCH), cada uma no
+    formato "T:xx,H:xx,D:xx,A:<idade em s>" (sem A se a idade é desconhecida).
+    """
+    texts = []
+    for offset in range(0, payload.length - BATCH_SIZE + 1, BATCH_SIZE):
+        age, temp, hum, db = struct.unpack_from(BATCH_RECORD, payload.data, offset)
+        text = f"T:{temp / 10:.1f},H:{hum / 10:.1f},D:{db / 10:.1f}"
+        texts.append(text if age == AGE_UNKNOWN else f"{text},A:{age}")
+    return texts
+
+# --- Processamento de um Pacote Recebido ---
+
+# Esta função é chamada pela tarefa de processamento para cada pacote da fila.
+def on_recv(payload):
+    """
+    Processa a mensagem recebida via LoRa.
+    
+    Args:
+        payload: RxPacket com a mensagem (payload.data, ou uma cópia em
+                 payload.message), RSSI em dBm (payload.rssi), SNR em
+                 passos de 0,25 dB (payload.snr) e o instante da
+                 interrupção (payload.ticks_ms).
+    """
+    global display_dirty
+    if ADR and not GATEWAY and not TDMA and adr_follower.on_frame(lora, payload):
+        print("ADR: preset", adr_follower.preset)
+        return
+
+    # Qualidade do enlace (fragmentos incluídos); a página é redesenhada pela
+    # tarefa de manutenção
+    link_stats.add(payload)
+    if stats_page:
+        display_dirty = True
+    if SERIAL_BINARY:
+        bridge.put(payload)  # Pacote bruto (fragmentos incluídos) para o PC
+
+    if TDMA and not payload.header_flags & FLAGS_BEACON:
+        schedule.assign(payload.header_from)  # Garante um slot a quem foi ouvido
+
+    if GATEWAY:
+        # Atualiza o registro do nó; a tarefa de manutenção redesenha a página
+        values = None
+        if not payload.header_flags & (FLAGS_FRAG | FLAGS_BATCH):
+            try:
+                values = nodes.parse_sensors(message_text(payload))
+            except UnicodeError:
+                pass
+        node_table.update(payload, values, lora.sender_stats(payload.header_from))
+        display_dirty = True
+
+    if payload.header_flags & FLAGS_FRAG:
+        # Fragmento: só exibe quando a mensagem inteira tiver chegado
+        message = lorafrag.handle_fragment(lora, reassembler, payload)
+        if message is not None and GATEWAY:
+            print("Mensagem fragmentada recebida:", len(message), "bytes de", payload.header_from)
+        elif message is not None:
+            print("Mensagem fragmentada recebida:", len(message), "bytes de", payload.header_from)
+            oled.fill(0)
+            oled.text("Msg grande:", 0, 0, 1)
+            oled.text(f"{len(message)} bytes", 0, 10, 1)
+            if message[:4] == b"HIST":
+                # Histórico do transmissor: temp, umidade e dB (int16 x10)
+                oled.text(f"Historico: {(len(message) - 4) // 6}", 0, 20, 1)
+            oled.show()
+        return
+
+    if payload.header_flags & FLAGS_BATCH:
+        # Leituras antigas, guardadas durante uma queda do enlace: não mudam o display
+        if not SERIAL_BINARY:
+            texts = batch_texts(payload)
+            print("Backlog de", payload.header_from, ":", len(texts), "leituras")
+            for text in texts:
+                print("  ", text)
+        return
+
+    # Decodifica a mensagem de bytes para uma string no formato UTF-8
+    message = message_text(payload)
+    if not SERIAL_BINARY:
+        print("Mensagem Recebida:", message) # Imprime a mensagem no console serial
+    # Estatísticas do enlace: retransmissões descartadas e quadros perdidos
+    # (lacunas na sequência de header_id de cada transmissor)
+    stats = lora.sender_stats(payload.header_from)
+    if stats and not SERIAL_BINARY:
+        print("No", payload.header_from, "Duplicados:", lora.duplicates, "Perdidos:", stats[1], "de", stats[0] + stats[1])
+
+    if not GATEWAY and not stats_page:
+        show_message(message)
+        if stats:
+            oled.text(f"Perdidos: {stats[1]}/{stats[0] + stats[1]}", 0, 40, 1)
+            oled.show()
+
     # --- Controle dos LEDs e Buzzer com base em mensagens simples ---
     # Esta parte do código permite controlar o receptor com comandos simples (1, 2, 3, 4)
     # enviados pelo transmissor, útil para testes e depuração.
-    if payload.message == b'1':
+    command = payload.data[0] if payload.length == 1 else 0
+    if command == ord('1'):
         vermelho.on()
         verde.off()
         azul.off()
 
-    if payload.message == b'2':
+    if command == ord('2'):
         vermelho.off()
         verde.on()
         azul.off()
     
-    if payload.message == b'3':
+    if command == ord('3'):
         vermelho.off()
         verde.off()
         azul.on()
@@ -95,7 +318,7 @@ def on_recv(payload):
         # Provavelmente seria uma função para tocar notas em um buzzer.
         # play_ex_notes() 
     
-    if payload.message == b'4':
+    if command == ord('4'):
         vermelho.off()
         verde.off()
         azul.off()
@@ -103,31 +326,134 @@ def on_recv(payload):
         # buzzer_pwm.duty_u16(0)
 
 
-# --- Inicialização do Rádio LoRa ---
-# Cria o objeto LoRa com todas as configurações definidas anteriormente
-lora = LoRa(RFM95_SPIBUS, RFM95_INT, SERVER_ADDRESS, RFM95_CS,
-            reset_pin=RFM95_RST, freq=RF95_FREQ, tx_power=RF95_POW, acks=True)
+lora = None
+
+# --- Tarefas do Receptor ---
+async def radio_task(irq_flag):
+    """Lê os quadros do rádio para a fila de pacotes pré-alocados."""
+    global rx_count, rx_overruns
+    while True:
+        await irq_flag.wait()  # Marcado pela interrupção do DIO0
+        while True:
+            if rx_count < RX_QUEUE:
+                packet = rx_pool[(rx_first + rx_count) % RX_QUEUE]
+            else:
+                packet = rx_spare
+            if lora.poll_recv(packet) is not packet:
+                break  # Nada mais a ler (ou quadro repetido, ACK, outro endereço)
+            if packet is rx_spare:
+                rx_overruns += 1
+                print("Fila de recepcao cheia, quadro descartado")
+            else:
+                rx_count += 1
+                rx_ready.set()
+
+async def process_task():
+    """Processa os pacotes da fila na ordem em que chegaram."""
+    global rx_first, rx_count
+    while True:
+        await rx_ready.wait()
+        rx_ready.clear()
+        while rx_count:
+            try:
+                on_recv(rx_pool[rx_first])
+            except Exception as e:
+                print("Erro ao processar pacote:", e)
+            # Só agora o pacote volta para a tarefa do rádio
+            rx_first = (rx_first + 1) % RX_QUEUE
+            rx_count -= 1
+            await asyncio.sleep_ms(0)
+
+async def beacon_task():
+    """Modo TDMA: envia o beacon no início de cada quadro."""
+    next_beacon = time.ticks_ms()
+    while True:
+        # Dorme até o beacon, para o quadro manter o período anunciado (os
+        # transmissores extrapolam por ele)
+        wait = time.ticks_diff(next_beacon, time.ticks_ms())
+        if wait > 0:
+            await asyncio.sleep_ms(wait)
+        schedule.expire()  # Libera slots de nós calados
+        schedule.send_beacon(lora)
+        if wait < 0:
+            next_beacon = time.ticks_ms()  # Atrasou: o quadro recomeça agora
+        next_beacon = time.ticks_add(next_beacon, schedule.period_ms)
+
+async def housekeeping_task():
+    """
+    Expira fragmentos e nós, volta o ADR ao padrão, troca as páginas do OLED
+    e exporta as estatísticas do enlace.
+    """
+    global page, display_dirty, stats_page
+    # No modo gateway, o botão A avança a página e as páginas também giram
+    # sozinhas a cada PAGE_MS. O botão B alterna a página de estatísticas.
+    last_page = time.ticks_ms()
+    last_export = last_page
+    button_was_pressed = False
+    b_was_pressed = False
+    while True:
+        reassembler.expire()  # Descarta mensagens fragmentadas incompletas antigas
+        if ADR and not GATEWAY and not TDMA:
+            adr_follower.poll(lora)  # Sem ouvir o transmissor, volta ao ModemConfig padrão
+        if GATEWAY:
+            node_table.expire()  # Remove nós sem enviar há muito tempo
+            now = time.ticks_ms()
+            pressed = botao_a.value() == 0
+            if (pressed and not button_was_pressed) or time.ticks_diff(now, last_page) >= PAGE_MS:
+                page += 1
+                last_page = now
+                display_dirty = True
+            button_was_pressed = pressed
+        pressed = botao_b.value() == 0
+        if pressed and not b_was_pressed:
+            stats_page = not stats_page
+            display_dirty = True
+        b_was_pressed = pressed
+        if display_dirty and (GATEWAY or stats_page):
+            display_dirty = False
+            if stats_page:
+                show_stats_page()
+            else:
+                show_node_page()
+        if LINK_EXPORT_MS and time.ticks_diff(time.ticks_ms(), last_export) >= LINK_EXPORT_MS:
+            last_export = time.ticks_ms()
+            link_stats.export(bridge.text if SERIAL_BINARY else print)
+        await asyncio.sleep_ms(100)
+
+async def receiver():
+    global lora
+    # --- Inicialização do Rádio LoRa ---
+    # Cria o objeto LoRa com todas as configurações definidas anteriormente
+    lora = LoRa(RFM95_SPIBUS, RFM95_INT, SERVER_ADDRESS, RFM95_CS,
+                reset_pin=RFM95_RST, freq=RF95_FREQ, tx_power=RF95_POW, acks=True, link_profile=LINK_PROFILE)
+    lora.max_senders = max(lora.max_senders, MAX_NODES)  # Sequência de cada nó acompanhado
+
+    # A interrupção só acorda a tarefa do rádio; o rádio fica em recepção contínua
+    irq_flag = asyncio.ThreadSafeFlag()
+    lora.set_irq_callback(irq_flag.set)
+    lora.start_recv()
+
+    # --- Mensagem Inicial ---
+    # Exibe uma mensagem de boas-vindas no OLED ao iniciar
+    oled.fill(0)
+    oled.text("Gateway LoRa" if GATEWAY else "Receptor LoRa", 0, 0, 1)
+    oled.text("Aguardando...", 0, 20, 1)
+    oled.show()
 
-# Associa a função 'on_recv' ao evento de recebimento de pacotes
-lora.on_recv = on_recv
+    asyncio.create_task(radio_task(irq_flag))
+    asyncio.create_task(process_task())
+    if TDMA:
+        asyncio.create_task(beacon_task())
+    if SERIAL_BINARY:
+        asyncio.create_task(bridge.run(sys.stdout.buffer))
+    await housekeeping_task()
 
-# Coloca o rádio em modo de recebimento contínuo
-lora.set_mode_rx()
+def main():
+    asyncio.run(receiver())
 
-# --- Configuração dos Botões (não utilizados no loop principal) ---
+# --- Configuração dos Botões (botão A troca de página no modo gateway) ---
 botao_a = Pin(5, Pin.IN, Pin.PULL_UP)
 botao_b = Pin(6, Pin.IN, Pin.PULL_UP)
 
-# --- Mensagem Inicial ---
-# Exibe uma mensagem de boas-vindas no OLED ao iniciar
-oled.fill(0)
-oled.text("Receptor LoRa", 0, 0, 1)
-oled.text("Aguardando...", 0, 20, 1)
-oled.show()
-
-# --- Loop Principal ---
-# O programa entra em um loop infinito para se manter ativo.
-# A recepção de dados ocorre por interrupções, gerenciadas pela biblioteca ulora.
-# O sleep(0.1) ajuda a reduzir o consumo de processamento.
-while True:
-    sleep(0.1)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import time
+
+# Per-node state for a receiver acting as a gateway for many transmitters.
+#
+# Each node is one small list, indexed by the constants below, in a dict
+# keyed by header_from, so lookups are O(1). The table holds at most
+# max_nodes entries: a new node evicts the one heard from least recently,
+# and nodes silent for longer than stale_ms are dropped by expire().
+
+TEMP = 0
+HUM = 1
+DB = 2
+RSSI = 3
+SNR = 4
+LAST_SEEN = 5 # ticks_ms of the last frame
+SEQ = 6 # header_id of the last frame
+RECEIVED = 7
+LOST = 8
+
+
+def parse_sensors(message):
+    # "T:xx,H:xx,D:xx" -> (temp, hum, db), or None for any other message
+    try:
+        parts = message.split(',')
+        return (float(parts[0].split(':')[1]), float(parts[1].split(':')[1]), float(parts[2].split(':')[1]))
+    except (IndexError, ValueError):
+        return None
+
+
+class NodeTable(object):
+    def __init__(self, max_nodes=8, stale_ms=10 * 60 * 1000):
+        """
+        NodeTable(max_nodes=8, stale_ms=600000)
+        max_nodes: nodes kept at once; the least recently heard is evicted when full
+        stale_ms: expire() drops nodes silent for longer than this
+        """
+        self.max_nodes = max_nodes
+        self.stale_ms = stale_ms
+        self._nodes = {}
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, address):
+        return address in self._nodes
+
+    def get(self, address):
+        return self._nodes.get(address)
+
+    def addresses(self):
+        return sorted(self._nodes)
+
+    def update(self, payload, values=None, stats=None):
+        """
+        Record a frame from payload.header_from.
+        payload: ulora.RxPacket filled by poll_recv()
+        values: (temp, hum, db) parsed from the message, or None to keep the last ones
+        stats: (received, lost) from LoRa.sender_stats(), if available
+        """
+        address = payload.header_from
+        node = self._nodes.get(address)
+        if node is None:
+            if len(self._nodes) >= self.max_nodes:
+                oldest = min(self._nodes, key=lambda a: self._nodes[a][LAST_SEEN])
+                del self._nodes[oldest]
+                self.evicted += 1
+            node = [None, None, None, 0, 0, 0, 0, 0, 0]
+            self._nodes[address] = node
+        if values is not None:
+            node[TEMP], node[HUM], node[DB] = values
+        node[RSSI] = payload.rssi
+        node[SNR] = payload.snr / 4 # 0.25 dB steps
+        node[LAST_SEEN] = payload.ticks_ms # when the frame arrived, not when it was processed
+        node[SEQ] = payload.header_id
+        if stats is not None:
+            node[RECEIVED], node[LOST] = stats
+        else:
+            node[RECEIVED] += 1
+        return node
+
+    def loss(self, address):
+        # Fraction of frames lost from address, from gaps in its header_id sequence
+        node = self._nodes.get(address)
+        if node is None or not node[RECEIVED] + node[LOST]:
+            return 0.0
+        return node[LOST] / (node[RECEIVED] + node[LOST])
+
+    def age_ms(self, address, now=None):
+        if now is None:
+            now = time.ticks_ms()
+        return time.ticks_diff(now, self._nodes[address][LAST_SEEN])
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.ticks_ms()
+        for address in [a for a, n in self._nodes.items() if time.ticks_diff(now, n[LAST_SEEN]) > self.stale_ms]:
+            del self._nodes[address]
+            self.evicted += 1
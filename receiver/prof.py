@@ -0,0 +1,176 @@
+import gc
+import struct
+import time
+from array import array
+
+# On-device profiling: per-stage ticks_us timers, gc.mem_alloc deltas and
+# event counters, aggregated into preallocated arrays so that measuring
+# allocates nothing (usable from the radio ISR).
+#
+# Every hook in an instrumented module sits behind a module-local constant:
+#   _PROF = const(0)
+#   if _PROF:
+#       prof.begin(prof.SENSE)
+# MicroPython drops `if 0:` blocks at compile time, so with _PROF = 0 the
+# hooks (and the `import prof`) cost nothing. The constant has to be local:
+# a const() imported from another module is not folded.
+#
+# Durations go to a log2 histogram per stage: bucket i counts calls that
+# took [2**i, 2**(i+1)) microseconds, so percentiles are upper bounds within
+# a factor of two. Read the results from the REPL (prof.report()), as bytes
+# for a BLE characteristic (prof.snapshot()) or as OLED lines (prof.lines()).
+
+SENSE = 0      # read_sensors: AHT20 + microphone samples
+DB = 1         # get_decibels
+OLED = 2       # SSD1306 show() (framebuffer over I2C)
+NEOPIXEL = 3   # NeoPixel write()
+BLE = 4        # gatts_write + gatts_notify
+LORA_SEND = 5  # ulora send(): CAD, FIFO fill, start TX
+LORA_ACK = 6   # ulora send_to_wait(): waiting for TxDone and the ACK
+LORA_ISR = 7   # ulora DIO0 interrupt handler
+LOOP = 8       # one iteration of the main loop
+STAGES = 9
+NAMES = ("sense", "db", "oled", "neopix", "ble", "tx", "ack", "isr", "loop")
+
+TX_RETRY = 0     # frames sent again after an ACK timeout
+TX_FAIL = 1      # send_to_wait() gave up
+GC_IN_STAGE = 2  # a collection ran inside a stage (its alloc delta is skipped)
+COUNTERS = 3
+COUNTER_NAMES = ("retry", "fail", "gc")
+
+BUCKETS = 24 # 1 us .. 16 s
+
+_count = array("I", bytes(4 * STAGES))
+_max_us = array("I", bytes(4 * STAGES))
+_sum_ms = array("I", bytes(4 * STAGES)) # sums split in ms + remainder to stay small ints
+_sum_us = array("H", bytes(2 * STAGES))
+_alloc_kb = array("I", bytes(4 * STAGES))
+_alloc_b = array("H", bytes(2 * STAGES))
+_hist = array("H", bytes(2 * STAGES * BUCKETS)) # saturates at 65535
+_t0 = array("I", bytes(4 * STAGES))
+_m0 = array("I", bytes(4 * STAGES))
+_counters = array("I", bytes(4 * COUNTERS))
+
+SNAPSHOT_FORMAT = "<IIIII" # per stage: calls, mean us, p90 us, max us, mean alloc bytes
+
+
+def reset():
+    for a in (_count, _max_us, _sum_ms, _sum_us, _alloc_kb, _alloc_b, _hist, _counters):
+        for i in range(len(a)):
+            a[i] = 0
+
+
+def begin(stage):
+    _m0[stage] = gc.mem_alloc()
+    _t0[stage] = time.ticks_us()
+
+
+def end(stage):
+    dt = time.ticks_diff(time.ticks_us(), _t0[stage])
+    alloc = gc.mem_alloc() - _m0[stage]
+    _count[stage] += 1
+    if dt > _max_us[stage]:
+        _max_us[stage] = dt
+    us = _sum_us[stage] + dt
+    _sum_ms[stage] += us // 1000
+    _sum_us[stage] = us % 1000
+    if alloc < 0:
+        _counters[GC_IN_STAGE] += 1
+    else:
+        b = _alloc_b[stage] + alloc
+        _alloc_kb[stage] += b >> 10
+        _alloc_b[stage] = b & 1023
+    i = 0
+    while dt > 1 and i < BUCKETS - 1:
+        dt >>= 1
+        i += 1
+    i += stage * BUCKETS
+    if _hist[i] < 65535:
+        _hist[i] += 1
+
+
+def count(counter, n=1):
+    _counters[counter] += n
+
+
+def wrap(stage, func):
+    # Times a method without arguments, e.g. oled.show = prof.wrap(prof.OLED, oled.show)
+    def timed():
+        begin(stage)
+        r = func()
+        end(stage)
+        return r
+    return timed
+
+
+def wrap1(stage, func):
+    # Same for one argument, e.g. an IRQ handler
+    def timed(arg):
+        begin(stage)
+        r = func(arg)
+        end(stage)
+        return r
+    return timed
+
+
+def percentile_us(stage, q):
+    # Upper bound of the histogram bucket holding quantile q (0..1)
+    n = 0
+    for i in range(BUCKETS):
+        n += _hist[stage * BUCKETS + i]
+    target = q * n
+    seen = 0
+    for i in range(BUCKETS):
+        seen += _hist[stage * BUCKETS + i]
+        if n and seen >= target:
+            return min(2 << i, _max_us[stage])
+    return 0
+
+
+def mean_us(stage):
+    n = _count[stage]
+    return (_sum_ms[stage] * 1000 + _sum_us[stage]) // n if n else 0
+
+
+def mean_alloc(stage):
+    n = _count[stage]
+    return ((_alloc_kb[stage] << 10) + _alloc_b[stage]) // n if n else 0
+
+
+def report(out=print):
+    out("stage    calls   mean_us    p90_us    max_us  alloc_B")
+    for s in range(STAGES):
+        if _count[s]:
+            out("%-6s %7d %9d %9d %9d %8d" % (NAMES[s], _count[s], mean_us(s), percentile_us(s, 0.9),
+                                              _max_us[s], mean_alloc(s)))
+    out(" ".join("%s=%d" % (COUNTER_NAMES[c], _counters[c]) for c in range(COUNTERS)))
+
+
+def snapshot():
+    # All stages in SNAPSHOT_FORMAT followed by the counters (u32 each), for a BLE read
+    data = bytearray()
+    for s in range(STAGES):
+        data += struct.pack(SNAPSHOT_FORMAT, _count[s], mean_us(s), percentile_us(s, 0.9), _max_us[s],
+                            mean_alloc(s))
+    for c in range(COUNTERS):
+        data += struct.pack("<I", _counters[c])
+    return data
+
+
+def lines(first=0, n=6):
+    # 16-column lines for the OLED debug page: stage, mean and max time
+    out = []
+    for s in range(first, STAGES):
+        if len(out) == n:
+            break
+        out.append("%-6s%5s%5s" % (NAMES[s], _short(mean_us(s)), _short(_max_us[s])))
+    return out
+
+
+def _short(us):
+    # 4-character duration: 950u, 12m, 1.2s
+    if us < 1000:
+        return "%du" % us
+    if us < 1000000:
+        return "%dm" % (us // 1000)
+    return "%d.%ds" % (us // 1000000, us // 100000 % 10)
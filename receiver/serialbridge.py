@@ -0,0 +1,145 @@
+import select
+import struct
+import asyncio
+from binascii import crc32
+
+# Binary output of received packets over the USB serial, for a PC to log
+# them at rates that printing text cannot keep up with.
+#
+# Each record is COBS-encoded (Cheshire & Baker, 1999) and terminated by a
+# 0x00 byte, so a reader resynchronizes at the next zero after any garbage:
+#   RECORD_HEADER  type, seq, to, from, id, flags, rssi (dBm),
+#                  snr (0.25 dB steps), ticks_ms of the radio interrupt
+#   payload        the message as received
+#   crc32          of header + payload, little endian
+# COBS adds one byte per 254 and never more, so frames have a fixed upper
+# size (MAX_FRAME). Text lines (e.g. the LINK export) can go through the
+# same ring with text(); the reader tells them apart because they fail the
+# COBS/CRC check. print() output bypasses the ring and may land inside a
+# frame, which the reader then drops as corrupt.
+#
+# put() encodes into a preallocated ring buffer and never blocks; a record
+# that does not fit is dropped whole and counted, and its seq is skipped so
+# the reader sees the gap. The writer task drains the ring in CHUNK-byte
+# writes, only while the stream polls writable, so a PC that stops reading
+# fills the ring instead of blocking the receiver. On the USB CDC "writable"
+# means some room in the 256-byte TX FIFO, so the write that fills it may
+# wait for the CDC TX timeout (500 ms) once, and then returns short.
+
+PACKET = 1
+RECORD_HEADER = "<BHBBBBhbI"
+HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+CRC_SIZE = 4
+MAX_RECORD = HEADER_SIZE + 255 + CRC_SIZE
+MAX_FRAME = MAX_RECORD + MAX_RECORD // 254 + 2 # COBS overhead + delimiter
+CHUNK = 64 # USB full-speed CDC packet
+
+
+class SerialBridge(object):
+    def __init__(self, size=4096):
+        """
+        SerialBridge(size=4096)
+        COBS-framed packet records in a ring buffer of `size` bytes
+        """
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._head = 0 # next byte to write
+        self._tail = 0 # next byte to send
+        self.used = 0
+        self._record = bytearray(MAX_RECORD)
+        self._record_view = memoryview(self._record)
+        self._frame = bytearray(MAX_FRAME)
+        self._frame_view = memoryview(self._frame)
+        self._ready = asyncio.Event()
+        self.seq = 0
+        self.records = 0 # records queued
+        self.dropped = 0 # records that did not fit (gaps in seq)
+        self.text_dropped = 0
+        self.sent = 0 # bytes written to the stream
+
+    def put(self, payload):
+        """
+        Queue a record for an RxPacket; returns False if the ring is full.
+        Called from the processing task, not from the radio ISR.
+        """
+        seq = self.seq
+        self.seq = (seq + 1) & 0xffff
+        rec = self._record
+        length = payload.length
+        struct.pack_into(RECORD_HEADER, rec, 0, PACKET, seq, payload.header_to, payload.header_from,
+                         payload.header_id, payload.header_flags, payload.rssi, payload.snr,
+                         payload.ticks_ms & 0xffffffff)
+        end = HEADER_SIZE + length
+        rec[HEADER_SIZE:end] = payload.data
+        struct.pack_into("<I", rec, end, crc32(self._record_view[:end]) & 0xffffffff)
+        n = self._encode(end + CRC_SIZE)
+        if n > len(self._buf) - self.used:
+            self.dropped += 1
+            return False
+        self._push(self._frame_view, n)
+        self.records += 1
+        return True
+
+    def text(self, line):
+        """Queue a text line (without the newline); for LoRa-unrelated output in binary mode."""
+        data = line.encode() + b"\n"
+        if len(data) > len(self._buf) - self.used:
+            self.text_dropped += 1
+            return False
+        self._push(data, len(data))
+        return True
+
+    def _encode(self, n):
+        # COBS: each code byte holds the distance to the next zero (0xff: a
+        # full block without one)
+        out = self._frame
+        code_at = 0
+        i = 1
+        code = 1
+        for b in self._record_view[:n]:
+            if b:
+                out[i] = b
+                i += 1
+                code += 1
+                if code == 0xff:
+                    out[code_at] = code
+                    code_at = i
+                    i += 1
+                    code = 1
+            else:
+                out[code_at] = code
+                code_at = i
+                i += 1
+                code = 1
+        out[code_at] = code
+        out[i] = 0
+        return i + 1
+
+    def _push(self, data, n):
+        size = len(self._buf)
+        first = min(n, size - self._head)
+        self._buf[self._head:self._head + first] = data[:first]
+        if n > first:
+            self._buf[:n - first] = data[first:n]
+        self._head = (self._head + n) % size
+        self.used += n
+        self._ready.set()
+
+    async def run(self, stream):
+        """Writer task: drains the ring into `stream` (sys.stdout.buffer)."""
+        poller = select.poll()
+        poller.register(stream, select.POLLOUT)
+        size = len(self._buf)
+        while True:
+            if not self.used:
+                self._ready.clear()
+                await self._ready.wait()
+            if not poller.poll(0):
+                await asyncio.sleep_ms(1)
+                continue
+            n = min(self.used, size - self._tail, CHUNK)
+            n = stream.write(self._view[self._tail:self._tail + n]) or 0 # less on a CDC TX timeout
+            self._tail = (self._tail + n) % size
+            self.used -= n
+            self.sent += n
+            await asyncio.sleep_ms(0)
@@ -0,0 +1,170 @@
+import math
+import struct
+import time
+from ulora import FLAGS_BEACON, BROADCAST_ADDRESS, time_on_air_ms
+
+# Beacon-synchronized TDMA for a gateway and many transmitters.
+#
+# The gateway broadcasts a beacon (RadioHead flags: FLAGS_BEACON) at the start
+# of every frame:
+#   [seq, period_ms (u32), slot_ms (u16), join_slots] + one address per slot
+# Slot i starts i * slot_ms after the end of the beacon and belongs to the
+# address at position i. After the assigned slots come join_slots contention
+# slots, where nodes without a slot send (ALOHA, with binary exponential
+# backoff over frames) until the gateway hears them and assigns them one in
+# the next beacon. The frame then idles until the next beacon, period_ms
+# after this one.
+#
+# A slot fits one data frame, its ACK, a TX/RX turnaround on each side and a
+# guard for beacon reception latency and clock drift.
+
+BEACON_FORMAT = "<BIHB"
+BEACON_HEADER_LEN = struct.calcsize(BEACON_FORMAT)
+DATA_FRAME_LEN = 4 + 24 # RadioHead header + "T:xx.x,H:xx.x,D:xx.x" with some slack
+ACK_FRAME_LEN = 4 + 1
+TURNAROUND_MS = 15
+GUARD_MS = 20
+JOIN_SLOTS = 2
+MAX_MISSED_BEACONS = 3 # a node extrapolates this many frames before losing sync
+MAX_JOIN_BACKOFF = 4 # join attempts spread over up to 2**4 frames
+
+
+def slot_ms(modem_config, frame_len=DATA_FRAME_LEN, guard_ms=GUARD_MS):
+    airtime = time_on_air_ms(frame_len, modem_config) + time_on_air_ms(ACK_FRAME_LEN, modem_config)
+    return int(math.ceil(airtime + 2 * TURNAROUND_MS + guard_ms))
+
+
+def encode_beacon(seq, period_ms, slot_len, addresses, join_slots=JOIN_SLOTS):
+    return struct.pack(BEACON_FORMAT, seq & 0xff, period_ms, slot_len, join_slots) + bytes(addresses)
+
+
+def decode_beacon(payload):
+    # Returns (seq, period_ms, slot_ms, join_slots, addresses)
+    seq, period_ms, slot_len, join_slots = struct.unpack(BEACON_FORMAT, payload[:BEACON_HEADER_LEN])
+    return seq, period_ms, slot_len, join_slots, bytes(payload[BEACON_HEADER_LEN:])
+
+
+class Schedule(object):
+    def __init__(self, modem_config, period_ms, max_slots=16, join_slots=JOIN_SLOTS):
+        """
+        Schedule(modem_config, period_ms, max_slots=16, join_slots=JOIN_SLOTS)
+        Gateway side: assigns slots and builds beacons.
+        period_ms: beacon interval, stretched if the slots do not fit in it
+        max_slots: assigned slots per frame; further nodes stay in the join slots
+        """
+        self.modem_config = modem_config
+        self.slot_ms = slot_ms(modem_config)
+        self.min_period_ms = period_ms
+        self.max_slots = max_slots
+        self.join_slots = join_slots
+        self._slots = [] # address per slot, in slot order
+        self._heard = {} # address -> ticks_ms of its last frame
+        self.seq = 0
+
+    @property
+    def addresses(self):
+        return self._slots
+
+    def assign(self, address):
+        # Call for every frame heard. Returns the slot of address, giving it a
+        # new one if there is room, else None
+        self._heard[address] = time.ticks_ms()
+        if address in self._slots:
+            return self._slots.index(address)
+        if address == BROADCAST_ADDRESS or len(self._slots) >= self.max_slots:
+            return None
+        self._slots.append(address)
+        return len(self._slots) - 1
+
+    def release(self, address):
+        self._heard.pop(address, None)
+        if address in self._slots:
+            self._slots.remove(address)
+
+    def expire(self, now=None):
+        # Frees the slots of nodes silent for longer than a node stays in sync
+        if now is None:
+            now = time.ticks_ms()
+        limit = (MAX_MISSED_BEACONS + 1) * self.period_ms
+        for address in [a for a, t in self._heard.items() if time.ticks_diff(now, t) > limit]:
+            self.release(address)
+
+    @property
+    def period_ms(self):
+        beacon = time_on_air_ms(4 + BEACON_HEADER_LEN + len(self._slots), self.modem_config)
+        needed = beacon + TURNAROUND_MS + (len(self._slots) + self.join_slots) * self.slot_ms
+        return max(self.min_period_ms, int(math.ceil(needed)))
+
+    def beacon(self):
+        self.seq = (self.seq + 1) & 0xff
+        return encode_beacon(self.seq, self.period_ms, self.slot_ms, self._slots, self.join_slots)
+
+    def send_beacon(self, lora):
+        payload = self.beacon()
+        lora.send(payload, BROADCAST_ADDRESS, header_id=self.seq, header_flags=FLAGS_BEACON)
+        lora.wait_packet_sent()
+        lora.set_mode_rx()
+
+
+class SlotClock(object):
+    def __init__(self, address, rand=None):
+        """
+        SlotClock(address, rand=None)
+        Transmitter side: follows the beacons and tells when this node may send.
+        rand: callable returning an int, used to pick a join slot
+        """
+        self.address = address
+        self._rand = rand
+        self._beacon_ticks = None
+        self._period_ms = 0
+        self._next = None # ticks_ms of the next slot not used yet
+        self.assigned = False
+        self._joins = 0 # join attempts without getting a slot
+        self.beacons = 0
+
+    def on_beacon(self, payload, rx_ticks=None):
+        # Call with the message of a FLAGS_BEACON frame, as soon as it arrives
+        if rx_ticks is None:
+            rx_ticks = time.ticks_ms()
+        seq, period_ms, slot_len, join_slots, addresses = decode_beacon(payload)
+        self._beacon_ticks = rx_ticks
+        self._period_ms = period_ms
+        self.beacons += 1
+        if self.address in addresses:
+            slot = addresses.index(self.address)
+            self.assigned = True
+            self._joins = 0
+        else:
+            # Pick one of join_slots << joins choices; only the first
+            # join_slots are slots in this frame, the rest wait for a later one
+            pick = self._rand() if self._rand else time.ticks_us()
+            choice = pick % (max(join_slots, 1) << min(self._joins, MAX_JOIN_BACKOFF))
+            self.assigned = False
+            if choice >= join_slots:
+                self._next = None
+                return
+            self._joins += 1
+            slot = len(addresses) + choice
+        self._next = time.ticks_add(rx_ticks, slot * slot_len)
+
+    @property
+    def synced(self):
+        if self._beacon_ticks is None:
+            return False
+        return time.ticks_diff(time.ticks_ms(), self._beacon_ticks) < (MAX_MISSED_BEACONS + 1) * self._period_ms
+
+    def delay_ms(self, now=None):
+        # Milliseconds until this node's next slot (<= 0 means send now), or None without sync
+        if not self.synced or self._next is None:
+            return None
+        if now is None:
+            now = time.ticks_ms()
+        # Too late for this slot (or beacons missed): the slot repeats every period
+        while time.ticks_diff(now, self._next) > GUARD_MS // 2:
+            self._next = time.ticks_add(self._next, self._period_ms)
+        return time.ticks_diff(self._next, now)
+
+    def used(self):
+        # Call after sending in the slot, so the next one is a period later
+        if self._next is not None:
+            self._next = time.ticks_add(self._next, self._period_ms)
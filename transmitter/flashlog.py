@@ -0,0 +1,195 @@
+import os
+import struct
+from binascii import crc32
+
+# Store-and-forward log of fixed-size records in flash, for readings that
+# could not be sent; it survives machine.reset() and power cycles.
+#
+# Records are appended to segment files "<prefix><n>", n counting up. New
+# records collect in a RAM page and are written with one append when PAGE
+# bytes fill up (or on flush()), so the flash is programmed once per page
+# instead of once per reading. A reset loses at most the unwritten page:
+# call flush() before a deliberate reset or deepsleep. A segment holds
+# SEGMENT_PAGES pages (about 4 KB, one erase block of the RP2040 flash and of
+# its LittleFS filesystem); when it is full the log moves on to a new one.
+#
+# Records leave the log only through ACKs: peek() returns the oldest ones
+# and ack(n) moves the read cursor past them. Segments are never rewritten:
+# a fully acknowledged segment is deleted, so the log is truncated a block
+# at a time, and records acknowledged while still in the RAM page never
+# reach the flash. With `segments` segments in use the oldest is deleted to
+# make room (counted in `dropped`), keeping the newest readings.
+#
+# The read position inside the oldest segment is saved at most every
+# CURSOR_EVERY acks, in two slot files written alternately with a sequence
+# number and a CRC, so a torn write leaves the previous position. After a
+# reset up to CURSOR_EVERY records may be sent again; a deleted segment needs
+# no cursor write, since the next segment is read from its start.
+#
+# Wear: LittleFS already spreads block erases over the filesystem, so the
+# log's part is to program and erase less: whole pages, whole-block
+# truncation, no in-place rewrites and cursor writes amortized over many
+# ACKs. page_writes and cursor_writes count the flash writes.
+
+PAGE = 256 # RP2040 flash program page
+SEGMENT_PAGES = 16 # 4 KB erase block
+CURSOR_EVERY = 32
+CURSOR_FORMAT = "<IIIH" # sequence, segment, records read in it, boot count
+CURSOR_LEN = struct.calcsize(CURSOR_FORMAT)
+
+
+class FlashLog(object):
+    def __init__(self, fmt, prefix="log", segments=16):
+        """
+        FlashLog(fmt, prefix="log", segments=16)
+        fmt: struct format of a record, e.g. "<HIhhh"
+        prefix: file name prefix of the segments and of the cursor slots
+        segments: segments kept at most, each about 4 KB of flash
+        """
+        self.fmt = fmt
+        self.record_len = struct.calcsize(fmt)
+        self.per_page = PAGE // self.record_len
+        self.per_segment = self.per_page * SEGMENT_PAGES
+        self.prefix = prefix
+        self.max_segments = segments
+        self._page = bytearray(self.per_page * self.record_len)
+        self._page_view = memoryview(self._page)
+        self._page_count = 0 # records in the RAM page
+        self._segments = [] # [number, records on flash], oldest first
+        self._tail_open = True # False after a torn write: append to a new segment
+        self._read = 0 # records already acknowledged in the oldest segment
+        self._first = 0 # number of the next segment when none is left
+        self._unsaved = 0 # acks since the cursor was saved
+        self._cursor_seq = 0
+        self.appended = 0
+        self.dropped = 0
+        self.page_writes = 0
+        self.cursor_writes = 0
+        self._load()
+
+    def _path(self, number):
+        return self.prefix + str(number)
+
+    def _load(self):
+        seq, first, read, boot = 0, 0, 0, 0
+        for slot in (0, 1):
+            try:
+                with open(self.prefix + "c" + str(slot), "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if len(data) == CURSOR_LEN + 4 and \
+                    struct.unpack_from("<I", data, CURSOR_LEN)[0] == crc32(data[:CURSOR_LEN]) & 0xffffffff:
+                cursor = struct.unpack_from(CURSOR_FORMAT, data)
+                if cursor[0] >= seq:
+                    seq, first, read, boot = cursor
+        self._cursor_seq = seq
+        self._first = first
+        numbers = []
+        n = len(self.prefix)
+        for name in os.listdir():
+            if name.startswith(self.prefix) and name[n:].isdigit():
+                numbers.append(int(name[n:]))
+        numbers.sort()
+        for number in numbers:
+            if number < first:
+                os.remove(self._path(number)) # acknowledged before a reset
+                continue
+            size = os.stat(self._path(number))[6]
+            self._segments.append([number, size // self.record_len])
+            self._tail_open = size % self.record_len == 0
+        if self._segments and self._segments[0][0] == first:
+            self._read = min(read, self._segments[0][1])
+        # One cursor write per boot, which also makes it match the segments found
+        self.boot = (boot + 1) & 0xffff
+        self._save_cursor()
+
+    def __len__(self):
+        return sum(seg[1] for seg in self._segments) - self._read + self._page_count
+
+    def append(self, *values):
+        # Queues one record; the RAM page goes to flash when full
+        struct.pack_into(self.fmt, self._page, self._page_count * self.record_len, *values)
+        self._page_count += 1
+        self.appended += 1
+        if self._page_count == self.per_page:
+            self.flush()
+
+    def flush(self):
+        # Writes the RAM page (a partial one too) to the tail segment
+        count = self._page_count
+        done = 0
+        while done < count:
+            if not self._segments or not self._tail_open or self._segments[-1][1] >= self.per_segment:
+                self._rotate()
+            seg = self._segments[-1]
+            n = min(count - done, self.per_segment - seg[1])
+            with open(self._path(seg[0]), "ab") as f:
+                f.write(self._page_view[done * self.record_len:(done + n) * self.record_len])
+            seg[1] += n
+            done += n
+            self.page_writes += 1
+        self._page_count = 0
+
+    def _rotate(self):
+        number = self._segments[-1][0] + 1 if self._segments else self._first
+        if len(self._segments) >= self.max_segments:
+            # Log full: the oldest readings make room for the new ones
+            oldest = self._segments.pop(0)
+            self.dropped += oldest[1] - self._read
+            os.remove(self._path(oldest[0]))
+            self._read = 0
+        self._segments.append([number, 0])
+        self._tail_open = True
+
+    def peek(self, n=1):
+        # Up to n oldest unacknowledged records, as tuples
+        out = []
+        skip = self._read
+        for number, count in self._segments:
+            if len(out) >= n:
+                break
+            k = min(n - len(out), count - skip)
+            if k > 0:
+                with open(self._path(number), "rb") as f:
+                    f.seek(skip * self.record_len)
+                    data = f.read(k * self.record_len)
+                for i in range(k):
+                    out.append(struct.unpack_from(self.fmt, data, i * self.record_len))
+            skip = 0
+        for i in range(min(n - len(out), self._page_count)):
+            out.append(struct.unpack_from(self.fmt, self._page, i * self.record_len))
+        return out
+
+    def ack(self, n=1):
+        # The n oldest records were delivered: fully read segments are deleted
+        while n and self._segments:
+            seg = self._segments[0]
+            k = min(n, seg[1] - self._read)
+            self._read += k
+            self._unsaved += k
+            n -= k
+            if self._read < seg[1]:
+                break
+            self._segments.pop(0)
+            os.remove(self._path(seg[0]))
+            self._first = seg[0] + 1
+            self._read = 0
+            self._unsaved = 0
+        if n and not self._segments:
+            # Delivered straight from the RAM page, never written
+            n = min(n, self._page_count)
+            size = self.record_len
+            self._page[:(self._page_count - n) * size] = self._page[n * size:self._page_count * size]
+            self._page_count -= n
+        if self._unsaved >= CURSOR_EVERY:
+            self._save_cursor()
+
+    def _save_cursor(self):
+        self._cursor_seq += 1
+        first = self._segments[0][0] if self._segments else self._first
+        data = struct.pack(CURSOR_FORMAT, self._cursor_seq, first, self._read, self.boot)
+        with open(self.prefix + "c" + str(self._cursor_seq & 1), "wb") as f:
+            f.write(data + struct.pack("<I", crc32(data) & 0xffffffff))
+        self._unsaved = 0
+        self.cursor_writes += 1
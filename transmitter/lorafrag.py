@@ -0,0 +1,255 @@
+import time
+from ulora import FLAGS_ACK, FLAGS_FRAG, FLAGS_SACK_REQ, BROADCAST_ADDRESS
+
+# Fragmentation, reassembly and windowed selective-repeat ARQ for messages
+# larger than one LoRa frame.
+#
+# Fragment frame (RadioHead flags: FLAGS_FRAG, plus FLAGS_SACK_REQ on the last
+# fragment of each burst):
+#   [msg_id, index, count] + data
+# Selective ACK frame (RadioHead flags: FLAGS_ACK | FLAGS_FRAG):
+#   [msg_id, count, cum] + bitmap
+# cum is the cumulative ACK (every fragment below it was received) and bit i
+# of the bitmap (byte i // 8) reports fragment cum + 1 + i, so one SACK acks
+# a whole window.
+#
+# The sender keeps up to `window` fragments in flight: it sends the missing
+# ones in [base, base + window) back to back, asks for a SACK on the last one,
+# and slides the window when the SACK arrives.
+#
+# Choosing the window (SF7/125 kHz, 251-byte fragments ~400 ms on air, SACK
+# ~40 ms, plus ~10-20 ms of half-duplex turnaround on each side):
+# - Each burst costs one turnaround and one SACK, so with no loss the link is
+#   busy with data W*T_frag / (W*T_frag + T_sack + 2*T_turn) of the time:
+#   ~85% for W=1 (stop-and-wait), ~98% for W=4, ~99% for W=8.
+# - A lost fragment-with-SACK-request costs a whole SACK timeout, so with high
+#   loss larger windows mostly save turnarounds while the timeouts dominate.
+# - The receiver holds up to `count` fragments per message anyway, so the
+#   window is bounded by airtime, not by memory: keep W*T_frag well below the
+#   duty-cycle budget and any TDMA slot, e.g. W=4 at SF7 and W=1-2 at SF10+,
+#   where a single fragment already takes over a second.
+# See host/sim_arq.py for goodput against loss rate for several windows.
+
+FRAG_HEADER_LEN = 3
+MAX_FRAME_PAYLOAD = 251 # 255-byte FIFO minus the 4-byte RadioHead header
+MAX_FRAGMENT = MAX_FRAME_PAYLOAD - FRAG_HEADER_LEN
+MAX_FRAGMENTS = 255
+WINDOW = 4
+SACK_BITMAP_BYTES = 8 # selective part covers the 64 fragments after cum
+
+
+def fragment(data, msg_id, size=MAX_FRAGMENT):
+    count = (len(data) + size - 1) // size or 1
+    if count > MAX_FRAGMENTS:
+        raise ValueError("message too large")
+    return [bytes([msg_id, i, count]) + data[i * size:(i + 1) * size] for i in range(count)]
+
+
+def encode_sack(msg_id, count, received):
+    # received: bitmap of every fragment received so far
+    cum = 0
+    while cum < count and received & (1 << cum):
+        cum += 1
+    span = min(count - cum - 1, 8 * SACK_BITMAP_BYTES) if cum < count else 0
+    rest = received >> (cum + 1)
+    return bytes([msg_id, count, cum]) + bytes((rest >> (8 * i)) & 0xff for i in range((span + 7) // 8))
+
+
+def decode_sack(payload):
+    # Returns (msg_id, count, bitmap of acknowledged fragments)
+    cum = payload[2]
+    bitmap = (1 << cum) - 1
+    for i, b in enumerate(payload[3:]):
+        bitmap |= b << (cum + 1 + 8 * i)
+    return payload[0], payload[1], bitmap & ((1 << payload[1]) - 1)
+
+
+class Sender(object):
+    def __init__(self, data, msg_id, size=MAX_FRAGMENT, window=WINDOW):
+        """
+        Sender(data, msg_id, size=MAX_FRAGMENT, window=WINDOW)
+        Keeps track of which fragments of one message were acknowledged.
+        window: fragments in flight per SACK
+        """
+        self.msg_id = msg_id
+        self.window = window
+        self.frames = fragment(data, msg_id, size)
+        self.count = len(self.frames)
+        self.acked = 0 # bitmap of acknowledged fragments
+
+    @property
+    def done(self):
+        return self.acked == (1 << self.count) - 1
+
+    @property
+    def base(self):
+        # lowest unacknowledged fragment
+        i = 0
+        while i < self.count and self.acked & (1 << i):
+            i += 1
+        return i
+
+    def pending(self):
+        # unacknowledged fragments inside the current window
+        base = self.base
+        return [i for i in range(base, min(base + self.window, self.count)) if not self.acked & (1 << i)]
+
+    def on_sack(self, payload):
+        # Returns the number of newly acknowledged fragments
+        msg_id, count, bitmap = decode_sack(payload)
+        if msg_id != self.msg_id or count != self.count:
+            return 0
+        new = bitmap & ~self.acked
+        self.acked |= bitmap
+        n = 0
+        while new:
+            n += new & 1
+            new >>= 1
+        return n
+
+
+class Reassembler(object):
+    def __init__(self, timeout_ms=5000, max_messages=4):
+        """
+        Reassembler(timeout_ms=5000, max_messages=4)
+        timeout_ms: drop a partial message if no fragment arrives for this long, and
+        forget a completed one this long after its last fragment
+        max_messages: partial (and completed) messages kept at once; the oldest is dropped when full
+        """
+        self.timeout_ms = timeout_ms
+        self.max_messages = max_messages
+        # (header_from, msg_id) -> [count, bitmap, parts, last fragment ticks_ms]
+        self._partial = {}
+        # recently completed messages, so late retransmissions are acked but not redelivered:
+        # (header_from, msg_id) -> [count, hash of each fragment, completion ticks_ms]
+        self._done = {}
+        self.completed = 0
+        self.expired = 0
+        self.duplicates = 0
+
+    def feed(self, header_from, payload):
+        # Returns the whole message once its last missing fragment arrives, else None
+        if len(payload) < FRAG_HEADER_LEN:
+            return None
+        msg_id, index, count = payload[0], payload[1], payload[2]
+        key = (header_from, msg_id)
+        now = time.ticks_ms()
+        self.expire(now)
+
+        if index >= count:
+            self.duplicates += 1
+            return None
+        done = self._done.get(key)
+        if done is not None:
+            if done[0] == count and done[1][index] == hash(payload[FRAG_HEADER_LEN:]):
+                self.duplicates += 1
+                return None
+            # Same msg_id but another count or content: the sender moved on to a new message
+            del self._done[key]
+
+        entry = self._partial.get(key)
+        if entry is None or entry[0] != count:
+            if len(self._partial) >= self.max_messages:
+                oldest = min(self._partial, key=lambda k: self._partial[k][3])
+                del self._partial[oldest]
+                self.expired += 1
+            entry = [count, 0, [None] * count, now]
+            self._partial[key] = entry
+
+        if entry[1] & (1 << index):
+            self.duplicates += 1
+            return None
+        entry[1] |= 1 << index
+        entry[2][index] = bytes(payload[FRAG_HEADER_LEN:])
+        entry[3] = now
+
+        if entry[1] != (1 << count) - 1:
+            return None
+
+        del self._partial[key]
+        if len(self._done) >= self.max_messages:
+            del self._done[min(self._done, key=lambda k: self._done[k][2])]
+        self._done[key] = [count, tuple(hash(part) for part in entry[2]), now]
+        self.completed += 1
+        return b''.join(entry[2])
+
+    def sack(self, header_from, msg_id, count):
+        # Selective ACK payload for (header_from, msg_id)
+        key = (header_from, msg_id)
+        entry = self._partial.get(key)
+        if entry is None and key in self._done and self._done[key][0] == count:
+            return encode_sack(msg_id, count, (1 << count) - 1)
+        return encode_sack(msg_id, count, entry[1] if entry else 0)
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.ticks_ms()
+        for key in [k for k, e in self._partial.items() if time.ticks_diff(now, e[3]) > self.timeout_ms]:
+            del self._partial[key]
+            self.expired += 1
+        for key in [k for k, e in self._done.items() if time.ticks_diff(now, e[2]) > self.timeout_ms]:
+            del self._done[key]
+
+
+def handle_fragment(lora, reassembler, payload):
+    """
+    Call from on_recv for frames with FLAGS_FRAG. Answers SACK requests and
+    returns the reassembled message when complete, else None.
+    """
+    message = reassembler.feed(payload.header_from, payload.message)
+    if payload.header_flags & FLAGS_SACK_REQ and len(payload.message) >= FRAG_HEADER_LEN:
+        sack = reassembler.sack(payload.header_from, payload.message[0], payload.message[2])
+        lora.send(sack, payload.header_from, header_id=payload.header_id, header_flags=FLAGS_ACK | FLAGS_FRAG)
+        lora.wait_packet_sent()
+        lora.set_mode_rx()
+    return message
+
+
+def send_message(lora, data, header_to, window=WINDOW, retries=4, sack_timeout=None):
+    """
+    Send `data` of any length up to MAX_FRAGMENTS * MAX_FRAGMENT bytes with up
+    to `window` fragments in flight per SACK. Gives up after `retries` bursts
+    in a row that acknowledge nothing new.
+    Returns True once every fragment was acknowledged.
+    Raises ValueError with the Compact link profile, whose 2-byte header has no FLAGS_FRAG
+    and whose fixed payload is too short for a fragment.
+    """
+    if lora.link_profile[0] or lora.link_profile[2]:
+        raise ValueError("fragments need the standard link profile (explicit header and RadioHead flags)")
+    lora._last_header_id = (lora._last_header_id + 1) & 0xff
+    sender = Sender(data, lora._last_header_id, window=window)
+    if sack_timeout is None:
+        sack_timeout = lora.retry_timeout * 2
+    timeout_ms = int(sack_timeout * 1000)
+
+    if header_to == BROADCAST_ADDRESS: # nobody answers a broadcast, send each fragment once
+        for frame in sender.frames:
+            lora.send(frame, header_to, header_id=sender.msg_id, header_flags=FLAGS_FRAG)
+        lora.wait_packet_sent()
+        lora.set_mode_rx()
+        return True
+
+    failures = 0
+    while failures <= retries:
+        pending = sender.pending()
+        seen = lora._last_payload
+        for n, i in enumerate(pending):
+            flags = FLAGS_FRAG | (FLAGS_SACK_REQ if n == len(pending) - 1 else 0)
+            if not lora.send(sender.frames[i], header_to, header_id=sender.msg_id, header_flags=flags):
+                lora.set_mode_rx() # not sent: duty cycle exhausted (see LoRa.airtime_wait_ms) or radio stuck in TX
+                return False
+        lora.wait_packet_sent()
+        lora.set_mode_rx()
+
+        progress = 0
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+            p = lora._last_payload
+            if p is not seen and p.header_from == header_to and p.header_id == sender.msg_id and \
+                    p.header_flags & FLAGS_ACK and p.header_flags & FLAGS_FRAG:
+                progress = sender.on_sack(p.message)
+                break
+        if sender.done:
+            return True
+        failures = 0 if progress else failures + 1
+    return False
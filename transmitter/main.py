@@ -2,29 +2,41 @@
 """
 Projeto Final BitDogLab - Integrado com LoRa
 """
-import bluetooth
-import ubluetooth
-from ble_advertising import advertising_payload
-from machine import Pin, ADC, SoftI2C, I2C, SPI
 import utime
+_T_BOOT = utime.ticks_ms()  # Referência para medir os tempos de boot
+
+# Apenas o necessário para o boot; bluetooth e ble_advertising são
+# importados na criação do BitDogBLE
+import micropython
+from micropython import const
+from machine import Pin, ADC, SoftI2C, I2C
 import math
-import ujson
-import random
 import machine
 import struct
-import bmp280
 import ahtx0
 from ssd1306 import SSD1306_I2C
 import neopixel
-from ulora import LoRa, ModemConfig, SPIConfig
+from ulora import LoRa, ModemConfig, SPIConfig, LinkProfile, FLAGS_BEACON, FLAGS_BATCH
+import tdma
+import adr
+import flashlog
+
+# Perfilamento (prof.py): 1 mede as etapas do laço, mostra os tempos no OLED
+# com o botão A pressionado e os publica numa característica BLE de depuração;
+# 0 remove as medições na compilação
+_PROF = const(0)
+if _PROF:
+    import prof
 
 # ========================
 # UUIDs Globais (BLE)
 # ========================
-ENV_SERVICE_UUID = ubluetooth.UUID(0x181A)  # Environmental Sensing Service
-TEMP_CHAR_UUID = ubluetooth.UUID(0x2A6E)    # Temperature (IEEE 11073-10101)
-HUM_CHAR_UUID = ubluetooth.UUID(0x2A6F)     # Humidity (Percentage)
-SOUND_CHAR_UUID = ubluetooth.UUID('00002B06-0000-1000-8000-00805F9B34FB')  # Sound Level (Custom)
+ENV_SERVICE_UUID = 0x181A  # Environmental Sensing Service
+TEMP_CHAR_UUID = 0x2A6E    # Temperature (IEEE 11073-10101)
+HUM_CHAR_UUID = 0x2A6F     # Humidity (Percentage)
+SOUND_CHAR_UUID = '00002B06-0000-1000-8000-00805F9B34FB'  # Sound Level (Custom)
+PROF_SERVICE_UUID = 0xFFF0  # Depuração: prof.snapshot() (só com _PROF)
+PROF_CHAR_UUID = 0xFFF1
 
 # ========================
 # Configurações Globais
@@ -40,6 +52,7 @@ class Config:
     COLOR_HUM = (0, 0, 50)
     COLOR_WAITING = (0, 0, 50)
     COLOR_CONNECTED = (0, 50, 0)
+    CONNECTION_PATTERN_MS = 2000  # Tempo que a matriz mostra o padrão de conexão/desconexão BLE
     
     MATRIX_SIZE = 5
     NUM_LEDS = 25
@@ -48,6 +61,38 @@ class Config:
     NUM_SAMPLES = 500
     SENSOR_UPDATE_INTERVAL = 2 # Intervalo para atualização BLE e LoRa
 
+    # Modo de baixo consumo: acorda, mede, envia um quadro LoRa e dorme
+    LOW_POWER = False
+    LOW_POWER_INTERVAL = 60   # Intervalo entre medições em segundos
+    LOW_POWER_LIGHTSLEEP = False  # True: lightsleep (mantém a RAM); False: deepsleep
+    STATE_FILE = "estado.bin"  # Usado quando não há memória RTC
+
+    # Modo TDMA: envia só no slot anunciado pelo beacon do receptor (gateway
+    # com TDMA = True), em vez de a cada SENSOR_UPDATE_INTERVAL
+    TDMA = False
+    TDMA_LOOKAHEAD_MS = 500  # Se o slot começa em até esse tempo, dorme até ele
+
+    # Taxa de dados adaptativa: usa o ModemConfig mais rápido e a menor potência
+    # que mantêm a margem do enlace, pelo SNR/RSSI que o receptor devolve no ACK
+    ADR = False
+    ADR_DATA_RATE = True  # False: adapta só a potência (gateway com vários nós ou TDMA)
+    ADR_TARGET_MARGIN_DB = 10
+
+    # Limite de ciclo de trabalho (fração de cada hora no ar, ex.: 0.01 para
+    # o 1% da banda europeia de 868 MHz). Quando o orçamento acaba, a leitura
+    # não é enviada e fica para o próximo intervalo. None: só contabiliza
+    DUTY_CYCLE = None
+
+    # Store-and-forward: leituras não enviadas (LoRa fora ou sem ACK) vão para
+    # um log na flash e são reenviadas, da mais antiga e em lotes, quando o
+    # enlace volta, sem atrasar as leituras ao vivo. Desligado com TDMA: o slot
+    # só comporta a leitura ao vivo e seu ACK, e o backlog nunca seria reenviado.
+    # Com LinkProfile.Compact (sem flags, sem a idade) as leituras ficam na
+    # flash e não são reenviadas
+    STORE_AND_FORWARD = True
+    BACKLOG_SEGMENTS = 16    # Até 16 x 4 KB de flash (~4600 leituras); depois descarta as mais antigas
+    BACKLOG_DRAIN_MS = 1000  # Tempo máximo de reenvio por volta do laço principal
+
 # ========================
 # Configurações LoRa
 # ========================
@@ -58,21 +103,39 @@ RFM95_INT = 20  # Pino de interrupção (DIO0)
 RF95_FREQ = 915.0  # Frequência em MHz (ajuste conforme a sua região)
 CLIENT_ADDRESS = 1
 SERVER_ADDRESS = 2
+# Perfil do enlace (igual nos dois nós). LinkProfile.Compact manda as leituras
+# num quadro binário fixo de 6 bytes (SENSOR_FRAME) com cabeçalho implícito e
+# cabeçalho de 2 bytes: ~34 ms no ar em SF7, contra ~62 ms do texto no
+# Standard. Não suporta histórico fragmentado, TDMA nem endereços acima de 14.
+LINK_PROFILE = LinkProfile.Standard
+SENSOR_FRAME = "<hhh"  # temperatura, umidade e dB, x10
+BACKLOG_FORMAT = "<HIhhh"  # boot, instante (s), temperatura, umidade e dB x10
+BATCH_RECORD = "<Ihhh"  # leitura num lote do backlog: idade (s), temperatura, umidade e dB x10
+BATCH_SIZE = struct.calcsize(BATCH_RECORD)
+AGE_UNKNOWN = 0xffffffff  # leitura de um boot anterior: o relógio recomeçou
 
 # ========================
 # Inicialização do Hardware
 # ========================
-# Configuração do sensor BME280 na interface I2C0 (pinos GPIO0 SDA, GPIO1 SCL)
-i2c = I2C(0, sda=Pin(0), scl=Pin(1), freq=400000)
-aht20 = ahtx0.AHT20(i2c)
-
-i2c1 = SoftI2C(scl=Pin(15), sda=Pin(14), freq=400000)
-oled = SSD1306_I2C(128, 64, i2c1)
-oled.fill(0)
-oled.text("Iniciando...", 0, 0)
-oled.show()
+# Os periféricos são criados sob demanda pelas etapas de boot abaixo, e não
+# na importação. Assim cada modo de operação liga só o que usa.
+i2c = None
+aht20 = None
+oled = None
+np = None
+joystick_y = None
+button_a = None
+button_b = None
+mic = None
+lora = None
+backlog = None  # flashlog.FlashLog das leituras não enviadas
+connection_shown_until = None  # ticks_ms até quando a matriz mantém o padrão de conexão BLE
+batch_buf = bytearray(251)  # Lote do backlog sendo montado
+slot_clock = tdma.SlotClock(CLIENT_ADDRESS)
+# O cabeçalho compacto não leva o FLAGS_ADR do pedido de troca de ModemConfig
+adr_control = adr.Controller(target_margin_db=Config.ADR_TARGET_MARGIN_DB,
+                             adapt_rate=Config.ADR_DATA_RATE and not Config.TDMA and not LINK_PROFILE[2])
 
-np = neopixel.NeoPixel(Pin(7), Config.NUM_LEDS)
 LED_MATRIX = [
     [24, 23, 22, 21, 20],
     [15, 16, 17, 18, 19],
@@ -89,12 +152,6 @@ NOISE_LEVELS = [
     [4, 20, 0, 24]       # Círculo externo
 ]
 
-# Controles
-joystick_y = ADC(Pin(26))
-button_a = Pin(5, Pin.IN, Pin.PULL_UP)
-button_b = Pin(6, Pin.IN, Pin.PULL_UP)
-mic = ADC(Pin(28))
-
 # Histórico de dados
 history = {
     "temp": [22] * Config.HISTORY_SIZE,
@@ -102,23 +159,130 @@ history = {
     "db": [40] * Config.HISTORY_SIZE
 }
 
-# Inicializa o LoRa
-try:
-    lora = LoRa(RFM95_SPIBUS, RFM95_INT, CLIENT_ADDRESS, RFM95_CS, reset_pin=RFM95_RST, freq=RF95_FREQ, tx_power=20, modem_config=ModemConfig.Bw125Cr45Sf128)
-    print("LoRa inicializado com sucesso!")
-except Exception as e:
-    print(f"Erro ao inicializar LoRa: {e}")
-    lora = None # Define lora como None para indicar falha
+def init_mic():
+    global mic
+    mic = ADC(Pin(28))
+
+def init_sensors():
+    global i2c, aht20
+    # Sensor AHT20 na interface I2C0 (pinos GPIO0 SDA, GPIO1 SCL)
+    i2c = I2C(0, sda=Pin(0), scl=Pin(1), freq=400000)
+    aht20 = ahtx0.AHT20(i2c)
+
+def init_display():
+    global oled
+    i2c1 = SoftI2C(scl=Pin(15), sda=Pin(14), freq=400000)
+    oled = SSD1306_I2C(128, 64, i2c1)
+    if _PROF:
+        oled.show = prof.wrap(prof.OLED, oled.show)
+    oled.fill(0)
+    oled.text("Iniciando...", 0, 0)
+    oled.show()
+
+def init_leds():
+    global np
+    np = neopixel.NeoPixel(Pin(7), Config.NUM_LEDS)
+    if _PROF:
+        np.write = prof.wrap(prof.NEOPIXEL, np.write)
+
+def init_controls():
+    global joystick_y, button_a, button_b
+    joystick_y = ADC(Pin(26))
+    button_a = Pin(5, Pin.IN, Pin.PULL_UP)
+    button_b = Pin(6, Pin.IN, Pin.PULL_UP)
+
+def init_backlog():
+    global backlog
+    if not Config.STORE_AND_FORWARD or Config.TDMA:
+        return  # No TDMA não sobra tempo no slot para reenviar: guardar só encheria a flash
+    try:
+        backlog = flashlog.FlashLog(BACKLOG_FORMAT, "backlog", Config.BACKLOG_SEGMENTS)
+        if len(backlog) and backlog_forwarded():
+            print("Backlog:", len(backlog), "leituras pendentes na flash")
+        elif len(backlog):
+            print("Backlog:", len(backlog), "leituras na flash, sem reenvio neste perfil de enlace")
+    except Exception as e:
+        print("Erro ao abrir o backlog:", e)
+        backlog = None
+
+def start_lora():
+    """Dispara o reset do rádio sem esperar; finish_lora() conclui a configuração."""
+    global lora
+    try:
+        # No modo TDMA o rádio também precisa receber os beacons (broadcast)
+        lora = LoRa(RFM95_SPIBUS, RFM95_INT, CLIENT_ADDRESS, RFM95_CS, reset_pin=RFM95_RST, freq=RF95_FREQ,
+                    tx_power=20, modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=Config.TDMA, deferred=True,
+                    link_profile=LINK_PROFILE)
+    except Exception as e:
+        print(f"Erro ao inicializar LoRa: {e}")
+        lora = None # Define lora como None para indicar falha
+
+def finish_lora():
+    global lora
+    if lora is None:
+        return
+    try:
+        lora.finish_init()
+        lora.set_duty_cycle(Config.DUTY_CYCLE)
+        if Config.TDMA:
+            lora.on_recv = on_lora_recv
+            lora.set_mode_rx()
+        print("LoRa inicializado com sucesso!")
+    except Exception as e:
+        print(f"Erro ao inicializar LoRa: {e}")
+        lora = None
+
+def on_lora_recv(payload):
+    # Beacon do receptor: marca o início do quadro TDMA
+    if payload.header_flags & FLAGS_BEACON and payload.header_from == SERVER_ADDRESS:
+        slot_clock.on_beacon(payload.message)
+
+def wait_for_slot():
+    """
+    Dorme até o slot TDMA deste nó se ele começar em até TDMA_LOOKAHEAD_MS.
+    Retorna True quando é hora de enviar.
+    """
+    delay = slot_clock.delay_ms()
+    if delay is None or delay > Config.TDMA_LOOKAHEAD_MS:
+        return False
+    if delay > 0:
+        utime.sleep_ms(delay)
+    return True
+
+def boot(steps):
+    """
+    Inicializa os periféricos pedidos enquanto o rádio LoRa cumpre as esperas
+    do reset (~120 ms), em vez de fazer tudo em sequência.
+    """
+    # O microfone (ADC 28) é criado antes do reset do rádio, que usa o mesmo
+    # GPIO 28 como saída, mantendo a ordem da inicialização original
+    if init_mic in steps:
+        init_mic()
+    start_lora()
+    for step in steps:
+        if step is not init_mic:
+            step()
+        if lora:
+            lora.poll_init()
+    finish_lora()
+    print("Boot concluido em", utime.ticks_diff(utime.ticks_ms(), _T_BOOT), "ms")
 
 # ========================
 # Configuração Bluetooth
 # ========================
 class BitDogBLE:
-    def __init__(self):
+    def __init__(self, on_change=None):
+        import bluetooth
+        from ble_advertising import advertising_payload
+        self._advertising_payload = advertising_payload
+        self._env_uuid = bluetooth.UUID(ENV_SERVICE_UUID)
+
         self._ble = bluetooth.BLE()
         self._ble.active(True)
         self._connected = False
         self._conn_handle = None
+        # Chamado pelo agendador (fora da IRQ) a cada conexão/desconexão
+        self._on_change = on_change
 
         # Configuração de segurança
         try:
@@ -128,16 +292,21 @@ class BitDogBLE:
         
         # Registro do serviço com propriedades corretas
         env_service = (
-            ENV_SERVICE_UUID,
+            self._env_uuid,
             [
-                (TEMP_CHAR_UUID, bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,),
-                (HUM_CHAR_UUID, bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,),
-                (SOUND_CHAR_UUID, bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,),
+                (bluetooth.UUID(TEMP_CHAR_UUID), bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,),
+                (bluetooth.UUID(HUM_CHAR_UUID), bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,),
+                (bluetooth.UUID(SOUND_CHAR_UUID), bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,),
             ]
         )
         
         services = (env_service,)
-        ((self._temp_char, self._hum_char, self._sound_char),) = self._ble.gatts_register_services(services)
+        if _PROF:
+            services += ((bluetooth.UUID(PROF_SERVICE_UUID), [(bluetooth.UUID(PROF_CHAR_UUID), bluetooth.FLAG_READ,)]),)
+        handles = self._ble.gatts_register_services(services)
+        ((self._temp_char, self._hum_char, self._sound_char),) = handles[:1]
+        if _PROF:
+            ((self._prof_char,),) = handles[1:]
         
         # Configura os formatos dos dados
         self._ble.gatts_write(self._temp_char, struct.pack('<h', 0))  # Int16
@@ -148,9 +317,9 @@ class BitDogBLE:
         self._advertise()
 
     def _advertise(self):
-        adv_data = advertising_payload(
+        adv_data = self._advertising_payload(
             name=Config.BLE_NAME,
-            services=[ENV_SERVICE_UUID],
+            services=[self._env_uuid],
             appearance=0x0341  # Generic Sensor
         )
         self._ble.gap_advertise(100000, adv_data=adv_data)
@@ -158,17 +327,31 @@ class BitDogBLE:
 
 
     def _irq(self, event, data):
+        # Na IRQ só atualiza o estado; o restante roda via micropython.schedule
+        # para não atrasar o laço de sensoriamento/LoRa
         if event == 1:  # Central conectado
             self._connected = True
             self._conn_handle = data[0]  # salva conn_handle
-            print("Dispositivo BLE conectado!")
-            self._ble.gap_advertise(None)
+            micropython.schedule(self._state_changed, True)
 
         elif event == 2:  # Central desconectado
             self._connected = False
             self._conn_handle = None
+            micropython.schedule(self._state_changed, False)
+
+    def _state_changed(self, connected):
+        if connected:
+            print("Dispositivo BLE conectado!")
+            self._ble.gap_advertise(None)
+        else:
             print("Dispositivo BLE desconectado!")
             self._advertise()
+        if self._on_change:
+            self._on_change(connected)
+
+    @property
+    def connected(self):
+        return self._connected
 
 
     def update_data(self, temp, hum, db):
@@ -177,6 +360,8 @@ class BitDogBLE:
             hum_int = int(hum * 100)    # Umidade
             db_int = int(db)            # Som
 
+            if _PROF:
+                prof.begin(prof.BLE)
             self._ble.gatts_write(self._temp_char, struct.pack('<h', temp_int))
             self._ble.gatts_write(self._hum_char, struct.pack('<h', hum_int))
             self._ble.gatts_write(self._sound_char, struct.pack('<h', db_int))
@@ -185,6 +370,9 @@ class BitDogBLE:
                 self._ble.gatts_notify(self._conn_handle, self._temp_char)
                 self._ble.gatts_notify(self._conn_handle, self._hum_char)
                 self._ble.gatts_notify(self._conn_handle, self._sound_char)
+            if _PROF:
+                prof.end(prof.BLE)
+                self._ble.gatts_write(self._prof_char, prof.snapshot())
 
         except Exception as e:
             print("Erro ao enviar dados BLE:", e)
@@ -192,29 +380,158 @@ class BitDogBLE:
 # ========================
 # Funções LoRa
 # ========================
-def send_lora_message(temp, hum, db):
+def x10(value):
+    return max(-32768, min(32767, round(value * 10)))
+
+def reading_bytes(temp, hum, db):
+    """Mensagem LoRa de uma leitura"""
+    if LINK_PROFILE[0]:
+        # Perfil de tamanho fixo: quadro binário em vez do texto
+        return struct.pack(SENSOR_FRAME, x10(temp), x10(hum), x10(db))
+    return f"T:{temp:.1f},H:{hum:.1f},D:{db:.1f}".encode('utf-8')
+
+def send_lora_message(temp, hum, db, retries=3):
     global lora
+    measured = int(utime.time())  # Instante da leitura, para a idade no backlog
     if lora:
         try:
             # Converte os dados em uma string formatada para envio LoRa
             message_str = f"T:{temp:.1f},H:{hum:.1f},D:{db:.1f}"
-            message_bytes = message_str.encode('utf-8')
+            message_bytes = reading_bytes(temp, hum, db)
             
+            wait = lora.airtime_wait_ms(len(message_bytes))
+            if wait != 0:
+                # Orçamento de tempo no ar esgotado: não conta como falha do enlace, mas
+                # a leitura vai para o backlog como uma não confirmada
+                print("LoRa adiado: ciclo de trabalho esgotado,",
+                      "libera em %d s" % (wait // 1000) if wait else "quadro maior que o orçamento")
+                return store_reading(measured, temp, hum, db)
+
             print(f"Tentando enviar LoRa: {message_str}")
-            if lora.send_to_wait(message_bytes, SERVER_ADDRESS):
+            if lora.send_to_wait(message_bytes, SERVER_ADDRESS, retries=retries):
                 print("Mensagem LoRa enviada com sucesso!")
-            else:
-                print("Falha ao enviar a mensagem LoRa.")
+                if Config.ADR and lora.ack_quality:
+                    update_adr(adr_control.on_ack(*lora.ack_quality))
+                return True
+            print("Falha ao enviar a mensagem LoRa.")
+            if Config.ADR:
+                update_adr(adr_control.on_fail())
         except Exception as e:
             print(f"Erro ao enviar dados via LoRa: {e}")
     else:
         print("LoRa não está inicializado. Dados não enviados via LoRa.")
+    return store_reading(measured, temp, hum, db)
+
+def store_reading(measured, temp, hum, db):
+    """Guarda no backlog uma leitura que não foi confirmada, para reenviar depois"""
+    if backlog is not None:
+        backlog.append(backlog.boot, measured, x10(temp), x10(hum), x10(db))
+        print("Leitura guardada na flash,", len(backlog), "pendentes")
+    return False
+
+def backlog_forwarded():
+    """
+    True se o perfil do enlace leva o lote do backlog (FLAGS_BATCH, com a
+    idade de cada leitura). Com cabeçalho compacto ou tamanho fixo não há
+    flags, e uma leitura antiga chegaria como se fosse ao vivo: o backlog
+    fica na flash, sem reenvio.
+    """
+    return not LINK_PROFILE[0] and not LINK_PROFILE[2]
+
+def backlog_fits(length, deadline):
+    """
+    Um quadro de backlog de `length` bytes cabe agora sem atrasar nem tirar
+    tempo no ar das leituras ao vivo
+    """
+    airtime = lora.time_on_air_ms(length)
+    if deadline is not None:
+        # Pior caso: o quadro mais a folga do TxDone (wait_packet_sent_timeout), a espera
+        # máxima do ACK (2 x retry_timeout, contada do TxDone em ticks_ms) e uma folga do laço
+        worst = airtime + 1000 * (lora.wait_packet_sent_timeout + 2 * lora.retry_timeout) + 50
+        if utime.ticks_diff(deadline, utime.ticks_ms()) < worst:
+            return False
+    if lora.airtime_wait_ms(length) != 0:
+        return False
+    budget = lora.airtime.budget_ms
+    if budget is None:
+        return True
+    # Reserva no orçamento uma janela inteira de leituras ao vivo (tamanho da maior)
+    interval_ms = (Config.LOW_POWER_INTERVAL if Config.LOW_POWER else Config.SENSOR_UPDATE_INTERVAL) * 1000
+    live = lora.time_on_air_ms(len(reading_bytes(-99.9, 100.0, 100.0))) * lora.airtime.window_ms / interval_ms
+    return lora.airtime.used_ms() + airtime + live <= budget
+
+def drain_backlog(deadline=None):
+    """
+    Reenvia o backlog, da leitura mais antiga, no tempo livre do rádio. As
+    leituras vão em lotes no maior quadro (FLAGS_BATCH, BATCH_RECORD cada),
+    encolhidos até caber com a espera do ACK antes de `deadline` (ticks_ms
+    da próxima leitura ao vivo) e no orçamento de tempo no ar além da
+    reserva das leituras ao vivo. Para ao esvaziar, após BACKLOG_DRAIN_MS,
+    sem espaço ou se um lote não for confirmado; cada ACK tira o lote do
+    log. Nos perfis sem flags não reenvia nada (backlog_forwarded). Retorna
+    False se o enlace falhou.
+    """
+    if backlog is None or not lora or not len(backlog) or not backlog_forwarded():
+        return True
+    start = utime.ticks_ms()
+    # Maior quadro: 251 bytes, ou 239 com a criptografia (byte de comprimento e blocos de 16)
+    limit = (239 if lora.crypto else 251) // BATCH_SIZE
+    sent = 0
+    ok = True
+    while len(backlog) and utime.ticks_diff(utime.ticks_ms(), start) < Config.BACKLOG_DRAIN_MS:
+        records = backlog.peek(limit)
+        n = len(records)
+        while n and not backlog_fits(n * BATCH_SIZE, deadline):
+            n -= 1
+        if not n:
+            break
+        now = int(utime.time())
+        for i in range(n):
+            boot, t, temp, hum, db = records[i]
+            # Idade só é conhecida para leituras deste boot (o relógio recomeça no reset)
+            age = max(0, now - t) if boot == backlog.boot else AGE_UNKNOWN
+            struct.pack_into(BATCH_RECORD, batch_buf, i * BATCH_SIZE, age, temp, hum, db)
+        try:
+            ok = lora.send_to_wait(bytes(batch_buf[:n * BATCH_SIZE]), SERVER_ADDRESS,
+                                   header_flags=FLAGS_BATCH, retries=0)
+        except Exception as e:
+            print(f"Erro ao reenviar o backlog: {e}")
+            ok = False
+        if not ok:
+            break
+        backlog.ack(n)
+        sent += n
+    if sent:
+        print("Backlog:", sent, "reenviadas,", len(backlog), "pendentes")
+    return ok
+
+def update_adr(change):
+    """Aplica a nova configuração (preset, potência) decidida pelo ADR, se houver"""
+    if change and adr_control.apply(lora, SERVER_ADDRESS, change):
+        print("ADR: preset", adr_control.preset, "potencia", adr_control.tx_power, "dBm")
+
+def send_history():
+    """Envia o histórico completo (3 x HISTORY_SIZE valores) como uma mensagem fragmentada"""
+    if not lora or LINK_PROFILE[2]:  # O cabeçalho compacto não leva os flags de fragmento
+        return False
+    data = bytearray(b"HIST")
+    for key in ("temp", "hum", "db"):
+        for value in history[key]:
+            data += struct.pack('<h', int(value * 10))
+    try:
+        ok = lora.send_bulk(data, SERVER_ADDRESS)
+        print("Historico enviado" if ok else "Falha ao enviar historico", len(data), "bytes")
+        return ok
+    except Exception as e:
+        print(f"Erro ao enviar historico via LoRa: {e}")
+        return False
 
 # ========================
 # Funções de Visualização
 # ========================
 def show_connection_status(connected):
     """Mostra status de conexão na matriz de LEDs"""
+    global connection_shown_until
     np.fill((0, 0, 0))
     
     if connected:
@@ -229,6 +546,15 @@ def show_connection_status(connected):
     for led in leds:
         np[led] = color
     np.write()
+    connection_shown_until = utime.ticks_add(utime.ticks_ms(), Config.CONNECTION_PATTERN_MS)
+
+def connection_pattern_shown():
+    """True enquanto o padrão de conexão BLE deve ficar na matriz, sem a leitura por cima"""
+    global connection_shown_until
+    if connection_shown_until is not None and utime.ticks_diff(connection_shown_until, utime.ticks_ms()) > 0:
+        return True
+    connection_shown_until = None
+    return False
 
 def show_noise(db, classification):
     """Exibe ruído como círculos concêntricos"""
@@ -305,7 +631,20 @@ def draw_graph(data, y_pos, height, color):
         y2 = y_pos + height - int((data[i+1]-min_val)*height/range_val)
         oled.line(x1,y1,x2,y2,color)
 
-def update_display(mode, value, classification):
+def show_profile():
+    """Página de depuração do OLED: tempo médio e máximo por etapa (prof.py)"""
+    oled.fill(0)
+    oled.text("etapa  med  max", 0, 0)
+    first = 0 if utime.ticks_ms() // 2000 % 2 == 0 else 7  # alterna as páginas a cada 2 s
+    for i, line in enumerate(prof.lines(first, 7)):
+        oled.text(line, 0, 8 + 8 * i)
+    oled.show()
+
+def update_display(mode, value, classification, ble_connected=False):
+    if _PROF:
+        if button_a.value() == 0:
+            show_profile()
+            return
     oled.fill(0)
     titles = {
         0: ("Ruido", "dB", history["db"], Config.DB_IDEAL),
@@ -316,6 +655,7 @@ def update_display(mode, value, classification):
     
     oled.text(f"{title}: {value:.1f}{unit}", 0, 0)
     oled.text(f"Status: {classification}", 0, 12)
+    oled.text("B" if ble_connected else "-", 120, 0)  # Indicador de conexão BLE
     
     draw_graph(data, 20, 40, 1)
     
@@ -339,14 +679,20 @@ def classify(value, ranges):
 # Funções de Sensoriamento
 # ========================
 def get_decibels(samples):
+    if _PROF:
+        prof.begin(prof.DB)
     mean = sum(samples)/len(samples)
     squared = [(s-mean)**2 for s in samples]
     rms = math.sqrt(sum(squared)/len(samples))
     voltage_rms = (rms/4095)*3.3
-    return int(20*math.log10(voltage_rms/0.00002)) if voltage_rms > 0 else 0
+    db = int(20*math.log10(voltage_rms/0.00002)) if voltage_rms > 0 else 0
+    if _PROF:
+        prof.end(prof.DB)
+    return db
 
 def read_sensors():
-    
+    if _PROF:
+        prof.begin(prof.SENSE)
     temp = aht20.temperature  # Lê a temperatura do AHT20
     hum = aht20.relative_humidity   # Lê a umidade do AHT20
     
@@ -359,46 +705,112 @@ def read_sensors():
         history[key].append(value)
         history[key] = history[key][-Config.HISTORY_SIZE:]
     
+    if _PROF:
+        prof.end(prof.SENSE)
     return temp, hum, db
 
+# ========================
+# Modo de Baixo Consumo
+# ========================
+# Estado que sobrevive ao deepsleep: ciclos, último header_id LoRa, falhas e,
+# do ADR, o preset e a potência combinados com o receptor e os envios seguidos sem ACK
+STATE_FORMAT = "<IBIBBB"
+
+def load_state():
+    data = None
+    try:
+        data = machine.RTC().memory()
+    except Exception:
+        pass  # Porta sem memória RTC (ex.: RP2040), usa a flash
+    if not data:
+        try:
+            with open(Config.STATE_FILE, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+    if data and len(data) == struct.calcsize(STATE_FORMAT):
+        return list(struct.unpack(STATE_FORMAT, data))
+    return [0, 0, 0, adr.DEFAULT, adr.MAX_POWER, 0]
+
+def save_state(state):
+    data = struct.pack(STATE_FORMAT, *state)
+    try:
+        machine.RTC().memory(data)
+        return
+    except Exception:
+        pass
+    with open(Config.STATE_FILE, "wb") as f:
+        f.write(data)
+
+def display_off():
+    if oled:
+        oled.poweroff()
+    else:
+        # Só o comando de desligar, sem inicializar o display (SET_DISP | 0)
+        try:
+            SoftI2C(scl=Pin(15), sda=Pin(14), freq=400000).writeto(0x3C, b'\x80\xae')
+        except OSError:
+            pass
+
+def low_power_cycle(state):
+    """Uma medição (AHT20 + microfone) e um quadro LoRa; deixa o rádio dormindo."""
+    if lora:
+        lora._last_header_id = state[1]
+        if Config.ADR:
+            adr_control.restore(lora, state[3], state[4], state[5])
+    temp, hum, db = read_sensors()
+    ok = send_lora_message(temp, hum, db)
+    if ok:
+        drain_backlog()
+    if backlog is not None:
+        backlog.flush()  # O deepsleep apaga a RAM
+    state[0] += 1
+    if lora:
+        state[1] = lora._last_header_id
+        state[3:] = adr_control.preset, adr_control.tx_power, adr_control.fails
+        lora.sleep()
+    if not ok:
+        state[2] += 1
+    save_state(state)
+
+def low_power_main():
+    state = load_state()
+    boot([init_mic, init_sensors, init_backlog])
+    display_off()
+    start = _T_BOOT  # Após um deepsleep, o boot faz parte do tempo acordado
+    while True:
+        try:
+            low_power_cycle(state)
+        except Exception as e:
+            print("Erro no ciclo:", e)
+        awake = utime.ticks_diff(utime.ticks_ms(), start)
+        sleep_ms = max(0, Config.LOW_POWER_INTERVAL * 1000 - awake)
+        print("Ciclo", state[0], "acordado", awake, "ms; dormindo", sleep_ms, "ms")
+        fallback = Config.ADR and adr_control.on_silence(sleep_ms)
+        if fallback:
+            # O receptor volta ao ModemConfig padrão antes de o nó acordar: o próximo ciclo também
+            state[3:] = fallback[0], fallback[1], 0
+            save_state(state)
+        if Config.LOW_POWER_LIGHTSLEEP:
+            machine.lightsleep(sleep_ms)
+            start = utime.ticks_ms()
+        else:
+            # Reinicia o programa ao acordar; o estado volta via load_state()
+            machine.deepsleep(sleep_ms)
+
 def main():
+    boot([init_mic, init_sensors, init_display, init_leds, init_controls, init_backlog])
     try:
-        # Inicializa BLE
-        ble = BitDogBLE()
-        
-        # Espera por conexão com feedback visual
-        oled.fill(0)
-        oled.text("Aguardando", 0, 10)
-        oled.text("conexao BLE...", 0, 25)
-        oled.show()
-        
-        last_blink = utime.time()
-        show_conn = False
-        
-        while not ble._connected:
-            if utime.time() - last_blink > 0.5:
-                show_conn = not show_conn
-                show_connection_status(show_conn)
-            # Verifica se LoRa está inicializado e exibe na tela
-            if lora:
-                oled.text("LoRa OK", 0, 40)
-            else:
-                oled.text("LoRa FALHA", 0, 40)
-            oled.show()
-            last_blink = utime.time()
-            utime.sleep_ms(100)
-            
-        # Conexão estabelecida
-        show_connection_status(True)
+        # Inicializa BLE. A conexão não bloqueia mais o sensoriamento: o BLE
+        # anuncia em segundo plano e passa a notificar quando um central conectar.
+        ble = BitDogBLE(on_change=show_connection_status)
+        show_connection_status(False)
+
         oled.fill(0)
-        oled.text("Conectado!", 0, 20)
-        if lora:
-            oled.text("LoRa OK", 0, 40)
-        else:
-            oled.text("LoRa FALHA", 0, 40)
+        oled.text("Iniciando LoRa", 0, 10)
+        oled.text("LoRa OK" if lora else "LoRa FALHA", 0, 40)
         oled.show()
-        utime.sleep(1)
-        
+
         # Loop principal
         current_mode = 0
         modes = [
@@ -406,17 +818,48 @@ def main():
             (show_temperature, "temp", Config.TEMP_IDEAL),
             (show_humidity, "hum", Config.HUM_IDEAL)
         ]
-        last_update_time = utime.time() # Variável para controlar o intervalo de atualização
+        last_update_time = None # Primeiro envio acontece já na primeira leitura
+        first_sample = True
+        first_packet = True
+        link_up = False # Último envio confirmado: o backlog pode ser reenviado
+        if _PROF:
+            prof.begin(prof.LOOP)
         
         while True:
             temp, hum, db = read_sensors()
+            if first_sample:
+                print("Tempo ate a primeira amostra:", utime.ticks_diff(utime.ticks_ms(), _T_BOOT), "ms")
+                first_sample = False
             
-            # Atualiza BLE e LoRa em um intervalo comum
-            if utime.time() - last_update_time > Config.SENSOR_UPDATE_INTERVAL:
+            # Atualiza BLE e LoRa em um intervalo comum. No modo TDMA o LoRa
+            # espera o slot do nó, sem retransmitir dentro dele (o slot só
+            # comporta um quadro e seu ACK)
+            now = utime.ticks_ms()
+            send_now = False
+            if last_update_time is None or \
+                    utime.ticks_diff(now, last_update_time) > Config.SENSOR_UPDATE_INTERVAL * 1000:
                 ble.update_data(temp, hum, db)
-                send_lora_message(temp, hum, db) # Envia dados via LoRa
-                last_update_time = utime.time()
+                last_update_time = now
+                send_now = not Config.TDMA
+            if Config.TDMA and wait_for_slot():
+                send_now = True
+            if send_now:
+                link_up = send_lora_message(temp, hum, db, retries=0 if Config.TDMA else 3) # Envia dados via LoRa
+                if Config.TDMA:
+                    slot_clock.used()
+                if first_packet:
+                    print("Tempo ate o primeiro pacote LoRa:", utime.ticks_diff(utime.ticks_ms(), _T_BOOT), "ms")
+                    first_packet = False
+            if link_up and not Config.TDMA:
+                # Fila de envio: a leitura ao vivo sai primeiro, na hora; fora do
+                # TDMA o backlog usa só o tempo livre até a próxima
+                link_up = drain_backlog(utime.ticks_add(last_update_time, Config.SENSOR_UPDATE_INTERVAL * 1000))
             
+            # Botão B envia o histórico completo via LoRa
+            if button_b.value() == 0:
+                send_history()
+                utime.sleep_ms(300) # Debounce
+
             # Controle de modo via joystick
             y_val = joystick_y.read_u16()
             # Adiciona uma pequena histerese para evitar mudança de modo muito rápida
@@ -432,14 +875,19 @@ def main():
             current_value = {"temp": temp, "hum": hum, "db": db}[key]
             classification = classify(current_value, ideal)
             
-            if key == "db":
+            if connection_pattern_shown():
+                pass  # A matriz ainda mostra a conexão/desconexão BLE
+            elif key == "db":
                 show_noise(current_value, classification)
             else:
                 display_func(current_value)
             
-            update_display(current_mode, current_value, classification)
+            update_display(current_mode, current_value, classification, ble.connected)
             
             utime.sleep_ms(100) # Loop mais rápido para leitura de joystick e display
+            if _PROF:
+                prof.end(prof.LOOP)
+                prof.begin(prof.LOOP)
             
     except Exception as e:
         print("Erro fatal:", e)
@@ -447,8 +895,13 @@ def main():
         oled.text("Erro:", 0, 10)
         oled.text(str(e)[:20], 0, 25)
         oled.show()
+        if backlog is not None:
+            backlog.flush()  # A página em RAM sobrevive ao reset
         utime.sleep(5)
         machine.reset()
 
 if __name__ == "__main__":
-    main()
+    if Config.LOW_POWER:
+        low_power_main()
+    else:
+        main()
@@ -0,0 +1,14 @@
+# Manifesto para congelar as bibliotecas do transmissor no firmware.
+# Uso (a partir do diretório ports/rp2 do MicroPython):
+#   make BOARD=RPI_PICO_W FROZEN_MANIFEST=/caminho/para/transmitter/manifest.py
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("ulora.py")
+module("lorafrag.py")
+module("ssd1306.py")
+module("ahtx0.py")
+module("ble_advertising.py")
+module("tdma.py")
+module("adr.py")
+module("prof.py")
+module("flashlog.py")
@@ -4,10 +4,23 @@ from ucollections import namedtuple
 from urandom import getrandbits
 from machine import SPI
 from machine import Pin
+from micropython import const
+
+# Profiling hooks (see prof.py): 1 times the ISR, send() and the ACK wait
+_PROF = const(0)
+if _PROF:
+    import prof
 
 #Constants
 FLAGS_ACK = 0x80
+# Application flags (low nibble of the RadioHead flags byte)
+FLAGS_FRAG = 0x01 # fragment of a multi-frame message (see lorafrag), acked selectively
+FLAGS_SACK_REQ = 0x02 # fragment asks the receiver for a selective ACK
+FLAGS_BEACON = 0x04 # TDMA beacon broadcast by the gateway (see tdma)
+FLAGS_BATCH = 0x08 # several stored readings packed in one frame (transmitter backlog)
+FLAGS_ADR = 0x10 # adaptive data rate command (see adr)
 BROADCAST_ADDRESS = 255
+SEQ_WINDOW = 32 # recent header IDs remembered per sender for duplicate detection
 RF95_FREQ = 915.0 # Frequencia de transmissao
 RF95_POW = 20 # Potencia de transmissao
 REG_00_FIFO = 0x00
@@ -39,6 +52,7 @@ PA_SELECT = 0x80
 
 CAD_DETECTED_MASK = 0x01
 RX_DONE = 0x40
+PAYLOAD_CRC_ERROR = 0x20
 TX_DONE = 0x08
 CAD_DONE = 0x04
 CAD_DETECTED = 0x01
@@ -61,6 +75,166 @@ class ModemConfig():
     Bw125Cr48Sf4096 = (0x78, 0xc4, 0x0c) #/< Bw = 125 kHz, Cr = 4/8, Sf = 4096chips/symbol, low data rate, CRC on. Slow+long range
     Bw125Cr45Sf2048 = (0x72, 0xb4, 0x04) #< Bw = 125 kHz, Cr = 4/5, Sf = 2048chips/symbol, CRC on. Slow+long range
 
+# Bandwidth in Hz for each MODEM_CONFIG1 Bw field value
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+def time_on_air_ms(frame_len, modem_config=ModemConfig.Bw125Cr45Sf128, preamble=8):
+    """
+    time_on_air_ms(frame_len, modem_config=ModemConfig.Bw125Cr45Sf128, preamble=8)
+    Airtime of a frame_len byte frame (RadioHead header included), from the
+    SX1276 datasheet formula and the modem_config register values.
+    """
+    config1, config2, config3 = modem_config
+    bw = BANDWIDTHS[config1 >> 4]
+    cr = (config1 >> 1) & 0x07 # 1..4 for 4/5..4/8
+    implicit = config1 & 0x01
+    sf = config2 >> 4
+    crc = (config2 >> 2) & 0x01
+    ldro = (config3 >> 3) & 0x01
+    t_sym = (1 << sf) * 1000 / bw
+    bits = 8 * frame_len - 4 * sf + 28 + 16 * crc - 20 * implicit
+    n_payload = 8 + max(math.ceil(bits / (4 * (sf - 2 * ldro))) * (cr + 4), 0)
+    return (preamble + 4.25 + n_payload) * t_sym
+
+def encode_ack_quality(snr, rssi):
+    # b'!' + SNR in 0.25 dB steps (int8) + -RSSI in dBm (uint8)
+    return bytes([0x21, int(snr * 4) & 0xff, min(max(int(-rssi), 0), 255)])
+
+def decode_ack_quality(message):
+    # (snr, rssi) from an ACK payload, or None for a plain b'!' ACK
+    if len(message) < 3 or message[0] != 0x21:
+        return None
+    snr = message[1] - 256 if message[1] > 127 else message[1]
+    return snr / 4, -message[2]
+
+class LinkProfile():
+    # (implicit header, preamble symbols, compact header, fixed payload length)
+    # Both ends must use the same profile.
+    Standard = (False, 8, False, 0) #< explicit header, 8-symbol preamble, 4-byte RadioHead header. RadioHead compatible
+    ShortPreamble = (False, 6, False, 0) #< as Standard with the shortest preamble the SX127x allows
+    # Implicit header (the payload length is fixed, so the PHY header is not
+    # sent) plus a 2-byte header: [to << 4 | from, ACK << 7 | 7-bit id].
+    # Addresses 0-14 (15 is broadcast), only the ACK flag, every frame padded
+    # to the fixed payload length. Sized for the binary sensor frame.
+    Compact = (True, 6, True, 6)
+
+def link_frame_len(payload_len, profile=LinkProfile.Standard):
+    # Bytes on air after the PHY header for a payload_len byte message
+    implicit, preamble, compact, fixed_len = profile
+    return (2 if compact else 4) + (fixed_len if implicit else payload_len)
+
+def link_time_on_air_ms(payload_len, modem_config=ModemConfig.Bw125Cr45Sf128, profile=LinkProfile.Standard):
+    # Airtime of a payload_len byte message with the given link profile
+    implicit, preamble, compact, fixed_len = profile
+    config = ((modem_config[0] & 0xfe) | (1 if implicit else 0), modem_config[1], modem_config[2])
+    return time_on_air_ms(link_frame_len(payload_len, profile), config, preamble)
+
+class AirtimeBudget(object):
+    def __init__(self, duty_cycle=None, window_ms=3600000, slices=6):
+        """
+        AirtimeBudget(duty_cycle=None, window_ms=3600000, slices=6)
+        Airtime transmitted over a sliding window, e.g. the hour regional duty-cycle limits use.
+        duty_cycle: fraction of the window the radio may transmit (0.01 for 1%), None to only count
+        window_ms: length of the sliding window
+        slices: the window is kept as this many sums, so accounting costs O(slices) memory
+        """
+        self.duty_cycle = duty_cycle
+        self.window_ms = window_ms
+        self._slice_ms = window_ms // slices
+        # One slice more than the window: a frame leaves the sum between
+        # window_ms and window_ms + slice_ms after it was sent, never earlier
+        self._slices = [0] * (slices + 1) # oldest first, ms of airtime each
+        self._start = time.ticks_ms() # start of the newest slice
+        self.total_ms = 0
+        self.deferred = 0 # sends refused for lack of budget
+
+    @property
+    def budget_ms(self):
+        return None if self.duty_cycle is None else int(self.window_ms * self.duty_cycle)
+
+    def _advance(self, now):
+        n = time.ticks_diff(now, self._start) // self._slice_ms
+        if n <= 0:
+            return
+        slices = self._slices
+        for i in range(len(slices)):
+            slices[i] = slices[i + n] if i + n < len(slices) else 0
+        self._start = time.ticks_add(self._start, n * self._slice_ms)
+
+    def used_ms(self, now=None):
+        # Airtime sent during the last window
+        self._advance(time.ticks_ms() if now is None else now)
+        return sum(self._slices)
+
+    def record(self, ms, now=None):
+        ms = math.ceil(ms)
+        self._advance(time.ticks_ms() if now is None else now)
+        self._slices[-1] += ms
+        self.total_ms += ms
+
+    def wait_ms(self, ms, now=None):
+        # How long until `ms` more of airtime fits the budget: 0 now, None never
+        budget = self.budget_ms
+        if budget is None:
+            return 0
+        ms = math.ceil(ms)
+        if ms > budget:
+            return None
+        if now is None:
+            now = time.ticks_ms()
+        self._advance(now)
+        over = sum(self._slices) + ms - budget
+        i = 0
+        while over > 0:
+            over -= self._slices[i]
+            i += 1
+        if i == 0:
+            return 0
+        # the i oldest slices leave the window once the newest one is i slices old
+        return max(0, time.ticks_diff(time.ticks_add(self._start, i * self._slice_ms), now))
+
+# Frame handed to on_recv by the interrupt handler (callback mode)
+Payload = namedtuple("Payload", ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr'])
+
+class RxPacket(object):
+    def __init__(self):
+        """
+        RxPacket()
+        A received frame for LoRa.poll_recv(), which fills it in place so one
+        preallocated packet serves every frame. Carries the metadata of
+        lora.RxPacket (ticks_ms of the RxDone interrupt, snr in 0.25 dB steps,
+        rssi in dBm, valid_crc) plus the RadioHead header fields.
+        data: memoryview of the message inside the packet's 256-byte buffer
+        """
+        # buf holds the SPI read as is: one dummy byte, the header, the message
+        self.buf = bytearray(256)
+        self._views = {} # offset << 8 | length -> memoryview, created once per frame size
+        self.data = self._view(0, 0)
+        self.length = 0
+        self.header_to = 0
+        self.header_from = 0
+        self.header_id = 0
+        self.header_flags = 0
+        self.ticks_ms = None
+        self.snr = 0
+        self.rssi = 0
+        self.valid_crc = True
+
+    def _view(self, offset, length):
+        key = offset << 8 | length
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = memoryview(self.buf)[offset:offset + length]
+        return view
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def message(self):
+        # copy of the message, for code written for the on_recv payload
+        return bytes(self.data)
+
 class SPIConfig():
     # spi pin defs for various boards (channel, sck, mosi, miso)
     rp2_0 = (0, 18, 19, 16)
@@ -71,10 +245,12 @@ class SPIConfig():
 
 class LoRa(object):
     def __init__(self, spi_channel, interrupt, this_address, cs_pin, reset_pin=None, freq=RF95_FREQ , tx_power=RF95_POW,
-                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None):
+                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None, deferred=False,
+                 link_profile=LinkProfile.Standard):
         """
         Lora(channel, interrupt, this_address, cs_pin, reset_pin=None, freq=868.0, tx_power=14,
-                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None)
+                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None, deferred=False,
+                 link_profile=LinkProfile.Standard)
         channel: SPI channel, check SPIConfig for preconfigured names
         interrupt: GPIO interrupt pin
         this_address: set address for this device [0-254]
@@ -86,6 +262,9 @@ class LoRa(object):
         receive_all: if True, don't filter packets on address
         acks: if True, request acknowledgments
         crypto: if desired, an instance of ucrypto AES (https://docs.pycom.io/firmwareapi/micropython/ucrypto/) - not tested
+        deferred: if True, only start the reset sequence; call poll_init() while doing other
+                  work and finish_init() before using the radio
+        link_profile: Check LinkProfile. Default is compatible with the Radiohead library
         """
         
         self._spi_channel = spi_channel
@@ -97,6 +276,10 @@ class LoRa(object):
         self._freq = freq
         self._tx_power = tx_power
         self._modem_config = modem_config
+        self._preamble = 8
+        self._profile = LinkProfile.Standard
+        self._id_mask = 0xff # header ids wrap at 128 with the compact header
+        self._shadow = {} # write-through copy of the static registers, to skip rewrites
         self._receive_all = receive_all
         self._acks = acks
 
@@ -104,25 +287,58 @@ class LoRa(object):
         self._last_header_id = 0
 
         self._last_payload = None
+        self.ack_quality = None # (snr, rssi) the peer measured on our last acked frame
         self.crypto = crypto
+        self._check_profile(link_profile)
+        self._profile = link_profile
+        self._preamble = link_profile[1]
+        self._id_mask = 0x7f if link_profile[2] else 0xff
 
         self.cad_timeout = 0
         self.send_retries = 2
-        self.wait_packet_sent_timeout = 0.2
+        self.wait_packet_sent_timeout = 0.2 # s allowed for TxDone beyond the frame's airtime
+        self._last_airtime_ms = 0
+        self._tx_start = 0 # ticks_ms when the last frame was handed to the radio
         self.retry_timeout = 0.2
+
+        # Duplicate suppression: header_from -> [last header_id, bitmap of the
+        # SEQ_WINDOW ids before it, ticks_ms, received, lost, shortest ms per id]
+        self._senders = {}
+        self.max_senders = 16
+        self.seq_timeout_ms = 5000 # retransmissions come sooner: after this much silence nothing is a duplicate
+        self.duplicates = 0
+        self.gaps = 0
+
+        # Airtime of every frame sent; set_duty_cycle() makes send() refuse
+        # frames that do not fit the budget
+        self.airtime = AirtimeBudget()
+
+        # Polled receive (start_recv/poll_recv): the interrupt only stamps
+        # the time and the frame is read into a caller-owned RxPacket, with
+        # preallocated SPI buffers so receiving allocates nothing
+        self._polled = False
+        self._last_irq = None
+        self._irq_callback = None
+        self._status = bytearray(5) # dummy byte + RegFifoRxCurrentAddr..RegRxNbBytes
+        self._quality = bytearray(3) # dummy byte + RegPktSnrValue, RegPktRssiValue
+        self._reg_write = bytearray(2)
+        self.crc_errors = 0
         
         # Setup the module
 #        gpio_interrupt = Pin(self._interrupt, Pin.IN, Pin.PULL_DOWN)
         gpio_interrupt = Pin(self._interrupt, Pin.IN)
-        gpio_interrupt.irq(trigger=Pin.IRQ_RISING, handler=self._handle_interrupt)
+        handler = self._handle_interrupt
+        if _PROF:
+            handler = prof.wrap1(prof.LORA_ISR, handler)
+        gpio_interrupt.irq(trigger=Pin.IRQ_RISING, handler=handler)
         
-        # reset the board
+        # reset the board (pulse is released by poll_init)
+        self._gpio_reset = None
         if reset_pin:
-            gpio_reset = Pin(reset_pin, Pin.OUT)
-            gpio_reset.value(0)
-            time.sleep(0.01)
-            gpio_reset.value(1)
-            time.sleep(0.01)
+            self._gpio_reset = Pin(reset_pin, Pin.OUT)
+            self._gpio_reset.value(0)
+        self._init_step = 0
+        self._init_wait_until = time.ticks_add(time.ticks_ms(), 10 if reset_pin else 0)
 
         # baud rate to 5MHz
         self.spi = SPI(self._spi_channel[0], 5000000,
@@ -131,74 +347,332 @@ class LoRa(object):
         # cs gpio pin
         self.cs = Pin(self._cs_pin, Pin.OUT)
         self.cs.value(1)
-        
-        # set mode
-        self._spi_write(REG_01_OP_MODE, MODE_SLEEP | LONG_RANGE_MODE)
-        time.sleep(0.1)
-        
+
+        if not deferred:
+            self.finish_init()
+
+    def poll_init(self):
+        # Advance the reset/configuration sequence without blocking on its
+        # waits (10 ms reset pulse, 10 ms after reset, 100 ms for sleep mode).
+        # Returns True once the radio is configured.
+        while self._init_step < 3:
+            if time.ticks_diff(time.ticks_ms(), self._init_wait_until) < 0:
+                return False
+
+            if self._init_step == 0:
+                delay = 0
+                if self._gpio_reset:
+                    self._gpio_reset.value(1)
+                    delay = 10
+            elif self._init_step == 1:
+                # set mode
+                self._spi_write(REG_01_OP_MODE, MODE_SLEEP | LONG_RANGE_MODE)
+                delay = 100
+            else:
+                self._configure()
+                delay = 0
+
+            self._init_step += 1
+            self._init_wait_until = time.ticks_add(time.ticks_ms(), delay)
+        return True
+
+    def finish_init(self):
+        while not self.poll_init():
+            time.sleep_ms(1)
+
+    def _configure(self):
         # check if mode is set
         assert self._spi_read(REG_01_OP_MODE) == (MODE_SLEEP | LONG_RANGE_MODE), \
             "LoRa initialization failed"
 
-        self._spi_write(REG_0E_FIFO_TX_BASE_ADDR, 0)
-        self._spi_write(REG_0F_FIFO_RX_BASE_ADDR, 0)
+        # the chip was just reset, so nothing written before is still there
+        self._shadow = {}
+
+        self._write_shadow(REG_0E_FIFO_TX_BASE_ADDR, [0, 0]) # TX and RX base addresses
         
         self.set_mode_idle()
 
         # set modem config (Bw125Cr45Sf128)
-        self._spi_write(REG_1D_MODEM_CONFIG1, self._modem_config[0])
-        self._spi_write(REG_1E_MODEM_CONFIG2, self._modem_config[1])
-        self._spi_write(REG_26_MODEM_CONFIG3, self._modem_config[2])
+        self.set_modem_config(self._modem_config)
 
         # set preamble length (8)
-        self._spi_write(REG_20_PREAMBLE_MSB, 0)
-        self._spi_write(REG_21_PREAMBLE_LSB, 8)
+        self.set_preamble_length(self._preamble)
 
         # set frequency
-        frf = int((self._freq * 1000000.0) / FSTEP)
-        self._spi_write(REG_06_FRF_MSB, (frf >> 16) & 0xff)
-        self._spi_write(REG_07_FRF_MID, (frf >> 8) & 0xff)
-        self._spi_write(REG_08_FRF_LSB, frf & 0xff)
+        self.set_frequency(self._freq)
         
         # Set tx power
-        if self._tx_power < 5:
-            self._tx_power = 5
-        if self._tx_power > 23:
-            self._tx_power = 23
-
-        if self._tx_power < 20:
-            self._spi_write(REG_4D_PA_DAC, PA_DAC_ENABLE)
-            self._tx_power -= 3
+        self.set_tx_power(self._tx_power)
+
+        # header mode and fixed payload length
+        self.set_link_profile(self._profile)
+
+    # Runtime reconfiguration. Each setter only writes the registers whose
+    # value changes, so re-applying the current settings costs no SPI traffic,
+    # and leaves RX (if active) for standby during the writes.
+
+    def _write_shadow(self, register, values):
+        # Write values to register and the following ones in one burst, unless
+        # the shadow says they already hold them. Returns True if written.
+        if [self._shadow.get(register + i) for i in range(len(values))] == values:
+            return False
+        self._spi_write(register, values)
+        for i, value in enumerate(values):
+            self._shadow[register + i] = value
+        return True
+
+    def _write_config(self, writes):
+        # writes: [(first register, [values for it and the following ones])]
+        changed = [(reg, values) for reg, values in writes
+                   if [self._shadow.get(reg + i) for i in range(len(values))] != values]
+        if not changed:
+            return False
+        rx = self._mode == MODE_RXCONTINUOUS
+        if rx:
+            self.set_mode_idle()
+        for reg, values in changed:
+            self._write_shadow(reg, values)
+        if rx:
+            self.set_mode_rx()
+        return True
+
+    def set_modem_config(self, modem_config):
+        # Both ends must use the same modem config to hear each other
+        self._modem_config = tuple(modem_config)
+        config1 = (modem_config[0] & 0xfe) | (1 if self._profile[0] else 0) # header mode comes from the link profile
+        self._write_config([(REG_1D_MODEM_CONFIG1, [config1, modem_config[1]]),
+                            (REG_26_MODEM_CONFIG3, [modem_config[2]])])
+
+    def set_spreading_factor(self, sf):
+        # 7-12 (SF6 needs implicit header mode)
+        if not 7 <= sf <= 12:
+            raise ValueError("spreading factor must be 7-12")
+        config1, config2, config3 = self._modem_config
+        self.set_modem_config(self._low_data_rate(config1, (config2 & 0x0f) | (sf << 4), config3))
+
+    def set_bandwidth(self, bandwidth):
+        # bandwidth in Hz, one of BANDWIDTHS
+        if bandwidth not in BANDWIDTHS:
+            raise ValueError("bandwidth must be one of %s" % (BANDWIDTHS,))
+        config1, config2, config3 = self._modem_config
+        config1 = (config1 & 0x0f) | (BANDWIDTHS.index(bandwidth) << 4)
+        self.set_modem_config(self._low_data_rate(config1, config2, config3))
+
+    def set_coding_rate(self, denominator):
+        # coding rate 4/5 to 4/8
+        if not 5 <= denominator <= 8:
+            raise ValueError("coding rate denominator must be 5-8")
+        config1, config2, config3 = self._modem_config
+        self.set_modem_config(((config1 & 0xf1) | ((denominator - 4) << 1), config2, config3))
+
+    def _low_data_rate(self, config1, config2, config3):
+        # LowDataRateOptimize is mandatory when a symbol lasts 16 ms or more
+        t_sym_ms = (1 << (config2 >> 4)) * 1000 / BANDWIDTHS[config1 >> 4]
+        return config1, config2, (config3 | 0x08) if t_sym_ms >= 16 else (config3 & ~0x08)
+
+    def _check_profile(self, profile):
+        implicit, preamble, compact, fixed_len = profile
+        if compact and self._this_address > 14:
+            raise ValueError("the compact header needs an address from 0 to 14")
+        if implicit and (fixed_len < 3 or self.crypto):
+            raise ValueError("implicit header needs a fixed payload of 3+ bytes and no crypto")
+        if preamble < 6:
+            raise ValueError("preamble must be at least 6 symbols")
+
+    def set_link_profile(self, profile):
+        # Both ends must use the same link profile
+        self._check_profile(profile)
+        self._profile = profile
+        self._id_mask = 0x7f if profile[2] else 0xff
+        self.set_modem_config(self._modem_config)
+        self.set_preamble_length(profile[1])
+        if profile[0]:
+            # implicit header: the receiver takes the length from RegPayloadLength
+            self._write_config([(REG_22_PAYLOAD_LENGTH, [link_frame_len(0, profile)])])
+
+    @property
+    def link_profile(self):
+        return self._profile
+
+    def set_duty_cycle(self, duty_cycle):
+        # fraction of each airtime window (one hour by default) we may transmit, None for no limit
+        self.airtime.duty_cycle = duty_cycle
+
+    def time_on_air_ms(self, payload_len):
+        # Airtime of a payload_len byte message with the current modem config, preamble and link profile
+        config1, config2, config3 = self._modem_config
+        config1 = (config1 & 0xfe) | (1 if self._profile[0] else 0)
+        return time_on_air_ms(link_frame_len(payload_len, self._profile), (config1, config2, config3), self._preamble)
+
+    def airtime_wait_ms(self, payload_len):
+        # How long until a payload_len byte message fits the duty cycle: 0 now, None never
+        return self.airtime.wait_ms(self.time_on_air_ms(payload_len))
+
+    def set_preamble_length(self, length):
+        self._preamble = length
+        self._write_config([(REG_20_PREAMBLE_MSB, [(length >> 8) & 0xff, length & 0xff])])
+
+    def set_frequency(self, freq):
+        # freq in MHz
+        self._freq = freq
+        frf = int((freq * 1000000.0) / FSTEP)
+        self._write_config([(REG_06_FRF_MSB, [(frf >> 16) & 0xff, (frf >> 8) & 0xff, frf & 0xff])])
+
+    def set_tx_power(self, tx_power):
+        tx_power = min(max(tx_power, 5), 23)
+        self._tx_power = tx_power
+
+        if tx_power < 20:
+            pa_dac = PA_DAC_ENABLE
+            tx_power -= 3
         else:
-            self._spi_write(REG_4D_PA_DAC, PA_DAC_DISABLE)
+            pa_dac = PA_DAC_DISABLE
+
+        self._write_config([(REG_4D_PA_DAC, [pa_dac]), (REG_09_PA_CONFIG, [PA_SELECT | (tx_power - 5)])])
+
+    @property
+    def modem_config(self):
+        return self._modem_config
+
+    @property
+    def frequency(self):
+        return self._freq
+
+    @property
+    def preamble_length(self):
+        return self._preamble
+
+    @property
+    def tx_power(self):
+        return self._tx_power
 
-        self._spi_write(REG_09_PA_CONFIG, PA_SELECT | (self._tx_power - 5))
-        
     def on_recv(self, message):
         # This should be overridden by the user
         pass
 
+    def set_irq_callback(self, callback):
+        # Called from the DIO0 interrupt in polled mode, e.g. an asyncio.ThreadSafeFlag's set
+        self._irq_callback = callback
+
+    def irq_triggered(self):
+        # True if a frame arrived since the last poll_recv()
+        return self._last_irq is not None
+
+    def start_recv(self):
+        """
+        Continuous receive without on_recv, as lora's start_recv(continuous=True):
+        call poll_recv() after each interrupt (see set_irq_callback). ACKs and
+        duplicate suppression work as in callback mode, but send_to_wait and
+        send_bulk need callback mode to see the replies.
+        """
+        self._polled = True
+        self._last_irq = None
+        self.set_mode_rx()
+
+    def poll_recv(self, rx_packet):
+        """
+        Reads a received frame into rx_packet (an RxPacket). Returns rx_packet
+        if a frame for this node arrived, else True while receiving, or False
+        if start_recv() was not called or the radio sleeps.
+        """
+        if not self._polled or self._mode == MODE_SLEEP:
+            return False
+        if self._mode == MODE_TX:
+            return True
+        if self._mode != MODE_RXCONTINUOUS:
+            self.set_mode_rx() # resume after a send
+        ticks_ms = self._last_irq
+        if ticks_ms is None:
+            return True
+        self._last_irq = None
+
+        status = self._status
+        self._spi_readinto(REG_10_FIFO_RX_CURRENT_ADDR, status)
+        irq_flags = status[3]
+        if not irq_flags & RX_DONE:
+            self._spi_write_byte(REG_12_IRQ_FLAGS, 0xff)
+            return True
+        if irq_flags & PAYLOAD_CRC_ERROR:
+            self.crc_errors += 1
+            self._spi_write_byte(REG_12_IRQ_FLAGS, 0xff)
+            return True
+
+        packet_len = status[4]
+        self._spi_write_byte(REG_0D_FIFO_ADDR_PTR, status[1])
+        self._spi_readinto(REG_00_FIFO, rx_packet._view(0, packet_len + 1))
+        self._spi_write_byte(REG_12_IRQ_FLAGS, 0xff)
+        quality = self._quality
+        self._spi_readinto(REG_19_PKT_SNR_VALUE, quality)
+
+        buf = rx_packet.buf
+        if self._profile[2] and packet_len >= 2:
+            header_to = buf[1] >> 4
+            if header_to == 15:
+                header_to = BROADCAST_ADDRESS
+            header_from = buf[1] & 0x0f
+            header_id = buf[2] & 0x7f
+            header_flags = FLAGS_ACK if buf[2] & 0x80 else 0
+            offset = 3
+        elif packet_len >= 4:
+            header_to, header_from, header_id, header_flags = buf[1], buf[2], buf[3], buf[4]
+            offset = 5
+        else:
+            return True
+        if (self._this_address != header_to) and ((header_to != BROADCAST_ADDRESS) or (self._receive_all is False)):
+            return True
+        length = packet_len + 1 - offset
+
+        # integer SNR (0.25 dB) and RSSI (dBm), as lora.RxPacket
+        snr = quality[1] - 256 if quality[1] > 127 else quality[1]
+        rssi = quality[2] + snr // 4 if snr < 0 else quality[2] * 16 // 15
+        rssi -= 157 if self._freq >= 779 else 164
+
+        if self.crypto and length % 16 == 0:
+            message = self._decrypt(bytes(rx_packet._view(offset, length)))
+            length = len(message)
+            buf[offset:offset + length] = message
+
+        if self._acks and header_to == self._this_address and not header_flags & (FLAGS_ACK | FLAGS_FRAG):
+            self.send_ack(header_from, header_id, snr / 4, rssi)
+            self.set_mode_rx()
+
+        if header_flags & FLAGS_ACK:
+            return True # replies are for send_to_wait, which needs callback mode
+        if self._track(header_from, header_id, header_flags & FLAGS_FRAG):
+            return True
+
+        rx_packet.data = rx_packet._view(offset, length)
+        rx_packet.length = length
+        rx_packet.header_to = header_to
+        rx_packet.header_from = header_from
+        rx_packet.header_id = header_id
+        rx_packet.header_flags = header_flags
+        rx_packet.ticks_ms = ticks_ms
+        rx_packet.snr = snr
+        rx_packet.rssi = rssi
+        return rx_packet
+
     def sleep(self):
-        if self._mode != MODE_SLEEP:
-            self._spi_write(REG_01_OP_MODE, MODE_SLEEP)
+        if self.wait_packet_sent() and self._mode != MODE_SLEEP:
+            self._spi_write(REG_01_OP_MODE, MODE_SLEEP | LONG_RANGE_MODE)
             self._mode = MODE_SLEEP
 
     def set_mode_tx(self):
         if self._mode != MODE_TX:
-            self._spi_write(REG_01_OP_MODE, MODE_TX)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x40)  # Interrupt on TxDone
+            self._spi_write(REG_01_OP_MODE, MODE_TX | LONG_RANGE_MODE)
+            self._write_shadow(REG_40_DIO_MAPPING1, [0x40])  # Interrupt on TxDone
             self._mode = MODE_TX
 
     def set_mode_rx(self):
-        if self._mode != MODE_RXCONTINUOUS:
-            self._spi_write(REG_01_OP_MODE, MODE_RXCONTINUOUS)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x00)  # Interrupt on RxDone
+        if self.wait_packet_sent() and self._mode != MODE_RXCONTINUOUS:
+            self._spi_write(REG_01_OP_MODE, MODE_RXCONTINUOUS | LONG_RANGE_MODE)
+            self._write_shadow(REG_40_DIO_MAPPING1, [0x00])  # Interrupt on RxDone
             self._mode = MODE_RXCONTINUOUS
             
     def set_mode_cad(self):
-        if self._mode != MODE_CAD:
-            self._spi_write(REG_01_OP_MODE, MODE_CAD)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x80)  # Interrupt on CadDone
+        if self.wait_packet_sent() and self._mode != MODE_CAD:
+            self._spi_write(REG_01_OP_MODE, MODE_CAD | LONG_RANGE_MODE)
+            self._write_shadow(REG_40_DIO_MAPPING1, [0x80])  # Interrupt on CadDone
             self._mode = MODE_CAD
 
     def _is_channel_active(self):
@@ -225,25 +699,42 @@ class LoRa(object):
                 return status
 
     def wait_packet_sent(self):
-        # wait for `_handle_interrupt` to switch the mode back
-        start = time.time()
-        while time.time() - start < self.wait_packet_sent_timeout:
+        # Waits for TxDone (`_handle_interrupt` switches the mode back) until the
+        # frame's airtime plus wait_packet_sent_timeout after it started. False
+        # if it is still on air: any mode change then would cut the frame off
+        if self._mode != MODE_TX:
+            return True
+        limit = self._last_airtime_ms + int(self.wait_packet_sent_timeout * 1000)
+        while time.ticks_diff(time.ticks_ms(), self._tx_start) < limit:
             if self._mode != MODE_TX:
                 return True
-
+        if self._spi_read(REG_01_OP_MODE) & 0x07 != MODE_TX:
+            # TxDone was missed (e.g. waiting inside the interrupt handler): the radio is done
+            self._mode = MODE_STDBY
+            return True
         return False
 
     def set_mode_idle(self):
-        if self._mode != MODE_STDBY:
-            self._spi_write(REG_01_OP_MODE, MODE_STDBY)
+        # Never while a frame is on air: STDBY would abort it
+        if self.wait_packet_sent() and self._mode != MODE_STDBY:
+            self._spi_write(REG_01_OP_MODE, MODE_STDBY | LONG_RANGE_MODE)
             self._mode = MODE_STDBY
 
     def send(self, data, header_to, header_id=0, header_flags=0):
-        self.wait_packet_sent()
+        if self._init_step < 3:
+            self.finish_init()
+        if not self.wait_packet_sent():
+            return False # the previous frame is still on air
         self.set_mode_idle()
         self.wait_cad()
 
-        header = [header_to, self._this_address, header_id, header_flags]
+        if self._profile[2]:
+            if header_flags & ~FLAGS_ACK:
+                raise ValueError("the compact header only carries the ACK flag")
+            header = [((header_to if header_to != BROADCAST_ADDRESS else 15) << 4) | self._this_address,
+                      (header_id & 0x7f) | (0x80 if header_flags & FLAGS_ACK else 0)]
+        else:
+            header = [header_to, self._this_address, header_id, header_flags]
         if type(data) == int:
             data = [data]
         elif type(data) == bytes:
@@ -254,37 +745,84 @@ class LoRa(object):
         if self.crypto:
             data = [b for b in self._encrypt(bytes(data))]
 
+        if self._profile[0]:
+            fixed_len = self._profile[3]
+            if len(data) > fixed_len:
+                raise ValueError("payload longer than the link profile's %d bytes" % fixed_len)
+            data = data + [0] * (fixed_len - len(data))
+
+        airtime = self.time_on_air_ms(len(data))
+        if self.airtime.wait_ms(airtime) != 0:
+            # duty cycle exhausted: the caller defers the frame (see airtime_wait_ms)
+            self.airtime.deferred += 1
+            return False
+
         payload = header + data
+        self._last_airtime_ms = airtime
         self._spi_write(REG_0D_FIFO_ADDR_PTR, 0)
         self._spi_write(REG_00_FIFO, payload)
-        self._spi_write(REG_22_PAYLOAD_LENGTH, len(payload))
+        # explicit header mode: reception never changes RegPayloadLength
+        self._write_shadow(REG_22_PAYLOAD_LENGTH, [len(payload)])
 
+        self._tx_start = time.ticks_ms()
         self.set_mode_tx()
+        self.airtime.record(airtime)
         return True
 
     def send_to_wait(self, data, header_to, header_flags=0, retries=3):
-        self._last_header_id += 1
+        self._last_header_id = (self._last_header_id + 1) & 0xff
+        # An ACK left from a send 256 IDs ago would match the new ID: only this send's count
+        self._last_payload = None
 
-        for _ in range(retries + 1):
-            self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags)
+        for attempt in range(retries + 1):
+            if _PROF:
+                if attempt:
+                    prof.count(prof.TX_RETRY)
+                prof.begin(prof.LORA_SEND)
+            if not self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags):
+                self.set_mode_rx()
+                return False
+            if _PROF:
+                prof.end(prof.LORA_SEND)
+            if not self.wait_packet_sent():
+                return False
             self.set_mode_rx()
 
             if header_to == BROADCAST_ADDRESS:  # Don't wait for acks from a broadcast message
                 return True
 
-            start = time.time()
-            while time.time() - start < self.retry_timeout + (self.retry_timeout * (getrandbits(16) / (2**16 - 1))):
+            if _PROF:
+                prof.begin(prof.LORA_ACK)
+            # Counted from TxDone (wait_packet_sent above), in ms: time.time() has 1 s steps on the rp2
+            timeout = int(self.retry_timeout * 1000 * (1 + getrandbits(16) / (2**16 - 1)))
+            start = time.ticks_ms()
+            while time.ticks_diff(time.ticks_ms(), start) < timeout:
                 if self._last_payload:
                     if self._last_payload.header_to == self._this_address and \
                             self._last_payload.header_flags & FLAGS_ACK and \
-                            self._last_payload.header_id == self._last_header_id:
+                            self._last_payload.header_id == self._last_header_id & self._id_mask:
 
                         # We got an ACK
+                        self.ack_quality = decode_ack_quality(self._last_payload.message)
+                        if _PROF:
+                            prof.end(prof.LORA_ACK)
                         return True
+            if _PROF:
+                prof.end(prof.LORA_ACK)
+        if _PROF:
+            prof.count(prof.TX_FAIL)
         return False
 
-    def send_ack(self, header_to, header_id):
-        self.send(b'!', header_to, header_id, FLAGS_ACK)
+    def send_bulk(self, data, header_to, window=4):
+        # Windowed selective-repeat transfer of data larger than one frame,
+        # with up to `window` frames in flight per ACK (see lorafrag)
+        import lorafrag
+        return lorafrag.send_message(self, data, header_to, window=window)
+
+    def send_ack(self, header_to, header_id, snr=None, rssi=None):
+        # The ACK reports the SNR/RSSI of the acked frame, for adaptive data rate
+        ack = b'!' if snr is None else encode_ack_quality(snr, rssi)
+        self.send(ack, header_to, header_id, FLAGS_ACK)
         self.wait_packet_sent()
 
     def _spi_write(self, register, payload):
@@ -298,6 +836,21 @@ class LoRa(object):
         self.spi.write(bytearray([register | 0x80] + payload))
         self.cs.value(1)
 
+    def _spi_write_byte(self, register, value):
+        # single register write from a preallocated buffer
+        buf = self._reg_write
+        buf[0] = register | 0x80
+        buf[1] = value
+        self.cs.value(0)
+        self.spi.write(buf)
+        self.cs.value(1)
+
+    def _spi_readinto(self, register, buf):
+        # burst read into buf; buf[0] is clocked in while the address goes out
+        self.cs.value(0)
+        self.spi.readinto(buf, register)
+        self.cs.value(1)
+
     def _spi_read(self, register, length=1):
         self.cs.value(0)
         if length == 1:
@@ -319,18 +872,96 @@ class LoRa(object):
         encrypted_msg = self.crypto.encrypt(msg_bytes)
         return encrypted_msg
 
+    def sender_stats(self, header_from):
+        # (received, lost) frames from header_from, or None if unknown
+        entry = self._senders.get(header_from)
+        return (entry[3], entry[4]) if entry else None
+
+    def _track(self, header_from, header_id, frag=False):
+        # Returns True if header_id from header_from was already received.
+        # Fragments of one message share a header_id, so they only move the
+        # sequence forward and are never reported as duplicates here.
+        now = time.ticks_ms()
+        entry = self._senders.get(header_from)
+        if entry is None:
+            if len(self._senders) >= self.max_senders:
+                oldest = min(self._senders, key=lambda k: self._senders[k][2])
+                del self._senders[oldest]
+            self._senders[header_from] = [header_id, 0, now, 1, 0, 0]
+            return False
+
+        silence = time.ticks_diff(now, entry[2])
+        entry[2] = now
+        ahead = (header_id - entry[0]) & self._id_mask
+        if silence > self.seq_timeout_ms and (ahead == 0 or ahead > self._id_mask >> 1 or
+                                              2 * silence < ahead * entry[5]):
+            # Silent for longer than any retransmission (a slow or sleeping sender keeps
+            # its sequence): a step back, or a jump ahead longer than the silence allows
+            # at the sender's fastest pace, is a restarted sender rather than a loss
+            entry[0], entry[1] = header_id, 0
+            entry[3] += 1
+            return False
+        if ahead == 0:
+            if frag:
+                return False
+            self.duplicates += 1
+            return True
+        if ahead <= self._id_mask >> 1:
+            # newer: slide the window, ids skipped in between were lost
+            entry[1] = ((entry[1] << ahead) | (1 << (ahead - 1))) & ((1 << SEQ_WINDOW) - 1)
+            entry[0] = header_id
+            step = max(1, silence // ahead)
+            if not entry[5] or step < entry[5]:
+                entry[5] = step
+            entry[3] += 1
+            if ahead > 1:
+                entry[4] += ahead - 1
+                self.gaps += ahead - 1
+            return False
+        behind = self._id_mask + 1 - ahead
+        if behind > SEQ_WINDOW:
+            # too old to tell, treat as a restarted sequence
+            entry[0], entry[1] = header_id, 0
+            entry[3] += 1
+            return False
+        bit = 1 << (behind - 1)
+        if entry[1] & bit:
+            if frag:
+                return False
+            self.duplicates += 1
+            return True
+        # late frame counted as a gap earlier
+        entry[1] |= bit
+        entry[3] += 1
+        if entry[4]:
+            entry[4] -= 1
+            self.gaps -= 1
+        return False
+
     def _handle_interrupt(self, channel):
-        irq_flags = self._spi_read(REG_12_IRQ_FLAGS)
+        if self._polled and self._mode == MODE_RXCONTINUOUS:
+            # RxDone is the only DIO0 source in RX: stamp it and leave the
+            # frame and the IRQ flags to poll_recv()
+            self._last_irq = time.ticks_ms()
+            if self._irq_callback:
+                self._irq_callback()
+            return
+
+        # One burst for RX current addr (0x10), IRQ flags (0x12) and RX bytes (0x13)
+        status = self._spi_read(REG_10_FIFO_RX_CURRENT_ADDR, 4)
+        irq_flags = status[2]
 
         if self._mode == MODE_RXCONTINUOUS and (irq_flags & RX_DONE):
-            packet_len = self._spi_read(REG_13_RX_NB_BYTES)
-            self._spi_write(REG_0D_FIFO_ADDR_PTR, self._spi_read(REG_10_FIFO_RX_CURRENT_ADDR))
+            packet_len = status[3]
+            self._spi_write(REG_0D_FIFO_ADDR_PTR, status[0])
 
             packet = self._spi_read(REG_00_FIFO, packet_len)
             self._spi_write(REG_12_IRQ_FLAGS, 0xff)  # Clear all IRQ flags
 
-            snr = self._spi_read(REG_19_PKT_SNR_VALUE) / 4
-            rssi = self._spi_read(REG_1A_PKT_RSSI_VALUE)
+            quality = self._spi_read(REG_19_PKT_SNR_VALUE, 2) # SNR and RSSI in one burst
+            snr = quality[0]
+            snr = (snr - 256 if snr > 127 else snr) / 4 # two's complement, 0.25 dB steps
+            rssi = quality[1]
 
             if snr < 0:
                 rssi = snr + rssi
@@ -342,34 +973,47 @@ class LoRa(object):
             else:
                 rssi = round(rssi - 164, 2)
 
-            if packet_len >= 4:
+            if self._profile[2] and packet_len >= 2:
+                # compact header
+                header_to = packet[0] >> 4
+                if header_to == 15:
+                    header_to = BROADCAST_ADDRESS
+                header_from = packet[0] & 0x0f
+                header_id = packet[1] & 0x7f
+                header_flags = FLAGS_ACK if packet[1] & 0x80 else 0
+                message = bytes(packet[2:])
+            elif packet_len >= 4:
                 header_to = packet[0]
                 header_from = packet[1]
                 header_id = packet[2]
                 header_flags = packet[3]
                 message = bytes(packet[4:]) if packet_len > 4 else b''
+            else:
+                return
 
-                if (self._this_address != header_to) and ((header_to != BROADCAST_ADDRESS) or (self._receive_all is False)):
-                    return
+            if (self._this_address != header_to) and ((header_to != BROADCAST_ADDRESS) or (self._receive_all is False)):
+                return
 
-                if self.crypto and len(message) % 16 == 0:
-                    message = self._decrypt(message)
+            if self.crypto and len(message) % 16 == 0:
+                message = self._decrypt(message)
 
-                if self._acks and header_to == self._this_address and not header_flags & FLAGS_ACK:
-                    self.send_ack(header_from, header_id)
+            if self._acks and header_to == self._this_address and not header_flags & (FLAGS_ACK | FLAGS_FRAG):
+                self.send_ack(header_from, header_id, snr, rssi)
 
-                self.set_mode_rx()
+            self.set_mode_rx()
+
+            # Retransmission after a lost ACK: acked above, not dispatched again
+            if not header_flags & FLAGS_ACK and self._track(header_from, header_id, header_flags & FLAGS_FRAG):
+                return
 
-                self._last_payload = namedtuple(
-                    "Payload",
-                    ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr']
-                )(message, header_to, header_from, header_id, header_flags, rssi, snr)
+            self._last_payload = Payload(message, header_to, header_from, header_id, header_flags, rssi, snr)
 
-                if not header_flags & FLAGS_ACK:
-                    self.on_recv(self._last_payload)
+            if not header_flags & FLAGS_ACK:
+                self.on_recv(self._last_payload)
+            return # IRQ flags were cleared right after reading the FIFO
 
         elif self._mode == MODE_TX and (irq_flags & TX_DONE):
-            self.set_mode_idle()
+            self._mode = MODE_STDBY # the radio returns to STDBY by itself after TxDone
 
         elif self._mode == MODE_CAD and (irq_flags & CAD_DONE):
             self._cad = irq_flags & CAD_DETECTED
@@ -380,4 +1024,3 @@ class LoRa(object):
     def close(self):
         self.spi.deinit()
 
-